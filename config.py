@@ -16,6 +16,12 @@ def load_parameters():
     TEXT_FILES = {'train': 'training.',        # Data files.
                   'val': 'dev.',
                   'test': 'test.'}
+    CLEAN_CORPUS = False                            # Clean the training files before building the dataset (in DATASET_STORE_PATH):
+                                                    # remove empty, too long, unbalanced and duplicated pairs.
+    CLEAN_MAX_LEN = 250                             # Remove pairs with a sentence longer than this (in words, 0 means no limit).
+    CLEAN_MAX_RATIO = 3.                            # Remove pairs whose length ratio is above this (0 means no limit).
+    CLEAN_NEAR_DUPLICATES = True                    # Also remove pairs which only differ in case, digits, punctuation or spacing.
+    CLEAN_DEDUPLICATION_MEMORY = 256                # Memory (in MB) of the deduplication filters (0 disables the deduplication).
 
     # Dataset class parameters
     INPUTS_IDS_DATASET = ['source_text', 'state_below']     # Corresponding inputs of the dataset.
@@ -84,6 +90,7 @@ def load_parameters():
                                                   # See Dataset class (from stager_keras_wrapper) for more info.
     BPE_CODES_PATH = DATA_ROOT_PATH + '/training_codes.joint'    # If TOKENIZATION_METHOD = 'tokenize_bpe',
                                                   # sets the path to the learned BPE codes.
+    TOKENIZATION_JOBS = 1                         # Number of processes that tokenize the text files when building the dataset.
     DETOKENIZATION_METHOD = 'detokenize_bpe'      # Select which de-tokenization method we'll apply.
 
     APPLY_DETOKENIZATION = True                   # Wheter we apply a detokenization method.
@@ -110,6 +117,17 @@ def load_parameters():
     CACHE_SIZE = 200
     SEP = 10                                      # When using cache models how much separation betwwen sentences in the same batch
     CACHE_PATIENCE = 150000
+    RING_BUFFER_CACHE = False                     # Use a RingBufferCache (preallocated ring buffer of CACHE_SIZE annotations) as cache
+    RING_BUFFER_PATIENCE = 100                    # Number of inserted annotations after which a RING_BUFFER_CACHE entry is evicted
+                                                  # (0: only when it is overwritten)
+    CACHE_TOP_K = 0                               # With RING_BUFFER_CACHE, attend only to the k cache entries most similar to each
+                                                  # sentence (0: the full cache). Only for the Tensorflow backend.
+    DOCUMENT_BATCHES = False                      # Train with document-ordered batches: each batch row follows a document, so the cache
+                                                  # holds the previous sentences of the same document. Rows are refilled when a document ends.
+                                                  # Requires RING_BUFFER_CACHE (each row has its own cache, reset at the start of a document)
+                                                  # and a single GPU.
+    DOCUMENTS_FILE = DATA_ROOT_PATH + '/' + TEXT_FILES['train'] + 'docs'  # Number of sentences of each training document (one per line).
+                                                  # If it does not exist, each row follows a contiguous part of the training corpus.
 
     # Input text parameters
     INPUT_VOCABULARY_SIZE = 0                     # Size of the input vocabulary. Set to 0 for using all,
@@ -130,6 +148,8 @@ def load_parameters():
     LOSS = 'categorical_crossentropy'
     CLASSIFIER_ACTIVATION = 'softmax'
     SAMPLE_WEIGHTS = True                         # Select whether we use a weights matrix (mask) for the data outputs
+    SAMPLED_SOFTMAX = False                       # Train with a sampled softmax (only for Tensorflow). Decoding always uses the full softmax.
+    SAMPLED_SOFTMAX_WORDS = 8192                  # Number of words sampled (from the target unigram distribution) at each batch.
     LABEL_SMOOTHING = 0.05                          # Epsilon value for label smoothing. Only valid for 'categorical_crossentropy' loss. See arxiv.org/abs/1512.00567.
 
     OPTIMIZER = 'Adam'                            # Optimizer. Supported optimizers: SGD, RMSprop, Adagrad, Adadelta, Adam, Adamax, Nadam.
@@ -158,11 +178,23 @@ def load_parameters():
     LR_REDUCER_EXP_BASE = 0.5                     # Base for the exponential decay.
     LR_HALF_LIFE = 8000                           # Factor for exponenital decay.
     WARMUP_EXP = -1.5                             # Warmup steps for noam decay.
+    MIN_LR = 1e-9                                 # Minimum learning rate of the LR reductions.
+
+    # Exponential moving average of the weights
+    USE_EMA = False                               # Keep an EMA of the weights. It is used for evaluating and saving the model.
+    EMA_DECAY = 0.9999                            # Decay of the moving average (applied each EMA_EACH updates).
+    EMA_EACH = 1                                  # Update the moving average each this number of updates.
 
     # Training parameters
     MAX_EPOCH = 500                               # Stop when computed this number of epochs.
     BATCH_SIZE = 7                               # Size of each minibatch.
     N_GPUS = 1                                    # Number of GPUs to use. Only for Tensorflow backend. Each GPU will receive mini-batches of BATCH_SIZE / N_GPUS.
+    DATA_PARALLEL_WORKERS = 1                     # Number of data-parallel (CPU) worker processes. Each one trains on its own batches of BATCH_SIZE
+                                                  # and the gradients are averaged at each update (or each ACCUMULATE_GRADIENTS batches).
+                                                  # Incompatible with EARLY_STOP, DOCUMENT_BATCHES and the (RELOAD_/SAVE_)TRAINING_STATE.
+    DATA_PARALLEL_ADDRESS = 'localhost:6000'      # 'host:port' where the worker with rank 0 listens.
+    DATA_PARALLEL_LOCAL_RANKS = None              # Ranks of the workers started in this host. None: all of them (single host).
+    DATA_PARALLEL_TRANSPORT = 'connection'        # Transport between workers. Currently, 'connection' (TCP sockets) is implemented.
 
     HOMOGENEOUS_BATCHES = False                   # Use batches with homogeneous output lengths (Dangerous!!).
     JOINT_BATCHES = 4                             # When using homogeneous batches, get this number of batches to sort.
@@ -208,6 +240,8 @@ def load_parameters():
     SCALE_TARGET_WORD_EMBEDDINGS = True          # Scale target word embeddings by Sqrt(TARGET_TEXT_EMBEDDING_SIZE)
 
     TIE_EMBEDDINGS = False                        # Use the same embeddings for source and target language.
+    TIE_OUTPUT_EMBEDDINGS = False                 # Use the (transposed) target embeddings as the output layer kernel.
+                                                  # Its input must have size TARGET_TEXT_EMBEDDING_SIZE.
 
     N_LAYERS_ENCODER = 2                          # Stack this number of encoding layers.
     N_LAYERS_DECODER = 2                          # Stack this number of decoding layers.
@@ -251,7 +285,17 @@ def load_parameters():
     MODEL_SIZE = 512                              # Transformer model size (d_{model} in de paper).
     MULTIHEAD_ATTENTION_ACTIVATION = 'linear'     # Activation the input projections in the Multi-Head Attention blocks.
     FF_SIZE = MODEL_SIZE * 4                      # Size of the feed-forward layers of the Transformer model.
+    ENCODER_MODEL_SIZE = None                     # Sizes of the encoder and decoder blocks and of their feed-forward layers,
+    DECODER_MODEL_SIZE = None                     # if they differ (e.g. a deep encoder and a shallow decoder).
+    ENCODER_FF_SIZE = None                        # If None, MODEL_SIZE and FF_SIZE. The encoder output is projected to
+    DECODER_FF_SIZE = None                        # DECODER_MODEL_SIZE before the attention of the decoder.
     N_HEADS = 8                                   # Number of parallel attention layers of the Transformer model.
+    FUSED_ATTENTION = False                       # Compute the query, key and value projections of each attention with a
+                                                  # single matrix product (see utils/fuse_attention.py for converting models).
+    ATTENTION_HEADS = {}                          # Number of heads of some attention layers (layer name -> heads), if they
+                                                  # differ from N_HEADS. Set by utils/prune_heads.py for the models without some heads.
+    STORED_POSITIONAL_ENCODINGS = False           # Store the positional encodings as (non-trainable) embedding weights, as the
+                                                  # models trained with previous versions. If False, they are computed on the fly.
     # # # # # # # # # # # # # # # # # # # # # # # #
 
     # Regularizers
@@ -304,6 +348,17 @@ def load_parameters():
 
     STORE_PATH = 'trained_models/' + MODEL_NAME + '/'  # Models and evaluation results will be stored here.
     DATASET_STORE_PATH = 'datasets/'                   # Dataset instance will be stored here.
+    BINARIZE_DATASET = False                           # Store the training text data as memory-mapped arrays of token ids (in DATASET_STORE_PATH/<dataset name>_binarized),
+                                                       # written from the files in two passes. The Dataset instance loads instantly and memory does not grow with the corpus size.
+    STREAMING_BUILD = False                            # Also bound the memory of the binarized build: the vocabulary is counted with bounded memory
+                                                       # and the data is written in shards (see BINARIZE_DATASET).
+    STREAMING_SHARD_SIZE = 1000000                     # Number of sentences of each binarized shard (0 means a single shard).
+    STREAMING_COUNT_BUCKET_WIDTH = 1000000             # Bucket width (in words) of the lossy counting of the vocabulary. Counts are underestimated
+                                                       # by at most (corpus words / width). 0 means exact counting.
+
+    PROFILE_THROUGHPUT = False                         # Profile the training throughput (data, train step and callbacks time,
+                                                       # tokens/s, padding). Written to STORE_PATH/throughput.csv and Tensorboard.
+    PROFILE_EACH = 100                                 # Report the throughput each this number of updates.
 
     # Tensorboard configuration. Only if the backend is Tensorflow. Otherwise, it will be ignored.
     TENSORBOARD = True                       # Switches On/Off the tensorboard callback.
@@ -325,8 +380,16 @@ def load_parameters():
     RELOAD = 0                                         # If 0 start training from scratch, otherwise the model.
                                                        # Saved on epoch 'RELOAD' will be used.
     RELOAD_EPOCH = False                                # Select whether we reload epoch or update number.
+    SAVE_TRAINING_STATE = False                        # Store the full training state (weights, optimizer, counters and RNGs).
+    TRAINING_STATE_EACH = 1000                         # Store the training state each this number of updates (and each epoch).
+    RELOAD_TRAINING_STATE = False                      # Resume training exactly from the last stored training state.
+                                                       # If True, RELOAD and RELOAD_EPOCH are taken from the stored state.
+                                                       # An interrupted epoch continues from its next batch.
+                                                       # (RELOAD_/SAVE_)TRAINING_STATE require PARALLEL_LOADERS = 1 (or HOMOGENEOUS_BATCHES).
 
     REBUILD_DATASET = True                             # Build again or use stored instance.
+    DATASET_CACHE = False                              # If REBUILD_DATASET is False, reuse the stored instance only if its files (contents and sizes)
+                                                       # and data parameters did not change. Otherwise, rebuild it (or only the changed evaluation splits).
     MODE = 'training'                                  # 'training' or 'sampling' (if 'sampling' then RELOAD must
                                                        # be greater than 0 and EVAL_ON_SETS will be used).
 
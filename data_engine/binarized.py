@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import codecs
+import logging
+import os
+from array import array
+from collections import Counter
+
+import numpy as np
+from six import iteritems, itervalues
+from keras_wrapper.dataset import Dataset
+from data_engine.tokenization import tokenize_sentences
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def count_words(sentences, bucket_width=0):
+    """
+    Counts the words of a stream of (tokenized) sentences.
+    If bucket_width > 0, the words are counted with lossy counting (Manku and Motwani, 2002): the stream is split into
+    buckets of bucket_width words, and each word keeps its count and the maximum number of occurrences it may have
+    missed (the index of the bucket where it was inserted, minus one). At the end of each bucket, the words whose
+    count plus missed occurrences do not exceed the current bucket index are discarded.
+    The counts are underestimated by at most n_words / bucket_width, every word with more occurrences is kept, and at
+    most bucket_width * log(n_words / bucket_width) words are kept in memory.
+
+    :param sentences: Iterable of sentences.
+    :param int bucket_width: Number of words of each bucket (0 means exact counting).
+    :return: Counter with the occurrences of each word.
+    """
+    if bucket_width <= 0:
+        counter = Counter()
+        for sentence in sentences:
+            counter.update(sentence.split())
+        return counter
+    counts = dict()
+    missed = dict()
+    bucket = 1
+    n_words = 0
+    for sentence in sentences:
+        for word in sentence.split():
+            if word in counts:
+                counts[word] += 1
+            else:
+                counts[word] = 1
+                missed[word] = bucket - 1
+            n_words += 1
+            if n_words % bucket_width == 0:
+                for discarded in [w for w, count in iteritems(counts) if count + missed[w] <= bucket]:
+                    del counts[discarded]
+                    del missed[discarded]
+                bucket += 1
+    return Counter(counts)
+
+
+def vocabulary_from_counts(counter, extra_words, min_occ=0, n_words=0):
+    """
+    Builds a vocabulary from word counts, with the same criteria as Dataset.build_vocabulary: words are sorted by
+    frequency and indexed after the extra words (padding, unknown, etc.).
+
+    :param counter: Counter with the occurrences of each word.
+    :param dict extra_words: Mapping from the extra words to their indices.
+    :param int min_occ: Minimum occurrences of each word to be included in the vocabulary.
+    :param int n_words: Maximum number of words of the vocabulary (including the extra words). 0 means no limit.
+    :return: Vocabulary dictionary, with the 'words2idx' and 'idx2words' mappings.
+    """
+    if min_occ > 1:
+        counter = Counter(dict((word, count) for word, count in iteritems(counter) if count >= min_occ))
+    vocab_count = counter.most_common(n_words - len(extra_words) if n_words > 0 else None)
+    words2idx = dict((word, i + len(extra_words)) for i, (word, _) in enumerate(vocab_count))
+    words2idx.update(extra_words)
+    return {'words2idx': words2idx, 'idx2words': dict((idx, word) for word, idx in iteritems(words2idx))}
+
+
+def write_sentences(sentences, path):
+    """
+    Writes a stream of sentences to a text file (one per line), while yielding them.
+
+    :param sentences: Iterable of sentences.
+    :param str path: Path to the text file.
+    :return: Generator of sentences.
+    """
+    with codecs.open(path, 'w', encoding='utf-8') as text_file:
+        for sentence in sentences:
+            text_file.write(sentence + u'\n')
+            yield sentence
+
+
+def read_sentences(path):
+    """
+    Reads the sentences of a text file (one per line), without loading it into memory.
+
+    :param str path: Path to the text file.
+    :return: Generator of sentences.
+    """
+    with codecs.open(path, 'r', encoding='utf-8') as text_file:
+        for line in text_file:
+            yield line.rstrip(u'\n')
+
+
+def shard_path(path, shard, shard_size):
+    """
+    Prefix of the files of a shard of binarized data.
+
+    :param str path: Prefix of the binarized data.
+    :param int shard: Shard index.
+    :param int shard_size: Number of sentences per shard (0 if the data is not sharded).
+    :return: Prefix of the files of the shard.
+    """
+    return path if shard_size == 0 else path + '.%d' % shard
+
+
+def binarize_sentences(sentences, path, words2idx=None, unk_symbol=u'<unk>', shard_size=0):
+    """
+    Stores a list of (tokenized) sentences in the binarized format:
+        * path.ids.npy: Token ids of all sentences, in a flat int32 array.
+        * path.offsets.npy: Position of the first token of each sentence in the ids array (plus the final position).
+        * path.vocab: Tokens of the ids, one per line.
+    By default, the vocabulary includes all the tokens of the sentences, so they are exactly recovered.
+    If shard_size > 0, the sentences are stored in shards of shard_size sentences (path.<shard>.ids.npy and
+    path.<shard>.offsets.npy), so only a shard is kept in memory and sentences can be a stream larger than memory.
+
+    :param sentences: Iterable of sentences.
+    :param str path: Prefix of the files.
+    :param dict words2idx: Fixed vocabulary. If given, words out of it are stored as unk_symbol.
+    :param unk_symbol: Unknown word of the fixed vocabulary.
+    :param int shard_size: Number of sentences per shard (0 means a single shard).
+    :return: Number of stored sentences.
+    """
+    fixed_vocabulary = words2idx is not None
+    if fixed_vocabulary:
+        unk_idx = words2idx[unk_symbol]
+    else:
+        words2idx = dict()
+    n_sentences = 0
+    shard = 0
+    ids = array('i')
+    offsets = [0]
+    for sentence in sentences:
+        for word in sentence.split():
+            idx = words2idx.get(word)
+            if idx is None:
+                if fixed_vocabulary:
+                    idx = unk_idx
+                else:
+                    idx = words2idx[word] = len(words2idx)
+            ids.append(idx)
+        offsets.append(len(ids))
+        n_sentences += 1
+        if shard_size > 0 and n_sentences % shard_size == 0:
+            np.save(shard_path(path, shard, shard_size) + '.ids.npy', np.asarray(ids, dtype='int32'))
+            np.save(shard_path(path, shard, shard_size) + '.offsets.npy', np.asarray(offsets, dtype='int64'))
+            shard += 1
+            ids = array('i')
+            offsets = [0]
+    if len(offsets) > 1 or shard == 0:
+        np.save(shard_path(path, shard, shard_size) + '.ids.npy', np.asarray(ids, dtype='int32'))
+        np.save(shard_path(path, shard, shard_size) + '.offsets.npy', np.asarray(offsets, dtype='int64'))
+    idx2words = [None] * (max(itervalues(words2idx)) + 1 if words2idx else 0)
+    for word, idx in iteritems(words2idx):
+        idx2words[idx] = word
+    with codecs.open(path + '.vocab', 'w', 'utf-8') as vocab_file:
+        for word in idx2words:
+            vocab_file.write(word + u'\n')
+    return n_sentences
+
+
+class BinarizedSequence(object):
+    """
+    Read-only list of sentences stored in the binarized format (see binarize_sentences). Each sentence is returned as
+    an int32 array with its token ids, which are directly encoded by BinarizedDataset.loadText. The text of a sentence
+    is available through get_sentence.
+    The arrays are memory-mapped when first accessed, so opening is instant and sentences are only loaded when
+    requested. Shuffling only permutes an index array, and remapping the vocabulary only stores a mapping of the ids.
+    Pickling stores only the path of the files, the order and the mapping.
+    """
+
+    def __init__(self, path, length, shard_size=0):
+        """
+        :param str path: Prefix of the binarized files.
+        :param int length: Number of sentences.
+        :param int shard_size: Number of sentences per shard (0 if the data is not sharded).
+        """
+        self.path = path
+        self.length = length
+        self.shard_size = shard_size
+        self.order = None
+        self.mapping = None
+        self._ids = None
+        self._offsets = None
+        self._words = None
+
+    def _open(self):
+        if self._ids is None:
+            n_shards = 1 if self.shard_size == 0 else max(1, -(-self.length // self.shard_size))
+            self._ids = [np.load(shard_path(self.path, shard, self.shard_size) + '.ids.npy', mmap_mode='r')
+                         for shard in range(n_shards)]
+            self._offsets = [np.load(shard_path(self.path, shard, self.shard_size) + '.offsets.npy', mmap_mode='r')
+                             for shard in range(n_shards)]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('BinarizedSequence index out of range')
+        self._open()
+        if self.order is not None:
+            index = self.order[index]
+        if self.shard_size > 0:
+            shard, index = divmod(index, self.shard_size)
+        else:
+            shard = 0
+        ids, offsets = self._ids[shard], self._offsets[shard]
+        sentence = np.asarray(ids[offsets[index]:offsets[index + 1]])
+        return sentence if self.mapping is None else self.mapping[sentence]
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+    def get_sentence(self, index):
+        """
+        Text of a sentence, decoded with the vocabulary file of the binarized data.
+        :param int index: Index of the sentence.
+        :return: Sentence (tokens separated by spaces).
+        """
+        if self._words is None:
+            with codecs.open(self.path + '.vocab', 'r', 'utf-8') as vocab_file:
+                self._words = vocab_file.read().split(u'\n')[:-1]
+            if self.mapping is not None:
+                words = [None] * (int(self.mapping.max()) + 1)
+                for idx, word in enumerate(self._words):
+                    words[self.mapping[idx]] = word
+                self._words = words
+        return u' '.join([self._words[idx] for idx in self[index]])
+
+    def count_ids(self, n_ids):
+        """
+        Counts the occurrences of each token id in all the sentences.
+        :param int n_ids: Number of different ids (vocabulary size).
+        :return: Numpy array with the counts of each id.
+        """
+        self._open()
+        counts = np.zeros(n_ids, dtype='int64')
+        for ids in self._ids:
+            counts += np.bincount(ids if self.mapping is None else self.mapping[ids], minlength=n_ids)[:n_ids]
+        return counts
+
+    def remap(self, mapping):
+        """
+        Changes the token ids of the sentences (e.g. when the vocabulary is merged with another one).
+        :param mapping: Array with the new id of each current id.
+        :return: None
+        """
+        mapping = np.asarray(mapping, dtype='int32')
+        self.mapping = mapping if self.mapping is None else mapping[self.mapping]
+        self._words = None
+
+    def shuffle(self, order):
+        """
+        Reorders the sentences: the new i-th sentence is the current order[i]-th one.
+        :param order: Permutation of the sentence indices.
+        :return: None
+        """
+        self.order = np.asarray(order) if self.order is None else self.order[order]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_ids'] = state['_offsets'] = state['_words'] = None
+        return state
+
+
+class BinarizedDataset(Dataset):
+    """
+    Dataset whose text data can be stored in the binarized format, as BinarizedSequences. The pickled Dataset instance
+    only keeps the vocabularies and metadata, so it is loaded instantly, and memory usage does not grow with the size
+    of the corpus.
+    """
+
+    def binarize(self, store_path, ids=None):
+        """
+        Binarizes the text data of all splits. The data is stored in store_path, indexed with the vocabulary of its
+        identifier. Data without vocabulary is not binarized.
+
+        :param str store_path: Directory where the binarized data is stored.
+        :param list ids: Identifiers of the data to binarize. If None, all data stored as lists of strings.
+        :return: None
+        """
+        store_path = os.path.abspath(store_path)
+        if not os.path.isdir(store_path):
+            os.makedirs(store_path)
+        for set_name in ['train', 'val', 'test']:
+            for prefix in ['X_', 'Y_']:
+                data = getattr(self, prefix + set_name)
+                for data_id, sentences in list(iteritems(data)):
+                    if ids is not None and data_id not in ids or data_id not in self.vocabulary:
+                        continue
+                    if not isinstance(sentences, list) or not all(isinstance(s, (str, type(u''))) for s in sentences):
+                        continue
+                    path = os.path.join(store_path, set_name + '.' + data_id)
+                    if not self.silence:
+                        logger.info('Binarizing ' + prefix + set_name + '[' + data_id + '] into ' + path)
+                    data[data_id] = BinarizedSequence(path, binarize_sentences(
+                        sentences, path, words2idx=self.vocabulary[data_id]['words2idx'], unk_symbol=self.unk_symbol))
+
+    def streamText(self, path, data_id, store_path, set_name='train', tokenization='tokenize_none',
+                   build_vocabulary=False, max_words=0, min_occ=0, bpe_codes=None, separator=u'@@',
+                   count_bucket_width=0, shard_size=0, tokenization_jobs=1):
+        """
+        Binarizes a text file without loading it into memory. If the vocabulary must be built, a first pass over the
+        file counts the words (optionally, with lossy counting) and stores the tokenized sentences in a temporary file;
+        the second pass reads them, indexes them and writes them in shards. Thus, the file is only tokenized once.
+
+        :param str path: Path to the text file (one sentence per line).
+        :param data_id: Identifier of the data.
+        :param str store_path: Directory where the binarized data is stored.
+        :param set_name: Split of the data.
+        :param tokenization: Name of the tokenization function (a method of the Dataset).
+        :param build_vocabulary: True for building the vocabulary from this file. A data_id for reusing its vocabulary.
+                                 Otherwise, the vocabulary of data_id must already exist.
+        :param max_words: Maximum number of words of the vocabulary. 0 means no limit.
+        :param min_occ: Minimum occurrences of each word to be included in the vocabulary.
+        :param bpe_codes: Path to the BPE codes (only for BPE tokenizations).
+        :param separator: BPE separator.
+        :param count_bucket_width: Bucket width of the lossy counting of the vocabulary (see count_words). 0 means
+                                   exact counting.
+        :param shard_size: Number of sentences per shard.
+        :param tokenization_jobs: Number of processes that tokenize the file (see tokenize_sentences).
+        :return: BinarizedSequence with the sentences.
+        """
+        store_path = os.path.abspath(store_path)
+        if not os.path.isdir(store_path):
+            os.makedirs(store_path)
+        binarized_path = os.path.join(store_path, set_name + '.' + data_id)
+        sentences = tokenize_sentences(read_sentences(path), tokenization, n_jobs=tokenization_jobs,
+                                       bpe_codes=bpe_codes, separator=separator)
+        tokenized_path = None
+        if build_vocabulary is True:
+            if not self.silence:
+                logger.info("Creating vocabulary for data with data_id '" + data_id + "' from " + path)
+            tokenized_path = binarized_path + '.tokenized'
+            counter = count_words(write_sentences(sentences, tokenized_path), bucket_width=count_bucket_width)
+            self.vocabulary[data_id] = vocabulary_from_counts(counter,
+                                                              self.extra_words,
+                                                              min_occ=min_occ,
+                                                              n_words=max_words)
+            self.vocabulary_len[data_id] = len(self.vocabulary[data_id]['words2idx'])
+            if not self.silence:
+                logger.info('\tVocabulary of ' + str(self.vocabulary_len[data_id]) + ' words.')
+            sentences = read_sentences(tokenized_path)
+        elif build_vocabulary:
+            self.vocabulary[data_id] = self.vocabulary[build_vocabulary]
+            self.vocabulary_len[data_id] = self.vocabulary_len[build_vocabulary]
+        if data_id not in self.vocabulary:
+            raise Exception('The dataset must include a vocabulary with data_id "' + data_id + '".')
+
+        if not self.silence:
+            logger.info('Binarizing ' + path + ' into ' + binarized_path)
+        length = binarize_sentences(sentences, binarized_path,
+                                    words2idx=self.vocabulary[data_id]['words2idx'],
+                                    unk_symbol=self.unk_symbol,
+                                    shard_size=shard_size)
+        if tokenized_path is not None:
+            os.remove(tokenized_path)
+        return BinarizedSequence(binarized_path, length, shard_size=shard_size)
+
+    def setStreamingInput(self, path, set_name, store_path, id, type='text', tokenization='tokenize_none',
+                          build_vocabulary=False, max_words=0, min_occ=0, bpe_codes=None, separator=u'@@',
+                          count_bucket_width=0, shard_size=0, tokenization_jobs=1, **kwargs):
+        """
+        Loads a text input as Dataset.setInput, but without loading the file into memory (see streamText).
+        The rest of the 'text' parameters (kwargs) are passed to setInput.
+        """
+        sentences = self.streamText(path, id, store_path, set_name=set_name, tokenization=tokenization,
+                                    build_vocabulary=build_vocabulary, max_words=max_words, min_occ=min_occ,
+                                    bpe_codes=bpe_codes, separator=separator,
+                                    count_bucket_width=count_bucket_width, shard_size=shard_size,
+                                    tokenization_jobs=tokenization_jobs)
+        # Sets the metadata of the input, and then its data
+        self.setInput([], set_name, type=type, id=id, tokenization=tokenization, build_vocabulary=False,
+                      max_words=max_words, min_occ=min_occ, bpe_codes=bpe_codes, separator=separator,
+                      overwrite_split=True, **kwargs)
+        self.replaceInput(sentences, set_name, type, id)
+
+    def setStreamingOutput(self, path, set_name, store_path, id, type='text', tokenization='tokenize_none',
+                           build_vocabulary=False, max_words=0, min_occ=0, bpe_codes=None, separator=u'@@',
+                           count_bucket_width=0, shard_size=0, tokenization_jobs=1, **kwargs):
+        """
+        Loads a text output as Dataset.setOutput, but without loading the file into memory (see streamText).
+        The rest of the 'text' parameters (kwargs) are passed to setOutput.
+        """
+        sentences = self.streamText(path, id, store_path, set_name=set_name, tokenization=tokenization,
+                                    build_vocabulary=build_vocabulary, max_words=max_words, min_occ=min_occ,
+                                    bpe_codes=bpe_codes, separator=separator,
+                                    count_bucket_width=count_bucket_width, shard_size=shard_size,
+                                    tokenization_jobs=tokenization_jobs)
+        # Sets the metadata of the output, and then its data
+        self.setOutput([], set_name, type=type, id=id, tokenization=tokenization, build_vocabulary=False,
+                       max_words=max_words, min_occ=min_occ, bpe_codes=bpe_codes, separator=separator,
+                       overwrite_split=True, **kwargs)
+        getattr(self, 'Y_' + set_name)[id] = sentences
+        setattr(self, 'len_' + set_name, len(sentences))
+
+    def binarized_sequences(self):
+        """
+        Binarized data of all splits.
+        :return: List of (data_id, BinarizedSequence) tuples.
+        """
+        return [(data_id, data) for set_name in ['train', 'val', 'test'] for prefix in ['X_', 'Y_']
+                for data_id, data in iteritems(getattr(self, prefix + set_name))
+                if isinstance(data, BinarizedSequence)]
+
+    def merge_vocabularies(self, ids):
+        """
+        Merges the vocabularies of a set of text inputs/outputs into a single one (see Dataset.merge_vocabularies).
+        The binarized data whose vocabulary changed is remapped to the merged one.
+
+        :param ids: identifiers of the inputs/outputs whose vocabularies will be merged
+        :return: None
+        """
+        old_vocabularies = dict((data_id, vocabulary['idx2words']) for data_id, vocabulary in iteritems(self.vocabulary))
+        super(BinarizedDataset, self).merge_vocabularies(ids)
+        for data_id, data in self.binarized_sequences():
+            idx2words = old_vocabularies.get(data_id)
+            if idx2words is None or idx2words is self.vocabulary[data_id]['idx2words']:
+                continue
+            words2idx = self.vocabulary[data_id]['words2idx']
+            mapping = np.arange(max(idx2words) + 1, dtype='int32')
+            for idx, word in iteritems(idx2words):
+                mapping[idx] = words2idx[word]
+            if not np.array_equal(mapping, np.arange(len(mapping))):
+                data.remap(mapping)
+
+    def loadText(self, X, vocabularies, max_len, offset, fill, pad_on_batch, words_so_far, loading_X=False):
+        """
+        Text encoder (see Dataset.loadText). Sentences from binarized data (arrays of token ids) are encoded without
+        looking their words up. The rest of sentences (or the options not implemented for ids) are encoded by
+        Dataset.loadText.
+
+        :return: Text as sequence of number. Mask for each sentence.
+        """
+        if not X or not isinstance(X[0], np.ndarray):
+            return super(BinarizedDataset, self).loadText(X, vocabularies, max_len, offset, fill, pad_on_batch,
+                                                          words_so_far, loading_X=loading_X)
+        if max_len == 0 or words_so_far or fill != 'end':
+            idx2words = vocabularies['idx2words']
+            X = [u' '.join([idx2words[idx] for idx in sentence]) for sentence in X]
+            return super(BinarizedDataset, self).loadText(X, vocabularies, max_len, offset, fill, pad_on_batch,
+                                                          words_so_far, loading_X=loading_X)
+        vocabulary_size = len(vocabularies['words2idx'])
+        if vocabulary_size < 255:
+            dtype_text = 'uint8'
+        elif vocabulary_size < 65535:
+            dtype_text = 'uint16'
+        else:
+            dtype_text = 'uint32'
+        max_len_batch = min(max([len(sentence) for sentence in X]) + 1, max_len) if pad_on_batch else max_len
+        X_out = np.full((len(X), max_len_batch), self.extra_words[self.pad_symbol], dtype=dtype_text)
+        X_mask = np.zeros((len(X), max_len_batch), dtype='int8')
+        for sentence_idx, sentence in enumerate(X):
+            # Always leave space for the <eos> symbol
+            len_j = min(len(sentence), max_len_batch - 1)
+            X_out[sentence_idx, :len_j] = sentence[:len_j]
+            X_mask[sentence_idx, :len_j + 1] = 1
+        if offset > 0:
+            # Move the text to the right: null symbol
+            X_out[:, offset:] = X_out[:, :-offset].copy()
+            X_out[:, :offset] = vocabularies['words2idx'][self.null_symbol]
+            X_mask[:, offset:] = X_mask[:, :-offset].copy()
+            X_mask[:, :offset] = 1
+        return X_out, X_mask
+
+    def shuffleTraining(self):
+        """
+        Applies a random shuffling to the training samples. Binarized data is shuffled by permuting its index.
+        """
+        if not self.silence:
+            logger.info("Shuffling training samples.")
+        shuffled_order = np.random.permutation(self.len_train)
+        for data in [self.X_train, self.Y_train]:
+            for sample_id in list(data):
+                if isinstance(data[sample_id], BinarizedSequence):
+                    data[sample_id].shuffle(shuffled_order)
+                else:
+                    data[sample_id] = [data[sample_id][s] for s in shuffled_order]
+        if not self.silence:
+            logger.info("Shuffling training done.")
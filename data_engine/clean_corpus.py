@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import codecs
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+
+import numpy as np
+from six.moves import zip_longest
+
+from data_engine.dataset_cache import hash_file
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Parameters which affect the cleaned corpus
+CLEAN_PARAMS = ['CLEAN_MAX_LEN', 'CLEAN_MAX_RATIO', 'CLEAN_NEAR_DUPLICATES', 'CLEAN_DEDUPLICATION_MEMORY']
+
+# Everything but letters is ignored when looking for near-duplicates
+_NON_LETTERS = re.compile(r'[\W\d_]+', re.UNICODE)
+
+
+class BloomFilter(object):
+    """
+    Set of hashes with a fixed memory size. Membership tests may give false positives (with a probability which grows
+    with the number of elements), but never false negatives.
+    """
+
+    def __init__(self, n_bytes, n_hashes=4):
+        """
+        :param int n_bytes: Size of the filter, in bytes.
+        :param int n_hashes: Number of bits set for each element.
+        """
+        self.bits = np.zeros(max(1, n_bytes), dtype='uint8')
+        self.n_bits = len(self.bits) * 8
+        self.n_hashes = n_hashes
+
+    def add(self, text):
+        """
+        Adds a text to the filter.
+
+        :param text: Text (unicode).
+        :return: Whether the text was (probably) already in the filter.
+        """
+        digest = hashlib.md5(text.encode('utf-8')).digest()
+        hash_1 = int(codecs.encode(digest[:8], 'hex'), 16)
+        hash_2 = int(codecs.encode(digest[8:], 'hex'), 16) | 1
+        positions = [(hash_1 + i * hash_2) % self.n_bits for i in range(self.n_hashes)]
+        found = True
+        for position in positions:
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                found = False
+                self.bits[byte] |= 1 << bit
+        return found
+
+
+def normalize_sentence(sentence):
+    """
+    Normalizes a sentence for detecting near-duplicates: lowercases it and removes digits, punctuation and spacing.
+
+    :param sentence: Sentence (unicode).
+    :return: Normalized sentence.
+    """
+    return u' '.join(_NON_LETTERS.sub(u' ', sentence.lower()).split())
+
+
+def is_near_duplicate(near, src_line, trg_line):
+    """
+    Checks whether a pair is a near-duplicate of a previous one, adding it to the filter. Pairs with an empty normalized
+    side are never near-duplicates (nor added to the filter).
+
+    :param BloomFilter near: Filter of the normalized pairs.
+    :param src_line: Source sentence (unicode).
+    :param trg_line: Target sentence (unicode).
+    :return: Whether the pair is (probably) a near-duplicate.
+    """
+    src_key, trg_key = normalize_sentence(src_line), normalize_sentence(trg_line)
+    if not src_key or not trg_key:
+        return False
+    return near.add(src_key + u'\t' + trg_key)
+
+
+def clean_corpus(src_path, trg_path, dest_src_path, dest_trg_path, max_len=0, max_ratio=0., near_duplicates=True,
+                 deduplication_memory=256):
+    """
+    Cleans a parallel corpus in a single pass, keeping only a line pair at a time (and the deduplication filters) in
+    memory. The following pairs are removed (and counted, in this order):
+        * 'empty': The source or the target line is empty.
+        * 'too_long': The source or the target sentence has more than max_len words.
+        * 'ratio': The ratio between the longest and the shortest sentence of the pair (in words) is above max_ratio.
+        * 'duplicates': The pair appeared before.
+        * 'near_duplicates': The pair appeared before, ignoring case, digits, punctuation and spacing. Pairs with a
+          side made only of digits and punctuation (e.g. numbers or list markers) are not checked, since ignoring
+          them would leave nothing to compare.
+    The duplicates are detected with Bloom filters, so a few unique pairs may be (wrongly) removed if the filters
+    are too small for the corpus.
+
+    :param str src_path: Source text file.
+    :param str trg_path: Target text file.
+    :param str dest_src_path: Cleaned source text file.
+    :param str dest_trg_path: Cleaned target text file.
+    :param int max_len: Maximum number of words of a sentence (0 means no limit).
+    :param float max_ratio: Maximum length ratio of a pair (0 means no limit).
+    :param bool near_duplicates: Whether to remove near-duplicates.
+    :param int deduplication_memory: Memory of the deduplication filters, in MB (0 disables the deduplication).
+    :return: Dictionary with the number of 'total', 'kept' and removed pairs (see above).
+    """
+    statistics = dict((key, 0) for key in ['total', 'kept', 'empty', 'too_long', 'ratio', 'duplicates',
+                                           'near_duplicates'])
+    n_bytes = deduplication_memory * (1 << 20) // (2 if near_duplicates else 1)
+    duplicates = BloomFilter(n_bytes) if deduplication_memory > 0 else None
+    near = BloomFilter(n_bytes) if deduplication_memory > 0 and near_duplicates else None
+
+    with codecs.open(src_path, 'r', encoding='utf-8') as src_file, \
+            codecs.open(trg_path, 'r', encoding='utf-8') as trg_file, \
+            codecs.open(dest_src_path, 'w', encoding='utf-8') as dest_src_file, \
+            codecs.open(dest_trg_path, 'w', encoding='utf-8') as dest_trg_file:
+        for src_line, trg_line in zip_longest(src_file, trg_file):
+            if src_line is None or trg_line is None:
+                raise Exception('The files ' + src_path + ' and ' + trg_path + ' have a different number of lines.')
+            statistics['total'] += 1
+            src_line, trg_line = src_line.strip(), trg_line.strip()
+            src_len, trg_len = len(src_line.split()), len(trg_line.split())
+            if src_len == 0 or trg_len == 0:
+                statistics['empty'] += 1
+            elif 0 < max_len < max(src_len, trg_len):
+                statistics['too_long'] += 1
+            elif 0 < max_ratio < float(max(src_len, trg_len)) / min(src_len, trg_len):
+                statistics['ratio'] += 1
+            elif duplicates is not None and duplicates.add(src_line + u'\t' + trg_line):
+                statistics['duplicates'] += 1
+            elif near is not None and is_near_duplicate(near, src_line, trg_line):
+                statistics['near_duplicates'] += 1
+            else:
+                statistics['kept'] += 1
+                dest_src_file.write(src_line + u'\n')
+                dest_trg_file.write(trg_line + u'\n')
+    return statistics
+
+
+def clean_training_corpus(params):
+    """
+    Cleans the training corpus defined by params (see clean_corpus), storing the cleaned files and their statistics
+    (<training files>clean.stats.json) in DATASET_STORE_PATH. If they were already cleaned with the same parameters and
+    the training files did not change, the stored files are reused.
+
+    :param params: Parameters for building the dataset.
+    :return: Copy of params whose training files are the cleaned ones.
+    """
+    base_path = params['DATA_ROOT_PATH']
+    if not os.path.isdir(params['DATASET_STORE_PATH']):
+        os.makedirs(params['DATASET_STORE_PATH'])
+    clean_prefix = os.path.join(params['DATASET_STORE_PATH'], os.path.basename(params['TEXT_FILES']['train']) + 'clean.')
+    src_path, trg_path = [base_path + '/' + params['TEXT_FILES']['train'] + params[lan] for lan in ['SRC_LAN', 'TRG_LAN']]
+    dest_src_path, dest_trg_path = [clean_prefix + params[lan] for lan in ['SRC_LAN', 'TRG_LAN']]
+
+    stored = None
+    if os.path.isfile(clean_prefix + 'stats.json'):
+        with open(clean_prefix + 'stats.json', 'r') as stats_file:
+            stored = json.load(stats_file)
+    known_files = (stored or {}).get('files', {})
+    files = dict((path, hash_file(path, known_files=known_files)) for path in [src_path, trg_path])
+    parameters = dict((key, params.get(key)) for key in CLEAN_PARAMS)
+    if stored is None or stored['files'] != files or stored['parameters'] != parameters or \
+            not os.path.isfile(dest_src_path) or not os.path.isfile(dest_trg_path):
+        logger.info('Cleaning the training corpus into ' + clean_prefix + '*')
+        statistics = clean_corpus(src_path, trg_path, dest_src_path, dest_trg_path,
+                                  max_len=params.get('CLEAN_MAX_LEN', 0),
+                                  max_ratio=params.get('CLEAN_MAX_RATIO', 0.),
+                                  near_duplicates=params.get('CLEAN_NEAR_DUPLICATES', True),
+                                  deduplication_memory=params.get('CLEAN_DEDUPLICATION_MEMORY', 256))
+        with open(clean_prefix + 'stats.json', 'w') as stats_file:
+            json.dump({'files': files, 'parameters': parameters, 'statistics': statistics}, stats_file,
+                      sort_keys=True, indent=1)
+    else:
+        statistics = stored['statistics']
+    logger.info('Training corpus cleaning: ' + ', '.join(key + ': ' + str(statistics[key])
+                                                         for key in sorted(statistics)))
+
+    params = copy.copy(params)
+    params['TEXT_FILES'] = dict(params['TEXT_FILES'])
+    params['TEXT_FILES']['train'] = os.path.relpath(clean_prefix, base_path)
+    return params
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import hashlib
+import json
+import os
+
+# Parameters which affect the content of the Dataset instance
+DATA_PARAMS = ['TASK_NAME', 'DATASET_NAME', 'SRC_LAN', 'TRG_LAN', 'TEXT_FILES', 'EVAL_ON_SETS',
+               'INPUTS_IDS_DATASET', 'OUTPUTS_IDS_DATASET', 'LOSS',
+               'TOKENIZATION_METHOD', 'BPE_CODES_PATH', 'CHAR_BPE',
+               'MAX_INPUT_TEXT_LEN', 'MAX_OUTPUT_TEXT_LEN', 'MAX_INPUT_WORD_LEN',
+               'INPUT_VOCABULARY_SIZE', 'OUTPUT_VOCABULARY_SIZE',
+               'MIN_OCCURRENCES_INPUT_VOCAB', 'MIN_OCCURRENCES_OUTPUT_VOCAB',
+               'FILL', 'FILL_CHAR', 'FILL_TARGET', 'PAD_ON_BATCH', 'SAMPLE_WEIGHTS',
+               'ALIGN_FROM_RAW', 'HOMOGENEOUS_BATCHES', 'TIE_EMBEDDINGS', 'POS_UNK', 'HEURISTIC', 'MAPPING',
+               'BINARIZE_DATASET', 'STREAMING_BUILD', 'STREAMING_SHARD_SIZE', 'STREAMING_COUNT_BUCKET_WIDTH']
+
+
+def hash_file(path, known_files=None, block_size=1 << 20):
+    """
+    Computes the SHA-1 hash of the size and contents of a file.
+    If the file is in known_files with the same size and modification time, its stored hash is reused, so unchanged
+    files are not read again.
+
+    :param str path: Path to the file.
+    :param dict known_files: Previously hashed files: path -> {'size', 'mtime', 'sha1'}.
+    :param int block_size: Number of bytes read at once.
+    :return: Dictionary with the 'size', 'mtime' and 'sha1' of the file. None if the file does not exist.
+    """
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    known = (known_files or {}).get(path)
+    if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+        return known
+    sha1 = hashlib.sha1(str(stat.st_size).encode('utf-8'))
+    with open(path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(block_size), b''):
+            sha1.update(block)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1.hexdigest()}
+
+
+def _hash_values(values):
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _hash_paths(paths, files, known_files=None):
+    hashes = []
+    for path in paths:
+        files[path] = hash_file(path, known_files=known_files)
+        hashes.append([path, files[path]['sha1'] if files[path] is not None else None])
+    return hashes
+
+
+def dataset_fingerprint(params, known_files=None):
+    """
+    Computes the fingerprint of the dataset defined by params:
+        * 'dataset': Hash of the data parameters and the files which define the vocabularies (training split, BPE codes
+          and mapping). If it changes, the whole dataset must be rebuilt.
+        * 'splits': Hash of the files of each evaluation split. If one changes, only that split must be reloaded.
+        * 'files': Hash of each file (see hash_file).
+
+    :param params: Parameters for building the dataset.
+    :param dict known_files: Previously hashed files (from a stored fingerprint).
+    :return: Dictionary with the fingerprint.
+    """
+    base_path = params['DATA_ROOT_PATH']
+    files = dict()
+    train_paths = [base_path + '/' + params['TEXT_FILES']['train'] + params[lan] for lan in ['SRC_LAN', 'TRG_LAN']]
+    extra_paths = [path for path in [params.get('BPE_CODES_PATH'), params.get('MAPPING')] if path]
+    dataset = _hash_values([[params.get(key) for key in DATA_PARAMS],
+                            _hash_paths(train_paths + extra_paths, files, known_files=known_files)])
+    splits = dict()
+    for split in ['val', 'test']:
+        if params['TEXT_FILES'].get(split) is not None:
+            split_paths = [base_path + '/' + params['TEXT_FILES'][split] + params[lan] for lan in ['SRC_LAN', 'TRG_LAN']]
+            splits[split] = _hash_values(_hash_paths(split_paths, files, known_files=known_files))
+    return {'dataset': dataset, 'splits': splits, 'files': files}
+
+
+def load_fingerprint(path):
+    """
+    Loads a stored fingerprint.
+
+    :param str path: Path to the fingerprint file.
+    :return: Dictionary with the fingerprint. None if it does not exist.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as fingerprint_file:
+        return json.load(fingerprint_file)
+
+
+def save_fingerprint(fingerprint, path):
+    """
+    Stores a fingerprint.
+
+    :param dict fingerprint: Fingerprint (see dataset_fingerprint).
+    :param str path: Path to the fingerprint file.
+    :return: None
+    """
+    with open(path, 'w') as fingerprint_file:
+        json.dump(fingerprint, fingerprint_file, sort_keys=True, indent=1)
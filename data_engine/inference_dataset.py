@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import copy
+import logging
+import os
+
+try:
+    import cPickle as pk
+except ImportError:
+    import pickle as pk
+
+from keras_wrapper.dataset import loadDataset
+from data_engine.vocabulary import compact_vocabularies
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def inference_dataset_path(dataset_path):
+    """
+    Path of the inference Dataset of a stored Dataset: Dataset_<name>.pkl -> Dataset_<name>.inference.pkl.
+
+    :param str dataset_path: Path to the stored Dataset.
+    :return: Path to its inference Dataset.
+    """
+    if dataset_path.endswith('.inference.pkl'):
+        return dataset_path
+    return os.path.splitext(dataset_path)[0] + '.inference.pkl'
+
+
+def export_inference_dataset(ds, store_path, bpe_codes=None):
+    """
+    Stores a copy of a Dataset instance without its data, for decoding and scoring new text.
+    It keeps the vocabularies (stored as CompactVocabularies), the tokenization (BPE encoder included) and detokenization
+    settings, the mapping and the definition of the inputs and outputs, so its size does not depend on the size of
+    the corpora.
+    The original Dataset instance is not modified.
+
+    :param ds: Dataset instance.
+    :param str store_path: Path to the inference Dataset.
+    :param bpe_codes: Path to the BPE codes. If given and the BPE encoder is not built, it is built into the copy.
+    :return: Inference Dataset instance.
+    """
+    inference_ds = copy.copy(ds)
+    for split in ['train', 'val', 'test']:
+        # Keep the ids of the inputs and outputs of each split, but not their samples
+        for prefix in ['X_', 'Y_', 'X_raw_', 'Y_raw_']:
+            setattr(inference_ds, prefix + split, dict((data_id, None if data is None else [])
+                                                       for data_id, data in getattr(ds, prefix + split).items()))
+        setattr(inference_ds, 'len_' + split, 0)
+    inference_ds.vocabulary = dict(ds.vocabulary)
+    compact_vocabularies(inference_ds)
+    if bpe_codes is not None and not inference_ds.BPE_built:
+        inference_ds.build_bpe(bpe_codes, separator=inference_ds.BPE_separator)
+    if not ds.silence:
+        logger.info('<<< Saving inference Dataset instance to ' + store_path + ' ... >>>')
+    with open(store_path, 'wb') as inference_file:
+        pk.dump(inference_ds, inference_file, protocol=-1)
+    return inference_ds
+
+
+def load_inference_dataset(dataset_path):
+    """
+    Loads a Dataset instance for decoding or scoring new text.
+    If dataset_path is a full Dataset and it has an up-to-date inference Dataset (see export_inference_dataset),
+    the latter is loaded instead. Its vocabularies are kept as CompactVocabularies (see
+    data_engine.vocabulary.decode_predictions_beam_search for decoding with them).
+
+    :param str dataset_path: Path to a stored Dataset or inference Dataset.
+    :return: Dataset instance.
+    """
+    inference_path = inference_dataset_path(dataset_path)
+    if inference_path != dataset_path and os.path.isfile(inference_path) and \
+            (not os.path.isfile(dataset_path) or os.path.getmtime(inference_path) >= os.path.getmtime(dataset_path)):
+        dataset_path = inference_path
+    return loadDataset(dataset_path)
@@ -1,9 +1,53 @@
 import logging
+import os
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
 from keras_wrapper.dataset import Dataset, saveDataset, loadDataset
+from data_engine.binarized import BinarizedDataset, BinarizedSequence
+from data_engine.clean_corpus import clean_training_corpus
+from data_engine.dataset_cache import dataset_fingerprint, load_fingerprint, save_fingerprint
+from data_engine.inference_dataset import export_inference_dataset, inference_dataset_path
+from data_engine.tokenization import tokenize_file
 
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 
 
+def tokenize_text_file(ds, path, tokenization, n_jobs=1, bpe_codes=None, tokenized_files=None):
+    """
+    Tokenizes a text file with a pool of processes, before loading it into the Dataset.
+    With a single job, the file is tokenized by the Dataset when loading it.
+    The tokenized sentences are loaded with 'tokenize_none', so the BPE encoder of the Dataset (used when decoding
+    and sampling) is built here.
+
+    :param ds: Dataset instance where the file will be loaded.
+    :param path: Path to the text file.
+    :param tokenization: Tokenization method.
+    :param n_jobs: Number of processes.
+    :param bpe_codes: Path to the BPE codes (only for BPE tokenizations).
+    :param tokenized_files: Dictionary of already tokenized files, which are reused.
+    :return: (data, tokenization) arguments for setInput/setOutput: the tokenized sentences and 'tokenize_none',
+             or the path and the tokenization method (single job).
+    """
+    if n_jobs <= 1:
+        return path, tokenization
+    if 'bpe' in tokenization.lower() and not getattr(ds, 'BPE_built', False):
+        if bpe_codes is None:
+            raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
+        ds.build_bpe(bpe_codes)
+    if tokenized_files is None:
+        tokenized_files = dict()
+    if (path, tokenization) not in tokenized_files:
+        tokenized_files[(path, tokenization)] = tokenize_file(path, tokenization, n_jobs=n_jobs, bpe_codes=bpe_codes)
+    # The list is shared by the data loaded from the same file. It is not copied: with 'tokenize_none', the Dataset
+    # does not change its sentences, and the shuffling and sample selection build new lists
+    return tokenized_files[(path, tokenization)], 'tokenize_none'
+
+
 def update_dataset_from_file(ds,
                              input_text_filename,
                              params,
@@ -42,6 +86,7 @@ def update_dataset_from_file(ds,
     if output_text_filename is None:
         recompute_references = False
 
+    tokenized_files = dict()
     for split in splits:
         if remove_outputs:
             ds.removeOutput(split,
@@ -50,11 +95,16 @@ def update_dataset_from_file(ds,
             recompute_references = False
 
         elif output_text_filename is not None:
-            ds.setOutput(output_text_filename,
+            output_text, tokenization = tokenize_text_file(ds, output_text_filename,
+                                                           params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                                                           n_jobs=params.get('TOKENIZATION_JOBS', 1),
+                                                           bpe_codes=params.get('BPE_CODES_PATH', None),
+                                                           tokenized_files=tokenized_files)
+            ds.setOutput(output_text,
                          split,
                          type='dense_text' if 'sparse' in params['LOSS'] else 'text',
                          id=params['OUTPUTS_IDS_DATASET'][0],
-                         tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                         tokenization=tokenization,
                          build_vocabulary=False,
                          pad_on_batch=params.get('PAD_ON_BATCH', True),
                          fill=params.get('FILL', 'end'),
@@ -67,11 +117,16 @@ def update_dataset_from_file(ds,
                          overwrite_split=True)
 
         # INPUT DATA
-        ds.setInput(input_text_filename,
+        input_text, tokenization = tokenize_text_file(ds, input_text_filename,
+                                                      params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                                                      n_jobs=params.get('TOKENIZATION_JOBS', 1),
+                                                      bpe_codes=params.get('BPE_CODES_PATH', None),
+                                                      tokenized_files=tokenized_files)
+        ds.setInput(input_text,
                     split,
                     type='text',
                     id=params['INPUTS_IDS_DATASET'][0],
-                    tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                    tokenization=tokenization,
                     build_vocabulary=False,
                     pad_on_batch=params.get('PAD_ON_BATCH', True),
                     fill=params.get('FILL', 'end'),
@@ -85,12 +140,17 @@ def update_dataset_from_file(ds,
                     overwrite_split=True)
         if compute_state_below and output_text_filename is not None:
             # INPUT DATA
-            ds.setInput(output_text_filename,
+            state_below_text, tokenization = tokenize_text_file(ds, output_text_filename,
+                                                                conditional_tok,
+                                                                n_jobs=params.get('TOKENIZATION_JOBS', 1),
+                                                                bpe_codes=params.get('BPE_CODES_PATH', None),
+                                                                tokenized_files=tokenized_files)
+            ds.setInput(state_below_text,
                         split,
                         type='text',
                         id=params['INPUTS_IDS_DATASET'][1],
                         pad_on_batch=params.get('PAD_ON_BATCH', True),
-                        tokenization=conditional_tok,
+                        tokenization=tokenization,
                         build_vocabulary=False,
                         offset=1,
                         fill=params['FILL'],
@@ -123,6 +183,70 @@ def update_dataset_from_file(ds,
     return ds
 
 
+def set_evaluation_split(ds, params, split, tokenized_files=None):
+    """
+    Loads an evaluation split ('val' or 'test') of the dataset, whose vocabularies are already built.
+
+    :param ds: Dataset instance
+    :param params: Parameters for building the dataset
+    :param split: Split to load
+    :param tokenized_files: Dictionary of already tokenized files (see tokenize_text_file)
+    :return: None
+    """
+    base_path = params['DATA_ROOT_PATH']
+
+    # OUTPUT DATA
+    ds.setOutput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
+                 split,
+                 type='dense_text' if 'sparse' in params['LOSS'] else 'text',
+                 id=params['OUTPUTS_IDS_DATASET'][0],
+                 pad_on_batch=params.get('PAD_ON_BATCH', True),
+                 fill=params.get('FILL_TARGET', 'end'),
+                 fill_char=params.get('FILL_TARGET', 'end'),
+                 sample_weights=params.get('SAMPLE_WEIGHTS', True),
+                 max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
+                 max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
+                 bpe_codes=params.get('BPE_CODES_PATH', None))
+    if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
+        ds.setRawOutput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
+                        split,
+                        type='file-name',
+                        id='raw_' + params['OUTPUTS_IDS_DATASET'][0])
+
+    # INPUT DATA
+    input_text, tokenization = tokenize_text_file(ds, base_path + '/' + params['TEXT_FILES'][split] + params['SRC_LAN'],
+                                                  params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                                                  n_jobs=params.get('TOKENIZATION_JOBS', 1),
+                                                  bpe_codes=params.get('BPE_CODES_PATH', None),
+                                                  tokenized_files=tokenized_files)
+    ds.setInput(input_text,
+                split,
+                type='text',
+                id=params['INPUTS_IDS_DATASET'][0],
+                pad_on_batch=params.get('PAD_ON_BATCH', True),
+                tokenization=tokenization,
+                build_vocabulary=False,
+                fill=params['FILL'],
+                fill_char=params.get('FILL_CHAR', 'end'),
+                max_text_len=params['MAX_INPUT_TEXT_LEN'],
+                max_word_len=params['MAX_INPUT_WORD_LEN'],
+                char_bpe=params['CHAR_BPE'],
+                max_words=params['INPUT_VOCABULARY_SIZE'],
+                min_occ=params['MIN_OCCURRENCES_INPUT_VOCAB'],
+                bpe_codes=params.get('BPE_CODES_PATH', None))
+    if len(params['INPUTS_IDS_DATASET']) > 1:
+        ds.setInput(None,
+                    split,
+                    type='ghost',
+                    id=params['INPUTS_IDS_DATASET'][-1],
+                    required=False)
+    if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
+        ds.setRawInput(base_path + '/' + params['TEXT_FILES'][split] + params['SRC_LAN'],
+                       split,
+                       type='file-name',
+                       id='raw_' + params['INPUTS_IDS_DATASET'][0])
+
+
 def build_dataset(params):
     """
     Builds (or loads) a Dataset instance.
@@ -130,7 +254,21 @@ def build_dataset(params):
     :return: Dataset object
     """
 
-    if params['REBUILD_DATASET']:  # We build a new dataset instance
+    dataset_path = params['DATASET_STORE_PATH'] + '/Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl'
+    if params.get('CLEAN_CORPUS', False) and (params['REBUILD_DATASET'] or params.get('DATASET_CACHE', False)):
+        # Build the dataset from the cleaned training files
+        params = clean_training_corpus(params)
+    fingerprint = None
+    if params.get('DATASET_CACHE', False):
+        # The stored Dataset is reused if its files and data parameters did not change
+        stored_fingerprint = load_fingerprint(dataset_path[:-len('.pkl')] + '.fingerprint.json')
+        fingerprint = dataset_fingerprint(params, known_files=(stored_fingerprint or {}).get('files'))
+        if not params['REBUILD_DATASET']:
+            ds = load_cached_dataset(params, dataset_path, fingerprint, stored_fingerprint)
+            if ds is not None:
+                return ds
+
+    if params['REBUILD_DATASET'] or params.get('DATASET_CACHE', False):  # We build a new dataset instance
         if params['VERBOSE'] > 0:
             silence = False
             logging.info(
@@ -146,103 +284,119 @@ def build_dataset(params):
 
         base_path = params['DATA_ROOT_PATH']
         name = params['TASK_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN']
-        ds = Dataset(name, base_path, silence=silence)
+        if params.get('BINARIZE_DATASET', False) or params.get('STREAMING_BUILD', False):
+            ds = BinarizedDataset(name, base_path, silence=silence)
+        else:
+            ds = Dataset(name, base_path, silence=silence)
+
+        # The binarized training split is read in two passes over the files (vocabulary counting and binarization),
+        # so it is never loaded into memory. STREAMING_BUILD also bounds the memory of both passes
+        streaming = params.get('BINARIZE_DATASET', False) or params.get('STREAMING_BUILD', False)
+        if streaming:
+            set_train_input = ds.setStreamingInput
+            set_train_output = ds.setStreamingOutput
+            streaming_options = {'store_path': params['DATASET_STORE_PATH'] + '/' + name + '_binarized',
+                                 'tokenization_jobs': params.get('TOKENIZATION_JOBS', 1)}
+            if params.get('STREAMING_BUILD', False):
+                streaming_options['count_bucket_width'] = params.get('STREAMING_COUNT_BUCKET_WIDTH', 0)
+                streaming_options['shard_size'] = params.get('STREAMING_SHARD_SIZE', 0)
+        else:
+            set_train_input = ds.setInput
+            set_train_output = ds.setOutput
+            streaming_options = {}
+
+        # With TOKENIZATION_JOBS > 1, the files are tokenized in parallel before loading them.
+        # Streamed files are tokenized while they are read.
+        tokenized_files = dict()
+        train_tokenization_jobs = 1 if streaming else params.get('TOKENIZATION_JOBS', 1)
 
         # OUTPUT DATA
         # Let's load the train, val and test splits of the target language sentences (outputs)
         #    the files include a sentence per line.
-        ds.setOutput(base_path + '/' + params['TEXT_FILES']['train'] + params['TRG_LAN'],
-                     'train',
-                     type='dense_text' if 'sparse' in params['LOSS'] else 'text',
-                     id=params['OUTPUTS_IDS_DATASET'][0],
-                     tokenization=conditional_tok,
-                     build_vocabulary=True,
-                     pad_on_batch=params.get('PAD_ON_BATCH', True),
-                     sample_weights=params.get('SAMPLE_WEIGHTS', True),
-                     fill=params.get('FILL', 'end'),
-                     max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
-                     max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
-                     min_occ=params.get('MIN_OCCURRENCES_OUTPUT_VOCAB', 0),
-                     bpe_codes=params.get('BPE_CODES_PATH', None))
+        train_output, tokenization = tokenize_text_file(ds, base_path + '/' + params['TEXT_FILES']['train'] + params['TRG_LAN'],
+                                                        conditional_tok,
+                                                        n_jobs=train_tokenization_jobs,
+                                                        bpe_codes=params.get('BPE_CODES_PATH', None),
+                                                        tokenized_files=tokenized_files)
+        set_train_output(train_output,
+                         'train',
+                         type='dense_text' if 'sparse' in params['LOSS'] else 'text',
+                         id=params['OUTPUTS_IDS_DATASET'][0],
+                         tokenization=tokenization,
+                         build_vocabulary=True,
+                         pad_on_batch=params.get('PAD_ON_BATCH', True),
+                         sample_weights=params.get('SAMPLE_WEIGHTS', True),
+                         fill=params.get('FILL', 'end'),
+                         max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
+                         max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
+                         min_occ=params.get('MIN_OCCURRENCES_OUTPUT_VOCAB', 0),
+                         bpe_codes=params.get('BPE_CODES_PATH', None),
+                         **streaming_options)
         if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
             ds.setRawOutput(base_path + '/' + params['TEXT_FILES']['train'] + params['TRG_LAN'],
                             'train',
                             type='file-name',
                             id='raw_' + params['OUTPUTS_IDS_DATASET'][0])
 
-        for split in ['val', 'test']:
-            if params['TEXT_FILES'].get(split) is not None:
-                ds.setOutput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
-                             split,
-                             type='dense_text' if 'sparse' in params['LOSS'] else 'text',
-                             id=params['OUTPUTS_IDS_DATASET'][0],
-                             pad_on_batch=params.get('PAD_ON_BATCH', True),
-                             fill=params.get('FILL_TARGET', 'end'),
-                             fill_char=params.get('FILL_TARGET', 'end'),
-                             sample_weights=params.get('SAMPLE_WEIGHTS', True),
-                             max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
-                             max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
-                             bpe_codes=params.get('BPE_CODES_PATH', None))
-                if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
-                    ds.setRawOutput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
-                                    split,
-                                    type='file-name',
-                                    id='raw_' + params['OUTPUTS_IDS_DATASET'][0])
-
         # INPUT DATA
-        # We must ensure that the 'train' split is the first (for building the vocabulary)
-        for split in ['train', 'val', 'test']:
-            if params['TEXT_FILES'].get(split) is not None:
-                if split == 'train':
-                    build_vocabulary = True
-                else:
-                    build_vocabulary = False
-                ds.setInput(base_path + '/' + params['TEXT_FILES'][split] + params['SRC_LAN'],
-                            split,
+        # The 'train' split must be the first (for building the vocabulary)
+        input_text, tokenization = tokenize_text_file(ds, base_path + '/' + params['TEXT_FILES']['train'] + params['SRC_LAN'],
+                                                      params.get('TOKENIZATION_METHOD', 'tokenize_none'),
+                                                      n_jobs=train_tokenization_jobs,
+                                                      bpe_codes=params.get('BPE_CODES_PATH', None),
+                                                      tokenized_files=tokenized_files)
+        set_train_input(input_text,
+                        'train',
+                        type='text',
+                        id=params['INPUTS_IDS_DATASET'][0],
+                        pad_on_batch=params.get('PAD_ON_BATCH', True),
+                        tokenization=tokenization,
+                        build_vocabulary=True,
+                        fill=params['FILL'],
+                        fill_char=params.get('FILL_CHAR', 'end'),
+                        max_text_len=params['MAX_INPUT_TEXT_LEN'],
+                        max_word_len=params['MAX_INPUT_WORD_LEN'],
+                        char_bpe=params['CHAR_BPE'],
+                        max_words=params['INPUT_VOCABULARY_SIZE'],
+                        min_occ=params['MIN_OCCURRENCES_INPUT_VOCAB'],
+                        bpe_codes=params.get('BPE_CODES_PATH', None),
+                        **streaming_options)
+
+        if len(params['INPUTS_IDS_DATASET']) > 1:
+            state_below_text, tokenization = tokenize_text_file(ds, base_path + '/' + params['TEXT_FILES']['train'] + params['TRG_LAN'],
+                                                                conditional_tok,
+                                                                n_jobs=train_tokenization_jobs,
+                                                                bpe_codes=params.get('BPE_CODES_PATH', None),
+                                                                tokenized_files=tokenized_files)
+            set_train_input(state_below_text,
+                            'train',
                             type='text',
-                            id=params['INPUTS_IDS_DATASET'][0],
-                            pad_on_batch=params.get('PAD_ON_BATCH', True),
-                            tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
-                            build_vocabulary=build_vocabulary,
-                            fill=params['FILL'],
-                            fill_char=params.get('FILL_CHAR', 'end'),
-                            max_text_len=params['MAX_INPUT_TEXT_LEN'],
-                            max_word_len=params['MAX_INPUT_WORD_LEN'],
+                            id=params['INPUTS_IDS_DATASET'][1],
+                            required=False,
+                            tokenization=tokenization,
+                            pad_on_batch=params['PAD_ON_BATCH'],
+                            build_vocabulary=params['OUTPUTS_IDS_DATASET'][0],
+                            offset=1,
+                            fill=params.get('FILL', 'end'),
+                            max_text_len=params['MAX_OUTPUT_TEXT_LEN'],
+                            max_word_len=0,
                             char_bpe=params['CHAR_BPE'],
-                            max_words=params['INPUT_VOCABULARY_SIZE'],
-                            min_occ=params['MIN_OCCURRENCES_INPUT_VOCAB'],
-                            bpe_codes=params.get('BPE_CODES_PATH', None))
-
-                if len(params['INPUTS_IDS_DATASET']) > 1:
-                    if 'train' in split:
-                        ds.setInput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
-                                    split,
-                                    type='text',
-                                    id=params['INPUTS_IDS_DATASET'][1],
-                                    required=False,
-                                    tokenization=conditional_tok,
-                                    pad_on_batch=params['PAD_ON_BATCH'],
-                                    build_vocabulary=params['OUTPUTS_IDS_DATASET'][0],
-                                    offset=1,
-                                    fill=params.get('FILL', 'end'),
-                                    max_text_len=params['MAX_OUTPUT_TEXT_LEN'],
-                                    max_word_len=0,
-                                    char_bpe=params['CHAR_BPE'],
-                                    max_words=params['OUTPUT_VOCABULARY_SIZE'],
-                                    bpe_codes=params.get('BPE_CODES_PATH', None))
-                        if params.get('TIE_EMBEDDINGS', False):
-                            ds.merge_vocabularies([params['INPUTS_IDS_DATASET'][1], params['INPUTS_IDS_DATASET'][0]])
-                    else:
-                        ds.setInput(None,
-                                    split,
-                                    type='ghost',
-                                    id=params['INPUTS_IDS_DATASET'][-1],
-                                    required=False)
-                if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
-                    ds.setRawInput(base_path + '/' + params['TEXT_FILES'][split] + params['SRC_LAN'],
-                                   split,
-                                   type='file-name',
-                                   id='raw_' + params['INPUTS_IDS_DATASET'][0])
+                            max_words=params['OUTPUT_VOCABULARY_SIZE'],
+                            bpe_codes=params.get('BPE_CODES_PATH', None),
+                            **streaming_options)
+            if params.get('TIE_EMBEDDINGS', False):
+                ds.merge_vocabularies([params['INPUTS_IDS_DATASET'][1], params['INPUTS_IDS_DATASET'][0]])
+        if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
+            ds.setRawInput(base_path + '/' + params['TEXT_FILES']['train'] + params['SRC_LAN'],
+                           'train',
+                           type='file-name',
+                           id='raw_' + params['INPUTS_IDS_DATASET'][0])
+
+        # Evaluation splits
+        for split in ['val', 'test']:
+            if params['TEXT_FILES'].get(split) is not None:
+                set_evaluation_split(ds, params, split, tokenized_files=tokenized_files)
+
         if params.get('POS_UNK', False):
             if params.get('HEURISTIC', 0) > 0:
                 ds.loadMapping(params['MAPPING'])
@@ -252,10 +406,14 @@ def build_dataset(params):
 
         # We have finished loading the dataset, now we can store it for using it in the future
         saveDataset(ds, params['DATASET_STORE_PATH'])
+        # And a copy without data, for decoding
+        export_inference_dataset(ds, inference_dataset_path(dataset_path), bpe_codes=get_bpe_codes(params))
+        if fingerprint is not None:
+            save_fingerprint(fingerprint, dataset_path[:-len('.pkl')] + '.fingerprint.json')
 
     else:
         # We can easily recover it with a single line
-        ds = loadDataset(params['DATASET_STORE_PATH'] + '/Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl')
+        ds = loadDataset(dataset_path)
 
         # If we had multiple references per sentence
         keep_n_captions(ds, repeat=1, n=1, set_names=params['EVAL_ON_SETS'])
@@ -263,71 +421,179 @@ def build_dataset(params):
     return ds
 
 
+def load_cached_dataset(params, dataset_path, fingerprint, stored_fingerprint):
+    """
+    Loads a stored Dataset instance if it is still valid: its data parameters and training files did not change.
+    The evaluation splits whose files changed are reloaded (and the Dataset is stored again).
+
+    :param params: Parameters for building the dataset
+    :param dataset_path: Path to the stored Dataset
+    :param fingerprint: Fingerprint of the current files and parameters (see dataset_fingerprint)
+    :param stored_fingerprint: Fingerprint of the stored Dataset
+    :return: Dataset object. None if it must be rebuilt.
+    """
+    if stored_fingerprint is None or not os.path.isfile(dataset_path):
+        return None
+    if stored_fingerprint['dataset'] != fingerprint['dataset'] or \
+            sorted(stored_fingerprint['splits']) != sorted(fingerprint['splits']):
+        logging.info('The data or parameters of the stored dataset changed. Rebuilding it.')
+        return None
+
+    ds = loadDataset(dataset_path)
+    changed_splits = [split for split in sorted(fingerprint['splits'])
+                      if fingerprint['splits'][split] != stored_fingerprint['splits'][split]]
+    for split in changed_splits:
+        logging.info('Reloading the "' + split + '" split, whose files changed.')
+        # Forget the stored data of the split
+        for prefix in ['X_', 'Y_', 'X_raw_', 'Y_raw_']:
+            setattr(ds, prefix + split, dict())
+        setattr(ds, 'loaded_' + split, [False, False])
+        setattr(ds, 'loaded_raw_' + split, [False, False])
+        ds.types_inputs.pop(split, None)
+        ds.types_outputs.pop(split, None)
+        set_evaluation_split(ds, params, split)
+
+    # If we had multiple references per sentence
+    keep_n_captions(ds, repeat=1, n=1, set_names=params['EVAL_ON_SETS'])
+
+    if changed_splits:
+        saveDataset(ds, params['DATASET_STORE_PATH'])
+    if changed_splits or not os.path.isfile(inference_dataset_path(dataset_path)):
+        export_inference_dataset(ds, inference_dataset_path(dataset_path), bpe_codes=get_bpe_codes(params))
+    save_fingerprint(fingerprint, dataset_path[:-len('.pkl')] + '.fingerprint.json')
+    return ds
+
+
+def get_bpe_codes(params):
+    """
+    Path to the BPE codes used by the tokenization of params.
+
+    :param params: Parameters for building the dataset
+    :return: Path to the BPE codes. None if the tokenization does not apply BPE.
+    """
+    if 'bpe' in params.get('TOKENIZATION_METHOD', 'tokenize_none').lower():
+        return params.get('BPE_CODES_PATH', None)
+    return None
+
+
+class KeptSamples(object):
+    """
+    Read-only view of the samples kept by keep_n_captions: the first n samples of each group of repeat samples.
+    The samples are not copied: indices are mapped to the original list.
+    """
+
+    def __init__(self, samples, repeat, n):
+        """
+        :param samples: Original list of samples.
+        :param int repeat: Number of samples per group.
+        :param int n: Number of samples kept from each group.
+        """
+        self.samples = samples
+        self.repeat = repeat
+        self.n = n
+        self.length = len(range(0, len(samples), repeat)) * n
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('KeptSamples index out of range')
+        group, position = divmod(index, self.n)
+        return self.samples[group * self.repeat + position]
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+
+class References(Mapping):
+    """
+    Read-only dictionary sample index -> [reference 1, ..., reference repeat], built by keep_n_captions.
+    The lists of references are built when requested, from the original list of samples.
+    """
+
+    def __init__(self, samples, repeat):
+        """
+        :param samples: Original list of samples (repeat consecutive references per sample).
+        :param int repeat: Number of references per sample.
+        """
+        self.samples = samples
+        self.repeat = repeat
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise KeyError(index)
+        return [self.samples[i] for i in range(index * self.repeat, min((index + 1) * self.repeat, len(self.samples)))]
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self):
+        return len(range(0, len(self.samples), self.repeat))
+
+
 def keep_n_captions(ds, repeat, n=1, set_names=None):
     """
-    Keeps only n captions per image and stores the rest in dictionaries for a later evaluation
+    Keeps only n captions per image and stores the rest in dictionaries for a later evaluation.
+    The kept captions and the dictionaries are views of the original data, which is not copied
+    (with repeat=1 and n>=1, the data is left untouched).
     :param ds: Dataset object
     :param repeat: Number of input samples per output
     :param n: Number of outputs to keep.
     :param set_names: Set name.
     :return:
     """
-
-    n_samples = None
-    X = None
-    Y = None
-
     if set_names is None:
         set_names = ['val', 'test']
+    n = min(n, repeat)
     for s in set_names:
         logging.info('Keeping ' + str(n) + ' captions per input on the ' + str(s) + ' set.')
 
         ds.extra_variables[s] = dict()
-        n_samples = getattr(ds, 'len_' + s)
-        # Process inputs
-        for id_in in ds.ids_inputs:
-            new_X = []
-            if id_in in ds.optional_inputs:
-                try:
-                    X = getattr(ds, 'X_' + s)
-                    for i in range(0, n_samples, repeat):
-                        for j in range(n):
-                            new_X.append(X[id_in][i + j])
-                    setattr(ds, 'X_' + s + '[' + id_in + ']', new_X)
-                except Exception:
-                    pass
-            else:
-                X = getattr(ds, 'X_' + s)
-                for i in range(0, n_samples, repeat):
-                    for j in range(n):
-                        new_X.append(X[id_in][i + j])
-                aux_list = getattr(ds, 'X_' + s)
-                aux_list[id_in] = new_X
-                setattr(ds, 'X_' + s, aux_list)
-                del aux_list
+        X = getattr(ds, 'X_' + s)
+        Y = getattr(ds, 'Y_' + s)
+        # Process inputs (optional inputs are left untouched)
+        if n < repeat:
+            for id_in in ds.ids_inputs:
+                if id_in not in ds.optional_inputs:
+                    X[id_in] = KeptSamples(X[id_in], repeat, n)
         # Process outputs
+        new_len = getattr(ds, 'len_' + s)
         for id_out in ds.ids_outputs:
-            new_Y = []
-            Y = getattr(ds, 'Y_' + s)
-            dict_Y = dict()
-            count_samples = 0
-            for i in range(0, n_samples, repeat):
-                dict_Y[count_samples] = []
-                for j in range(repeat):
-                    if j < n:
-                        new_Y.append(Y[id_out][i + j])
-                    dict_Y[count_samples].append(Y[id_out][i + j])
-                count_samples += 1
-
-            aux_list = getattr(ds, 'Y_' + s)
-            aux_list[id_out] = new_Y
-            setattr(ds, 'Y_' + s, aux_list)
-            del aux_list
-
             # store dictionary with img_pos -> [cap1, cap2, cap3, ..., capN]
-            ds.extra_variables[s][id_out] = dict_Y
-
-        new_len = len(new_Y)
+            ds.extra_variables[s][id_out] = References(Y[id_out], repeat)
+            if n < repeat:
+                Y[id_out] = KeptSamples(Y[id_out], repeat, n)
+            new_len = len(Y[id_out])
         setattr(ds, 'len_' + s, new_len)
 
         logging.info('Samples reduced to ' + str(new_len) + ' in ' + s + ' set.')
+
+
+def get_unigram_counts(ds, data_id, set_name='train'):
+    """
+    Counts the occurrences of each word of a vocabulary in a split of the dataset.
+    Words out of the vocabulary are counted as the unknown word.
+
+    :param ds: Dataset instance
+    :param data_id: Identifier of the data (and vocabulary) to count.
+    :param set_name: Split where the words are counted.
+    :return: Numpy array with the counts of each word index.
+    """
+    words2idx = ds.vocabulary[data_id]['words2idx']
+    unk_idx = words2idx[ds.unk_symbol]
+    data = getattr(ds, 'Y_' + set_name).get(data_id)
+    if data is None:
+        data = getattr(ds, 'X_' + set_name)[data_id]
+    if isinstance(data, BinarizedSequence):
+        return data.count_ids(ds.vocabulary_len[data_id])
+    counts = np.zeros(ds.vocabulary_len[data_id], dtype='int64')
+    for sentence in data:
+        for word in sentence.split():
+            counts[words2idx.get(word, unk_idx)] += 1
+    return counts
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import codecs
+import logging
+from itertools import islice
+from multiprocessing import Pool
+
+from keras_wrapper.dataset import Dataset
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Tokenization function of each worker process
+_tokfun = None
+
+
+def get_tokenization_function(tokenization, bpe_codes=None, separator=u'@@'):
+    """
+    Gets a tokenization function from the Dataset class, building its BPE encoder if necessary.
+
+    :param str tokenization: Name of the tokenization method of the Dataset class.
+    :param bpe_codes: Path to the BPE codes (only for BPE tokenizations).
+    :param separator: BPE separator.
+    :return: Tokenization function.
+    """
+    ds = Dataset('tokenizer', None, silence=True)
+    if not hasattr(ds, tokenization):
+        raise Exception('Tokenization procedure "' + tokenization + '" is not implemented.')
+    if 'bpe' in tokenization.lower():
+        if bpe_codes is None:
+            raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
+        ds.build_bpe(bpe_codes, separator=separator)
+    return getattr(ds, tokenization)
+
+
+def _init_worker(tokenization, bpe_codes, separator):
+    global _tokfun
+    _tokfun = get_tokenization_function(tokenization, bpe_codes=bpe_codes, separator=separator)
+
+
+def _tokenize_chunk(sentences):
+    return [_tokfun(sentence) for sentence in sentences]
+
+
+def tokenize_sentences(sentences, tokenization, n_jobs=1, bpe_codes=None, separator=u'@@', chunk_size=10000):
+    """
+    Tokenizes a stream of sentences in parallel. The sentences are split into chunks, which are tokenized by a pool of
+    processes and merged in the original order. Only a few chunks per process are kept in memory at the same time.
+
+    :param sentences: Iterable of sentences.
+    :param str tokenization: Name of the tokenization method of the Dataset class (e.g. 'tokenize_bpe').
+    :param int n_jobs: Number of processes.
+    :param bpe_codes: Path to the BPE codes (only for BPE tokenizations).
+    :param separator: BPE separator.
+    :param int chunk_size: Number of sentences of each chunk.
+    :return: Generator of tokenized sentences.
+    """
+    if n_jobs <= 1:
+        tokfun = get_tokenization_function(tokenization, bpe_codes=bpe_codes, separator=separator)
+        for sentence in sentences:
+            yield tokfun(sentence)
+        return
+    sentences = iter(sentences)
+    pool = Pool(n_jobs, initializer=_init_worker, initargs=(tokenization, bpe_codes, separator))
+    try:
+        while True:
+            chunks = [chunk for chunk in (list(islice(sentences, chunk_size)) for _ in range(2 * n_jobs)) if chunk]
+            if not chunks:
+                break
+            for tokenized_chunk in pool.map(_tokenize_chunk, chunks):
+                for sentence in tokenized_chunk:
+                    yield sentence
+    finally:
+        pool.terminate()
+
+
+def tokenize_file(path, tokenization, n_jobs=1, bpe_codes=None, separator=u'@@', chunk_size=10000):
+    """
+    Reads and tokenizes a text file (one sentence per line) in parallel (see tokenize_sentences).
+
+    :param str path: Path to the text file.
+    :param str tokenization: Name of the tokenization method of the Dataset class.
+    :param int n_jobs: Number of processes.
+    :param bpe_codes: Path to the BPE codes (only for BPE tokenizations).
+    :param separator: BPE separator.
+    :param int chunk_size: Number of sentences of each chunk.
+    :return: List of tokenized sentences.
+    """
+    logger.info('Applying tokenization function "' + tokenization + '" to ' + path + ' with ' + str(n_jobs) +
+                ' processes.')
+    with codecs.open(path, 'r', encoding='utf-8') as text_file:
+        return list(tokenize_sentences((line.rstrip(u'\n') for line in text_file), tokenization, n_jobs=n_jobs,
+                                       bpe_codes=bpe_codes, separator=separator, chunk_size=chunk_size))
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import zlib
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
+from six import string_types, text_type
+
+
+def _to_text(word):
+    return word if isinstance(word, text_type) else word.decode('utf-8')
+
+
+def _hash_word(word):
+    return zlib.crc32(word.encode('utf-8')) & 0xffffffff
+
+
+class CompactVocabulary(Mapping):
+    """
+    Read-only vocabulary stored in a few contiguous arrays, instead of two dictionaries:
+        * A string with all the words, concatenated in index order, and the offset of each word in it.
+        * The CRC32 hashes of the words, sorted, and the index of the word of each hash, for looking words up with a
+          binary search.
+
+    It replaces a vocabulary of a Dataset instance ({'words2idx': dict, 'idx2words': dict}): vocabulary['words2idx']
+    and vocabulary['idx2words'] are read-only mappings backed by the arrays, so the text loaders of the Dataset and the
+    models use it as the dictionaries. Whole batches are converted at once with words_to_ids and ids_to_words (e.g. the
+    hypotheses of the beam search, see decode_predictions_beam_search).
+    """
+
+    def __init__(self, words):
+        """
+        :param words: Words of the vocabulary, in index order.
+        """
+        words = [_to_text(word) for word in words]
+        self._table = u''.join(words)
+        self._offsets = np.zeros(len(words) + 1, dtype='int64')
+        np.cumsum([len(word) for word in words], out=self._offsets[1:])
+        hashes = np.array([_hash_word(word) for word in words], dtype='uint32')
+        self._order = np.argsort(hashes, kind='mergesort').astype('int64')
+        self._hashes = hashes[self._order]
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary):
+        """
+        Builds a CompactVocabulary from a vocabulary of a Dataset instance.
+
+        :param dict vocabulary: Vocabulary: {'words2idx': dict, 'idx2words': dict}.
+        :return: CompactVocabulary instance.
+        """
+        idx2words = vocabulary['idx2words']
+        if sorted(idx2words) != list(range(len(idx2words))):
+            raise ValueError('The indices of the vocabulary must be contiguous, from 0 to %d.' % (len(idx2words) - 1))
+        return cls(idx2words[index] for index in range(len(idx2words)))
+
+    def to_vocabulary(self):
+        """
+        Expands the vocabulary into the dictionaries of a Dataset instance. All words are gathered at once.
+
+        :return: Vocabulary: {'words2idx': dict, 'idx2words': dict}.
+        """
+        words = self.ids_to_words(np.arange(self.size))
+        return {'words2idx': dict((word, index) for index, word in enumerate(words)),
+                'idx2words': dict(enumerate(words))}
+
+    def __getitem__(self, key):
+        if key == 'words2idx':
+            return WordsToIndices(self)
+        elif key == 'idx2words':
+            return IndicesToWords(self)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(['words2idx', 'idx2words'])
+
+    def __len__(self):
+        return 2
+
+    @property
+    def size(self):
+        """
+        Number of words of the vocabulary.
+        """
+        return len(self._offsets) - 1
+
+    def word(self, index):
+        """
+        Word of an index.
+
+        :param int index: Index of the word.
+        :return: Word.
+        """
+        if not 0 <= index < self.size:
+            raise KeyError(index)
+        return self._table[self._offsets[index]:self._offsets[index + 1]]
+
+    def index(self, word, default=None):
+        """
+        Index of a word.
+
+        :param word: Word.
+        :param default: Value returned if the word is not in the vocabulary.
+        :return: Index of the word.
+        """
+        word = _to_text(word)
+        # The hash has the type of the array, so that the search does not convert the array
+        word_hash = np.uint32(_hash_word(word))
+        position = int(self._hashes.searchsorted(word_hash))
+        # Words with the same hash (collisions) are contiguous
+        while position < self.size and self._hashes[position] == word_hash:
+            index = int(self._order[position])
+            if self.word(index) == word:
+                return index
+            position += 1
+        return default
+
+    def words_to_ids(self, words, unk_index=None):
+        """
+        Converts a batch of words into indices. The hashes of all words are looked up at once.
+
+        :param words: List of words, or list of sentences (lists of words).
+        :param unk_index: Index given to the words which are not in the vocabulary. If None, they raise a KeyError.
+        :return: Array with the indices of the words, or list of arrays (one per sentence).
+        """
+        if len(words) > 0 and not isinstance(words[0], string_types + (bytes,)):
+            lengths = np.cumsum([len(sentence) for sentence in words])[:-1]
+            return np.split(self.words_to_ids([word for sentence in words for word in sentence],
+                                              unk_index=unk_index), lengths)
+        words = [_to_text(word) for word in words]
+        if self.size == 0 or len(words) == 0:
+            candidates = np.zeros(len(words), dtype='int64')
+        else:
+            hashes = np.array([_hash_word(word) for word in words], dtype='uint32')
+            positions = np.minimum(np.searchsorted(self._hashes, hashes), self.size - 1)
+            candidates = self._order[positions]
+        ids = np.zeros(len(words), dtype='int64')
+        for position, (word, candidate) in enumerate(zip(words, candidates)):
+            # The first word with the same hash is almost always the one (unless there is a collision)
+            if self.size > 0 and self.word(candidate) == word:
+                ids[position] = candidate
+            else:
+                index = self.index(word, default=unk_index)
+                if index is None:
+                    raise KeyError(word)
+                ids[position] = index
+        return ids
+
+    def ids_to_words(self, ids):
+        """
+        Converts a batch of indices into words. The offsets of all words are gathered at once.
+
+        :param ids: Array of indices (of any number of dimensions), or list of sequences of indices.
+        :return: List of words, with the same nesting as ids.
+        """
+        if not isinstance(ids, np.ndarray) and len(ids) > 0 and np.ndim(ids[0]) > 0:
+            if any(np.ndim(sequence) > 1 for sequence in ids):
+                return [self.ids_to_words(sequence) for sequence in ids]
+            # Sequences of different lengths: all their words are gathered at once, and then split
+            lengths = [len(sequence) for sequence in ids]
+            words = self.ids_to_words(np.concatenate([np.asarray(sequence, dtype='int64') for sequence in ids]))
+            starts = np.cumsum([0] + lengths)
+            return [words[start:start + length] for start, length in zip(starts, lengths)]
+        ids = np.asarray(ids, dtype='int64')
+        if ids.size > 0 and (ids.min() < 0 or ids.max() >= self.size):
+            raise KeyError('Indices out of the vocabulary: %s' % str(ids[(ids < 0) | (ids >= self.size)]))
+        starts = self._offsets[ids.ravel()]
+        ends = self._offsets[ids.ravel() + 1]
+        words = [self._table[start:end] for start, end in zip(starts, ends)]
+        for dimension in reversed(ids.shape[1:]):
+            words = [words[i:i + dimension] for i in range(0, len(words), dimension)]
+        return words
+
+
+class WordsToIndices(Mapping):
+    """
+    Read-only words -> indices mapping of a CompactVocabulary (replaces vocabulary['words2idx']).
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+
+    def __getitem__(self, word):
+        index = self.vocabulary.index(word)
+        if index is None:
+            raise KeyError(word)
+        return index
+
+    def __contains__(self, word):
+        return self.vocabulary.index(word) is not None
+
+    def __iter__(self):
+        return iter(self.vocabulary.ids_to_words(np.arange(self.vocabulary.size)))
+
+    def __len__(self):
+        return self.vocabulary.size
+
+    def items(self):
+        return list(zip(self.vocabulary.ids_to_words(np.arange(self.vocabulary.size)), range(self.vocabulary.size)))
+
+
+class IndicesToWords(Mapping):
+    """
+    Read-only indices -> words mapping of a CompactVocabulary (replaces vocabulary['idx2words']).
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+
+    def __getitem__(self, index):
+        return self.vocabulary.word(index)
+
+    def __contains__(self, index):
+        return 0 <= index < self.vocabulary.size
+
+    def __iter__(self):
+        return iter(range(self.vocabulary.size))
+
+    def __len__(self):
+        return self.vocabulary.size
+
+    def items(self):
+        return list(enumerate(self.vocabulary.ids_to_words(np.arange(self.vocabulary.size))))
+
+
+def compact_vocabularies(ds):
+    """
+    Replaces the vocabularies of a Dataset instance with CompactVocabularies. Vocabularies shared between several
+    inputs or outputs (e.g. tied embeddings) are still shared.
+    The vocabularies become read-only, so this must be applied once the Dataset has been built.
+
+    :param ds: Dataset instance.
+    :return: Dataset instance.
+    """
+    compacted = dict()
+    for data_id, vocabulary in list(ds.vocabulary.items()):
+        if isinstance(vocabulary, CompactVocabulary):
+            continue
+        key = id(vocabulary['idx2words'])
+        if key not in compacted:
+            compacted[key] = CompactVocabulary.from_vocabulary(vocabulary)
+        ds.vocabulary[data_id] = compacted[key]
+    return ds
+
+
+def decode_predictions_beam_search(preds, index2word, glossary=None, alphas=None, heuristic=0, x_text=None,
+                                   unk_symbol=u'<unk>', pad_sequences=False, mapping=None, verbose=0):
+    """
+    Decodes the predictions of the beam search, as keras_wrapper.utils.decode_predictions_beam_search (same
+    arguments). If index2word is the mapping of a CompactVocabulary, the words of all the predictions are gathered
+    at once (see CompactVocabulary.ids_to_words), instead of being looked up one by one.
+
+    :param preds: Predictions codified as word indices.
+    :param index2word: Mapping from word indices into words.
+    :param glossary: Glossary for the unknown words replacement.
+    :param alphas: Attention weights of each prediction (for the unknown words replacement).
+    :param heuristic: Unknown words replacement heuristic (0, 1 or 2).
+    :param x_text: Source text (for the unknown words replacement).
+    :param unk_symbol: Unknown words symbol.
+    :param pad_sequences: Whether the predictions are zero-padded.
+    :param mapping: Source-target dictionary (for the unknown words replacement heuristics 1 and 2).
+    :param verbose: Verbosity level.
+    :return: List of decoded predictions.
+    """
+    from keras_wrapper.utils import decode_predictions_beam_search as decode_predictions, replace_unknown_words
+    if not isinstance(index2word, IndicesToWords):
+        return decode_predictions(preds, index2word, glossary=glossary, alphas=alphas, heuristic=heuristic,
+                                  x_text=x_text, unk_symbol=unk_symbol, pad_sequences=pad_sequences, mapping=mapping,
+                                  verbose=verbose)
+    if alphas is not None and x_text is None:
+        raise AssertionError('When using POS_UNK, you must provide the input text to decode_predictions_beam_search!')
+    if pad_sequences:
+        preds = [pred[:np.count_nonzero(np.asarray(pred) > 0) + 1] for pred in preds]
+    predictions = index2word.vocabulary.ids_to_words(list(preds))
+    if alphas is not None:
+        for i, (alignment, x_sentence) in enumerate(zip(alphas, x_text)):
+            x_sentence = x_sentence.split()
+            if unk_symbol in predictions[i] or glossary is not None:
+                hard_alignment = np.argmax(alignment[:, :max(1, len(x_sentence))], axis=1)
+                predictions[i] = replace_unknown_words(x_sentence, predictions[i], hard_alignment, unk_symbol,
+                                                       glossary=glossary, heuristic=heuristic, mapping=mapping,
+                                                       verbose=verbose)
+    # The last word of each prediction is the end of sentence
+    return [u' '.join(words[:-1]) for words in predictions]
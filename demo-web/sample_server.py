@@ -20,12 +20,15 @@ from collections import OrderedDict
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
 from keras_wrapper.model_ensemble import InteractiveBeamSearchSampler
 from keras_wrapper.cnn_model import loadModel, updateModel
-from keras_wrapper.dataset import loadDataset
+from data_engine.inference_dataset import load_inference_dataset
+from data_engine.vocabulary import decode_predictions_beam_search
 from keras_wrapper.extra.isles_utils import *
 from keras_wrapper.extra.read_write import pkl2dict, list2file
 from keras_wrapper.online_trainer import OnlineTrainer
-from keras_wrapper.utils import decode_predictions_beam_search, flatten_list_of_lists
+from keras_wrapper.utils import flatten_list_of_lists
 from nmt_keras.model_zoo import TranslationModel
+from nmt_keras.numpy_inference import load_numpy_model
+from nmt_keras.training import set_model_mappings
 # from online_models import build_online_models
 from utils.utils import update_parameters
 from config_online import load_parameters as load_parameters_online
@@ -114,7 +117,7 @@ class NMTHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
 def parse_args():
     parser = argparse.ArgumentParser("Interactive neural machine translation server.")
-    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance")
+    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance (or its inference Dataset: Dataset_*.inference.pkl)")
     parser.add_argument("-v", "--verbose", required=False, default=0, type=int, help="Verbosity level")
     parser.add_argument("-c", "--config", required=False, help="Config pkl for loading the model configuration. "
                                                                "If not specified, hyperparameters "
@@ -131,14 +134,16 @@ def parse_args():
                                                       "\t 1: Debug messages."
                                                       "\t 2: Time monitoring messages.", type=int, default=0)
     parser.add_argument("-eos", "--eos-symbol", help="End-of-sentence symbol", type=str, default='/')
+    parser.add_argument("-np", "--numpy", action='store_true', default=False, required=False,
+                        help="Decode with the NumPy inference instead of Keras. Incompatible with --online.")
 
     return parser.parse_args()
 
 
 class NMTSampler:
     def __init__(self, models, dataset, params, params_prediction, params_training, model_tokenize_f, model_detokenize_f, general_tokenize_f,
-                 general_detokenize_f, mapping=None, word2index_x=None, word2index_y=None, index2word_y=None,
-                 excluded_words=None, unk_id=1, eos_symbol='/', online=False, verbose=0):
+                 general_detokenize_f, mapping=None, excluded_words=None, unk_id=1, eos_symbol='/', online=False,
+                 verbose=0):
         self.models = models
         self.dataset = dataset
         self.params = params
@@ -152,12 +157,9 @@ class NMTSampler:
         self.excluded_words = excluded_words
         self.verbose = verbose
         self.eos_symbol = eos_symbol
-        self.word2index_x = word2index_x if word2index_x is not None else \
-            dataset.vocabulary[params_prediction['INPUTS_IDS_DATASET'][0]]['words2idx']
-        self.index2word_y = index2word_y if index2word_y is not None else \
-            dataset.vocabulary[params_prediction['OUTPUTS_IDS_DATASET'][0]]['idx2words']
-        self.word2index_y = word2index_y if word2index_y is not None else \
-            dataset.vocabulary[params_prediction['OUTPUTS_IDS_DATASET'][0]]['words2idx']
+        # Vocabularies of the dataset (CompactVocabularies if it is an inference Dataset)
+        self.vocabulary_x = dataset.vocabulary[params_prediction['INPUTS_IDS_DATASET'][0]]
+        self.vocabulary_y = dataset.vocabulary[params_prediction['OUTPUTS_IDS_DATASET'][0]]
         self.unk_id = unk_id
         self.interactive_beam_searcher = InteractiveBeamSearchSampler(self.models,
                                                                       self.dataset,
@@ -200,7 +202,7 @@ class NMTSampler:
         tokenization_end_time = time.time()
         logger.log(2, 'tokenization time: %.6f' % (tokenization_end_time - tokenization_start_time))
         parse_input_start_time = time.time()
-        src_seq, src_words = parse_input(tokenized_input, self.dataset, self.word2index_x)
+        src_seq, src_words = parse_input(tokenized_input, self.dataset, self.vocabulary_x['words2idx'])
         parse_input_end_time = time.time()
         logger.log(2, 'parse_input time: %.6f' % (parse_input_end_time - parse_input_start_time))
 
@@ -222,9 +224,10 @@ class NMTSampler:
 
             # 2.2.5 Validate words
             word_validation_start_time = time.time()
+            word2index_y = self.vocabulary_y['words2idx']
             for pos, word in enumerate(tokenized_validated_prefix.split()):
-                fixed_words_user[pos] = self.word2index_y.get(word, self.unk_id)
-                if self.word2index_y.get(word) is None:
+                fixed_words_user[pos] = word2index_y.get(word, self.unk_id)
+                if word2index_y.get(word) is None:
                     unk_words_dict[pos] = word
             word_validation_end_time = time.time()
             logger.log(2, 'word_validation time: %.6f' % (word_validation_end_time - word_validation_start_time))
@@ -234,8 +237,9 @@ class NMTSampler:
             last_user_word_pos = list(fixed_words_user.keys())[-1]
             if next_correction != u' ':
                 last_user_word = tokenized_validated_prefix.split()[-1]
-                filtered_idx2word = dict((self.word2index_y[candidate_word], candidate_word)
-                                         for candidate_word in self.word2index_y if candidate_word[:len(last_user_word)] == last_user_word)
+                filtered_idx2word = dict((index, candidate_word)
+                                         for candidate_word, index in self.vocabulary_y['words2idx'].items()
+                                         if candidate_word[:len(last_user_word)] == last_user_word)
 
                 # if candidate_word.decode('utf-8')[:len(last_user_word)] == last_user_word)
                 if filtered_idx2word != dict():
@@ -254,7 +258,7 @@ class NMTSampler:
                                                                           max_N=max_N,
                                                                           isles=isle_indices,
                                                                           valid_next_words=filtered_idx2word,
-                                                                          idx2word=self.index2word_y)
+                                                                          idx2word=self.vocabulary_y['idx2words'])
         sample_beam_search_end_time = time.time()
         logger.log(2, 'sample_beam_search time: %.6f' % (sample_beam_search_end_time - sample_beam_search_start_time))
 
@@ -276,7 +280,7 @@ class NMTSampler:
         # 1.2 Decode hypothesis
         decoding_predictions_start_time = time.time()
         hypothesis = decode_predictions_beam_search([trans_indices],
-                                                    self.index2word_y,
+                                                    self.vocabulary_y['idx2words'],
                                                     alphas=alphas,
                                                     x_text=sources,
                                                     heuristic=heuristic,
@@ -325,7 +329,7 @@ class NMTSampler:
         # Tokenize input
         tokenized_input = self.general_tokenize_f(source_sentence, escape=False)
         tokenized_input = self.model_tokenize_f(tokenized_input)
-        src_seq, src_words = parse_input(tokenized_input, self.dataset, self.word2index_x)
+        src_seq, src_words = parse_input(tokenized_input, self.dataset, self.vocabulary_x['words2idx'])
 
         # Tokenize output
         tokenized_reference = self.general_tokenize_f(target_sentence, escape=False)
@@ -362,6 +366,8 @@ class NMTSampler:
 
 def main():
     args = parse_args()
+    if args.online and args.numpy:
+        raise ValueError('The NumPy inference (--numpy) cannot be trained online (--online).')
     server_address = (args.address, args.port)
     httpd = BaseHTTPServer.HTTPServer(server_address, NMTHandler)
     logger.setLevel(args.logging_level)
@@ -388,7 +394,7 @@ def main():
     except ValueError:
         print('Error processing arguments: (', k, ",", v, ")")
         exit(2)
-    dataset = loadDataset(args.dataset)
+    dataset = load_inference_dataset(args.dataset)
 
     # For converting predictions into sentences
     # Dataset backwards compatibility
@@ -413,7 +419,8 @@ def main():
     parameters_prediction['n_parallel_loaders'] = parameters.get('PARALLEL_LOADERS', 1)
     parameters_prediction['beam_size'] = parameters.get('BEAM_SIZE', 6)
     parameters_prediction['maxlen'] = parameters.get('MAX_OUTPUT_TEXT_LEN_TEST', 100)
-    parameters_prediction['optimized_search'] = parameters['OPTIMIZED_SEARCH']
+    # The NumPy models only implement the optimized search
+    parameters_prediction['optimized_search'] = parameters['OPTIMIZED_SEARCH'] or args.numpy
     parameters_prediction['model_inputs'] = parameters['INPUTS_IDS_MODEL']
     parameters_prediction['model_outputs'] = parameters['OUTPUTS_IDS_MODEL']
     parameters_prediction['dataset_inputs'] = parameters['INPUTS_IDS_DATASET']
@@ -487,28 +494,26 @@ def main():
         # if parameters.get('N_BEST_OPTIMIZER', False):
         #     logging.info('Using N-best optimizer')
         # models = build_online_models(models, parameters)
+    elif args.numpy:
+        models = [load_numpy_model(parameters, m) for m in args.models]
+        for nmt_model in models:
+            set_model_mappings(nmt_model, dataset, parameters)
     else:
         models = [loadModel(m, -1, full_path=True) for m in args.models]
 
-    for nmt_model in models:
-        nmt_model.setParams(parameters)
-        nmt_model.setOptimizer()
+    if not args.numpy:
+        for nmt_model in models:
+            nmt_model.setParams(parameters)
+            nmt_model.setOptimizer()
 
     parameters['INPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[parameters['INPUTS_IDS_DATASET'][0]]
     parameters['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[parameters['OUTPUTS_IDS_DATASET'][0]]
 
-    # Get word2index and index2word dictionaries
-    index2word_y = dataset.vocabulary[parameters['OUTPUTS_IDS_DATASET'][0]]['idx2words']
-    word2index_y = dataset.vocabulary[parameters['OUTPUTS_IDS_DATASET'][0]]['words2idx']
-    index2word_x = dataset.vocabulary[parameters['INPUTS_IDS_DATASET'][0]]['idx2words']
-    word2index_x = dataset.vocabulary[parameters['INPUTS_IDS_DATASET'][0]]['words2idx']
-
     excluded_words = None
     interactive_beam_searcher = NMTSampler(models, dataset, parameters, parameters_prediction, parameters_training,
                                            tokenize_f, detokenize_function,
                                            tokenize_general, detokenize_general,
-                                           mapping=mapping, word2index_x=word2index_x, word2index_y=word2index_y,
-                                           index2word_y=index2word_y, eos_symbol=args.eos_symbol,
+                                           mapping=mapping, eos_symbol=args.eos_symbol,
                                            excluded_words=excluded_words, online=args.online, verbose=args.verbose)
 
     httpd.sampler = interactive_beam_searcher
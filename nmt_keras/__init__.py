@@ -4,6 +4,27 @@ import logging
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 logger = logging.getLogger(__name__)
 
+try:
+    from keras.utils import get_custom_objects
+    from nmt_keras.average_attention import AverageAttentionGate, CumulativeAverage
+    from nmt_keras.fused_attention import FusedMultiHeadAttention
+    from nmt_keras.positional_encoding import SinusoidalPositionalEncoding
+    from nmt_keras.ring_buffer_cache import RingBufferCache
+    from nmt_keras.sampled_softmax import SampledSoftmaxOutput
+    from nmt_keras.tied_embedding import TiedEmbedding
+except ImportError:
+    # Without Keras, only the modules which do not need it can be used (e.g. helpers and numpy_inference)
+    pass
+else:
+    # Custom layers of the models, so Keras can load them (e.g. in loadModel and updateModel) without custom_objects
+    get_custom_objects().update({'AverageAttentionGate': AverageAttentionGate,
+                                 'CumulativeAverage': CumulativeAverage,
+                                 'FusedMultiHeadAttention': FusedMultiHeadAttention,
+                                 'RingBufferCache': RingBufferCache,
+                                 'SampledSoftmaxOutput': SampledSoftmaxOutput,
+                                 'SinusoidalPositionalEncoding': SinusoidalPositionalEncoding,
+                                 'TiedEmbedding': TiedEmbedding})
+
 
 def check_params(params):
     """
@@ -22,21 +43,24 @@ def check_params(params):
     if not params['PAD_ON_BATCH']:
         logger.warn('It is HIGHLY recommended to set the option "PAD_ON_BATCH = True."')
 
-    if params['MODEL_TYPE'].lower() == 'transformer':
+    if params['MODEL_TYPE'].lower() in ['transformer', 'averageattentionnetwork']:
 
-        assert params['MODEL_SIZE'] == params['TARGET_TEXT_EMBEDDING_SIZE'], 'When using the Transformer model, ' \
-                                                                             'dimensions of "MODEL_SIZE" and "TARGET_TEXT_EMBEDDING_SIZE" must match. ' \
-                                                                             'Currently, they are: %d and %d, respectively.' % (params['MODEL_SIZE'], params['TARGET_TEXT_EMBEDDING_SIZE'])
-        assert params['MODEL_SIZE'] == params['SOURCE_TEXT_EMBEDDING_SIZE'], 'When using the Transformer model, ' \
-                                                                             'dimensions of "MODEL_SIZE" and "SOURCE_TEXT_EMBEDDING_SIZE" must match. ' \
-                                                                             'Currently, they are: %d and %d, respectively.' % (params['MODEL_SIZE'], params['SOURCE_TEXT_EMBEDDING_SIZE'])
+        encoder_size = params.get('ENCODER_MODEL_SIZE') or params['MODEL_SIZE']
+        decoder_size = params.get('DECODER_MODEL_SIZE') or params['MODEL_SIZE']
+        assert decoder_size == params['TARGET_TEXT_EMBEDDING_SIZE'], 'When using the Transformer model, ' \
+                                                                     'dimensions of the decoder ("DECODER_MODEL_SIZE" or "MODEL_SIZE") and "TARGET_TEXT_EMBEDDING_SIZE" must match. ' \
+                                                                     'Currently, they are: %d and %d, respectively.' % (decoder_size, params['TARGET_TEXT_EMBEDDING_SIZE'])
+        assert encoder_size == params['SOURCE_TEXT_EMBEDDING_SIZE'], 'When using the Transformer model, ' \
+                                                                     'dimensions of the encoder ("ENCODER_MODEL_SIZE" or "MODEL_SIZE") and "SOURCE_TEXT_EMBEDDING_SIZE" must match. ' \
+                                                                     'Currently, they are: %d and %d, respectively.' % (encoder_size, params['SOURCE_TEXT_EMBEDDING_SIZE'])
 
         if params['POS_UNK']:
             logger.warn('The "POS_UNK" option is still unimplemented for the "Transformer" model. Setting it to False.')
             params['POS_UNK'] = False
-        assert params['MODEL_SIZE'] % params['N_HEADS'] == 0, \
-            '"MODEL_SIZE" should be a multiple of "N_HEADS". ' \
-            'Currently: mod(%d, %d) == %d.' % (params['MODEL_SIZE'], params['N_HEADS'], params['MODEL_SIZE'] % params['N_HEADS'])
+        for model_size in [encoder_size, decoder_size]:
+            assert model_size % params['N_HEADS'] == 0, \
+                'The model sizes ("MODEL_SIZE", "ENCODER_MODEL_SIZE", "DECODER_MODEL_SIZE") should be a multiple of "N_HEADS". ' \
+                'Currently: mod(%d, %d) == %d.' % (model_size, params['N_HEADS'], model_size % params['N_HEADS'])
 
     if params['POS_UNK']:
         if not params['OPTIMIZED_SEARCH']:
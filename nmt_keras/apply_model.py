@@ -17,7 +17,7 @@ def sample_ensemble(args, params):
 
     :param argparse.Namespace args: Arguments given to the method:
 
-                      * dataset: Dataset instance with data.
+                      * dataset: Dataset instance with data (or its inference Dataset, see load_inference_dataset).
                       * text: Text file with source sentences.
                       * splits: Splits to sample. Should be already included in the dataset object.
                       * dest: Output file to save scores.
@@ -25,6 +25,7 @@ def sample_ensemble(args, params):
                       * n_best: Write n-best list (n = beam size).
                       * config: Config .pkl for loading the model configuration. If not specified, hyperparameters are read from config.py.
                       * models: Path to the models.
+                      * numpy: Decode with the NumPy inference (see load_numpy_model) instead of Keras (optional).
                       * verbose: Be verbose or not.
 
     :param params: parameters of the translation model.
@@ -32,13 +33,22 @@ def sample_ensemble(args, params):
     from data_engine.prepare_data import update_dataset_from_file
     from keras_wrapper.model_ensemble import BeamSearchEnsemble
     from keras_wrapper.cnn_model import loadModel
-    from keras_wrapper.dataset import loadDataset
-    from keras_wrapper.utils import decode_predictions_beam_search
+    from data_engine.inference_dataset import load_inference_dataset
+    from data_engine.vocabulary import decode_predictions_beam_search
 
     logging.info("Using an ensemble of %d models" % len(args.models))
-    models = [loadModel(m, -1, full_path=True) for m in args.models]
-    dataset = loadDataset(args.dataset)
+    use_numpy = getattr(args, 'numpy', False)
+    if use_numpy:
+        from nmt_keras.numpy_inference import load_numpy_model
+        from nmt_keras.training import set_model_mappings
+        models = [load_numpy_model(params, m) for m in args.models]
+    else:
+        models = [loadModel(m, -1, full_path=True) for m in args.models]
+    dataset = load_inference_dataset(args.dataset)
     dataset = update_dataset_from_file(dataset, args.text, params, splits=args.splits, remove_outputs=True)
+    if use_numpy:
+        for model in models:
+            set_model_mappings(model, dataset, params)
 
     params['INPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['INPUTS_IDS_DATASET'][0]]
     params['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['OUTPUTS_IDS_DATASET'][0]]
@@ -53,7 +63,8 @@ def sample_ensemble(args, params):
     params_prediction['n_parallel_loaders'] = params.get('PARALLEL_LOADERS', 1)
     params_prediction['beam_size'] = params.get('BEAM_SIZE', 6)
     params_prediction['maxlen'] = 80 #params.get('MAX_OUTPUT_TEXT_LEN_TEST', 100)
-    params_prediction['optimized_search'] = params['OPTIMIZED_SEARCH']
+    # The NumPy models only implement the optimized search
+    params_prediction['optimized_search'] = params['OPTIMIZED_SEARCH'] or use_numpy
     params_prediction['model_inputs'] = params['INPUTS_IDS_MODEL']
     params_prediction['model_outputs'] = params['OUTPUTS_IDS_MODEL']
     params_prediction['dataset_inputs'] = params['INPUTS_IDS_DATASET']
@@ -156,7 +167,7 @@ def score_corpus(args, params):
 
     :param argparse.Namespace args: Arguments given to the method:
 
-                                * dataset: Dataset instance with data.
+                                * dataset: Dataset instance with data (or its inference Dataset, see load_inference_dataset).
                                 * source: Text file with source sentences.
                                 * target: Text file with target sentences.
                                 * splits: Splits to sample. Should be already included in the dataset object.
@@ -169,13 +180,13 @@ def score_corpus(args, params):
     """
 
     from data_engine.prepare_data import update_dataset_from_file
-    from keras_wrapper.dataset import loadDataset
+    from data_engine.inference_dataset import load_inference_dataset
     from keras_wrapper.cnn_model import loadModel
     from keras_wrapper.model_ensemble import BeamSearchEnsemble
 
     logging.info("Using an ensemble of %d models" % len(args.models))
     models = [loadModel(m, -1, full_path=True) for m in args.models]
-    dataset = loadDataset(args.dataset)
+    dataset = load_inference_dataset(args.dataset)
     dataset = update_dataset_from_file(dataset, args.source, params, splits=args.splits,
                                        output_text_filename=args.target, compute_state_below=True)
 
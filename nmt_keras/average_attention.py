@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from keras import backend as K
+from keras import initializers
+from keras.layers import Layer
+
+
+class CumulativeAverage(Layer):
+    """
+    Cumulative average of a sequence (the average of the vectors up to each position), which replaces the masked
+    self-attention of the Transformer decoder in the average attention network (Zhang et al., 2018).
+
+    The layer takes a sequence with shape (batch, time, dim) or, for decoding step by step, a list
+    [sequence, previous average, position], where the previous average (batch, 1, dim) is the average of the
+    previous `position` vectors (batch, 1). With return_state, it also returns the average of the whole sequence and
+    its length (the state for the next step), so each decoding step has the same cost regardless of its position.
+    """
+
+    def __init__(self, return_state=False, **kwargs):
+        """
+        :param bool return_state: Return [averages, last average, next position] instead of the averages.
+        """
+        super(CumulativeAverage, self).__init__(**kwargs)
+        self.return_state = return_state
+        self.supports_masking = True
+
+    def call(self, inputs, mask=None):
+        if isinstance(inputs, list):
+            x, prev_average, position = inputs
+            mask = mask[0] if mask is not None else None
+        else:
+            x, prev_average, position = inputs, None, None
+        if mask is not None:
+            x = x * K.expand_dims(K.cast(mask, K.floatx()))
+        sums = K.cumsum(x, axis=1)
+        counts = K.reshape(K.cast(K.arange(1, K.shape(x)[1] + 1), K.floatx()), (1, -1, 1))
+        if position is None:
+            position = K.zeros_like(x[:, :1, 0])
+        else:
+            sums += prev_average * K.expand_dims(position)
+        counts += K.expand_dims(position)
+        averages = sums / counts
+        if not self.return_state:
+            return averages
+        return [averages, averages[:, -1:], position + K.cast(K.shape(x)[1], K.floatx())]
+
+    def compute_mask(self, inputs, mask=None):
+        if isinstance(mask, list):
+            mask = mask[0]
+        return [mask, None, None] if self.return_state else mask
+
+    def compute_output_shape(self, input_shape):
+        if isinstance(input_shape, list):
+            input_shape = input_shape[0]
+        if not self.return_state:
+            return input_shape
+        return [input_shape, (input_shape[0], 1, input_shape[-1]), (input_shape[0], 1)]
+
+    def get_config(self):
+        config = {'return_state': self.return_state}
+        base_config = super(CumulativeAverage, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class AverageAttentionGate(Layer):
+    """
+    Gating layer of the average attention network: takes a list [x, y], with the input of the average attention and
+    the (transformed) cumulative average, and returns i * x + f * y, where the input and forget gates are computed from
+    their concatenation.
+    """
+
+    def __init__(self, kernel_initializer='glorot_uniform', bias_initializer='zeros', **kwargs):
+        super(AverageAttentionGate, self).__init__(**kwargs)
+        self.kernel_initializer = initializers.get(kernel_initializer)
+        self.bias_initializer = initializers.get(bias_initializer)
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        self.dim = input_shape[0][-1]
+        self.kernel = self.add_weight(shape=(2 * self.dim, 2 * self.dim), initializer=self.kernel_initializer,
+                                      name='kernel')
+        self.bias = self.add_weight(shape=(2 * self.dim,), initializer=self.bias_initializer, name='bias')
+        super(AverageAttentionGate, self).build(input_shape)
+
+    def call(self, inputs, mask=None):
+        x, y = inputs
+        gates = K.sigmoid(K.bias_add(K.dot(K.concatenate([x, y]), self.kernel), self.bias))
+        return gates[:, :, :self.dim] * x + gates[:, :, self.dim:] * y
+
+    def compute_mask(self, inputs, mask=None):
+        return mask[0] if mask is not None else None
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0]
+
+    def get_config(self):
+        config = {'kernel_initializer': initializers.serialize(self.kernel_initializer),
+                  'bias_initializer': initializers.serialize(self.bias_initializer)}
+        base_config = super(AverageAttentionGate, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -1,21 +1,59 @@
 # -*- coding: utf-8 -*-
+import math
+from keras_wrapper.cnn_model import saveModel
 from keras_wrapper.extra.callbacks import *
+from nmt_keras.callbacks import ExponentialMovingAverage, StoreTrainingState, ThroughputProfiler
 
 
-def buildCallbacks(params, model, dataset):
+def buildCallbacks(params, model, dataset, steps_per_epoch=None):
     """
     Builds the selected set of callbacks run during the training of the model:
         * PrintPerformanceMetricOnEpochEndOrEachNUpdates: Evaluates the model in the validation set given a number of epochs/updates.
         * SampleEachNUpdates: Shows several translation samples during training.
+        * StoreTrainingState: Stores the full training state, for resuming the training exactly.
+        * ExponentialMovingAverage: Keeps an EMA of the weights, used for evaluating and saving the model.
+        * StoreModelWeightsOnEpochEnd: With EMA, stores the model (with the EMA weights) each EPOCHS_FOR_SAVE epochs.
+        * ThroughputProfiler: Measures where the training time goes (data, train step, callbacks) and the throughput.
 
 
     :param dict params: Dictionary of network hyperparameters.
     :param Model_Wrapper model: Model instance on which to apply the callback.
     :param Dataset dataset: Dataset instance on which to apply the callback.
+    :param int steps_per_epoch: Number of updates of each epoch. If None, ceil(len_train / BATCH_SIZE).
     :return: list of callbacks to pass to the Keras' training.
     """
 
     callbacks = []
+    if steps_per_epoch is None:
+        steps_per_epoch = int(math.ceil(dataset.len_train / float(params['BATCH_SIZE'])))
+    update_offset = params['RELOAD'] * steps_per_epoch if params['RELOAD_EPOCH'] else params['RELOAD']
+
+    callback_ema = None
+    if params.get('USE_EMA', False):
+        # Must run before the evaluation and saving callbacks, so they use the averaged weights
+        callback_ema = ExponentialMovingAverage(model,
+                                                decay=params.get('EMA_DECAY', 0.9999),
+                                                each_n_updates=params.get('EMA_EACH', 1),
+                                                eval_on_epochs=params['EVAL_EACH_EPOCHS'],
+                                                eval_each=params['EVAL_EACH'],
+                                                update_offset=update_offset,
+                                                verbose=params['VERBOSE'])
+
+    if params.get('SAVE_TRAINING_STATE', False):
+        # Must run before the EMA callback, so the training weights are stored
+        callback_training_state = StoreTrainingState(model,
+                                                     params['STORE_PATH'] + '/training_state.pkl',
+                                                     each_n_updates=params.get('TRAINING_STATE_EACH', 0),
+                                                     update_offset=update_offset,
+                                                     ema=callback_ema,
+                                                     verbose=params['VERBOSE'])
+        callbacks.append(callback_training_state)
+
+    if callback_ema is not None:
+        callbacks.append(callback_ema)
+        # The model storing callback of the training (Model_Wrapper.trainNet) runs before any other callback, so it
+        # would store the training weights. With EMA, it is disabled (see train_model) and the model is stored here.
+        callbacks.append(StoreModelWeightsOnEpochEnd(model, saveModel, params['EPOCHS_FOR_SAVE']))
 
     if params['METRICS'] or params['SAMPLE_ON_SETS']:
         # Evaluate training
@@ -111,4 +149,16 @@ def buildCallbacks(params, model, dataset):
                                                    start_sampling_on_epoch=params['START_SAMPLING_ON_EPOCH'],
                                                    verbose=params['VERBOSE'])
             callbacks.append(callback_sampling)
+
+    if params.get('PROFILE_THROUGHPUT', False):
+        tensorboard_dir = model.model_path + '/' + params.get('LOG_DIR', 'tensorboard_logs') \
+            if params.get('TENSORBOARD', False) else None
+        callback_profiler = ThroughputProfiler(dataset,
+                                               model.model_path + '/throughput.csv',
+                                               each_n_updates=params.get('PROFILE_EACH', 100),
+                                               tensorboard_dir=tensorboard_dir,
+                                               verbose=params['VERBOSE'])
+        for callback in callbacks:
+            callback_profiler.watch(callback)
+        callbacks.insert(0, callback_profiler)
     return callbacks
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import collections
+import logging
+import os
+import random
+import threading
+from timeit import default_timer as timer
+
+import numpy as np
+from six.moves import cPickle as pk
+from keras import backend as K
+from keras.callbacks import Callback as KerasCallback
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def get_trained_model(model_wrapper):
+    """
+    Returns the Keras model that is actually compiled and trained (the multi-GPU replica, if it exists).
+
+    :param Model_Wrapper model_wrapper: Model instance.
+    :return: Keras model.
+    """
+    if getattr(model_wrapper, 'multi_gpu_model', None) is not None:
+        return model_wrapper.multi_gpu_model
+    return model_wrapper.model
+
+
+def get_training_state(model_wrapper, epoch, update, batch_in_epoch=0, shuffle_seed=None, ema=None):
+    """
+    Collects the full training state of a model: weights, optimizer slots, learning rate, counters and RNG states.
+
+    :param Model_Wrapper model_wrapper: Model instance.
+    :param int epoch: Epoch in which training must be resumed.
+    :param int update: Number of updates performed so far.
+    :param int batch_in_epoch: Number of batches already consumed in the current epoch.
+    :param int shuffle_seed: Seed of the EpochShuffler of the training samples.
+    :param ExponentialMovingAverage ema: If given, its shadow weights are also stored.
+    :return: dict with the training state.
+    """
+    optimizer = get_trained_model(model_wrapper).optimizer
+    return {'epoch': epoch,
+            'update': update,
+            'batch_in_epoch': batch_in_epoch,
+            'shuffle_seed': shuffle_seed,
+            'weights': model_wrapper.model.get_weights(),
+            'optimizer_weights': K.batch_get_value(optimizer.weights),
+            'lr': K.get_value(optimizer.lr),
+            'python_rng': random.getstate(),
+            'numpy_rng': np.random.get_state(),
+            'ema_weights': ema.shadow_weights if ema is not None else None}
+
+
+def save_training_state(state, path):
+    """
+    Stores a training state. The state is written to a temporary file, which then replaces the previous one,
+    so an interrupted job never leaves a truncated checkpoint behind.
+
+    :param dict state: Training state (see get_training_state).
+    :param str path: Destination file.
+    :return: None
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as state_file:
+        pk.dump(state, state_file, protocol=-1)
+        state_file.flush()
+        os.fsync(state_file.fileno())
+    os.rename(tmp_path, path)
+
+
+def load_training_state(path):
+    """
+    Loads a training state stored with save_training_state.
+
+    :param str path: Path to the training state file.
+    :return: dict with the training state.
+    """
+    logger.info('<<< Loading training state from ' + path + ' ... >>>')
+    with open(path, 'rb') as state_file:
+        return pk.load(state_file)
+
+
+def restore_training_state(model_wrapper, state):
+    """
+    Restores a training state into an already compiled model.
+    The optimizer slots are created by building the training function before setting their values.
+
+    :param Model_Wrapper model_wrapper: Model instance. Its optimizer must be set.
+    :param dict state: Training state (see get_training_state).
+    :return: None
+    """
+    model_wrapper.model.set_weights(state['weights'])
+    model_to_train = get_trained_model(model_wrapper)
+    model_to_train._make_train_function()
+    model_to_train.optimizer.set_weights(state['optimizer_weights'])
+    K.set_value(model_to_train.optimizer.lr, state['lr'])
+    random.setstate(state['python_rng'])
+    np.random.set_state(state['numpy_rng'])
+    logger.info('<<< Training state restored: epoch %d, update %d >>>' % (state['epoch'], state['update']))
+
+
+def reorder_training_samples(dataset, order):
+    """
+    Reorders the training samples of a Dataset instance: the new i-th sample is the current order[i]-th one.
+    Data with its own shuffle method (e.g. a BinarizedSequence) only permutes its index.
+
+    :param Dataset dataset: Dataset instance.
+    :param order: Permutation of the sample indices.
+    :return: None
+    """
+    for data in [dataset.X_train, dataset.Y_train]:
+        for sample_id in list(data):
+            if hasattr(data[sample_id], 'shuffle'):
+                data[sample_id].shuffle(order)
+            else:
+                data[sample_id] = [data[sample_id][s] for s in order]
+
+
+class EpochShuffler(object):
+    """
+    Replaces the shuffling of the training samples of a Dataset instance (Dataset.shuffleTraining, called by the batch
+    generators at the beginning of each epoch) with a seeded one: the order of the samples in an epoch only depends on
+    the seed and the epoch, so the batches of an interrupted epoch can be rebuilt when resuming the training.
+    """
+
+    def __init__(self, dataset, seed, epoch=0):
+        """
+        :param Dataset dataset: Dataset instance. Its training samples must be in their original order.
+        :param int seed: Seed of the shuffles.
+        :param int epoch: Epoch of the next shuffle.
+        """
+        self.dataset = dataset
+        self.seed = seed
+        self.epoch = epoch
+        # Current order of the samples, as indices in the original order
+        self.order = np.arange(dataset.len_train)
+        dataset.shuffleTraining = self.shuffle
+
+    def epoch_order(self, epoch):
+        """
+        Order of the training samples in an epoch, as indices in the original order.
+        """
+        return np.random.RandomState((self.seed + epoch) % 2 ** 32).permutation(self.dataset.len_train)
+
+    def shuffle(self):
+        """
+        Sets the order of the training samples of the next epoch.
+        :return: None
+        """
+        order = self.epoch_order(self.epoch)
+        reorder_training_samples(self.dataset, np.argsort(self.order)[order])
+        self.order = order
+        self.epoch += 1
+
+
+class StoreTrainingState(KerasCallback):
+    """
+    Stores the full training state (see get_training_state) each N updates and at the end of each epoch.
+    The state file is overwritten atomically, keeping only the latest state.
+    """
+
+    def __init__(self, model_wrapper, store_path, each_n_updates=0, update_offset=0, ema=None, shuffler=None,
+                 verbose=1):
+        """
+        :param Model_Wrapper model_wrapper: Model instance.
+        :param str store_path: File where the training state is stored.
+        :param int each_n_updates: Store the state each this number of updates (0 means only at the end of epochs).
+        :param int update_offset: Number of updates performed before the current training run.
+        :param ExponentialMovingAverage ema: EMA callback whose shadow weights are stored with the state.
+                                             It must run after this callback, so the raw weights are stored.
+        :param EpochShuffler shuffler: Shuffler of the training samples, whose seed is stored with the state.
+        :param int verbose: Be verbose.
+        """
+        super(StoreTrainingState, self).__init__()
+        self.model_wrapper = model_wrapper
+        self.ema = ema
+        self.shuffler = shuffler
+        self.store_path = store_path
+        self.each_n_updates = each_n_updates
+        self.cum_update = update_offset
+        self.epoch = 0
+        self.batch_in_epoch = 0
+        self.verbose = verbose
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.batch_in_epoch = 0
+
+    def on_batch_end(self, n_update, logs=None):
+        self.cum_update += 1
+        self.batch_in_epoch = n_update + 1
+        if self.each_n_updates > 0 and self.cum_update % self.each_n_updates == 0:
+            self.store()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch = epoch + 1
+        self.batch_in_epoch = 0
+        self.store()
+
+    def store(self):
+        """
+        Stores the current training state.
+        :return: None
+        """
+        save_training_state(get_training_state(self.model_wrapper, self.epoch, self.cum_update, self.batch_in_epoch,
+                                               shuffle_seed=self.shuffler.seed if self.shuffler is not None else None,
+                                               ema=self.ema),
+                            self.store_path)
+        if self.verbose > 0:
+            logger.info('<<< Training state stored in ' + self.store_path + ' (update %d) >>>' % self.cum_update)
+
+
+class ExponentialMovingAverage(KerasCallback):
+    """
+    Keeps an exponential moving average (EMA) of the model weights during training:
+        shadow = decay * shadow + (1 - decay) * weights
+    The average is updated each N updates. The shadow weights are swapped into the model at the end of each epoch and
+    at the evaluation updates, so the callbacks that run after this one (evaluation, sampling, model saving) use them.
+    The training weights are restored before the next batch.
+    """
+
+    def __init__(self, model_wrapper, decay=0.9999, each_n_updates=1, eval_on_epochs=True, eval_each=1,
+                 shadow_weights=None, update_offset=0, verbose=1):
+        """
+        :param Model_Wrapper model_wrapper: Model instance.
+        :param float decay: Decay of the moving average, applied each time the average is updated.
+        :param int each_n_updates: Update the average each this number of updates.
+        :param bool eval_on_epochs: Whether the model is evaluated each epochs or each updates.
+        :param int eval_each: Number of updates between evaluations (if not eval_on_epochs).
+        :param list shadow_weights: Initial shadow weights. If None, they are initialized with the model weights.
+        :param int update_offset: Number of updates performed before the current training run.
+        :param int verbose: Be verbose.
+        """
+        super(ExponentialMovingAverage, self).__init__()
+        self.model_wrapper = model_wrapper
+        self.decay = decay
+        self.each_n_updates = each_n_updates
+        self.eval_on_epochs = eval_on_epochs
+        self.eval_each = eval_each
+        self.shadow_weights = shadow_weights
+        self.training_weights = None
+        self.cum_update = update_offset
+        self.verbose = verbose
+
+    def on_train_begin(self, logs=None):
+        if self.shadow_weights is None:
+            self.shadow_weights = self.model_wrapper.model.get_weights()
+
+    def on_batch_begin(self, n_update, logs=None):
+        self.restore_training_weights()
+
+    def on_batch_end(self, n_update, logs=None):
+        self.cum_update += 1
+        if self.cum_update % self.each_n_updates == 0:
+            self.update_average()
+        if not self.eval_on_epochs and self.cum_update % self.eval_each == 0:
+            self.apply_shadow_weights()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.restore_training_weights()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.apply_shadow_weights()
+
+    def on_train_end(self, logs=None):
+        self.restore_training_weights()
+
+    def update_average(self):
+        """
+        Updates the shadow weights with the current model weights.
+        :return: None
+        """
+        for shadow, weight in zip(self.shadow_weights, self.model_wrapper.model.get_weights()):
+            shadow *= self.decay
+            shadow += (1. - self.decay) * weight
+
+    def apply_shadow_weights(self):
+        """
+        Loads the shadow weights into the model, keeping a copy of the training weights.
+        :return: None
+        """
+        if self.training_weights is None:
+            self.training_weights = self.model_wrapper.model.get_weights()
+            self.model_wrapper.model.set_weights(self.shadow_weights)
+            if self.verbose > 1:
+                logger.info('Using the EMA weights (update %d).' % self.cum_update)
+
+    def restore_training_weights(self):
+        """
+        Restores the training weights into the model, if the shadow weights are loaded.
+        :return: None
+        """
+        if self.training_weights is not None:
+            self.model_wrapper.model.set_weights(self.training_weights)
+            self.training_weights = None
+
+
+class ThroughputProfiler(KerasCallback):
+    """
+    Profiles the training throughput. Each N updates, reports the mean time per update spent in:
+        * data: Waiting for the batch generator (it also includes the time of the Keras' internal callbacks).
+        * train_step: Forward, backward and optimizer update (a single backend call in Keras).
+        * callbacks: Callbacks registered with watch() (evaluation, sampling...).
+    together with the processed tokens per second and the ratio of padding in the training batches.
+    The results are written to a CSV file and, if tensorboard_dir is given, to Tensorboard.
+
+    It must be the first callback of the training, so the train step is measured correctly.
+    The tokens are counted from the training batches loaded by the batch generator thread or by the training loop.
+    Batches loaded by the watched callbacks (e.g. sampling) are not counted. Token counts are only available when the
+    training batches are not loaded by other processes (PARALLEL_LOADERS = 1).
+    """
+
+    fields = ['update', 'data_time', 'train_step_time', 'callbacks_time', 'tokens_per_sec', 'padding_ratio']
+
+    def __init__(self, dataset, csv_path, each_n_updates=100, tensorboard_dir=None, verbose=1):
+        """
+        :param Dataset dataset: Dataset instance used for training.
+        :param str csv_path: CSV file where the measures are written.
+        :param int each_n_updates: Report each this number of updates.
+        :param str tensorboard_dir: Directory of the Tensorboard logs. If None, the measures are not sent to Tensorboard.
+        :param int verbose: Be verbose.
+        """
+        super(ThroughputProfiler, self).__init__()
+        self.dataset = dataset
+        self.csv_path = csv_path
+        self.each_n_updates = each_n_updates
+        self.tensorboard_dir = tensorboard_dir
+        self.verbose = verbose
+        self.batch_sizes = collections.deque()
+        self.callbacks_time = 0.
+        self.cum_update = 0
+        self.csv_file = None
+        self.writer = None
+        self.main_thread = None
+        self.in_callback = 0
+        self.last_batch_end = None
+        self.batch_begin = None
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the accumulated measures.
+        :return: None
+        """
+        self.times = {'data': 0., 'train_step': 0., 'callbacks': 0.}
+        self.n_tokens = 0
+        self.n_padded = 0
+        self.n_updates = 0
+        self.start_time = timer()
+
+    def watch(self, callback):
+        """
+        Measures the time spent in the methods of a callback.
+        :param callback: Keras callback.
+        :return: None
+        """
+        for method_name in ['on_epoch_begin', 'on_epoch_end', 'on_batch_begin', 'on_batch_end']:
+            setattr(callback, method_name, self._timed(getattr(callback, method_name)))
+
+    def _timed(self, method):
+        def timed_method(*args, **kwargs):
+            start = timer()
+            self.in_callback += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.in_callback -= 1
+                self.callbacks_time += timer() - start
+        return timed_method
+
+    def _counted(self, get_batch):
+        def counted_get_batch(set_name, *args, **kwargs):
+            X, Y = get_batch(set_name, *args, **kwargs)
+            # The training batches are produced by the generator thread or by the training loop (main thread). The
+            # callbacks (e.g. sampling), which run in the main thread, are skipped.
+            if set_name == 'train' and (threading.current_thread() is not self.main_thread or not self.in_callback):
+                n_tokens = n_total = 0
+                for x in X:
+                    if isinstance(x, np.ndarray) and x.ndim == 2:
+                        n_tokens += np.count_nonzero(x)
+                        n_total += x.size
+                self.batch_sizes.append((n_tokens, n_total))
+            return X, Y
+        return counted_get_batch
+
+    def on_train_begin(self, logs=None):
+        self.main_thread = threading.current_thread()
+        self.dataset.getXY = self._counted(self.dataset.getXY)
+        self.dataset.getXY_FromIndices = self._counted(self.dataset.getXY_FromIndices)
+        write_header = not os.path.isfile(self.csv_path)
+        self.csv_file = open(self.csv_path, 'a')
+        if write_header:
+            self.csv_file.write(','.join(self.fields) + '\n')
+        if self.tensorboard_dir is not None and K.backend() == 'tensorflow':
+            import tensorflow as tf
+            self.writer = tf.summary.FileWriter(self.tensorboard_dir)
+        self.reset()
+        self.last_batch_end = timer()
+
+    def on_batch_begin(self, n_update, logs=None):
+        self.batch_begin = timer()
+        self.times['callbacks'] += self.callbacks_time
+        self.times['data'] += max(self.batch_begin - self.last_batch_end - self.callbacks_time, 0.)
+        self.callbacks_time = 0.
+
+    def on_batch_end(self, n_update, logs=None):
+        self.times['train_step'] += timer() - self.batch_begin
+        self.cum_update += 1
+        self.n_updates += 1
+        if self.batch_sizes:
+            n_tokens, n_total = self.batch_sizes.popleft()
+            self.n_tokens += n_tokens
+            self.n_padded += n_total - n_tokens
+        if self.cum_update % self.each_n_updates == 0:
+            self.report()
+        self.last_batch_end = timer()
+
+    def on_train_end(self, logs=None):
+        del self.dataset.getXY
+        del self.dataset.getXY_FromIndices
+        self.csv_file.close()
+        if self.writer is not None:
+            self.writer.close()
+
+    def report(self):
+        """
+        Writes the measures accumulated since the last report and resets them.
+        :return: None
+        """
+        n_processed = self.n_tokens + self.n_padded
+        measures = {'update': self.cum_update,
+                    'data_time': self.times['data'] / self.n_updates,
+                    'train_step_time': self.times['train_step'] / self.n_updates,
+                    'callbacks_time': self.times['callbacks'] / self.n_updates,
+                    'tokens_per_sec': self.n_tokens / (timer() - self.start_time),
+                    'padding_ratio': self.n_padded / float(n_processed) if n_processed > 0 else 0.}
+        self.csv_file.write(','.join(str(measures[field]) for field in self.fields) + '\n')
+        self.csv_file.flush()
+        if self.writer is not None:
+            import tensorflow as tf
+            summary = tf.Summary(value=[tf.Summary.Value(tag='throughput/' + field, simple_value=measures[field])
+                                        for field in self.fields[1:]])
+            self.writer.add_summary(summary, self.cum_update)
+            self.writer.flush()
+        if self.verbose > 0:
+            logger.info('Update %d - data: %.4fs - train step: %.4fs - callbacks: %.4fs - '
+                        '%.1f tokens/s - padding: %.2f%%' % (self.cum_update, measures['data_time'],
+                                                             measures['train_step_time'], measures['callbacks_time'],
+                                                             measures['tokens_per_sec'],
+                                                             100. * measures['padding_ratio']))
+        self.reset()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import logging
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from keras import backend as K
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """
+    Parses an address in the 'host:port' format.
+
+    :param str address: Address.
+    :return: (host, port) tuple.
+    """
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class ConnectionTransport(object):
+    """
+    Star transport between data-parallel workers, built on multiprocessing connections (TCP sockets).
+    The worker with rank 0 listens on the given address and reduces the arrays sent by the rest of workers.
+    It works both for workers on a single host (address 'localhost:port') and across hosts.
+    """
+
+    def __init__(self, rank, n_workers, address='localhost:6000', authkey=b'nmt-keras', timeout=600):
+        """
+        :param int rank: Rank of this worker (0 <= rank < n_workers).
+        :param int n_workers: Total number of workers.
+        :param str address: 'host:port' where the worker with rank 0 listens.
+        :param bytes authkey: Authentication key shared by all workers.
+        :param int timeout: Seconds to wait for the worker with rank 0.
+        """
+        self.rank = rank
+        self.n_workers = n_workers
+        self.connections = []
+        if n_workers == 1:
+            return
+        address = parse_address(address)
+        if rank == 0:
+            listener = Listener(address, authkey=authkey)
+            connections = {}
+            while len(connections) < n_workers - 1:
+                connection = listener.accept()
+                connections[connection.recv()] = connection
+            listener.close()
+            # Always reduce in the same order, so the results are deterministic
+            self.connections = [connections[worker_rank] for worker_rank in sorted(connections)]
+        else:
+            start_time = time.time()
+            while True:
+                try:
+                    connection = Client(address, authkey=authkey)
+                    break
+                except (IOError, OSError):
+                    if time.time() - start_time > timeout:
+                        raise
+                    time.sleep(0.5)
+            connection.send(rank)
+            self.connections = [connection]
+
+    def allreduce(self, arrays):
+        """
+        Averages a list of arrays across all workers.
+
+        :param list arrays: List of numpy arrays. It must have the same structure in all workers.
+        :return: List with the averaged arrays.
+        """
+        if self.n_workers == 1:
+            return arrays
+        if self.rank == 0:
+            total = [np.array(array, copy=True) for array in arrays]
+            for connection in self.connections:
+                for accumulated, array in zip(total, connection.recv()):
+                    accumulated += array
+            averaged = [accumulated / self.n_workers for accumulated in total]
+            for connection in self.connections:
+                connection.send(averaged)
+            return averaged
+        self.connections[0].send(arrays)
+        return self.connections[0].recv()
+
+    def broadcast(self, arrays):
+        """
+        Sends a list of arrays from the worker with rank 0 to the rest of workers.
+
+        :param list arrays: List of numpy arrays (only used by the worker with rank 0).
+        :return: The list of arrays of the worker with rank 0.
+        """
+        if self.n_workers == 1:
+            return arrays
+        if self.rank == 0:
+            for connection in self.connections:
+                connection.send(arrays)
+            return arrays
+        return self.connections[0].recv()
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+
+
+# Available transports, selected with the DATA_PARALLEL_TRANSPORT parameter
+TRANSPORTS = {'connection': ConnectionTransport}
+
+
+def shard_batches(n_samples, batch_size, rank, n_workers, seed=0):
+    """
+    Shuffles the training samples and yields the batches assigned to a worker. All workers must use the same seed, so
+    they get disjoint batches. Samples which do not fill a step for all workers are discarded, so every worker
+    performs the same number of steps.
+
+    :param int n_samples: Number of training samples.
+    :param int batch_size: Number of samples of each batch (for a single worker).
+    :param int rank: Rank of the worker.
+    :param int n_workers: Total number of workers.
+    :param int seed: Seed of the shuffling (e.g. dependent on the epoch).
+    :return: Generator of lists of sample indices.
+    """
+    indices = np.random.RandomState(seed).permutation(n_samples)
+    n_steps = n_samples // (batch_size * n_workers)
+    for step in range(n_steps):
+        start = (step * n_workers + rank) * batch_size
+        yield indices[start:start + batch_size].tolist()
+
+
+class DataParallelTrainer(object):
+    """
+    Trains a compiled Keras model replicated in several workers. Each worker computes the gradients on its own batches;
+    the gradients are averaged across workers (all-reduce) and then applied by the optimizer of each replica.
+    Since all replicas start from the same weights and apply the same gradients, they stay synchronized.
+    """
+
+    def __init__(self, model, transport, accumulate_gradients=1):
+        """
+        :param model: Compiled Keras model.
+        :param transport: Transport between workers (see ConnectionTransport).
+        :param int accumulate_gradients: Number of batches whose gradients are accumulated before each all-reduce.
+        """
+        self.model = model
+        self.transport = transport
+        self.accumulate_gradients = accumulate_gradients
+        self.uses_learning_phase = model.uses_learning_phase and not isinstance(K.learning_phase(), int)
+        self.accumulated_gradients = None
+        self.accumulated_loss = 0.
+        self.n_accumulated = 0
+
+        inputs = model._feed_inputs + model._feed_targets + model._feed_sample_weights
+        if self.uses_learning_phase:
+            inputs += [K.learning_phase()]
+        trainable_weights = model._collected_trainable_weights
+        optimizer = model.optimizer
+
+        # Gradients of the local batch. Sparse gradients are converted to dense ones, for being reduced
+        gradients = [K.identity(gradient) for gradient in optimizer.get_gradients(model.total_loss, trainable_weights)]
+        self.gradients_function = K.function(inputs, [model.total_loss] + gradients, updates=model.updates)
+
+        # Optimizer updates from the averaged gradients
+        self.gradient_placeholders = [K.placeholder(shape=K.int_shape(weight)) for weight in trainable_weights]
+        get_gradients = optimizer.get_gradients
+        optimizer.get_gradients = lambda loss, params: self.gradient_placeholders
+        try:
+            training_updates = optimizer.get_updates(params=trainable_weights, loss=model.total_loss)
+        finally:
+            optimizer.get_gradients = get_gradients
+        self.apply_function = K.function(self.gradient_placeholders, [], updates=training_updates)
+
+    def broadcast_weights(self):
+        """
+        Copies the weights of the worker with rank 0 to the rest of workers.
+        :return: None
+        """
+        self.model.set_weights(self.transport.broadcast(self.model.get_weights()))
+
+    def train_on_batch(self, x, y, sample_weight=None):
+        """
+        Computes the gradients of a batch. Each accumulate_gradients batches, the gradients are averaged across
+        workers and applied.
+
+        :param x: Inputs of the model.
+        :param y: Targets of the model.
+        :param sample_weight: Sample weights.
+        :return: Loss of the batch. When the gradients are applied, the loss averaged across workers and
+                 accumulated batches.
+        """
+        x, y, sample_weights = self.model._standardize_user_data(x, y, sample_weight=sample_weight)
+        ins = x + y + sample_weights
+        if self.uses_learning_phase:
+            ins += [1.]
+        outputs = self.gradients_function(ins)
+        loss, gradients = outputs[0], outputs[1:]
+
+        if self.accumulated_gradients is None:
+            self.accumulated_gradients = gradients
+        else:
+            for accumulated, gradient in zip(self.accumulated_gradients, gradients):
+                accumulated += gradient
+        self.accumulated_loss += loss
+        self.n_accumulated += 1
+        if self.n_accumulated < self.accumulate_gradients:
+            return loss
+        return self.apply_gradients()
+
+    def flush(self):
+        """
+        Averages across workers and applies the gradients accumulated so far (e.g. at the end of an epoch). All workers
+        must call it at the same step.
+
+        :return: Loss averaged across workers and accumulated batches, or None if there were no accumulated gradients.
+        """
+        if self.n_accumulated == 0:
+            return None
+        return self.apply_gradients()
+
+    def apply_gradients(self):
+        """
+        Averages the accumulated gradients across workers and applies them.
+
+        :return: Loss averaged across workers and accumulated batches.
+        """
+        reduced = self.transport.allreduce([gradient / self.n_accumulated for gradient in self.accumulated_gradients] +
+                                           [np.asarray(self.accumulated_loss / self.n_accumulated)])
+        self.apply_function(reduced[:-1])
+        self.accumulated_gradients = None
+        self.accumulated_loss = 0.
+        self.n_accumulated = 0
+        return float(reduced[-1])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import logging
+import os
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def load_document_lengths(path):
+    """
+    Loads the number of sentences of each document of a corpus (one number per line, in corpus order).
+
+    :param str path: Path to the file.
+    :return: List with the number of sentences of each document. None if the file does not exist.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    with open(path, 'r') as documents_file:
+        return [int(line) for line in documents_file if line.strip()]
+
+
+def document_boundaries(n_samples, batch_size, document_lengths=None):
+    """
+    Computes the (start, end) sample indices of each document. Without document lengths, the corpus is split into
+    batch_size contiguous documents.
+
+    :param int n_samples: Number of samples of the corpus.
+    :param int batch_size: Number of rows of each batch.
+    :param document_lengths: Number of sentences of each document, in corpus order.
+    :return: List of (start, end) indices.
+    """
+    if document_lengths is None:
+        document_lengths = [len(chunk) for chunk in np.array_split(np.arange(n_samples), min(batch_size, n_samples))]
+    if sum(document_lengths) != n_samples:
+        raise ValueError('The documents have %d sentences, but the corpus has %d.' % (sum(document_lengths), n_samples))
+    ends = np.cumsum(document_lengths)
+    return [(int(end - length), int(end)) for end, length in zip(ends, document_lengths) if length > 0]
+
+
+def document_batches(n_samples, batch_size, document_lengths=None, seed=0):
+    """
+    Yields batches in which each row follows a document stream: row i of a batch holds the sentence which follows the
+    one at row i of the previous batch, so a cache of the previous sentences (TransformerCache) keeps being valid
+    across batches. When the document of a row ends, the row continues with the next document of the queue. The queue
+    holds the documents in a random order, which is shuffled again (with the next seed) when it is exhausted, so the
+    generator never ends and no sentence is dropped.
+
+    :param int n_samples: Number of samples of the corpus.
+    :param int batch_size: Number of rows of each batch.
+    :param document_lengths: Number of sentences of each document, in corpus order. If None, the corpus is split
+                             into batch_size contiguous documents.
+    :param int seed: Seed of the first shuffling of the documents.
+    :return: Generator of lists of sample indices.
+    """
+    documents = document_boundaries(n_samples, batch_size, document_lengths=document_lengths)
+    if len(documents) < batch_size:
+        logger.warning('There are less documents (%d) than batch rows (%d): some documents will be read by several '
+                       'rows at the same time.' % (len(documents), batch_size))
+    queue = []
+    streams = []
+    while True:
+        # Refill the rows whose document ended
+        for row in range(batch_size):
+            if row >= len(streams) or streams[row][0] == streams[row][1]:
+                if not queue:
+                    queue = [documents[i] for i in np.random.RandomState(seed).permutation(len(documents))][::-1]
+                    seed += 1
+                if row >= len(streams):
+                    streams.append(list(queue.pop()))
+                else:
+                    streams[row] = list(queue.pop())
+        yield [stream[0] for stream in streams]
+        for stream in streams:
+            stream[0] += 1
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import numpy as np
+from keras import activations, initializers
+from keras import backend as K
+from keras.layers import Layer
+
+# Value given to the masked attention energies (as in the Keras MultiHeadAttention)
+MASK_VALUE = -2. ** 32 + 1
+
+
+class FusedMultiHeadAttention(Layer):
+    """
+    Multi-head attention, equivalent to keras.layers.MultiHeadAttention, whose input projections are computed by a
+    single matrix product: the projection of the queries, keys and values for self-attention (kernel 'wqkv') and the
+    projection of the keys and values for the attention to another sequence (kernel 'wkv'; the queries keep their 'wq'
+    kernel). The fused kernels are the concatenation of the separate ones (see fuse_attention_weights).
+
+    The layer takes a list [queries, keys] (the keys are also the values). For self-attention, the keys must be the
+    queries: only their mask is read. The heads may be smaller than dmodel / n_heads (head_size), as in the models
+    without some heads stored by utils/prune_heads.py.
+    """
+
+    def __init__(self, n_heads, dmodel, activation='linear', use_bias=True, dropout=0., mask_future=False,
+                 self_attention=True, head_size=None, kernel_initializer='glorot_uniform', bias_initializer='zeros',
+                 **kwargs):
+        """
+        :param int n_heads: Number of heads.
+        :param int dmodel: Size of the output (and of the projections, unless head_size is given).
+        :param activation: Activation of the queries, keys and values projections.
+        :param bool use_bias: Add biases to the projections.
+        :param float dropout: Dropout of the attention weights.
+        :param bool mask_future: Do not attend to future positions.
+        :param bool self_attention: Fuse the queries, keys and values projections (self-attention) or only the keys and
+                                    values projections (attention to another sequence).
+        :param int head_size: Size of each head (dmodel / n_heads if None): the projections have n_heads * head_size
+                              units.
+        """
+        super(FusedMultiHeadAttention, self).__init__(**kwargs)
+        self.n_heads = n_heads
+        self.dmodel = dmodel
+        self.activation = activations.get(activation)
+        self.use_bias = use_bias
+        self.dropout = dropout
+        self.mask_future = mask_future
+        self.self_attention = self_attention
+        self.head_size = head_size or dmodel // n_heads
+        self.units = self.n_heads * self.head_size
+        self.kernel_initializer = initializers.get(kernel_initializer)
+        self.bias_initializer = initializers.get(bias_initializer)
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        query_dim, key_dim = input_shape[0][-1], input_shape[1][-1]
+        if self.self_attention:
+            self.wqkv = self.add_weight(shape=(query_dim, 3 * self.units), initializer=self.kernel_initializer,
+                                        name='wqkv')
+        else:
+            self.wq = self.add_weight(shape=(query_dim, self.units), initializer=self.kernel_initializer, name='wq')
+            self.wkv = self.add_weight(shape=(key_dim, 2 * self.units), initializer=self.kernel_initializer,
+                                       name='wkv')
+        self.wo = self.add_weight(shape=(self.units, self.dmodel), initializer=self.kernel_initializer, name='wo')
+        if self.use_bias:
+            if self.self_attention:
+                self.bqkv = self.add_weight(shape=(3 * self.units,), initializer=self.bias_initializer, name='bqkv')
+            else:
+                self.bq = self.add_weight(shape=(self.units,), initializer=self.bias_initializer, name='bq')
+                self.bkv = self.add_weight(shape=(2 * self.units,), initializer=self.bias_initializer, name='bkv')
+            self.bo = self.add_weight(shape=(self.dmodel,), initializer=self.bias_initializer, name='bo')
+        super(FusedMultiHeadAttention, self).build(input_shape)
+
+    def project(self, x, kernel, bias):
+        x = K.dot(x, kernel)
+        if self.use_bias:
+            x = K.bias_add(x, bias)
+        return x
+
+    def split_heads(self, x):
+        # (batch, time, n_heads * head_size) -> (batch * n_heads, time, head_size)
+        shape = K.shape(x)
+        x = K.reshape(x, (shape[0], shape[1], self.n_heads, self.head_size))
+        return K.reshape(K.permute_dimensions(x, (0, 2, 1, 3)), (-1, shape[1], self.head_size))
+
+    def merge_heads(self, x, batch_size):
+        # (batch * n_heads, time, head_size) -> (batch, time, n_heads * head_size)
+        shape = K.shape(x)
+        x = K.reshape(x, (batch_size, self.n_heads, shape[1], self.head_size))
+        return K.reshape(K.permute_dimensions(x, (0, 2, 1, 3)), (batch_size, shape[1], self.units))
+
+    def call(self, inputs, mask=None):
+        queries, keys = inputs
+        query_mask, key_mask = mask if mask is not None else (None, None)
+        if self.self_attention:
+            qkv = self.activation(self.project(queries, self.wqkv, self.bqkv if self.use_bias else None))
+            q, k, v = qkv[:, :, :self.units], qkv[:, :, self.units:2 * self.units], qkv[:, :, 2 * self.units:]
+        else:
+            q = self.activation(self.project(queries, self.wq, self.bq if self.use_bias else None))
+            kv = self.activation(self.project(keys, self.wkv, self.bkv if self.use_bias else None))
+            k, v = kv[:, :, :self.units], kv[:, :, self.units:]
+        batch_size = K.shape(q)[0]
+        q, k, v = self.split_heads(q), self.split_heads(k), self.split_heads(v)
+        energies = K.batch_dot(q, k, axes=[2, 2]) / np.sqrt(self.head_size)
+        if key_mask is not None:
+            key_mask = K.repeat_elements(K.expand_dims(K.cast(key_mask, K.floatx()), 1), self.n_heads, axis=0)
+            energies = energies * key_mask + (1. - key_mask) * MASK_VALUE
+        if self.mask_future:
+            import tensorflow as tf
+            future_mask = tf.linalg.band_part(K.ones_like(energies[0]), -1, 0)
+            energies = energies * future_mask + (1. - future_mask) * MASK_VALUE
+        weights = K.softmax(energies)
+        if query_mask is not None:
+            weights = weights * K.repeat_elements(K.expand_dims(K.cast(query_mask, K.floatx()), -1), self.n_heads,
+                                                  axis=0)
+        if 0. < self.dropout < 1.:
+            weights = K.in_train_phase(K.dropout(weights, self.dropout), weights)
+        outputs = self.merge_heads(K.batch_dot(weights, v, axes=[2, 1]), batch_size)
+        return self.project(outputs, self.wo, self.bo if self.use_bias else None)
+
+    def compute_mask(self, inputs, mask=None):
+        return mask[0] if mask is not None else None
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[0][:-1]) + (self.dmodel,)
+
+    def get_config(self):
+        config = {'n_heads': self.n_heads,
+                  'dmodel': self.dmodel,
+                  'activation': activations.serialize(self.activation),
+                  'use_bias': self.use_bias,
+                  'dropout': self.dropout,
+                  'mask_future': self.mask_future,
+                  'self_attention': self.self_attention,
+                  'head_size': self.head_size,
+                  'kernel_initializer': initializers.serialize(self.kernel_initializer),
+                  'bias_initializer': initializers.serialize(self.bias_initializer)}
+        base_config = super(FusedMultiHeadAttention, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+def fuse_attention_weights(weights, self_attention=True, use_bias=True):
+    """
+    Converts the weights of a MultiHeadAttention layer into the weights of a FusedMultiHeadAttention layer.
+
+    :param weights: Weights of the MultiHeadAttention layer: the kernels (wq, wk, wv, wo) and the biases
+                    (bq, bk, bv, bo), in this order.
+    :param bool self_attention: Whether the FusedMultiHeadAttention fuses the queries projection.
+    :param bool use_bias: Whether the FusedMultiHeadAttention has biases.
+    :return: List of weights of the FusedMultiHeadAttention layer.
+    """
+    kernels = [weight for weight in weights if weight.ndim == 2]
+    biases = [weight for weight in weights if weight.ndim == 1]
+    if not use_bias and any(np.any(bias) for bias in biases):
+        raise ValueError('The attention layer has biases, but the fused layer does not use them.')
+    if not biases:
+        biases = [np.zeros(kernel.shape[1], dtype=kernel.dtype) for kernel in kernels]
+    wq, wk, wv, wo = kernels
+    bq, bk, bv, bo = biases
+    if self_attention:
+        fused_kernels, fused_biases = [np.concatenate([wq, wk, wv], axis=1), wo], [np.concatenate([bq, bk, bv]), bo]
+    else:
+        fused_kernels, fused_biases = [wq, np.concatenate([wk, wv], axis=1), wo], [bq, np.concatenate([bk, bv]), bo]
+    return fused_kernels + fused_biases if use_bias else fused_kernels
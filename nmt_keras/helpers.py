@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Helpers shared by the Keras models and the NumPy inference: this module must not import Keras.
+import numpy as np
+
+
+def to_str(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def positional_encoding_constants(output_dim):
+    """
+    Inverse frequencies of the sinusoidal positional encodings (Vaswani et al., 2017) of each dimension, and whether
+    each dimension is a sine (even dimensions) or a cosine (odd dimensions).
+
+    :param int output_dim: Dimension of the encodings.
+    :return: Tuple of arrays with shape (output_dim,): (inverse frequencies, sine mask).
+    """
+    inverse_frequencies = 1. / np.power(10000, 2. * np.arange(output_dim) / output_dim)
+    return inverse_frequencies, np.arange(output_dim) % 2 == 0
+
+
+def positional_encodings(positions, output_dim):
+    """
+    Sinusoidal positional encodings of some positions.
+
+    :param positions: Array of positions.
+    :param int output_dim: Dimension of the encodings.
+    :return: Array with shape positions.shape + (output_dim,).
+    """
+    inverse_frequencies, sine = positional_encoding_constants(output_dim)
+    angles = np.asarray(positions, dtype='float64')[..., None] * inverse_frequencies
+    return np.where(sine, np.sin(angles), np.cos(angles))
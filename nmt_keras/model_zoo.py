@@ -16,6 +16,13 @@ from keras.optimizers import *
 from keras.regularizers import l2, AlphaRegularizer
 from keras_wrapper.cnn_model import Model_Wrapper
 from keras_wrapper.extra.regularize import Regularize
+from nmt_keras.average_attention import AverageAttentionGate, CumulativeAverage
+from nmt_keras.fused_attention import FusedMultiHeadAttention
+from nmt_keras.helpers import positional_encodings
+from nmt_keras.positional_encoding import SinusoidalPositionalEncoding
+from nmt_keras.ring_buffer_cache import RingBufferCache
+from nmt_keras.sampled_softmax import SampledSoftmaxOutput, sampled_softmax_loss
+from nmt_keras.tied_embedding import TiedEmbedding
 
 
 def getPositionalEncodingWeights(input_dim, output_dim, name='', verbose=True):
@@ -31,10 +38,7 @@ def getPositionalEncodingWeights(input_dim, output_dim, name='', verbose=True):
 
     if verbose > 0:
         logging.info("<<< Obtaining positional encodings of layer " + name + " >>>")
-    position_enc = np.array([[pos / np.power(10000, 2. * i / output_dim) for i in range(output_dim)] for pos in range(input_dim)])
-    position_enc[:, 0::2] = np.sin(position_enc[:, 0::2])  # dim 2i
-    position_enc[:, 1::2] = np.cos(position_enc[:, 1::2])  # dim 2i+1
-    return [position_enc]
+    return [positional_encodings(np.arange(input_dim), output_dim)]
 
 
 class TranslationModel(Model_Wrapper):
@@ -157,6 +161,296 @@ class TranslationModel(Model_Wrapper):
     def setParams(self, params):
         self.params = params
 
+    def getTrainingOutput(self, shared_FC_soft, out_layer, softout):
+        """
+        Returns the output of the training model. With SAMPLED_SOFTMAX, the full softmax is replaced by a
+        SampledSoftmaxOutput layer, which shares its weights. The sampling models always use the full softmax.
+
+        :param shared_FC_soft: Output (softmax) layer.
+        :param out_layer: Input of the output layer.
+        :param softout: Output of the full softmax.
+        :return: Output tensor of the training model.
+        """
+        if not self.params.get('SAMPLED_SOFTMAX', False):
+            return softout
+        if K.backend() != 'tensorflow':
+            logging.warning('The sampled softmax is only implemented for the Tensorflow backend. Using the full softmax.')
+            self.params['SAMPLED_SOFTMAX'] = False
+            return softout
+        if self.params.get('TIE_OUTPUT_EMBEDDINGS', False):
+            logging.warning('The sampled softmax is not implemented for output layers tied to the embeddings. '
+                            'Using the full softmax.')
+            self.params['SAMPLED_SOFTMAX'] = False
+            return softout
+        return SampledSoftmaxOutput(self.params['OUTPUT_VOCABULARY_SIZE'],
+                                    output_layer=shared_FC_soft,
+                                    name=self.ids_outputs[0])(out_layer)
+
+    def getMultiHeadAttention(self, name, mask_future=False, self_attention=True, model_size=None):
+        """
+        Returns a multi-head attention layer of the Transformer models. With FUSED_ATTENTION, a FusedMultiHeadAttention
+        layer, which computes the queries, keys and values projections (only the keys and values ones when attending
+        to another sequence) with a single matrix product. The layers with a number of heads in ATTENTION_HEADS (models
+        without some heads, stored by utils/prune_heads.py) are also FusedMultiHeadAttention layers, with that number
+        of heads of size model_size / N_HEADS.
+
+        :param str name: Name of the layer.
+        :param bool mask_future: Do not attend to future positions.
+        :param bool self_attention: Whether the layer attends to its own input.
+        :param int model_size: Size of the projections and of the output (MODEL_SIZE if None).
+        :return: Attention layer.
+        """
+        model_size = model_size or self.params['MODEL_SIZE']
+        n_heads = (self.params.get('ATTENTION_HEADS') or {}).get(name)
+        if n_heads is not None or self.params.get('FUSED_ATTENTION', False):
+            return FusedMultiHeadAttention(n_heads or self.params['N_HEADS'],
+                                           model_size,
+                                           dropout=self.params.get('ATTENTION_DROPOUT_P', 0.),
+                                           mask_future=mask_future,
+                                           self_attention=self_attention,
+                                           head_size=model_size // self.params['N_HEADS'],
+                                           name=name)
+        return MultiHeadAttention(self.params['N_HEADS'],
+                                  model_size,
+                                  dropout=self.params.get('ATTENTION_DROPOUT_P', 0.),
+                                  mask_future=mask_future,
+                                  name=name)
+
+    def getPositionalEncoding(self, max_len, output_dim, name):
+        """
+        Returns the layer which gives the sinusoidal positional encodings of the Transformer models, from the positions
+        given by a PositionLayer: a SinusoidalPositionalEncoding layer, which computes them for any position. With
+        STORED_POSITIONAL_ENCODINGS (models trained with previous versions), a non-trainable Embedding with the
+        encodings of the first max_len positions as weights.
+
+        :param int max_len: Number of encoded positions of the Embedding.
+        :param int output_dim: Dimension of the encodings.
+        :param str name: Name of the layer.
+        :return: Positional encoding layer.
+        """
+        if self.params.get('STORED_POSITIONAL_ENCODINGS', False):
+            return Embedding(max_len, output_dim, name=name, trainable=False,
+                             weights=getPositionalEncodingWeights(max_len, output_dim, name=name,
+                                                                  verbose=self.verbose))
+        return SinusoidalPositionalEncoding(output_dim, name=name)
+
+    def getRingBufferCache(self):
+        """
+        Returns the RING_BUFFER_CACHE layer of TransformerCache: a RingBufferCache of CACHE_SIZE entries, evicted after
+        RING_BUFFER_PATIENCE insertions, from which each sentence reads its CACHE_TOP_K most similar entries (all of
+        them if CACHE_TOP_K is 0). The top-k retrieval is only implemented for the Tensorflow backend.
+        With DOCUMENT_BATCHES, each of the BATCH_SIZE rows has its own cache, which is reset when the row starts a new
+        document.
+
+        :return: Cache layer.
+        """
+        top_k = self.params.get('CACHE_TOP_K', 0)
+        if top_k and K.backend() != 'tensorflow':
+            logging.warning('The top-k cache retrieval is only implemented for the Tensorflow backend. '
+                            'Reading the full cache.')
+            self.params['CACHE_TOP_K'] = top_k = 0
+        return RingBufferCache(self.params['CACHE_SIZE'],
+                               self.params.get('RING_BUFFER_PATIENCE', 0),
+                               top_k=top_k,
+                               n_rows=self.params['BATCH_SIZE'] if self.params.get('DOCUMENT_BATCHES', False) else 0,
+                               name='src_cache')
+
+    def getWordEmbedding(self, *args, **kwargs):
+        """
+        Returns a word embedding layer. With TIE_OUTPUT_EMBEDDINGS, the embeddings tied to the output layer are a
+        TiedEmbedding layer, which also computes the output projection (see getTiedOutputLayer).
+
+        :param args: Arguments of the Embedding layer.
+        :param kwargs: Keyword arguments of the Embedding layer and 'tied_output' (default: True): whether the
+                       embeddings are the ones tied to the output layer.
+        :return: Embedding layer.
+        """
+        if kwargs.pop('tied_output', True) and self.params.get('TIE_OUTPUT_EMBEDDINGS', False):
+            return TiedEmbedding(*args, **kwargs)
+        return Embedding(*args, **kwargs)
+
+    def getTiedOutputLayer(self, embedding):
+        """
+        Returns the output (softmax) layer when TIE_OUTPUT_EMBEDDINGS is set: the projection is computed by the
+        TiedEmbedding layer of the target words (with the transposed embeddings as kernel) and followed by an
+        activation layer, which takes the name of the output.
+
+        :param embedding: TiedEmbedding layer of the target words.
+        :return: Function which applies the output layer to a tensor.
+        """
+        activation = Activation(self.params['CLASSIFIER_ACTIVATION'], name=self.ids_outputs[0])
+
+        def output_layer(x):
+            return activation(embedding(x))
+        return output_layer
+
+    def getTransformerEncoder(self, src_text, embedding):
+        """
+        Builds the encoder of the Transformer models: source word embeddings with positional encoding, followed by
+        N_LAYERS_ENCODER blocks of multi-head self-attention and position-wise feed-forward networks. If the encoder and
+        the decoder have different sizes, the annotations are projected to the size of the decoder.
+
+        :param src_text: Source text input.
+        :param embedding: Source word embedding layer.
+        :return: Masked annotations of the source text and positional encoding layer of the source words.
+        """
+        params = self.params
+        # Sizes of the encoder and decoder blocks (MODEL_SIZE and FF_SIZE, unless they are set separately)
+        encoder_size = params.get('ENCODER_MODEL_SIZE') or params['MODEL_SIZE']
+        decoder_size = params.get('DECODER_MODEL_SIZE') or params['MODEL_SIZE']
+        encoder_ff_size = params.get('ENCODER_FF_SIZE') or params['FF_SIZE']
+
+        src_positions = PositionLayer(name='position_layer_src_text')(src_text)
+        src_embedding = embedding(src_text)
+
+        if params.get('SCALE_SOURCE_WORD_EMBEDDINGS', False):
+            src_embedding = SqrtScaling(encoder_size)(src_embedding)
+        if params['TARGET_TEXT_EMBEDDING_SIZE'] == params['SOURCE_TEXT_EMBEDDING_SIZE']:
+            max_len = max(params['MAX_INPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN_TEST'])
+        else:
+            max_len = params['MAX_INPUT_TEXT_LEN']
+
+        positional_embedding = self.getPositionalEncoding(max_len, params['SOURCE_TEXT_EMBEDDING_SIZE'],
+                                                          name='positional_src_word_embedding')
+        positional_src_embedding = positional_embedding(src_positions)
+        src_residual_multihead = Add(name='add_src_embedding_positional_src_embedding')([src_embedding, positional_src_embedding])
+
+        # Regularize
+        src_residual_multihead = Dropout(params['DROPOUT_P'])(src_residual_multihead)
+
+        prev_src_residual_multihead = src_residual_multihead
+
+        # Left tranformer block (encoder)
+        for n_block in range(params['N_LAYERS_ENCODER']):
+            src_multihead = self.getMultiHeadAttention('src_MultiHeadAttention_' + str(n_block),
+                                                       model_size=encoder_size)([src_residual_multihead,
+                                                                                 src_residual_multihead])
+            # Regularize
+            src_multihead = Dropout(params['DROPOUT_P'])(src_multihead)
+            # Add
+            src_multihead = Add(name='src_Residual_MultiHeadAttention_' + str(n_block))([src_multihead, prev_src_residual_multihead])
+
+            # And norm
+            src_multihead = BatchNormalization(mode=1, name='src_Normalization_MultiHeadAttention_' + str(n_block))(src_multihead)
+
+            # FF
+            ff_src_multihead = TimeDistributed(PositionwiseFeedForwardDense(encoder_ff_size))(src_multihead)
+            # Regularize
+            ff_src_multihead = Dropout(params['DROPOUT_P'])(ff_src_multihead)
+
+            # Add
+            src_multihead = Add(name='src_Residual_FF_' + str(n_block))([ff_src_multihead, src_multihead])
+            # And norm
+            src_multihead = BatchNormalization(mode=1, name='src_Normalization_FF_' + str(n_block))(src_multihead)
+
+            prev_src_residual_multihead = src_multihead
+            src_residual_multihead = src_multihead
+
+        # Bridge: projection of the encoder output to the size of the decoder
+        if encoder_size != decoder_size:
+            prev_src_residual_multihead = TimeDistributed(Dense(decoder_size,
+                                                                kernel_initializer=params['INIT_FUNCTION'],
+                                                                kernel_regularizer=l2(params['WEIGHT_DECAY']),
+                                                                bias_regularizer=l2(params['WEIGHT_DECAY']),
+                                                                trainable=params.get('TRAINABLE_ENCODER', True)),
+                                                          trainable=params.get('TRAINABLE_ENCODER', True),
+                                                          name='src_trg_bridge')(prev_src_residual_multihead)
+
+        masked_src_multihead = MaskLayer()(prev_src_residual_multihead)  # We may want the padded annotations
+        return masked_src_multihead, positional_embedding
+
+    def getTransformerTargetEmbedding(self, next_words, positional_embedding, tied_embedding=None):
+        """
+        Builds the target word embeddings of the Transformer models, with positional encoding and dropout.
+
+        :param next_words: Input of the previously generated words.
+        :param positional_embedding: Positional encoding layer of the source words. It is shared with the target words
+                                     if both embeddings have the same size.
+        :param tied_embedding: Source word embedding layer. With TIE_EMBEDDINGS, it also embeds the target words.
+        :return: Embedded target words, target word embedding layer, target word embeddings (before the positional
+                 encoding) and positional encoding layer of the target words.
+        """
+        params = self.params
+        decoder_size = params.get('DECODER_MODEL_SIZE') or params['MODEL_SIZE']
+        next_words_positions = PositionLayer(name='position_layer_next_words')(next_words)
+
+        if tied_embedding is not None and params.get('TIE_EMBEDDINGS', False):
+            trg_embedding = tied_embedding
+        else:
+            trg_embedding = self.getWordEmbedding(params['OUTPUT_VOCABULARY_SIZE'], params['TARGET_TEXT_EMBEDDING_SIZE'],
+                                                  name='target_word_embedding',
+                                                  embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                                  embeddings_initializer=params['INIT_FUNCTION'],
+                                                  trainable=self.trg_embedding_weights_trainable,
+                                                  weights=self.trg_embedding_weights,
+                                                  mask_zero=True)
+        trg_word_embedding = trg_embedding(next_words)
+
+        if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
+            trg_word_embedding = SqrtScaling(decoder_size)(trg_word_embedding)
+
+        if params['TARGET_TEXT_EMBEDDING_SIZE'] == params['SOURCE_TEXT_EMBEDDING_SIZE']:
+            positional_embedding_trg = positional_embedding
+        else:
+            max_len = max(params['MAX_OUTPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN_TEST'])
+
+            positional_embedding_trg = self.getPositionalEncoding(max_len, params['TARGET_TEXT_EMBEDDING_SIZE'],
+                                                                  name='positional_trg_word_embedding')
+
+        positional_trg_embedding = positional_embedding_trg(next_words_positions)
+
+        state_below = Add()([trg_word_embedding, positional_trg_embedding])
+
+        # Regularize
+        state_below = Dropout(params['DROPOUT_P'])(state_below)
+        return state_below, trg_embedding, trg_word_embedding, positional_embedding_trg
+
+    def getTransformerOutput(self, out_layer, trg_embedding):
+        """
+        Builds the output layers of the Transformer models: the optional deep output layers (DEEP_OUTPUT_LAYERS) and the
+        softmax, tied to the target word embeddings with TIE_OUTPUT_EMBEDDINGS. The layers are returned for applying
+        them in the sampling models.
+
+        :param out_layer: Output of the decoder.
+        :param trg_embedding: Target word embedding layer.
+        :return: Input of the softmax, output of the softmax, deep output layers, their regularizers and softmax layer.
+        """
+        params = self.params
+        shared_deep_list = []
+        shared_reg_deep_list = []
+        # 3.6 Optional deep ouput layer
+        for i, (activation, dimension) in enumerate(params['DEEP_OUTPUT_LAYERS']):
+            shared_deep_list.append(TimeDistributed(Dense(dimension,
+                                                          activation=activation,
+                                                          kernel_initializer=params['INIT_FUNCTION'],
+                                                          kernel_regularizer=l2(params['WEIGHT_DECAY']),
+                                                          bias_regularizer=l2(params['WEIGHT_DECAY']),
+                                                          trainable=params.get('TRAINABLE_DECODER', True),
+                                                          ),
+                                                    trainable=params.get('TRAINABLE_DECODER', True),
+                                                    name=activation + '_%d' % i))
+            out_layer = shared_deep_list[-1](out_layer)
+            [out_layer, shared_reg_out_layer] = Regularize(out_layer,
+                                                           params, shared_layers=True,
+                                                           name='out_layer_' + str(activation) + '_%d' % i)
+            shared_reg_deep_list.append(shared_reg_out_layer)
+
+        # 3.7. Output layer: Softmax
+        if params.get('TIE_OUTPUT_EMBEDDINGS', False):
+            shared_FC_soft = self.getTiedOutputLayer(trg_embedding)
+        else:
+            shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
+                                                   activation=params['CLASSIFIER_ACTIVATION'],
+                                                   kernel_regularizer=l2(params['WEIGHT_DECAY']),
+                                                   bias_regularizer=l2(params['WEIGHT_DECAY']),
+                                                   trainable=params.get('TRAINABLE_DECODER', True),
+                                                   name=params['CLASSIFIER_ACTIVATION']
+                                                   ),
+                                             trainable=params.get('TRAINABLE_DECODER', True),
+                                             name=self.ids_outputs[0])
+        softout = shared_FC_soft(out_layer)
+        return out_layer, softout, shared_deep_list, shared_reg_deep_list, shared_FC_soft
+
     def setOptimizer(self, **kwargs):
         """
         Sets and compiles a new optimizer for the Translation_Model.
@@ -187,6 +481,9 @@ class TranslationModel(Model_Wrapper):
             if self.params.get('ACCUMULATE_GRADIENTS', 1) > 1:
                 logging.warning('The gradient accumulation is not natively implemented in native Tensorflow optimizers. Using the Keras version.')
                 self.params['USE_TF_OPTIMIZER'] = False
+            if self.params.get('SAVE_TRAINING_STATE', False):
+                logging.warning('The state of native Tensorflow optimizers cannot be stored. Using the Keras version.')
+                self.params['USE_TF_OPTIMIZER'] = False
 
         if self.params.get('USE_TF_OPTIMIZER', False) and K.backend() == 'tensorflow' and self.params['OPTIMIZER'].lower() in ['sgd', 'adagrad', 'adadelta', 'rmsprop', 'adam']:
             import tensorflow as tf
@@ -291,8 +588,18 @@ class TranslationModel(Model_Wrapper):
         else:
             model_to_compile = self.model
 
+        if self.params.get('SAMPLED_SOFTMAX', False):
+            if self.params.get('LABEL_SMOOTHING', 0.) > 0.:
+                logging.warning('Label smoothing is not applied with the sampled softmax.')
+            loss = sampled_softmax_loss(self.model.get_layer(self.ids_outputs[0]),
+                                        self.params.get('SAMPLED_SOFTMAX_WORDS', 8192),
+                                        unigram_counts=self.params.get('TARGET_UNIGRAM_COUNTS'),
+                                        sparse_targets=self.params['LOSS'] == 'sparse_categorical_crossentropy')
+        else:
+            loss = self.params['LOSS']
+
         model_to_compile.compile(optimizer=optimizer,
-                                 loss=self.params['LOSS'],
+                                 loss=loss,
                                  metrics=self.params.get('KERAS_METRICS', []),
                                  loss_weights=self.params.get('LOSS_WEIGHTS', None),
                                  sample_weight_mode='temporal' if self.params['SAMPLE_WEIGHTS'] else None,
@@ -352,13 +659,14 @@ class TranslationModel(Model_Wrapper):
         src_text = Input(name=self.ids_inputs[0], batch_shape=tuple([None, None]), dtype='int32')
         # 2. Encoder
         # 2.1. Source word embedding
-        embedding = Embedding(params['INPUT_VOCABULARY_SIZE'], params['SOURCE_TEXT_EMBEDDING_SIZE'],
-                              name='source_word_embedding',
-                              embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                              embeddings_initializer=params['INIT_FUNCTION'],
-                              trainable=self.src_embedding_weights_trainable,
-                              weights=self.src_embedding_weights,
-                              mask_zero=True)
+        embedding = self.getWordEmbedding(params['INPUT_VOCABULARY_SIZE'], params['SOURCE_TEXT_EMBEDDING_SIZE'],
+                                          name='source_word_embedding',
+                                          embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                          embeddings_initializer=params['INIT_FUNCTION'],
+                                          trainable=self.src_embedding_weights_trainable,
+                                          weights=self.src_embedding_weights,
+                                          mask_zero=True,
+                                          tied_output=params.get('TIE_EMBEDDINGS', False))
         src_embedding = embedding(src_text)
 
         if params.get('SCALE_SOURCE_WORD_EMBEDDINGS', False):
@@ -436,15 +744,16 @@ class TranslationModel(Model_Wrapper):
         next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
         # 3.1.2. Target word embedding
         if params.get('TIE_EMBEDDINGS', False):
-            state_below = embedding(next_words)
+            trg_embedding = embedding
         else:
-            state_below = Embedding(params['OUTPUT_VOCABULARY_SIZE'], params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                    name='target_word_embedding',
-                                    embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                                    embeddings_initializer=params['INIT_FUNCTION'],
-                                    trainable=self.trg_embedding_weights_trainable,
-                                    weights=self.trg_embedding_weights,
-                                    mask_zero=True)(next_words)
+            trg_embedding = self.getWordEmbedding(params['OUTPUT_VOCABULARY_SIZE'], params['TARGET_TEXT_EMBEDDING_SIZE'],
+                                                  name='target_word_embedding',
+                                                  embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                                  embeddings_initializer=params['INIT_FUNCTION'],
+                                                  trainable=self.trg_embedding_weights_trainable,
+                                                  weights=self.trg_embedding_weights,
+                                                  mask_zero=True)
+        state_below = trg_embedding(next_words)
 
         if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
             state_below = SqrtScaling(params['TARGET_TEXT_EMBEDDING_SIZE'])(state_below)
@@ -634,18 +943,21 @@ class TranslationModel(Model_Wrapper):
             shared_reg_deep_list.append(shared_reg_out_layer)
 
         # 3.7. Output layer: Softmax
-        shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
-                                               activation=params['CLASSIFIER_ACTIVATION'],
-                                               kernel_regularizer=l2(params['WEIGHT_DECAY']),
-                                               bias_regularizer=l2(params['WEIGHT_DECAY']),
-                                               trainable=params.get('TRAINABLE_DECODER', True),
-                                               name=params['CLASSIFIER_ACTIVATION']
-                                               ),
-                                         trainable=params.get('TRAINABLE_DECODER', True),
-                                         name=self.ids_outputs[0])
+        if params.get('TIE_OUTPUT_EMBEDDINGS', False):
+            shared_FC_soft = self.getTiedOutputLayer(trg_embedding)
+        else:
+            shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
+                                                   activation=params['CLASSIFIER_ACTIVATION'],
+                                                   kernel_regularizer=l2(params['WEIGHT_DECAY']),
+                                                   bias_regularizer=l2(params['WEIGHT_DECAY']),
+                                                   trainable=params.get('TRAINABLE_DECODER', True),
+                                                   name=params['CLASSIFIER_ACTIVATION']
+                                                   ),
+                                             trainable=params.get('TRAINABLE_DECODER', True),
+                                             name=self.ids_outputs[0])
         softout = shared_FC_soft(out_layer)
 
-        self.model = Model(inputs=[src_text, next_words], outputs=softout)
+        self.model = Model(inputs=[src_text, next_words], outputs=self.getTrainingOutput(shared_FC_soft, out_layer, softout))
 
         if params['DOUBLE_STOCHASTIC_ATTENTION_REG'] > 0.:
             self.model.add_loss(alpha_regularizer)
@@ -808,113 +1120,32 @@ class TranslationModel(Model_Wrapper):
         :return: None
         """
 
+        # Sizes of the decoder blocks (MODEL_SIZE and FF_SIZE, unless they are set separately)
+        decoder_size = params.get('DECODER_MODEL_SIZE') or params['MODEL_SIZE']
+        decoder_ff_size = params.get('DECODER_FF_SIZE') or params['FF_SIZE']
+
         # 1. Source text input
         src_text = Input(name=self.ids_inputs[0], batch_shape=tuple([None, None]), dtype='int32')
-        src_positions = PositionLayer(name='position_layer_src_text')(src_text)
 
         # 2. Encoder
         # 2.1. Source word embedding
-        embedding = Embedding(params['INPUT_VOCABULARY_SIZE'], params['SOURCE_TEXT_EMBEDDING_SIZE'],
-                              name='source_word_embedding',
-                              embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                              embeddings_initializer=params['INIT_FUNCTION'],
-                              trainable=self.src_embedding_weights_trainable,
-                              weights=self.src_embedding_weights,
-                              mask_zero=True)
-        src_embedding = embedding(src_text)
-
-        if params.get('SCALE_SOURCE_WORD_EMBEDDINGS', False):
-            src_embedding = SqrtScaling(params['MODEL_SIZE'])(src_embedding)
-        if params['TARGET_TEXT_EMBEDDING_SIZE'] == params['SOURCE_TEXT_EMBEDDING_SIZE']:
-            max_len = max(params['MAX_INPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN_TEST'])
-        else:
-            max_len = params['MAX_INPUT_TEXT_LEN']
-
-        positional_embedding = Embedding(max_len,
-                                         params['SOURCE_TEXT_EMBEDDING_SIZE'],
-                                         name='positional_src_word_embedding',
-                                         trainable=False,
-                                         weights=getPositionalEncodingWeights(max_len,
-                                                                              params['SOURCE_TEXT_EMBEDDING_SIZE'],
-                                                                              name='positional_src_word_embedding',
-                                                                              verbose=self.verbose))
-        positional_src_embedding = positional_embedding(src_positions)
-        src_residual_multihead = Add(name='add_src_embedding_positional_src_embedding')([src_embedding, positional_src_embedding])
-
-        # Regularize
-        src_residual_multihead = Dropout(params['DROPOUT_P'])(src_residual_multihead)
-
-        prev_src_residual_multihead = src_residual_multihead
-
-        # Left tranformer block (encoder)
-        for n_block in range(params['N_LAYERS_ENCODER']):
-            src_multihead = MultiHeadAttention(params['N_HEADS'],
-                                               params['MODEL_SIZE'],
-                                               dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                               name='src_MultiHeadAttention_' + str(n_block))([src_residual_multihead,
-                                                                                               src_residual_multihead])
-            # Regularize
-            src_multihead = Dropout(params['DROPOUT_P'])(src_multihead)
-            # Add
-            src_multihead = Add(name='src_Residual_MultiHeadAttention_' + str(n_block))([src_multihead, prev_src_residual_multihead])
-
-            # And norm
-            src_multihead = BatchNormalization(mode=1, name='src_Normalization_MultiHeadAttention_' + str(n_block))(src_multihead)
-
-            # FF
-            ff_src_multihead = TimeDistributed(PositionwiseFeedForwardDense(params['FF_SIZE']))(src_multihead)
-            # Regularize
-            ff_src_multihead = Dropout(params['DROPOUT_P'])(ff_src_multihead)
-
-            # Add
-            src_multihead = Add(name='src_Residual_FF_' + str(n_block))([ff_src_multihead, src_multihead])
-            # And norm
-            src_multihead = BatchNormalization(mode=1, name='src_Normalization_FF_' + str(n_block))(src_multihead)
-
-            prev_src_residual_multihead = src_multihead
-            src_residual_multihead = src_multihead
-
-        masked_src_multihead = MaskLayer()(prev_src_residual_multihead)  # We may want the padded annotations
+        embedding = self.getWordEmbedding(params['INPUT_VOCABULARY_SIZE'], params['SOURCE_TEXT_EMBEDDING_SIZE'],
+                                          name='source_word_embedding',
+                                          embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                          embeddings_initializer=params['INIT_FUNCTION'],
+                                          trainable=self.src_embedding_weights_trainable,
+                                          weights=self.src_embedding_weights,
+                                          mask_zero=True,
+                                          tied_output=params.get('TIE_EMBEDDINGS', False))
+        # 2.2. Encoder blocks
+        masked_src_multihead, positional_embedding = self.getTransformerEncoder(src_text, embedding)
 
         # 3.1.1. Previously generated words as inputs for training -> Teacher forcing
         next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
-        next_words_positions = PositionLayer(name='position_layer_next_words')(next_words)
 
         # 3.1.2. Target word embedding
-        if params.get('TIE_EMBEDDINGS', False):
-            state_below = embedding(next_words)
-        else:
-            state_below = Embedding(params['OUTPUT_VOCABULARY_SIZE'], params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                    name='target_word_embedding',
-                                    embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                                    embeddings_initializer=params['INIT_FUNCTION'],
-                                    trainable=self.trg_embedding_weights_trainable,
-                                    weights=self.trg_embedding_weights,
-                                    mask_zero=True)(next_words)
-
-        if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
-            state_below = SqrtScaling(params['MODEL_SIZE'])(state_below)
-
-        if params['TARGET_TEXT_EMBEDDING_SIZE'] == params['SOURCE_TEXT_EMBEDDING_SIZE']:
-            positional_embedding_trg = positional_embedding
-        else:
-            max_len = max(params['MAX_OUTPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN_TEST'])
-
-            positional_embedding_trg = Embedding(max_len,
-                                                 params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                                 name='positional_trg_word_embedding',
-                                                 trainable=False,
-                                                 weights=getPositionalEncodingWeights(max_len,
-                                                                                      params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                                                                      name='positional_trg_word_embedding',
-                                                                                      verbose=self.verbose))
-
-        positional_trg_embedding = positional_embedding_trg(next_words_positions)
-
-        state_below = Add()([state_below, positional_trg_embedding])
-
-        # Regularize
-        state_below = Dropout(params['DROPOUT_P'])(state_below)
+        state_below, trg_embedding, _, _ = self.getTransformerTargetEmbedding(next_words, positional_embedding,
+                                                                              tied_embedding=embedding)
 
         shared_trg_multihead_list = []
         shared_trg_dropout_multihead_list = []
@@ -939,11 +1170,9 @@ class TranslationModel(Model_Wrapper):
             # Declare shared layers of each block
 
             # Masked Multi-Head Attention block
-            shared_trg_multihead = MultiHeadAttention(params['N_HEADS'],
-                                                      params['MODEL_SIZE'],
-                                                      dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                                      mask_future=True,  # Avoid attending on future sequences
-                                                      name='trg_MultiHeadAttention_' + str(n_block))
+            shared_trg_multihead = self.getMultiHeadAttention('trg_MultiHeadAttention_' + str(n_block),
+                                                              mask_future=True,  # Avoid attending on future sequences
+                                                              model_size=decoder_size)
             shared_trg_multihead_list.append(shared_trg_multihead)
 
             # Regularize
@@ -959,9 +1188,9 @@ class TranslationModel(Model_Wrapper):
             shared_trg_norm_multihead_list.append(shared_trg_multihead_norm)
 
             # Second Multi-Head Attention block
-            shared_src_trg_multihead = MultiHeadAttention(params['N_HEADS'], params['MODEL_SIZE'],
-                                                          dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                                          name='src_trg_MultiHeadAttention_' + str(n_block))
+            shared_src_trg_multihead = self.getMultiHeadAttention('src_trg_MultiHeadAttention_' + str(n_block),
+                                                                  self_attention=False,
+                                                                  model_size=decoder_size)
             shared_src_trg_multihead_list.append(shared_src_trg_multihead)
 
             # Regularize
@@ -977,7 +1206,7 @@ class TranslationModel(Model_Wrapper):
             shared_src_trg_norm_multihead_list.append(shared_src_trg_multihead_norm)
 
             # FF
-            shared_ff_src_trg_multihead = TimeDistributed(PositionwiseFeedForwardDense(params['FF_SIZE'],
+            shared_ff_src_trg_multihead = TimeDistributed(PositionwiseFeedForwardDense(decoder_ff_size,
                                                                                        name='src_trg_PositionwiseFeedForward_' + str(n_block)),
                                                           name='src_trg_TimeDistributedPositionwiseFeedForward_' + str(n_block))
             shared_ff_list.append(shared_ff_src_trg_multihead)
@@ -1036,37 +1265,10 @@ class TranslationModel(Model_Wrapper):
             prev_state_below = ff_src_trg_multihead_norm
 
         out_layer = prev_state_below
-        shared_deep_list = []
-        shared_reg_deep_list = []
-        # 3.6 Optional deep ouput layer
-        for i, (activation, dimension) in enumerate(params['DEEP_OUTPUT_LAYERS']):
-            shared_deep_list.append(TimeDistributed(Dense(dimension,
-                                                          activation=activation,
-                                                          kernel_initializer=params['INIT_FUNCTION'],
-                                                          kernel_regularizer=l2(params['WEIGHT_DECAY']),
-                                                          bias_regularizer=l2(params['WEIGHT_DECAY']),
-                                                          trainable=params.get('TRAINABLE_DECODER', True),
-                                                          ),
-                                                    trainable=params.get('TRAINABLE_DECODER', True),
-                                                    name=activation + '_%d' % i))
-            out_layer = shared_deep_list[-1](out_layer)
-            [out_layer, shared_reg_out_layer] = Regularize(out_layer,
-                                                           params, shared_layers=True,
-                                                           name='out_layer_' + str(activation) + '_%d' % i)
-            shared_reg_deep_list.append(shared_reg_out_layer)
-
-        # 3.7. Output layer: Softmax
-        shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
-                                               activation=params['CLASSIFIER_ACTIVATION'],
-                                               kernel_regularizer=l2(params['WEIGHT_DECAY']),
-                                               bias_regularizer=l2(params['WEIGHT_DECAY']),
-                                               trainable=params.get('TRAINABLE_DECODER', True),
-                                               name=params['CLASSIFIER_ACTIVATION']
-                                               ),
-                                         trainable=params.get('TRAINABLE_DECODER', True),
-                                         name=self.ids_outputs[0])
-        softout = shared_FC_soft(out_layer)
-        self.model = Model(inputs=[src_text, next_words], outputs=softout)
+        # 3.6. Output layers: optional deep output layers and softmax
+        out_layer, softout, shared_deep_list, shared_reg_deep_list, shared_FC_soft = \
+            self.getTransformerOutput(out_layer, trg_embedding)
+        self.model = Model(inputs=[src_text, next_words], outputs=self.getTrainingOutput(shared_FC_soft, out_layer, softout))
 
         if params.get('N_GPUS', 1) > 1:
             self.multi_gpu_model = multi_gpu_model(self.model, gpus=params['N_GPUS'])
@@ -1101,7 +1303,7 @@ class TranslationModel(Model_Wrapper):
         # and the following outputs:
         #   - softmax probabilities
 
-        preprocessed_size = params['MODEL_SIZE']
+        preprocessed_size = decoder_size
 
         # Define inputs
         preprocessed_annotations = Input(name='preprocessed_input',
@@ -1181,6 +1383,277 @@ class TranslationModel(Model_Wrapper):
         self.matchings_init_to_next = {'preprocessed_input': 'preprocessed_input'}
         self.matchings_next_to_next = {'preprocessed_input': 'preprocessed_input'}
 
+    def AverageAttentionNetwork(self, params):
+        """
+        Transformer whose decoder self-attention is replaced by an average attention layer: the cumulative average
+        of the previous positions, followed by a position-wise feed-forward network and a gating layer. The rest of
+        the model is the Transformer one (see Transformer).
+
+        The sampling model carries the averages of each decoder block and the current position as states, so it only
+        processes the last word and each decoding step has a constant cost.
+
+        See:
+            * `Accelerating Neural Transformer via an Average Attention Network`_.
+
+        .. _Accelerating Neural Transformer via an Average Attention Network: https://arxiv.org/abs/1805.00631
+
+        :param int params: Dictionary of params (see config.py)
+        :return: None
+        """
+        # Sizes of the decoder blocks (MODEL_SIZE and FF_SIZE, unless they are set separately)
+        decoder_size = params.get('DECODER_MODEL_SIZE') or params['MODEL_SIZE']
+        decoder_ff_size = params.get('DECODER_FF_SIZE') or params['FF_SIZE']
+
+        # 1. Source text input
+        src_text = Input(name=self.ids_inputs[0], batch_shape=tuple([None, None]), dtype='int32')
+
+        # 2. Encoder
+        # 2.1. Source word embedding
+        embedding = self.getWordEmbedding(params['INPUT_VOCABULARY_SIZE'], params['SOURCE_TEXT_EMBEDDING_SIZE'],
+                                          name='source_word_embedding',
+                                          embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                          embeddings_initializer=params['INIT_FUNCTION'],
+                                          trainable=self.src_embedding_weights_trainable,
+                                          weights=self.src_embedding_weights,
+                                          mask_zero=True,
+                                          tied_output=params.get('TIE_EMBEDDINGS', False))
+        # 2.2. Encoder blocks
+        masked_src_multihead, positional_embedding = self.getTransformerEncoder(src_text, embedding)
+
+        # 3.1.1. Previously generated words as inputs for training -> Teacher forcing
+        next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
+
+        # 3.1.2. Target word embedding
+        state_below, trg_embedding, trg_word_embedding, positional_embedding_trg = \
+            self.getTransformerTargetEmbedding(next_words, positional_embedding, tied_embedding=embedding)
+
+        shared_trg_average_list = []
+        shared_trg_ff_average_list = []
+        shared_trg_gate_list = []
+        shared_trg_dropout_average_list = []
+        shared_trg_add_average_list = []
+        shared_trg_norm_average_list = []
+
+        shared_src_trg_multihead_list = []
+        shared_src_trg_dropout_multihead_list = []
+        shared_src_trg_add_multihead_list = []
+        shared_src_trg_norm_multihead_list = []
+
+        shared_ff_list = []
+        shared_dropout_ff_list = []
+        shared_add_ff_list = []
+        shared_norm_ff_list = []
+
+        prev_state_below = state_below
+
+        # Right tranformer block (decoder)
+        for n_block in range(params['N_LAYERS_DECODER']):
+
+            # Declare shared layers of each block
+
+            # Average attention block: cumulative average of the previous positions
+            shared_trg_average = CumulativeAverage(return_state=True, name='trg_CumulativeAverage_' + str(n_block))
+            shared_trg_average_list.append(shared_trg_average)
+
+            # FF of the average
+            shared_trg_ff_average = TimeDistributed(PositionwiseFeedForwardDense(decoder_ff_size,
+                                                                                 name='trg_AverageAttentionPositionwiseFeedForward_' + str(n_block)),
+                                                    name='trg_AverageAttentionTimeDistributedPositionwiseFeedForward_' + str(n_block))
+            shared_trg_ff_average_list.append(shared_trg_ff_average)
+
+            # Gating
+            shared_trg_gate = AverageAttentionGate(kernel_initializer=params['INIT_FUNCTION'],
+                                                   name='trg_AverageAttentionGate_' + str(n_block))
+            shared_trg_gate_list.append(shared_trg_gate)
+
+            # Regularize
+            shared_trg_average_dropout = Dropout(params['DROPOUT_P'])
+            shared_trg_dropout_average_list.append(shared_trg_average_dropout)
+
+            # Add
+            shared_trg_average_add = Add(name='trg_Residual_AverageAttention_' + str(n_block))
+            shared_trg_add_average_list.append(shared_trg_average_add)
+
+            # And norm
+            shared_trg_average_norm = BatchNormalization(mode=1, name='trg_Normalization_AverageAttention_' + str(n_block))
+            shared_trg_norm_average_list.append(shared_trg_average_norm)
+
+            # Multi-Head Attention block
+            shared_src_trg_multihead = self.getMultiHeadAttention('src_trg_MultiHeadAttention_' + str(n_block),
+                                                                  self_attention=False,
+                                                                  model_size=decoder_size)
+            shared_src_trg_multihead_list.append(shared_src_trg_multihead)
+
+            # Regularize
+            shared_src_trg_multihead_dropout = Dropout(params['DROPOUT_P'])
+            shared_src_trg_dropout_multihead_list.append(shared_src_trg_multihead_dropout)
+
+            # Add
+            shared_src_trg_multihead_add = Add(name='src_trg_Residual_MultiHeadAttention_' + str(n_block))
+            shared_src_trg_add_multihead_list.append(shared_src_trg_multihead_add)
+
+            # And norm
+            shared_src_trg_multihead_norm = BatchNormalization(mode=1, name='src_trg_Normalization_MultiHeadAttention_' + str(n_block))
+            shared_src_trg_norm_multihead_list.append(shared_src_trg_multihead_norm)
+
+            # FF
+            shared_ff_src_trg_multihead = TimeDistributed(PositionwiseFeedForwardDense(decoder_ff_size,
+                                                                                       name='src_trg_PositionwiseFeedForward_' + str(n_block)),
+                                                          name='src_trg_TimeDistributedPositionwiseFeedForward_' + str(n_block))
+            shared_ff_list.append(shared_ff_src_trg_multihead)
+
+            # Regularize
+            shared_ff_src_trg_multihead_dropout = Dropout(params['DROPOUT_P'])
+            shared_dropout_ff_list.append(shared_ff_src_trg_multihead_dropout)
+
+            # Add
+            shared_ff_src_trg_multihead_add = Add(name='src_trg_Residual_FF_' + str(n_block))
+            shared_add_ff_list.append(shared_ff_src_trg_multihead_add)
+
+            # And norm
+            shared_ff_src_trg_multihead_norm = BatchNormalization(mode=1, name='src_trg_Normalization_FF_' + str(n_block))
+            shared_norm_ff_list.append(shared_ff_src_trg_multihead_norm)
+
+        def apply_decoder(prev_state_below, annotations, prev_averages=None, prev_position=None):
+            """
+            Applies the shared decoder blocks. Returns the output of the decoder, the average of the input of each
+            block (the states for the next decoding step) and the next position.
+            """
+            averages_list = []
+            for n_block in range(params['N_LAYERS_DECODER']):
+                # Average attention block
+                if prev_averages is None:
+                    trg_average, average, next_position = shared_trg_average_list[n_block](prev_state_below)
+                else:
+                    trg_average, average, next_position = shared_trg_average_list[n_block]([prev_state_below,
+                                                                                            prev_averages[n_block],
+                                                                                            prev_position])
+                averages_list.append(average)
+                trg_average = shared_trg_ff_average_list[n_block](trg_average)
+                trg_average = shared_trg_gate_list[n_block]([prev_state_below, trg_average])
+
+                # Regularize
+                trg_average_dropout = shared_trg_dropout_average_list[n_block](trg_average)
+
+                # Add
+                trg_average_add = shared_trg_add_average_list[n_block]([prev_state_below, trg_average_dropout])
+
+                # And norm
+                trg_average_norm = shared_trg_norm_average_list[n_block](trg_average_add)
+
+                # Multi-Head Attention block
+                src_trg_multihead = shared_src_trg_multihead_list[n_block]([trg_average_norm, annotations])
+
+                # Regularize
+                src_trg_multihead_dropout = shared_src_trg_dropout_multihead_list[n_block](src_trg_multihead)
+
+                # Add
+                src_trg_multihead_add = shared_src_trg_add_multihead_list[n_block]([src_trg_multihead_dropout, trg_average_norm])
+
+                # And norm
+                src_trg_multihead_norm = shared_src_trg_norm_multihead_list[n_block](src_trg_multihead_add)
+
+                # FF
+                ff_src_trg_multihead = shared_ff_list[n_block](src_trg_multihead_norm)
+
+                # Regularize
+                ff_src_trg_multihead_dropout = shared_dropout_ff_list[n_block](ff_src_trg_multihead)
+
+                # Add
+                ff_src_trg_multihead_add = shared_add_ff_list[n_block]([ff_src_trg_multihead_dropout,
+                                                                        src_trg_multihead_norm])
+
+                # And norm
+                prev_state_below = shared_norm_ff_list[n_block](ff_src_trg_multihead_add)
+            return prev_state_below, averages_list, next_position
+
+        out_layer, averages_list, next_position = apply_decoder(state_below, masked_src_multihead)
+
+        # 3.6. Output layers: optional deep output layers and softmax
+        out_layer, softout, shared_deep_list, shared_reg_deep_list, shared_FC_soft = \
+            self.getTransformerOutput(out_layer, trg_embedding)
+        self.model = Model(inputs=[src_text, next_words], outputs=self.getTrainingOutput(shared_FC_soft, out_layer, softout))
+
+        if params.get('N_GPUS', 1) > 1:
+            self.multi_gpu_model = multi_gpu_model(self.model, gpus=params['N_GPUS'])
+        else:
+            self.multi_gpu_model = None
+
+        ##################################################################
+        #                         SAMPLING MODEL                         #
+        ##################################################################
+        # Now that we have the basic training model ready, let's prepare the model for applying decoding
+        # The beam-search model will include all the minimum required set of layers (decoder stage) which offer the
+        # possibility to generate the next state in the sequence given a pre-processed input (encoder stage)
+        # First, we need a model that outputs the preprocessed input and the decoder states
+        # for applying the initial forward pass
+
+        model_init_input = [src_text, next_words]
+        model_init_output = [softout, masked_src_multihead, next_position] + averages_list
+
+        self.model_init = Model(inputs=model_init_input, outputs=model_init_output)
+
+        # Store inputs and outputs names for model_init
+        self.ids_inputs_init = self.ids_inputs
+        ids_averages_names = ['next_average_' + str(i) for i in range(len(averages_list))]
+
+        # first output must be the output probs.
+        self.ids_outputs_init = self.ids_outputs + ['preprocessed_input', 'next_position'] + ids_averages_names
+
+        # Second, we need to build an additional model with the capability to have the following inputs:
+        #   - preprocessed_input
+        #   - prev_word
+        #   - prev_position
+        #   - prev_average (one for each decoder block)
+        # and the following outputs:
+        #   - softmax probabilities
+        #   - next_position
+        #   - next_average (one for each decoder block)
+        # Unlike the Transformer, it only processes the last word: the previous ones are summarized by the averages.
+
+        preprocessed_size = decoder_size
+
+        # Define inputs
+        preprocessed_annotations = Input(name='preprocessed_input',
+                                         shape=tuple([None, preprocessed_size]),
+                                         dtype='float32')
+        prev_position = Input(name='prev_position', shape=tuple([1]), dtype='float32')
+        prev_averages = [Input(name='prev_average_' + str(i), shape=tuple([1, decoder_size]), dtype='float32')
+                         for i in range(len(averages_list))]
+
+        # Apply decoder
+        state_below = Add()([trg_word_embedding, positional_embedding_trg(prev_position)])
+        out_layer, next_averages, next_position = apply_decoder(state_below, preprocessed_annotations,
+                                                                prev_averages=prev_averages,
+                                                                prev_position=prev_position)
+
+        for (deep_out_layer, reg_list) in zip(shared_deep_list, shared_reg_deep_list):
+            out_layer = deep_out_layer(out_layer)
+            for reg in reg_list:
+                out_layer = reg(out_layer)
+
+        # Softmax
+        softout = shared_FC_soft(out_layer)
+
+        model_next_inputs = [next_words, preprocessed_annotations, prev_position] + prev_averages
+        model_next_outputs = [softout, preprocessed_annotations, next_position] + next_averages
+
+        self.model_next = Model(inputs=model_next_inputs,
+                                outputs=model_next_outputs)
+
+        # Store inputs and outputs names for model_next
+        # first input must be previous word
+        self.ids_inputs_next = [self.ids_inputs[1], 'preprocessed_input', 'prev_position'] + \
+            ['prev_average_' + str(i) for i in range(len(prev_averages))]
+        # first output must be the output probs.
+        self.ids_outputs_next = self.ids_outputs + ['preprocessed_input', 'next_position'] + ids_averages_names
+        # Input -> Output matchings from model_init to model_next and from model_next to model_next
+        self.matchings_init_to_next = {'preprocessed_input': 'preprocessed_input',
+                                       'next_position': 'prev_position'}
+        for n_block in range(len(averages_list)):
+            self.matchings_init_to_next['next_average_' + str(n_block)] = 'prev_average_' + str(n_block)
+        self.matchings_next_to_next = dict(self.matchings_init_to_next)
+
     # Backwards compatibility.
     GroundHogModel = AttentionRNNEncoderDecoder
 
@@ -1357,13 +1830,14 @@ class TranslationModel(Model_Wrapper):
         next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
 
         # 3.1.2. Target word embedding
-        state_below = Embedding(input_dim=params['OUTPUT_VOCABULARY_SIZE'],
-                                output_dim=params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                name='target_word_embedding',
-                                embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                                embeddings_initializer=params['INIT_FUNCTION'],
-                                trainable=self.trg_embedding_weights_trainable, weights=self.trg_embedding_weights,
-                                mask_zero=True)(next_words)
+        trg_embedding = self.getWordEmbedding(input_dim=params['OUTPUT_VOCABULARY_SIZE'],
+                                              output_dim=params['TARGET_TEXT_EMBEDDING_SIZE'],
+                                              name='target_word_embedding',
+                                              embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                              embeddings_initializer=params['INIT_FUNCTION'],
+                                              trainable=self.trg_embedding_weights_trainable, weights=self.trg_embedding_weights,
+                                              mask_zero=True)
+        state_below = trg_embedding(next_words)
         state_below = Regularize(state_below, params, name='state_below')
 
         # 3.2. Decoder's RNN initialization perceptrons with ctx mean
@@ -1542,15 +2016,18 @@ class TranslationModel(Model_Wrapper):
             shared_reg_deep_list.append(shared_reg_out_layer)
 
         # 3.7. Output layer: Softmax
-        shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
-                                               activation=params['CLASSIFIER_ACTIVATION'],
-                                               kernel_regularizer=l2(params['WEIGHT_DECAY']),
-                                               name=params['CLASSIFIER_ACTIVATION']
-                                               ),
-                                         name=self.ids_outputs[0])
+        if params.get('TIE_OUTPUT_EMBEDDINGS', False):
+            shared_FC_soft = self.getTiedOutputLayer(trg_embedding)
+        else:
+            shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
+                                                   activation=params['CLASSIFIER_ACTIVATION'],
+                                                   kernel_regularizer=l2(params['WEIGHT_DECAY']),
+                                                   name=params['CLASSIFIER_ACTIVATION']
+                                                   ),
+                                             name=self.ids_outputs[0])
         softout = shared_FC_soft(out_layer)
 
-        self.model = Model(inputs=[src_text, next_words], outputs=softout)
+        self.model = Model(inputs=[src_text, next_words], outputs=self.getTrainingOutput(shared_FC_soft, out_layer, softout))
 
         if params['DOUBLE_STOCHASTIC_ATTENTION_REG'] > 0.:
             self.model.add_loss(alpha_regularizer)
@@ -1699,119 +2176,43 @@ class TranslationModel(Model_Wrapper):
         :return: None
         """
 
+        # Sizes of the decoder blocks (MODEL_SIZE and FF_SIZE, unless they are set separately)
+        decoder_size = params.get('DECODER_MODEL_SIZE') or params['MODEL_SIZE']
+        decoder_ff_size = params.get('DECODER_FF_SIZE') or params['FF_SIZE']
+
         # 1. Source text input
         src_text = Input(name=self.ids_inputs[0], batch_shape=tuple([None, None]), dtype='int32')
-        src_positions = PositionLayer(name='position_layer_src_text')(src_text)
 
         # 2. Encoder
         # 2.1. Source word embedding
-        src_embedding = Embedding(params['INPUT_VOCABULARY_SIZE'],
-                                  params['SOURCE_TEXT_EMBEDDING_SIZE'],
-                                  name='source_word_embedding',
-                                  embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                                  embeddings_initializer=params['INIT_FUNCTION'],
-                                  trainable=self.src_embedding_weights_trainable,
-                                  weights=self.src_embedding_weights,
-                                  mask_zero=True)(src_text)
-
-        if params.get('SCALE_SOURCE_WORD_EMBEDDINGS', False):
-            src_embedding = SqrtScaling(params['MODEL_SIZE'])(src_embedding)
-        if params['TARGET_TEXT_EMBEDDING_SIZE'] == params['SOURCE_TEXT_EMBEDDING_SIZE']:
-            max_len = max(params['MAX_INPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN_TEST'])
-        else:
-            max_len = params['MAX_INPUT_TEXT_LEN']
-
-        positional_embedding = Embedding(max_len,
-                                         params['SOURCE_TEXT_EMBEDDING_SIZE'],
-                                         name='positional_src_word_embedding',
-                                         trainable=False,
-                                         weights=getPositionalEncodingWeights(max_len,
-                                                                              params['SOURCE_TEXT_EMBEDDING_SIZE'],
-                                                                              name='positional_src_word_embedding',
-                                                                              verbose=self.verbose))
-        positional_src_embedding = positional_embedding(src_positions)
-        src_residual_multihead = Add(name='add_src_embedding_positional_src_embedding')([src_embedding, positional_src_embedding])
-
-        # Regularize
-        src_residual_multihead = Dropout(params['DROPOUT_P'])(src_residual_multihead)
-
-        prev_src_residual_multihead = src_residual_multihead
-
-        # Left tranformer block (encoder)
-        for n_block in range(params['N_LAYERS_ENCODER']):
-            src_multihead = MultiHeadAttention(params['N_HEADS'],
-                                               params['MODEL_SIZE'],
-                                               dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                               name='src_MultiHeadAttention_' + str(n_block))([src_residual_multihead,
-                                                                                               src_residual_multihead])
-            # Regularize
-            src_multihead = Dropout(params['DROPOUT_P'])(src_multihead)
-            # Add
-            src_multihead = Add(name='src_Residual_MultiHeadAttention_' + str(n_block))([src_multihead, prev_src_residual_multihead])
-
-            # And norm
-            src_multihead = BatchNormalization(mode=1, name='src_Normalization_MultiHeadAttention_' + str(n_block))(src_multihead)
-
-            # FF
-            ff_src_multihead = TimeDistributed(PositionwiseFeedForwardDense(params['FF_SIZE']))(src_multihead)
-            # Regularize
-            ff_src_multihead = Dropout(params['DROPOUT_P'])(ff_src_multihead)
-
-            # Add
-            src_multihead = Add(name='src_Residual_FF_' + str(n_block))([ff_src_multihead, src_multihead])
-            # And norm
-            src_multihead = BatchNormalization(mode=1, name='src_Normalization_FF_' + str(n_block))(src_multihead)
-
-            prev_src_residual_multihead = src_multihead
-            src_residual_multihead = src_multihead
-
-        masked_src_multihead = MaskLayer()(prev_src_residual_multihead)  # We may want the padded annotations
+        embedding = Embedding(params['INPUT_VOCABULARY_SIZE'],
+                              params['SOURCE_TEXT_EMBEDDING_SIZE'],
+                              name='source_word_embedding',
+                              embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                              embeddings_initializer=params['INIT_FUNCTION'],
+                              trainable=self.src_embedding_weights_trainable,
+                              weights=self.src_embedding_weights,
+                              mask_zero=True)
+        # 2.2. Encoder blocks
+        masked_src_multihead, positional_embedding = self.getTransformerEncoder(src_text, embedding)
 
         ################
         ##### CACHE ####
         ################
-        shared_cache_layer = CacheLayer(params['CACHE_SIZE'],
-                                        len(self.vocabularies[self.ids_outputs[0]]['words2idx']) - 1,
-                                        params['CACHE_PATIENCE'])
-        masked_src_multihead = shared_cache_layer([masked_src_multihead, src_text])
+        if params.get('RING_BUFFER_CACHE', False):
+            # The cache entries are appended to the annotations returned by model_init
+            masked_src_multihead = self.getRingBufferCache()([masked_src_multihead, src_text])
+        else:
+            shared_cache_layer = CacheLayer(params['CACHE_SIZE'],
+                                            len(self.vocabularies[self.ids_outputs[0]]['words2idx']) - 1,
+                                            params['CACHE_PATIENCE'])
+            masked_src_multihead = shared_cache_layer([masked_src_multihead, src_text])
 
         # 3.1.1. Previously generated words as inputs for training -> Teacher forcing
         next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
-        next_words_positions = PositionLayer(name='position_layer_next_words')(next_words)
 
-        # 3.1.2. Target word embedding
-        state_below = Embedding(params['OUTPUT_VOCABULARY_SIZE'],
-                                params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                name='target_word_embedding',
-                                embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                                embeddings_initializer=params['INIT_FUNCTION'],
-                                trainable=self.trg_embedding_weights_trainable,
-                                weights=self.trg_embedding_weights,
-                                mask_zero=True)(next_words)
-
-        if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
-            state_below = SqrtScaling(params['MODEL_SIZE'])(state_below)
-
-        if params['TARGET_TEXT_EMBEDDING_SIZE'] == params['SOURCE_TEXT_EMBEDDING_SIZE']:
-            positional_embedding_trg = positional_embedding
-        else:
-            max_len = max(params['MAX_OUTPUT_TEXT_LEN'], params['MAX_OUTPUT_TEXT_LEN_TEST'])
-
-            positional_embedding_trg = Embedding(max_len,
-                                                 params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                                 name='positional_trg_word_embedding',
-                                                 trainable=False,
-                                                 weights=getPositionalEncodingWeights(max_len,
-                                                                                      params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                                                                      name='positional_trg_word_embedding',
-                                                                                      verbose=self.verbose))
-
-        positional_trg_embedding = positional_embedding_trg(next_words_positions)
-
-        state_below = Add()([state_below, positional_trg_embedding])
-
-        # Regularize
-        state_below = Dropout(params['DROPOUT_P'])(state_below)
+        # 3.1.2. Target word embedding (never tied to the source one)
+        state_below, trg_embedding, _, _ = self.getTransformerTargetEmbedding(next_words, positional_embedding)
 
         shared_trg_multihead_list = []
         shared_trg_dropout_multihead_list = []
@@ -1836,11 +2237,9 @@ class TranslationModel(Model_Wrapper):
             # Declare shared layers of each block
 
             # Masked Multi-Head Attention block
-            shared_trg_multihead = MultiHeadAttention(params['N_HEADS'],
-                                                      params['MODEL_SIZE'],
-                                                      dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                                      mask_future=True,  # Avoid attending on future sequences
-                                                      name='trg_MultiHeadAttention_' + str(n_block))
+            shared_trg_multihead = self.getMultiHeadAttention('trg_MultiHeadAttention_' + str(n_block),
+                                                              mask_future=True,  # Avoid attending on future sequences
+                                                              model_size=decoder_size)
             shared_trg_multihead_list.append(shared_trg_multihead)
 
             # Regularize
@@ -1856,9 +2255,9 @@ class TranslationModel(Model_Wrapper):
             shared_trg_norm_multihead_list.append(shared_trg_multihead_norm)
 
             # Second Multi-Head Attention block
-            shared_src_trg_multihead = MultiHeadAttention(params['N_HEADS'], params['MODEL_SIZE'],
-                                                          dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                                          name='src_trg_MultiHeadAttention_' + str(n_block))
+            shared_src_trg_multihead = self.getMultiHeadAttention('src_trg_MultiHeadAttention_' + str(n_block),
+                                                                  self_attention=False,
+                                                                  model_size=decoder_size)
             shared_src_trg_multihead_list.append(shared_src_trg_multihead)
 
             # Regularize
@@ -1874,7 +2273,7 @@ class TranslationModel(Model_Wrapper):
             shared_src_trg_norm_multihead_list.append(shared_src_trg_multihead_norm)
 
             # FF
-            shared_ff_src_trg_multihead = TimeDistributed(PositionwiseFeedForwardDense(params['FF_SIZE'],
+            shared_ff_src_trg_multihead = TimeDistributed(PositionwiseFeedForwardDense(decoder_ff_size,
                                                                                        name='src_trg_PositionwiseFeedForward_' + str(n_block)),
                                                           name='src_trg_TimeDistributedPositionwiseFeedForward_' + str(n_block))
             shared_ff_list.append(shared_ff_src_trg_multihead)
@@ -1933,37 +2332,10 @@ class TranslationModel(Model_Wrapper):
             prev_state_below = ff_src_trg_multihead_norm
 
         out_layer = prev_state_below
-        shared_deep_list = []
-        shared_reg_deep_list = []
-        # 3.6 Optional deep ouput layer
-        for i, (activation, dimension) in enumerate(params['DEEP_OUTPUT_LAYERS']):
-            shared_deep_list.append(TimeDistributed(Dense(dimension,
-                                                          activation=activation,
-                                                          kernel_initializer=params['INIT_FUNCTION'],
-                                                          kernel_regularizer=l2(params['WEIGHT_DECAY']),
-                                                          bias_regularizer=l2(params['WEIGHT_DECAY']),
-                                                          trainable=params.get('TRAINABLE_DECODER', True),
-                                                          ),
-                                                    trainable=params.get('TRAINABLE_DECODER', True),
-                                                    name=activation + '_%d' % i))
-            out_layer = shared_deep_list[-1](out_layer)
-            [out_layer, shared_reg_out_layer] = Regularize(out_layer,
-                                                           params, shared_layers=True,
-                                                           name='out_layer_' + str(activation) + '_%d' % i)
-            shared_reg_deep_list.append(shared_reg_out_layer)
-
-        # 3.7. Output layer: Softmax
-        shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
-                                               activation=params['CLASSIFIER_ACTIVATION'],
-                                               kernel_regularizer=l2(params['WEIGHT_DECAY']),
-                                               bias_regularizer=l2(params['WEIGHT_DECAY']),
-                                               trainable=params.get('TRAINABLE_DECODER', True),
-                                               name=params['CLASSIFIER_ACTIVATION']
-                                               ),
-                                         trainable=params.get('TRAINABLE_DECODER', True),
-                                         name=self.ids_outputs[0])
-        softout = shared_FC_soft(out_layer)
-        self.model = Model(inputs=[src_text, next_words], outputs=softout)
+        # 3.6. Output layers: optional deep output layers and softmax
+        out_layer, softout, shared_deep_list, shared_reg_deep_list, shared_FC_soft = \
+            self.getTransformerOutput(out_layer, trg_embedding)
+        self.model = Model(inputs=[src_text, next_words], outputs=self.getTrainingOutput(shared_FC_soft, out_layer, softout))
 
         ##################################################################
         #                         SAMPLING MODEL                         #
@@ -1993,7 +2365,7 @@ class TranslationModel(Model_Wrapper):
         # and the following outputs:
         #   - softmax probabilities
 
-        preprocessed_size = params['MODEL_SIZE']
+        preprocessed_size = decoder_size
 
         # Define inputs
         preprocessed_annotations = Input(name='preprocessed_input',
@@ -2001,7 +2373,10 @@ class TranslationModel(Model_Wrapper):
                                          dtype='float32')
 
         # CACHE IN SAMPLING
-        preprocessed_annotations_with_cache = shared_cache_layer([preprocessed_annotations, src_text])
+        if params.get('RING_BUFFER_CACHE', False):
+            preprocessed_annotations_with_cache = preprocessed_annotations
+        else:
+            preprocessed_annotations_with_cache = shared_cache_layer([preprocessed_annotations, src_text])
 
         # Apply decoder
         prev_state_below = state_below
@@ -2211,12 +2586,13 @@ class TranslationModel(Model_Wrapper):
             # 3.1 Previously generated words as inputs for training -> Teacher forcing
             next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
             # Target word embedding
-            state_below = Embedding(params['OUTPUT_VOCABULARY_SIZE'], params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                    name='target_word_embedding',
-                                    embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                                    embeddings_initializer=params['INIT_FUNCTION'],
-                                    trainable=self.trg_embedding_weights_trainable, weights=self.trg_embedding_weights,
-                                    mask_zero=True)(next_words)
+            trg_embedding = self.getWordEmbedding(params['OUTPUT_VOCABULARY_SIZE'], params['TARGET_TEXT_EMBEDDING_SIZE'],
+                                                  name='target_word_embedding',
+                                                  embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                                  embeddings_initializer=params['INIT_FUNCTION'],
+                                                  trainable=self.trg_embedding_weights_trainable, weights=self.trg_embedding_weights,
+                                                  mask_zero=True)
+            state_below = trg_embedding(next_words)
             state_below = Regularize(state_below, params, name='state_below')
 
             # 3.2. Decoder's RNN initialization perceptrons with ctx mean
@@ -2413,15 +2789,18 @@ class TranslationModel(Model_Wrapper):
                 shared_reg_deep_list.append(shared_reg_out_layer)
 
             # 3.7. Output layer: Softmax
-            shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
-                                                   activation=params['CLASSIFIER_ACTIVATION'],
-                                                   W_regularizer=l2(params['WEIGHT_DECAY']),
-                                                   name=params['CLASSIFIER_ACTIVATION']
-                                                   ),
-                                             name=self.ids_outputs[0])
+            if params.get('TIE_OUTPUT_EMBEDDINGS', False):
+                shared_FC_soft = self.getTiedOutputLayer(trg_embedding)
+            else:
+                shared_FC_soft = TimeDistributed(Dense(params['OUTPUT_VOCABULARY_SIZE'],
+                                                       activation=params['CLASSIFIER_ACTIVATION'],
+                                                       W_regularizer=l2(params['WEIGHT_DECAY']),
+                                                       name=params['CLASSIFIER_ACTIVATION']
+                                                       ),
+                                                 name=self.ids_outputs[0])
             softout = shared_FC_soft(out_layer)
 
-            self.model = Model(input=[src_text, next_words], output=softout)
+            self.model = Model(input=[src_text, next_words], output=self.getTrainingOutput(shared_FC_soft, out_layer, softout))
 
             ##################################################################
             #                         SAMPLING MODEL                         #
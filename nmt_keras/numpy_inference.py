@@ -0,0 +1,914 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from nmt_keras.helpers import positional_encodings, to_str
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Value given to the masked attention energies (as in the Keras MultiHeadAttention)
+MASK_VALUE = -2. ** 32 + 1
+
+
+class QuantizedMatrix(object):
+    """
+    Matrix stored as int8 values and a float32 scale for each row (axis=0) or column (axis=1): the matrix is
+    values * scales. Embeddings are quantized by rows (one scale per word) and projection kernels by columns (one scale
+    per output unit), so the rows of an embedding lookup and the outputs of a projection are dequantized on the fly.
+
+    With cache, the matrix is dequantized at its first product and the float32 copy is reused by the next ones (and by
+    its transpose), so the decoding is as fast as with the float32 model. Otherwise, it is dequantized by blocks at
+    each product: slower, but the float32 matrix is never stored.
+
+    :param values: int8 array with shape (rows, columns).
+    :param scales: float32 array with the scale of each row (axis=0) or column (axis=1).
+    :param int axis: 0 for row scales, 1 for column scales.
+    :param bool cache: Whether to keep the dequantized matrix.
+    """
+
+    def __init__(self, values, scales, axis=0, cache=True):
+        self.values = np.asarray(values, dtype='int8')
+        self.scales = np.asarray(scales, dtype='float32')
+        self.axis = axis
+        self.cache = cache
+        self.matrix = None
+        self.transposed = None
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def ndim(self):
+        return self.values.ndim
+
+    @property
+    def T(self):
+        if self.transposed is None:
+            self.transposed = QuantizedMatrix(self.values.T, self.scales, axis=1 - self.axis, cache=self.cache)
+            self.transposed.transposed = self
+        return self.transposed
+
+    def dequantize(self):
+        return self.values.astype('float32') * (self.scales[:, None] if self.axis == 0 else self.scales[None, :])
+
+    def dequantized(self):
+        """
+        Cached dequantized matrix (shared with the transpose).
+        """
+        if self.matrix is None:
+            if self.transposed is not None and self.transposed.matrix is not None:
+                self.matrix = self.transposed.matrix.T
+            else:
+                self.matrix = self.dequantize()
+        return self.matrix
+
+    def __getitem__(self, rows):
+        """
+        Rows of the matrix (e.g. the embeddings of some words), dequantizing only them.
+        """
+        if self.axis == 0:
+            return self.values[rows].astype('float32') * self.scales[rows][..., None]
+        return self.values[rows].astype('float32') * self.scales
+
+    def dot(self, x, block_size=4096):
+        """
+        Computes np.dot(x, matrix). Without cache, the scales are applied to the outputs (or to the inputs, for row
+        scales) and the int8 values are converted to float32 by blocks of columns, so the float32 matrix is never
+        stored.
+
+        :param x: Array with shape (..., rows).
+        :param int block_size: Number of columns converted at once (without cache).
+        :return: Array with shape (..., columns).
+        """
+        if self.cache:
+            return np.dot(x, self.dequantized())
+        if self.axis == 0:
+            x = x * self.scales
+        outputs = np.empty(x.shape[:-1] + (self.shape[1],), dtype='float32')
+        for start in range(0, self.shape[1], block_size):
+            block = self.values[:, start:start + block_size].astype('float32')
+            outputs[..., start:start + block_size] = np.dot(x, block)
+        if self.axis == 1:
+            outputs *= self.scales
+        return outputs
+
+
+def quantize(matrix, axis=0):
+    """
+    Quantizes a matrix to int8 with a symmetric scale for each row (axis=0) or column (axis=1).
+
+    :param matrix: 2D array.
+    :param int axis: 0 for row scales, 1 for column scales.
+    :return: QuantizedMatrix.
+    """
+    matrix = np.asarray(matrix, dtype='float32')
+    scales = np.max(np.abs(matrix), axis=1 - axis) / 127.
+    scales[scales == 0.] = 1.
+    values = np.round(matrix / (scales[:, None] if axis == 0 else scales[None, :]))
+    return QuantizedMatrix(np.clip(values, -127, 127), scales, axis=axis)
+
+
+def project(x, kernel):
+    """
+    np.dot(x, kernel), for float32 and quantized kernels.
+    """
+    if isinstance(kernel, QuantizedMatrix):
+        return kernel.dot(x)
+    return np.dot(x, kernel)
+
+
+def read_hdf5_weights(group):
+    """
+    Reads the weights stored by Keras in a HDF5 group. The int8 weights stored by utils/quantize_model.py (with their
+    scales in '<weight name>_scales') are read as QuantizedMatrix.
+
+    :param group: h5py group (the file for save_weights, 'model_weights' for save).
+    :return: Dictionary from layer names to OrderedDicts from weight names to arrays.
+    """
+    weights = dict()
+    for layer_name in group.attrs['layer_names']:
+        layer_name = to_str(layer_name)
+        layer_group = group[layer_name]
+        weights[layer_name] = OrderedDict()
+        for weight_name in layer_group.attrs['weight_names']:
+            weight_name = to_str(weight_name)
+            # 'layer/inner_layer/kernel:0' -> 'kernel'
+            short_name = weight_name.split('/')[-1].split(':')[0]
+            if short_name in weights[layer_name]:
+                short_name = weight_name
+            dataset = layer_group[weight_name]
+            if dataset.dtype == np.int8:
+                weights[layer_name][short_name] = QuantizedMatrix(dataset[()], layer_group[weight_name + '_scales'][()],
+                                                                  axis=int(dataset.attrs['quantization_axis']))
+            else:
+                weights[layer_name][short_name] = np.asarray(dataset[()], dtype='float32')
+    return weights
+
+
+def load_keras_model(model_path, suffix='_init'):
+    """
+    Loads the layers and weights of a model stored by saveModel, without Keras. It reads <model_path><suffix>.h5 or,
+    if the model could not be stored in a single file, <model_path>_structure<suffix>.json and
+    <model_path>_weights<suffix>.h5.
+
+    :param str model_path: Path to the stored model (e.g. trained_models/model/epoch_1).
+    :param str suffix: Model to load: '_init' (model_init), '_next' (model_next) or '' (training model).
+    :return: Tuple (layers, weights): dictionaries from layer names to layer descriptions (name, class_name, config
+             and inbound_nodes, from the model structure) and to OrderedDicts of weights (name -> array).
+    """
+    import h5py
+    if os.path.isfile(model_path + suffix + '.h5'):
+        with h5py.File(model_path + suffix + '.h5', 'r') as model_file:
+            structure = json.loads(to_str(model_file.attrs['model_config']))
+            weights = read_hdf5_weights(model_file['model_weights'])
+    else:
+        with open(model_path + '_structure' + suffix + '.json', 'r') as structure_file:
+            structure = json.load(structure_file)
+        with h5py.File(model_path + '_weights' + suffix + '.h5', 'r') as weights_file:
+            weights = read_hdf5_weights(weights_file)
+    layers = OrderedDict((layer['name'], layer) for layer in structure['config']['layers'])
+    return layers, weights
+
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+def hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0., 1.)
+
+
+def relu(x):
+    return np.maximum(x, 0.)
+
+
+def linear(x):
+    return x
+
+
+def softmax(x, mask=None, axis=-1):
+    """
+    Softmax over an axis. The masked positions (mask == 0) get a MASK_VALUE energy.
+
+    :param x: Energies.
+    :param mask: Mask broadcastable to x (or None).
+    :param axis: Axis of the softmax.
+    :return: Probabilities.
+    """
+    if mask is not None:
+        x = np.where(mask, x, MASK_VALUE)
+    e = np.exp(x - np.max(x, axis=axis, keepdims=True))
+    return e / np.sum(e, axis=axis, keepdims=True)
+
+
+ACTIVATIONS = {'linear': linear, None: linear, 'relu': relu, 'tanh': np.tanh, 'sigmoid': sigmoid,
+               'hard_sigmoid': hard_sigmoid, 'softmax': softmax}
+
+
+def get_activation(name):
+    if name not in ACTIVATIONS:
+        raise NotImplementedError('Activation "%s" is not implemented in the NumPy inference.' % str(name))
+    return ACTIVATIONS[name]
+
+
+def lstm(inputs, recurrent_kernel, activation, recurrent_activation, h=None, c=None, go_backwards=False):
+    """
+    LSTM over a sequence of (already projected) inputs.
+
+    :param inputs: Input projections (x * kernel + bias), with shape (batch, time, 4 * units).
+    :param recurrent_kernel: Recurrent kernel, with shape (units, 4 * units).
+    :param activation: Activation function.
+    :param recurrent_activation: Activation function of the gates.
+    :param h: Initial state (zeros if None).
+    :param c: Initial memory (zeros if None).
+    :param bool go_backwards: Process the sequence backwards (the outputs keep the input order).
+    :return: Outputs (batch, time, units), last state, last memory.
+    """
+    units = recurrent_kernel.shape[0]
+    h = np.zeros((inputs.shape[0], units), dtype='float32') if h is None else h
+    c = np.zeros((inputs.shape[0], units), dtype='float32') if c is None else c
+    outputs = np.zeros(inputs.shape[:2] + (units,), dtype='float32')
+    for t in (reversed(range(inputs.shape[1])) if go_backwards else range(inputs.shape[1])):
+        z = inputs[:, t] + np.dot(h, recurrent_kernel)
+        i = recurrent_activation(z[:, :units])
+        f = recurrent_activation(z[:, units:2 * units])
+        c = f * c + i * activation(z[:, 2 * units:3 * units])
+        o = recurrent_activation(z[:, 3 * units:])
+        h = o * activation(c)
+        outputs[:, t] = h
+    return outputs, h, c
+
+
+def gru_step(x, h, recurrent_kernel, activation, recurrent_activation, recurrent_bias=None):
+    """
+    GRU step from the input projections x. With a recurrent bias, the reset gate is applied after the recurrent
+    projection (reset_after, as in CuDNN).
+    """
+    units = recurrent_kernel.shape[0]
+    if recurrent_bias is not None:
+        inner = np.dot(h, recurrent_kernel) + recurrent_bias
+        z = recurrent_activation(x[:, :units] + inner[:, :units])
+        r = recurrent_activation(x[:, units:2 * units] + inner[:, units:2 * units])
+        hh = activation(x[:, 2 * units:] + r * inner[:, 2 * units:])
+    else:
+        inner = np.dot(h, recurrent_kernel[:, :2 * units])
+        z = recurrent_activation(x[:, :units] + inner[:, :units])
+        r = recurrent_activation(x[:, units:2 * units] + inner[:, units:])
+        hh = activation(x[:, 2 * units:] + np.dot(r * h, recurrent_kernel[:, 2 * units:]))
+    return z * h + (1. - z) * hh
+
+
+def gru(inputs, recurrent_kernel, activation, recurrent_activation, h=None, recurrent_bias=None, go_backwards=False):
+    """
+    GRU over a sequence of (already projected) inputs. See lstm and gru_step.
+
+    :return: Outputs (batch, time, units), last state.
+    """
+    units = recurrent_kernel.shape[0]
+    h = np.zeros((inputs.shape[0], units), dtype='float32') if h is None else h
+    outputs = np.zeros(inputs.shape[:2] + (units,), dtype='float32')
+    for t in (reversed(range(inputs.shape[1])) if go_backwards else range(inputs.shape[1])):
+        h = gru_step(inputs[:, t], h, recurrent_kernel, activation, recurrent_activation, recurrent_bias=recurrent_bias)
+        outputs[:, t] = h
+    return outputs, h
+
+
+def multi_head_attention(queries, keys, wq, wk, wv, wo, biases=None, n_heads=1, activation=linear, query_mask=None,
+                         key_mask=None, mask_future=False):
+    """
+    Multi-head (scaled dot-product) attention.
+
+    :param queries: Queries, with shape (batch, queries_time, dim).
+    :param keys: Keys (and values), with shape (batch, keys_time, dim).
+    :param wq: Queries projection.
+    :param wk: Keys projection.
+    :param wv: Values projection.
+    :param wo: Output projection.
+    :param biases: Biases of the projections (bq, bk, bv, bo) or None.
+    :param int n_heads: Number of heads.
+    :param activation: Activation of the queries, keys and values projections.
+    :param query_mask: Mask of the queries (batch, queries_time). The masked queries get a null attention.
+    :param key_mask: Mask of the keys (batch, keys_time). The masked keys are not attended.
+    :param bool mask_future: Do not attend to future positions (queries and keys must be the same sequence).
+    :return: Attended values, with shape (batch, queries_time, dmodel).
+    """
+    bq, bk, bv, bo = biases if biases is not None else (0., 0., 0., 0.)
+    q = activation(project(queries, wq) + bq)
+    k = activation(project(keys, wk) + bk)
+    v = activation(project(keys, wv) + bv)
+    outputs = scaled_dot_product_attention(q, k, v, n_heads=n_heads, query_mask=query_mask, key_mask=key_mask,
+                                           mask_future=mask_future)
+    return project(outputs, wo) + bo
+
+
+def scaled_dot_product_attention(q, k, v, n_heads=1, query_mask=None, key_mask=None, mask_future=False):
+    """
+    Attention of the (projected) queries q to the (projected) keys k and values v, with several heads.
+
+    :return: Concatenation of the attended values of each head, with shape (batch, queries_time, dmodel).
+    """
+    batch_size, q_len, dmodel = q.shape
+    k_len = k.shape[1]
+    head_size = dmodel // n_heads
+    # (batch, heads, time, head_size)
+    q = q.reshape(batch_size, q_len, n_heads, head_size).transpose(0, 2, 1, 3)
+    k = k.reshape(batch_size, k_len, n_heads, head_size).transpose(0, 2, 1, 3)
+    v = v.reshape(batch_size, k_len, n_heads, -1).transpose(0, 2, 1, 3)
+    energies = np.matmul(q, k.transpose(0, 1, 3, 2)) / np.sqrt(head_size)
+    mask = np.ones((batch_size, 1, q_len, k_len), dtype=bool)
+    if key_mask is not None:
+        mask = mask & key_mask[:, None, None, :].astype(bool)
+    if mask_future:
+        mask = mask & np.tril(np.ones((q_len, k_len), dtype=bool))[None, None]
+    weights = softmax(energies, mask=mask)
+    if query_mask is not None:
+        weights = weights * query_mask[:, None, :, None]
+    return np.matmul(weights, v).transpose(0, 2, 1, 3).reshape(batch_size, q_len, -1)
+
+
+class NumpyTranslationModel(object):
+    """
+    Translation model which runs with NumPy, from the weights of a model stored by saveModel.
+    It neither imports Keras nor builds any graph: each stored layer (found by its name in model_init) is applied by a
+    NumPy kernel. It mimics model_init and model_next (predict_init and predict_next) and implements
+    predict_cond_optimized, so it can be used by keras_wrapper.search.beam_search. It also implements the inputs and
+    outputs mappings of Model_Wrapper (see set_model_mappings), so it can be used by BeamSearchEnsemble.
+
+    Only the layers used by the supported architectures are implemented. The class is abstract: the subclass of each
+    architecture (see NUMPY_MODELS) implements predict_init and predict_next, from which predict_cond_optimized
+    dispatches the decoding steps.
+
+    :param dict params: Parameters of the model (config.pkl stored with the model).
+    :param str model_path: Path to the stored model (e.g. trained_models/model/epoch_1).
+    """
+
+    def __init__(self, params, model_path):
+        self.params = params
+        self.model_path = model_path
+        self.ids_inputs = params['INPUTS_IDS_MODEL']
+        self.ids_outputs = params['OUTPUTS_IDS_MODEL']
+        self.return_alphas = params.get('COVERAGE_PENALTY', False) or params.get('POS_UNK', False)
+        self.layers, self.weights = load_keras_model(model_path, suffix='_init')
+        self.set_ids()
+
+    def set_ids(self):
+        """
+        Sets the input and output identifiers of the init and next models (as in TranslationModel).
+        """
+        self.ids_inputs_init = self.ids_inputs
+        self.ids_outputs_init = self.ids_outputs + ['preprocessed_input']
+        self.ids_inputs_next = [self.ids_inputs[1], 'preprocessed_input']
+        self.ids_outputs_next = self.ids_outputs + ['preprocessed_input']
+        self.matchings_init_to_next = {'preprocessed_input': 'preprocessed_input'}
+        self.matchings_next_to_next = {'preprocessed_input': 'preprocessed_input'}
+
+    def setInputsMapping(self, inputsMapping):
+        self.inputsMapping = inputsMapping
+
+    def setOutputsMapping(self, outputsMapping):
+        self.outputsMapping = outputsMapping
+
+    def prepareData(self, X_batch, Y_batch=None):
+        """
+        Maps a batch of the Dataset to the inputs and outputs of the model, as Model_Wrapper.prepareData.
+
+        :param X_batch: Batch of input data.
+        :param Y_batch: Batch of output data.
+        :return: [inputs, outputs] dictionaries (model id -> data).
+        """
+        X = dict((input_id, X_batch[position]) for input_id, position in self.inputsMapping.items())
+        Y = dict()
+        if Y_batch is not None:
+            Y = dict((output_id, Y_batch[position][0] if isinstance(Y_batch[position], tuple) else Y_batch[position])
+                     for output_id, position in self.outputsMapping.items())
+        return [X, Y]
+
+    # Layers
+    def has_layer(self, name):
+        return name in self.layers
+
+    def layer_config(self, name):
+        """
+        Configuration of a layer (of the wrapped layer, for TimeDistributed layers).
+        """
+        layer = self.layers[name]
+        if layer['class_name'] == 'TimeDistributed':
+            return layer['config']['layer']['config']
+        return layer['config']
+
+    def layer_weights(self, name):
+        return list(self.weights[name].values())
+
+    def consumers(self, name):
+        """
+        Names of the layers which take as input the output of a layer.
+        """
+        return [layer_name for layer_name, layer in self.layers.items()
+                if any(inbound[0] == name for node in layer.get('inbound_nodes', []) for inbound in node)]
+
+    def embedding(self, name, ids):
+        return self.layer_weights(name)[0][ids]
+
+    def dense(self, name, x):
+        weights = self.layer_weights(name)
+        x = project(x, weights[0])
+        if len(weights) > 1:
+            x = x + weights[1]
+        return get_activation(self.layer_config(name).get('activation', 'linear'))(x)
+
+    def normalization(self, name, x):
+        """
+        BatchNormalization layer at test time. Mode 1 normalizes each sample (as a layer normalization), mode 0 uses
+        the moving statistics.
+        """
+        config = self.layer_config(name)
+        weights = self.layer_weights(name)
+        gamma = weights.pop(0) if config.get('scale', True) else 1.
+        beta = weights.pop(0) if config.get('center', True) else 0.
+        epsilon = config.get('epsilon', 1e-3)
+        mode = config.get('mode', 0)
+        if mode == 1:
+            std = np.sqrt(np.var(x, axis=-1, keepdims=True) + epsilon)
+            x_normed = (x - np.mean(x, axis=-1, keepdims=True)) / (std + epsilon)
+        elif mode == 0:
+            x_normed = (x - weights[0]) / np.sqrt(weights[1] + epsilon)
+        else:
+            raise NotImplementedError('BatchNormalization mode %d is not implemented in the NumPy inference.' % mode)
+        return gamma * x_normed + beta
+
+    def regularize(self, name, x):
+        """
+        Applies the regularization layers added by Regularize (name + '_<regularizer>') which are active at test time.
+        """
+        if self.has_layer(name + '_batch_normalization'):
+            x = self.normalization(name + '_batch_normalization', x)
+        if self.has_layer(name + '_PReLU'):
+            alpha = self.layer_weights(name + '_PReLU')[0]
+            x = np.maximum(x, 0.) + alpha * np.minimum(x, 0.)
+        if self.has_layer(name + '_L1_norm'):
+            raise NotImplementedError('L1 normalization is not implemented in the NumPy inference.')
+        if self.has_layer(name + '_L2_norm'):
+            x = x / np.sqrt(np.maximum(np.sum(np.square(x), axis=-1, keepdims=True), 1e-12))
+        return x
+
+    def output_layer(self, x):
+        """
+        Deep output layers (DEEP_OUTPUT_LAYERS) and softmax. With TIE_OUTPUT_EMBEDDINGS, the softmax projection is
+        computed with the transposed target embeddings.
+        """
+        for i, (activation, _) in enumerate(self.params['DEEP_OUTPUT_LAYERS']):
+            x = self.dense(activation + '_%d' % i, x)
+            x = self.regularize('out_layer_' + str(activation) + '_%d' % i, x)
+        if self.layers[self.ids_outputs[0]]['class_name'] == 'Activation':
+            embeddings, bias = self.layer_weights(self.target_embedding_name())
+            return get_activation(self.layer_config(self.ids_outputs[0])['activation'])(project(x, embeddings.T) + bias)
+        return self.dense(self.ids_outputs[0], x)
+
+    def target_embedding_name(self):
+        return 'source_word_embedding' if self.params.get('TIE_EMBEDDINGS', False) else 'target_word_embedding'
+
+    # Prediction (abstract: implemented by the subclass of each architecture, see NUMPY_MODELS)
+    def predict_init(self, inputs):
+        """
+        Equivalent to model_init.predict_on_batch. Subclasses encode the source sentences and decode the given words,
+        returning the probabilities first and then the outputs matched to the inputs of predict_next
+        (matchings_init_to_next).
+
+        :param dict inputs: Inputs (ids_inputs_init -> array).
+        :return: List of outputs (in the order of ids_outputs_init).
+        """
+        raise NotImplementedError('%s must implement predict_init: the NumpyTranslationModel of each architecture '
+                                  'returns the outputs of its model_init.' % self.__class__.__name__)
+
+    def predict_next(self, inputs):
+        """
+        Equivalent to model_next.predict_on_batch. Subclasses decode the next words from the outputs of the previous
+        step (matchings_init_to_next and matchings_next_to_next), returning the probabilities first.
+
+        :param dict inputs: Inputs (ids_inputs_next -> array).
+        :return: List of outputs (in the order of ids_outputs_next).
+        """
+        raise NotImplementedError('%s must implement predict_next: the NumpyTranslationModel of each architecture '
+                                  'returns the outputs of its model_next.' % self.__class__.__name__)
+
+    def predict_cond_optimized(self, X, states_below, params, ii, prev_out):
+        """
+        Returns the predictions for the time-step ii, as Model_Wrapper.predict_cond_optimized.
+
+        :param X: Input context.
+        :param states_below: Batch of partial hypotheses.
+        :param params: Decoding parameters.
+        :param ii: Decoding time-step.
+        :param prev_out: Outputs from the previous time-step.
+        :return: [probabilities at the time-step ii, outputs]
+        """
+        n_samples = states_below.shape[0]
+        pad_on_batch = params.get('pad_on_batch', True)
+        attend_on_output = params.get('attend_on_output', False)
+        if ii == 0:
+            in_data = dict()
+            for model_input in params['model_inputs']:
+                in_data[model_input] = np.repeat(X[model_input], n_samples, axis=0) if X[model_input].shape[0] == 1 \
+                    else X[model_input]
+            if pad_on_batch:
+                states_below = states_below.reshape(n_samples, -1)
+            in_data[params['model_inputs'][params['state_below_index']]] = states_below
+            out_data = self.predict_init(in_data)
+        else:
+            if ii == 1:
+                output_ids, matchings = self.ids_outputs_init, self.matchings_init_to_next
+            else:
+                output_ids, matchings = self.ids_outputs_next, self.matchings_next_to_next
+            if pad_on_batch and not attend_on_output:
+                states_below = states_below[:, -1].reshape(n_samples, -1)
+            in_data = {self.ids_inputs_next[0]: states_below}
+            for idx, output_id in enumerate(output_ids):
+                if idx > 0 and output_id in matchings:
+                    if prev_out[idx].shape[0] == 1:
+                        prev_out[idx] = np.repeat(prev_out[idx], n_samples, axis=0)
+                    in_data[matchings[output_id]] = prev_out[idx]
+            out_data = self.predict_next(in_data)
+        probs = out_data[0][:, ii if attend_on_output else 0, :]
+        return [probs, out_data]
+
+
+class NumpyTransformer(NumpyTranslationModel):
+    """
+    NumPy inference of the Transformer model (see TranslationModel.Transformer).
+    """
+
+    def __init__(self, params, model_path):
+        super(NumpyTransformer, self).__init__(params, model_path)
+        self.positional_cache = dict()
+
+    def multi_head_attention(self, name, queries, keys, query_mask=None, key_mask=None):
+        config = self.layer_config(name)
+        n_heads = config.get('n_heads', self.params['N_HEADS'])
+        activation = get_activation(config.get('activation', 'linear'))
+        if self.layers[name]['class_name'] == 'FusedMultiHeadAttention':
+            weights = self.weights[name]
+            dmodel = weights['wo'].shape[0]
+            if 'wqkv' in weights:
+                qkv = activation(project(queries, weights['wqkv']) + weights.get('bqkv', 0.))
+                q, k, v = qkv[..., :dmodel], qkv[..., dmodel:2 * dmodel], qkv[..., 2 * dmodel:]
+            else:
+                q = activation(project(queries, weights['wq']) + weights.get('bq', 0.))
+                kv = activation(project(keys, weights['wkv']) + weights.get('bkv', 0.))
+                k, v = kv[..., :dmodel], kv[..., dmodel:]
+            outputs = scaled_dot_product_attention(q, k, v, n_heads=n_heads, query_mask=query_mask, key_mask=key_mask,
+                                                   mask_future=config.get('mask_future', False))
+            return project(outputs, weights['wo']) + weights.get('bo', 0.)
+        weights = self.layer_weights(name)
+        # Kernels and biases are stored in the order q, k, v, o
+        kernels = [w for w in weights if w.ndim == 2]
+        biases = [w for w in weights if w.ndim == 1] or None
+        return multi_head_attention(queries, keys, *kernels, biases=biases, n_heads=n_heads, activation=activation,
+                                    query_mask=query_mask, key_mask=key_mask,
+                                    mask_future=config.get('mask_future', False))
+
+    def feed_forward(self, name, x):
+        config = self.layer_config(name)
+        weights = self.layer_weights(name)
+        kernels = [w for w in weights if w.ndim == 2]
+        biases = [w for w in weights if w.ndim == 1] or [0., 0.]
+        hidden = get_activation(config.get('activation', 'relu'))(project(x, kernels[0]) + biases[0])
+        return project(hidden, kernels[1]) + biases[1]
+
+    def encoder_feed_forward_name(self, n_block):
+        # The feed-forward layers of the encoder are not named: look for the one applied after the normalization
+        for name in self.consumers('src_Normalization_MultiHeadAttention_' + str(n_block)):
+            if self.layers[name]['class_name'] == 'TimeDistributed':
+                return name
+        raise ValueError('The feed-forward layer of the encoder block %d was not found.' % n_block)
+
+    def encode_positions(self, name, length):
+        """
+        Positional encodings of the first positions: the weights of the positional Embedding
+        (STORED_POSITIONAL_ENCODINGS) or, for a SinusoidalPositionalEncoding layer, a buffer of encodings which grows
+        on demand.
+        """
+        if self.layers[name]['class_name'] != 'SinusoidalPositionalEncoding':
+            return self.embedding(name, np.arange(length))
+        encodings = self.positional_cache.get(name)
+        if encodings is None or len(encodings) < length:
+            cached_length = 0 if encodings is None else len(encodings)
+            encodings = positional_encodings(np.arange(max(length, 2 * cached_length)),
+                                             self.layer_config(name)['output_dim']).astype('float32')
+            self.positional_cache[name] = encodings
+        return encodings[:length]
+
+    def embed(self, embedding_name, positional_name, ids, scale):
+        x = self.embedding(embedding_name, ids)
+        if scale:
+            x = x * np.sqrt(x.shape[-1])
+        return x + self.encode_positions(positional_name, ids.shape[1])[None]
+
+    def encode(self, src):
+        src_mask = src != 0
+        x = self.embed('source_word_embedding', 'positional_src_word_embedding', src,
+                       self.params.get('SCALE_SOURCE_WORD_EMBEDDINGS', False))
+        for n_block in range(self.params['N_LAYERS_ENCODER']):
+            attended = self.multi_head_attention('src_MultiHeadAttention_' + str(n_block), x, x,
+                                                 query_mask=src_mask, key_mask=src_mask)
+            x = self.normalization('src_Normalization_MultiHeadAttention_' + str(n_block), attended + x)
+            x = self.normalization('src_Normalization_FF_' + str(n_block),
+                                   self.feed_forward(self.encoder_feed_forward_name(n_block), x) + x)
+        if self.has_layer('src_trg_bridge'):
+            x = self.dense('src_trg_bridge', x)
+        return x * src_mask[:, :, None]
+
+    def decode(self, next_words, encoded, src_mask=None):
+        trg_mask = next_words != 0
+        positional_name = 'positional_trg_word_embedding' if self.has_layer('positional_trg_word_embedding') \
+            else 'positional_src_word_embedding'
+        y = self.embed(self.target_embedding_name(), positional_name, next_words,
+                       self.params.get('SCALE_TARGET_WORD_EMBEDDINGS', False))
+        for n_block in range(self.params['N_LAYERS_DECODER']):
+            attended = self.multi_head_attention('trg_MultiHeadAttention_' + str(n_block), y, y,
+                                                 query_mask=trg_mask, key_mask=trg_mask)
+            y = self.normalization('trg_Normalization_MultiHeadAttention_' + str(n_block), y + attended)
+            attended = self.multi_head_attention('src_trg_MultiHeadAttention_' + str(n_block), y, encoded,
+                                                 query_mask=trg_mask, key_mask=src_mask)
+            y = self.normalization('src_trg_Normalization_MultiHeadAttention_' + str(n_block), attended + y)
+            feed_forward = self.feed_forward('src_trg_TimeDistributedPositionwiseFeedForward_' + str(n_block), y)
+            y = self.normalization('src_trg_Normalization_FF_' + str(n_block), feed_forward + y)
+        return self.output_layer(y)
+
+    def predict_init(self, inputs):
+        src = np.asarray(inputs[self.ids_inputs[0]])
+        encoded = self.encode(src)
+        return [self.decode(np.asarray(inputs[self.ids_inputs[1]]), encoded, src_mask=src != 0), encoded]
+
+    def predict_next(self, inputs):
+        # As in model_next, the preprocessed input is not masked
+        encoded = inputs['preprocessed_input']
+        return [self.decode(np.asarray(inputs[self.ids_inputs_next[0]]), encoded), encoded]
+
+
+class NumpyAttentionRNNEncoderDecoder(NumpyTranslationModel):
+    """
+    NumPy inference of the AttentionRNNEncoderDecoder model (see TranslationModel.AttentionRNNEncoderDecoder). Only the
+    additive ('add') attention is implemented.
+    """
+
+    def set_ids(self):
+        super(NumpyAttentionRNNEncoderDecoder, self).set_ids()
+        self.lstm = 'LSTM' in self.params['DECODER_RNN_TYPE']
+        for n_state in range(self.params['N_LAYERS_DECODER']):
+            self.ids_outputs_init.append('next_state_' + str(n_state))
+            self.ids_inputs_next.append('prev_state_' + str(n_state))
+            self.ids_outputs_next.append('next_state_' + str(n_state))
+            self.matchings_init_to_next['next_state_' + str(n_state)] = 'prev_state_' + str(n_state)
+            self.matchings_next_to_next['next_state_' + str(n_state)] = 'prev_state_' + str(n_state)
+        if self.lstm:
+            for n_memory in range(self.params['N_LAYERS_DECODER']):
+                self.ids_outputs_init.append('next_memory_' + str(n_memory))
+                self.ids_inputs_next.append('prev_memory_' + str(n_memory))
+                self.ids_outputs_next.append('next_memory_' + str(n_memory))
+                self.matchings_init_to_next['next_memory_' + str(n_memory)] = 'prev_memory_' + str(n_memory)
+                self.matchings_next_to_next['next_memory_' + str(n_memory)] = 'prev_memory_' + str(n_memory)
+
+    def recurrent(self, name, x):
+        """
+        Applies a (GRU, LSTM, CuDNNGRU, CuDNNLSTM or Bidirectional) encoder layer to a sequence.
+        """
+        layer = self.layers[name]
+        weights = self.layer_weights(name)
+        if layer['class_name'] == 'Bidirectional':
+            # The weights of the forward layer are stored before those of the backward layer
+            half = len(weights) // 2
+            forward = self.apply_recurrent(layer['config']['layer'], x, weights[:half])
+            backward = self.apply_recurrent(layer['config']['layer'], x, weights[half:], go_backwards=True)
+            merge_mode = layer['config'].get('merge_mode', 'concat')
+            if merge_mode == 'concat':
+                return np.concatenate([forward, backward], axis=-1)
+            elif merge_mode == 'sum':
+                return forward + backward
+            elif merge_mode == 'ave':
+                return (forward + backward) / 2.
+            elif merge_mode == 'mul':
+                return forward * backward
+            raise NotImplementedError('Bidirectional merge mode "%s" is not implemented.' % str(merge_mode))
+        return self.apply_recurrent(layer, x, weights)
+
+    def apply_recurrent(self, layer, x, weights, go_backwards=False):
+        config = layer['config']
+        kernel, recurrent_kernel = weights[0], weights[1]
+        bias = weights[2] if len(weights) > 2 else np.zeros(kernel.shape[1], dtype='float32')
+        go_backwards = go_backwards != config.get('go_backwards', False)
+        if layer['class_name'].startswith('CuDNN'):
+            activation, recurrent_activation = np.tanh, sigmoid
+        else:
+            activation = get_activation(config.get('activation', 'tanh'))
+            recurrent_activation = get_activation(config.get('recurrent_activation', 'hard_sigmoid'))
+        if layer['class_name'] in ['LSTM', 'CuDNNLSTM']:
+            if bias.shape[-1] != kernel.shape[1]:
+                bias = bias[:kernel.shape[1]] + bias[kernel.shape[1]:]
+            return lstm(np.dot(x, kernel) + bias, recurrent_kernel, activation, recurrent_activation,
+                        go_backwards=go_backwards)[0]
+        elif layer['class_name'] in ['GRU', 'CuDNNGRU']:
+            recurrent_bias = None
+            if layer['class_name'] == 'CuDNNGRU' or config.get('reset_after', False):
+                bias = bias.reshape(2, -1)
+                bias, recurrent_bias = bias[0], bias[1]
+            return gru(np.dot(x, kernel) + bias, recurrent_kernel, activation, recurrent_activation,
+                       recurrent_bias=recurrent_bias, go_backwards=go_backwards)[0]
+        raise NotImplementedError('Layer "%s" is not implemented in the NumPy inference.' % layer['class_name'])
+
+    def encode(self, src):
+        """
+        Computes the (masked) annotations of the source sentences, as the encoder does: the RNNs are not masked.
+        """
+        params = self.params
+        x = self.embedding('source_word_embedding', src)
+        if params.get('SCALE_SOURCE_WORD_EMBEDDINGS', False):
+            x = x * np.sqrt(params['SOURCE_TEXT_EMBEDDING_SIZE'])
+        x = self.regularize('src_embedding', x)
+        rnn_types = ['bidirectional_encoder_' + params['ENCODER_RNN_TYPE'], 'encoder_' + params['ENCODER_RNN_TYPE']]
+        rnn_type = [name for name in self.layers if name in rnn_types][0]
+        annotations = self.regularize('annotations', self.recurrent(rnn_type, x))
+        for n_layer in range(1, params['N_LAYERS_ENCODER']):
+            if params['BIDIRECTIONAL_DEEP_ENCODER']:
+                current_annotations = self.recurrent('bidirectional_encoder_' + str(n_layer), annotations)
+                residual = not (n_layer == 1 and not params['BIDIRECTIONAL_ENCODER'])
+            else:
+                current_annotations = self.recurrent('encoder_' + str(n_layer), annotations)
+                residual = not (n_layer == 1 and params['BIDIRECTIONAL_ENCODER'])
+            current_annotations = self.regularize('annotations_' + str(n_layer), current_annotations)
+            annotations = annotations + current_annotations if residual else current_annotations
+        return annotations * (src != 0)[:, :, None]
+
+    def initial_states(self, annotations, src_mask):
+        """
+        Initial states (and memories) of the decoder, from the mean of the annotations.
+        """
+        params = self.params
+        n_samples = annotations.shape[0]
+        if not params['INIT_LAYERS']:
+            zeros = np.zeros((n_samples, params['DECODER_HIDDEN_SIZE']), dtype='float32')
+            return zeros, zeros
+        mask = src_mask[:, :, None].astype('float32')
+        ctx_mean = np.sum(annotations * mask, axis=1) / np.maximum(np.sum(mask, axis=1), 1.)
+        for n_layer_init in range(len(params['INIT_LAYERS']) - 1):
+            ctx_mean = self.regularize('ctx' + str(n_layer_init), self.dense('init_layer_%d' % n_layer_init, ctx_mean))
+        initial_state = self.regularize('initial_state', self.dense('initial_state', ctx_mean))
+        initial_memory = None
+        if self.lstm:
+            initial_memory = self.regularize('initial_memory', self.dense('initial_memory', ctx_mean))
+        return initial_state, initial_memory
+
+    def conditional_rnn(self, name, x, context, h, c=None, context_mask=None):
+        """
+        Applies a conditional decoder layer (AttGRUCond, AttLSTMCond, GRUCond or LSTMCond). The attentional layers
+        attend to the context (batch, context_time, dim) at each step; the rest receive a context for each time-step
+        (batch, time, dim).
+
+        :return: Outputs (batch, time, units), contexts (batch, time, dim), alphas (batch, time, context_time), last
+                 state, last memory.
+        """
+        config = self.layer_config(name)
+        weights = self.weights[name]
+        attention = 'attention_context_kernel' in weights
+        if attention and config.get('attention_mode', 'add') != 'add':
+            raise NotImplementedError('Attention mode "%s" is not implemented.' % config['attention_mode'])
+        activation = get_activation(config.get('activation', 'tanh'))
+        recurrent_activation = get_activation(config.get('recurrent_activation', 'sigmoid'))
+        inputs = np.dot(x, weights['kernel']) + weights.get('bias', 0.)
+        n_samples, n_steps = inputs.shape[:2]
+        units = weights['recurrent_kernel'].shape[0]
+        outputs = np.zeros((n_samples, n_steps, units), dtype='float32')
+        contexts = np.zeros((n_samples, n_steps, context.shape[-1]), dtype='float32')
+        alphas = np.zeros((n_samples, n_steps, context.shape[1] if attention else 0), dtype='float32')
+        if attention:
+            projected_context = np.dot(context, weights['attention_context_kernel']) + weights.get('bias_ba', 0.)
+            wa = weights['attention_context_wa'].reshape(weights['attention_context_wa'].shape[0], -1)
+        c = np.zeros_like(h) if c is None and self.lstm else c
+        for t in range(n_steps):
+            if attention:
+                energies = np.dot(np.tanh(projected_context + np.dot(h, weights['attention_recurrent_kernel'])[:, None]),
+                                  wa).reshape(n_samples, -1) + weights.get('bias_ca', 0.)
+                if context_mask is not None:
+                    energies = energies * context_mask
+                alphas[:, t] = softmax(energies)
+                contexts[:, t] = np.sum(context * alphas[:, t, :, None], axis=1)
+            else:
+                contexts[:, t] = context[:, t]
+            x_t = inputs[:, t] + np.dot(contexts[:, t], weights['conditional_kernel'])
+            if self.lstm:
+                z = x_t + np.dot(h, weights['recurrent_kernel'])
+                i = recurrent_activation(z[:, :units])
+                f = recurrent_activation(z[:, units:2 * units])
+                c = f * c + i * activation(z[:, 2 * units:3 * units])
+                h = recurrent_activation(z[:, 3 * units:]) * activation(c)
+            else:
+                h = gru_step(x_t, h, weights['recurrent_kernel'], activation, recurrent_activation)
+            outputs[:, t] = h
+        return outputs, contexts, alphas, h, c
+
+    def decode(self, next_words, annotations, states, memories, context_mask=None):
+        """
+        Decodes the next words, from the annotations and the previous states (and memories) of each decoder layer.
+
+        :return: Probabilities, states, memories and alphas (time-major, as the model outputs them).
+        """
+        params = self.params
+        state_below = self.embedding(self.target_embedding_name(), next_words)
+        if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
+            state_below = state_below * np.sqrt(params['TARGET_TEXT_EMBEDDING_SIZE'])
+        state_below = self.regularize('state_below', state_below)
+
+        proj_h, x_att, alphas, h, c = self.conditional_rnn('decoder_Att' + params['DECODER_RNN_TYPE'] + 'Cond',
+                                                           state_below, annotations, states[0],
+                                                           c=memories[0] if self.lstm else None,
+                                                           context_mask=context_mask)
+        next_states, next_memories = [h], [c]
+        proj_h = self.regularize('proj_h0', proj_h)
+        for n_layer in range(1, params['N_LAYERS_DECODER']):
+            current_proj_h, _, _, h, c = self.conditional_rnn(
+                'decoder_' + params['DECODER_RNN_TYPE'].replace('Conditional', '') + 'Cond' + str(n_layer),
+                proj_h, x_att, states[n_layer], c=memories[n_layer] if self.lstm else None)
+            next_states.append(h)
+            next_memories.append(c)
+            proj_h = proj_h + self.regularize('proj_h' + str(n_layer), current_proj_h)
+
+        skip_vectors = [self.regularize('out_layer_mlp', self.dense('logit_lstm', proj_h)),
+                        self.regularize('out_layer_ctx', self.dense('logit_ctx', x_att)),
+                        self.regularize('out_layer_emb', self.dense('logit_emb', state_below))]
+        merge_mode = params['ADDITIONAL_OUTPUT_MERGE_MODE']
+        if merge_mode == 'Add':
+            out_layer = sum(skip_vectors)
+        elif merge_mode == 'Average':
+            out_layer = sum(skip_vectors) / len(skip_vectors)
+        elif merge_mode == 'Multiply':
+            out_layer = skip_vectors[0] * skip_vectors[1] * skip_vectors[2]
+        elif merge_mode == 'Maximum':
+            out_layer = np.maximum(np.maximum(skip_vectors[0], skip_vectors[1]), skip_vectors[2])
+        elif merge_mode == 'Concatenate':
+            out_layer = np.concatenate(skip_vectors, axis=-1)
+        else:
+            raise NotImplementedError('Merge mode "%s" is not implemented.' % merge_mode)
+        out_layer = get_activation(params.get('SKIP_VECTORS_SHARED_ACTIVATION', 'tanh'))(out_layer)
+        return self.output_layer(out_layer), next_states, next_memories, alphas.transpose(1, 0, 2)
+
+    def outputs(self, probs, annotations, states, memories, alphas):
+        outputs = [probs, annotations] + states
+        if self.lstm:
+            outputs += memories
+        if self.return_alphas:
+            outputs.append(alphas)
+        return outputs
+
+    def predict_init(self, inputs):
+        src = np.asarray(inputs[self.ids_inputs[0]])
+        src_mask = src != 0
+        annotations = self.encode(src)
+        initial_state, initial_memory = self.initial_states(annotations, src_mask)
+        n_layers = self.params['N_LAYERS_DECODER']
+        probs, states, memories, alphas = self.decode(np.asarray(inputs[self.ids_inputs[1]]), annotations,
+                                                      [initial_state] * n_layers, [initial_memory] * n_layers,
+                                                      context_mask=src_mask)
+        return self.outputs(probs, annotations, states, memories, alphas)
+
+    def predict_next(self, inputs):
+        # As in model_next, the preprocessed input is not masked
+        annotations = inputs['preprocessed_input']
+        n_layers = self.params['N_LAYERS_DECODER']
+        states = [inputs['prev_state_' + str(n_layer)] for n_layer in range(n_layers)]
+        memories = [inputs['prev_memory_' + str(n_layer)] for n_layer in range(n_layers)] if self.lstm \
+            else [None] * n_layers
+        probs, states, memories, alphas = self.decode(np.asarray(inputs[self.ids_inputs_next[0]]), annotations,
+                                                      states, memories)
+        return self.outputs(probs, annotations, states, memories, alphas)
+
+
+NUMPY_MODELS = {'Transformer': NumpyTransformer,
+                'AttentionRNNEncoderDecoder': NumpyAttentionRNNEncoderDecoder,
+                'GroundHogModel': NumpyAttentionRNNEncoderDecoder}
+
+
+def load_numpy_model(params, model_path, cache_dequantized=True):
+    """
+    Loads a stored model for the NumPy inference.
+
+    :param dict params: Parameters of the model (config.pkl stored with the model).
+    :param str model_path: Path to the stored model (e.g. trained_models/model/epoch_1).
+    :param bool cache_dequantized: Whether the int8 weights keep their dequantized copy (see QuantizedMatrix).
+    :return: NumpyTranslationModel instance.
+    """
+    if params['MODEL_TYPE'] not in NUMPY_MODELS:
+        raise NotImplementedError('The NumPy inference of "%s" models is not implemented. Available models: %s' %
+                                  (params['MODEL_TYPE'], ', '.join(sorted(NUMPY_MODELS))))
+    logger.info('<<< Loading ' + params['MODEL_TYPE'] + ' model from ' + model_path + ' for the NumPy inference >>>')
+    model = NUMPY_MODELS[params['MODEL_TYPE']](params, model_path)
+    for layer_weights in model.weights.values():
+        for weight in layer_weights.values():
+            if isinstance(weight, QuantizedMatrix):
+                weight.cache = cache_dequantized
+    return model
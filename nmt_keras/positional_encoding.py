@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from keras import backend as K
+from keras.layers import Layer
+from nmt_keras.helpers import positional_encoding_constants
+
+
+class SinusoidalPositionalEncoding(Layer):
+    """
+    Sinusoidal positional encodings of the Transformer models, computed on the fly from the positions given by a
+    PositionLayer, so they have no maximum length and are not stored with the model. It is equivalent to an Embedding
+    whose (non-trainable) weights are the encodings given by getPositionalEncodingWeights.
+    """
+
+    def __init__(self, output_dim, **kwargs):
+        """
+        :param int output_dim: Dimension of the encodings.
+        """
+        super(SinusoidalPositionalEncoding, self).__init__(**kwargs)
+        self.output_dim = output_dim
+
+    def call(self, inputs, mask=None):
+        inverse_frequencies, sine = positional_encoding_constants(self.output_dim)
+        angles = K.expand_dims(K.cast(inputs, K.floatx())) * K.constant(inverse_frequencies)
+        sine = K.constant(sine.astype(K.floatx()))
+        return sine * K.sin(angles) + (1. - sine) * K.cos(angles)
+
+    def compute_mask(self, inputs, mask=None):
+        return None
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape) + (self.output_dim,)
+
+    def get_config(self):
+        config = {'output_dim': self.output_dim}
+        base_config = super(SinusoidalPositionalEncoding, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
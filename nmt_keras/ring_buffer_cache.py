@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from keras import backend as K
+from keras import initializers
+from keras.layers import Layer
+
+
+class RingBufferCache(Layer):
+    """
+    Cache of annotations for TransformerCache, stored in a preallocated ring buffer of cache_size entries.
+
+    The layer takes a list [annotations, source text], with shapes (batch, time, dim) and (batch, time), and returns
+    the annotations followed by the cache entries: all of them or, with top_k, the k entries most similar (dot
+    product) to the average annotation of each sentence, gathered from the buffer. The entries which were never written
+    or which were inserted more than `patience` annotations ago are masked (and zeroed).
+
+    The annotations of the non-padded source words are then inserted into the buffer, overwriting the oldest entries.
+    The insertion is a scatter update of the written entries, applied after the cache is read: a batch does not
+    retrieve its own annotations. As the layer is stateful, the cache is also updated when predicting; its state is
+    stored with the model and reset by reset_states.
+
+    With n_rows, each batch row has its own cache (e.g. when each row follows a document, see document_batches): the
+    entries are tagged with the row which inserted them, and a row only reads its own entries inserted after its last
+    reset_rows. The rows share the buffer, so each of them keeps about cache_size / n_rows entries. Row i of a batch
+    is the cache row i % n_rows.
+    """
+
+    def __init__(self, cache_size, patience, top_k=0, n_rows=0, **kwargs):
+        """
+        :param int cache_size: Number of entries of the buffer.
+        :param int patience: Number of insertions after which an entry is evicted. If 0, the entries are only evicted
+                             when they are overwritten.
+        :param int top_k: Number of retrieved entries. If 0, all the entries are returned.
+        :param int n_rows: Number of rows with their own cache. If 0, the cache is shared by all the rows.
+        """
+        super(RingBufferCache, self).__init__(**kwargs)
+        if top_k > cache_size:
+            raise ValueError('The number of retrieved entries (%d) is larger than the cache (%d).' %
+                             (top_k, cache_size))
+        self.cache_size = cache_size
+        self.patience = patience
+        self.top_k = top_k
+        self.n_rows = n_rows
+        self.stateful = True
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        self.dim = input_shape[0][-1]
+        self.memory = self.add_weight(shape=(self.cache_size, self.dim), initializer='zeros', trainable=False,
+                                      name='memory')
+        # Number of annotations inserted before each entry (-1: empty) and in total
+        self.positions = self.add_weight(shape=(self.cache_size,), initializer=initializers.Constant(-1),
+                                         dtype='int32', trainable=False, name='positions')
+        self.n_inserted = self.add_weight(shape=(), initializer='zeros', dtype='int32', trainable=False,
+                                          name='n_inserted')
+        if self.n_rows:
+            # Row which inserted each entry (-1: empty) and number of annotations inserted before the last reset of
+            # each row
+            self.entry_rows = self.add_weight(shape=(self.cache_size,), initializer=initializers.Constant(-1),
+                                              dtype='int32', trainable=False, name='entry_rows')
+            self.row_starts = self.add_weight(shape=(self.n_rows,), initializer='zeros', dtype='int32',
+                                              trainable=False, name='row_starts')
+        super(RingBufferCache, self).build(input_shape)
+
+    def valid_entries(self, positions, n_inserted):
+        """
+        Mask (cache_size,) of the entries which are not empty nor evicted.
+        """
+        valid = K.cast(K.greater_equal(positions, 0), K.floatx())
+        if self.patience:
+            valid *= K.cast(K.less_equal(n_inserted - positions, self.patience), K.floatx())
+        return valid
+
+    def row_entries(self, rows, positions, entry_rows, row_starts):
+        """
+        Mask (batch, cache_size) of the entries inserted by each row after its last reset.
+        """
+        return K.cast(K.equal(K.expand_dims(entry_rows, 0), K.expand_dims(rows)), K.floatx()) * \
+            K.cast(K.greater_equal(K.expand_dims(positions, 0), K.expand_dims(K.gather(row_starts, rows))),
+                   K.floatx())
+
+    def retrieve(self, annotations, src_text, memory, valid):
+        """
+        Cache entries read by each sentence and their mask: (batch, entries, dim) and (batch, entries).
+        """
+        if not self.top_k:
+            batch_size = K.shape(annotations)[0]
+            return K.tile(K.expand_dims(memory, 0), [batch_size, 1, 1]), valid
+        import tensorflow as tf
+        src_mask = K.expand_dims(K.cast(K.not_equal(src_text, 0), K.floatx()))
+        queries = K.sum(annotations * src_mask, axis=1) / K.maximum(K.sum(src_mask, axis=1), 1.)
+        scores = K.dot(queries, K.transpose(memory)) - 1e9 * (1. - valid)
+        _, indices = tf.nn.top_k(scores, k=self.top_k)
+        # The mask of each row is gathered from its own row of valid
+        batch_size = K.shape(annotations)[0]
+        valid_indices = indices + K.expand_dims(K.arange(0, batch_size, dtype='int32') * self.cache_size)
+        return K.gather(memory, indices), K.gather(K.reshape(valid, (-1,)), valid_indices)
+
+    def insert(self, annotations, src_text, n_inserted, rows=None):
+        """
+        Updates of the buffer which insert the annotations of the non-padded words, in order.
+        """
+        inserted = K.cast(K.reshape(K.not_equal(src_text, 0), (-1,)), 'int32')
+        # Index of each vector among the inserted ones: only the last cache_size ones remain in the buffer, so their
+        # entries are different
+        order = K.cumsum(inserted) - 1
+        n_new = K.sum(inserted)
+        written = nonzero(inserted * K.cast(K.greater_equal(order, n_new - self.cache_size), 'int32'))
+        new_positions = K.gather(n_inserted + order, written)
+        slots = new_positions % self.cache_size
+        updates = [scatter_update(self.memory, slots, K.gather(K.reshape(annotations, (-1, self.dim)), written)),
+                   scatter_update(self.positions, slots, new_positions),
+                   assign(self.n_inserted, n_inserted + n_new)]
+        if self.n_rows:
+            vector_rows = K.reshape(K.tile(K.expand_dims(rows), [1, K.shape(src_text)[1]]), (-1,))
+            updates.append(scatter_update(self.entry_rows, slots, K.gather(vector_rows, written)))
+        return updates
+
+    def call(self, inputs, mask=None):
+        annotations, src_text = inputs
+        # The cache is read once, before the insertion
+        memory, positions, n_inserted = [K.identity(weight)
+                                         for weight in [self.memory, self.positions, self.n_inserted]]
+        batch_size = K.shape(annotations)[0]
+        valid = K.tile(K.expand_dims(self.valid_entries(positions, n_inserted), 0), [batch_size, 1])
+        rows = None
+        if self.n_rows:
+            rows = K.arange(0, batch_size, dtype='int32') % self.n_rows
+            valid *= self.row_entries(rows, positions, K.identity(self.entry_rows), K.identity(self.row_starts))
+        entries, self.entries_mask = self.retrieve(annotations, src_text, memory, valid)
+        outputs = K.concatenate([annotations, entries * K.expand_dims(self.entries_mask)], axis=1)
+        if K.backend() == 'tensorflow':
+            # The variables are updated in place: the updates must wait for the retrieval
+            import tensorflow as tf
+            with tf.control_dependencies([outputs]):
+                updates = self.insert(annotations, src_text, n_inserted, rows=rows)
+        else:
+            updates = self.insert(annotations, src_text, n_inserted, rows=rows)
+        self.add_update(updates, inputs)
+        return outputs
+
+    def compute_mask(self, inputs, mask=None):
+        # Called after call, which computes the mask of the retrieved entries
+        if mask is None or mask[0] is None:
+            return None
+        return K.concatenate([K.cast(mask[0], 'bool'), K.cast(self.entries_mask, 'bool')], axis=1)
+
+    def compute_output_shape(self, input_shape):
+        annotations_shape = input_shape[0]
+        length = annotations_shape[1] + (self.top_k or self.cache_size) if annotations_shape[1] is not None else None
+        return (annotations_shape[0], length, annotations_shape[2])
+
+    def reset_states(self):
+        values = [(self.memory, K.get_value(self.memory) * 0.),
+                  (self.positions, K.get_value(self.positions) * 0 - 1),
+                  (self.n_inserted, 0)]
+        if self.n_rows:
+            values += [(self.entry_rows, K.get_value(self.entry_rows) * 0 - 1),
+                       (self.row_starts, K.get_value(self.row_starts) * 0)]
+        K.batch_set_value(values)
+
+    def reset_rows(self, rows):
+        """
+        Empties the cache of some rows (e.g. when they start a new document): they will only read the entries inserted
+        from now on.
+
+        :param list rows: Indices of the rows.
+        :return: None
+        """
+        if not self.n_rows:
+            raise ValueError('The cache is shared by all the rows: it can only be reset with reset_states.')
+        row_starts = K.get_value(self.row_starts)
+        row_starts[[row % self.n_rows for row in rows]] = K.get_value(self.n_inserted)
+        K.set_value(self.row_starts, row_starts)
+
+    def get_config(self):
+        config = {'cache_size': self.cache_size,
+                  'patience': self.patience,
+                  'top_k': self.top_k,
+                  'n_rows': self.n_rows}
+        base_config = super(RingBufferCache, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+def nonzero(x):
+    """
+    Indices of the non-zero elements of a vector.
+    """
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+        return K.cast(tf.where(K.not_equal(x, 0))[:, 0], 'int32')
+    return x.nonzero()[0]
+
+
+def scatter_update(variable, indices, values):
+    """
+    Update of a variable which writes values into its rows at some (different) indices.
+    """
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+        return tf.scatter_update(variable, indices, values)
+    import theano.tensor as T
+    return variable, T.set_subtensor(variable[indices], values)
+
+
+def assign(variable, value):
+    """
+    Update of a variable which assigns it a value.
+    """
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+        return tf.assign(variable, value)
+    return variable, value
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from keras import backend as K
+from keras.layers import Layer
+
+
+class SampledSoftmaxOutput(Layer):
+    """
+    Training-time replacement of the output softmax layer (see sampled_softmax_loss).
+    It holds the weights of the output layer (kernel and bias), but returns its input untouched: the loss only
+    computes the output projection for the target words and a set of sampled words.
+
+    The weights have the same shapes and order as the ones from the full output layer, so models trained with this
+    layer can be reloaded with a full softmax (e.g. for decoding) and vice versa.
+    """
+
+    def __init__(self, units, output_layer=None, **kwargs):
+        """
+        :param int units: Output vocabulary size.
+        :param output_layer: Full output layer (Dense or TimeDistributed(Dense)) whose weights are shared.
+                             If None, the layer creates its own weights (e.g. when deserializing a stored model).
+        """
+        super(SampledSoftmaxOutput, self).__init__(**kwargs)
+        self.units = units
+        self.output_layer = output_layer
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        if self.output_layer is not None:
+            if not self.output_layer.built:
+                self.output_layer.build(input_shape)
+            self._trainable_weights = list(self.output_layer.trainable_weights)
+            self._non_trainable_weights = list(self.output_layer.non_trainable_weights)
+            self.add_loss(self.output_layer.losses)
+        else:
+            self.add_weight(shape=(input_shape[-1], self.units), initializer='glorot_uniform', name='kernel')
+            self.add_weight(shape=(self.units,), initializer='zeros', name='bias')
+        super(SampledSoftmaxOutput, self).build(input_shape)
+
+    def call(self, inputs, mask=None):
+        return inputs
+
+    def compute_mask(self, inputs, mask=None):
+        return mask
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = {'units': self.units}
+        base_config = super(SampledSoftmaxOutput, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+def sampler_parameters(num_sampled, n_classes, unigram_counts=None):
+    """
+    Adapts the parameters of the candidate sampler to the vocabulary, since sampling without replacement fails when
+    there are fewer candidates than sampled words:
+        * The unigram counts are add-one smoothed, so every word (including the unseen ones) can be sampled.
+        * The number of sampled words is clamped to the vocabulary size.
+
+    :param int num_sampled: Number of words sampled at each batch.
+    :param int n_classes: Output vocabulary size.
+    :param unigram_counts: Counts of each word of the target vocabulary.
+    :return: Tuple (num_sampled, unigrams). unigrams is None if unigram_counts is None.
+    """
+    unigrams = [int(count) + 1 for count in unigram_counts] if unigram_counts is not None else None
+    return min(num_sampled, n_classes), unigrams
+
+
+def sampled_softmax_loss(output_layer, num_sampled, unigram_counts=None, sparse_targets=False):
+    """
+    Builds a sampled softmax loss (Jean et al., 2015), computed from the output of a SampledSoftmaxOutput layer.
+    The negative words are sampled from the (smoothed) unigram distribution of the target words. If it is not
+    available, from a log-uniform (Zipfian) distribution, which approximates it, since the vocabulary is sorted by
+    frequency. At most, the whole vocabulary is sampled (see sampler_parameters).
+    Only available for the Tensorflow backend.
+
+    :param SampledSoftmaxOutput output_layer: Output layer of the training model.
+    :param int num_sampled: Number of words sampled at each batch.
+    :param unigram_counts: Counts of each word of the target vocabulary.
+    :param bool sparse_targets: Whether the targets are word indices, instead of one-hot vectors.
+    :return: Keras loss function.
+    """
+    import tensorflow as tf
+    n_classes = output_layer.units
+    num_sampled, unigrams = sampler_parameters(num_sampled, n_classes, unigram_counts=unigram_counts)
+
+    def loss(y_true, y_pred):
+        kernel, bias = output_layer.weights[:2]
+        if sparse_targets:
+            labels = K.reshape(K.cast(y_true, 'int64'), (-1, 1))
+        else:
+            labels = K.reshape(K.cast(K.argmax(y_true, axis=-1), 'int64'), (-1, 1))
+        if unigrams is not None:
+            sampled_values = tf.nn.fixed_unigram_candidate_sampler(true_classes=labels,
+                                                                   num_true=1,
+                                                                   num_sampled=num_sampled,
+                                                                   unique=True,
+                                                                   range_max=n_classes,
+                                                                   unigrams=unigrams)
+        else:
+            sampled_values = tf.nn.log_uniform_candidate_sampler(true_classes=labels,
+                                                                 num_true=1,
+                                                                 num_sampled=num_sampled,
+                                                                 unique=True,
+                                                                 range_max=n_classes)
+        losses = tf.nn.sampled_softmax_loss(weights=K.transpose(kernel),
+                                            biases=bias,
+                                            labels=labels,
+                                            inputs=K.reshape(y_pred, (-1, K.int_shape(y_pred)[-1])),
+                                            num_sampled=num_sampled,
+                                            num_classes=n_classes,
+                                            sampled_values=sampled_values,
+                                            remove_accidental_hits=True)
+        return K.reshape(losses, K.shape(y_pred)[:-1])
+
+    return loss
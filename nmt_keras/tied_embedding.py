@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import numpy as np
+from keras import backend as K
+from keras.layers import Embedding
+
+
+class TiedEmbedding(Embedding):
+    """
+    Embedding layer whose (transposed) embeddings are also the kernel of the output layer of the model
+    (Press and Wolf, 2017). Called on a 2D tensor of word indices, it returns their embeddings. Called on a 3D tensor
+    of vectors (the input of the output layer), it returns their dot product with the embedding of each word, plus a
+    bias: the logits of the output softmax.
+
+    The layer has an additional weight (the output bias), so pretrained embeddings ('weights' argument) are completed
+    with a zero bias.
+    """
+
+    def __init__(self, input_dim, output_dim, **kwargs):
+        weights = kwargs.get('weights')
+        if weights is not None and len(weights) == 1:
+            kwargs['weights'] = list(weights) + [np.zeros(input_dim)]
+        super(TiedEmbedding, self).__init__(input_dim, output_dim, **kwargs)
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        super(TiedEmbedding, self).build(input_shape)
+        self.output_bias = self.add_weight(shape=(self.input_dim,), initializer='zeros', name='output_bias')
+
+    def call(self, inputs):
+        if K.ndim(inputs) == 3:
+            return K.bias_add(K.dot(inputs, K.transpose(self.embeddings)), self.output_bias)
+        return super(TiedEmbedding, self).call(inputs)
+
+    def compute_mask(self, inputs, mask=None):
+        if K.ndim(inputs) == 3:
+            return mask
+        return super(TiedEmbedding, self).compute_mask(inputs, mask)
+
+    def compute_output_shape(self, input_shape):
+        if len(input_shape) == 3:
+            if input_shape[-1] is not None and input_shape[-1] != self.output_dim:
+                raise ValueError('The input of the output layer has size %d, but the embeddings tied to it have size '
+                                 '%d.' % (input_shape[-1], self.output_dim))
+            return tuple(input_shape[:-1]) + (self.input_dim,)
+        return super(TiedEmbedding, self).compute_output_shape(input_shape)
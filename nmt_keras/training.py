@@ -1,17 +1,115 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import math
+import multiprocessing
+import os
+import random
+from itertools import islice
+import numpy as np
 from six import iteritems
 from timeit import default_timer as timer
 import logging
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 logger = logging.getLogger(__name__)
 
-from data_engine.prepare_data import build_dataset, update_dataset_from_file
-from keras_wrapper.cnn_model import updateModel
+from data_engine.prepare_data import build_dataset, get_unigram_counts, update_dataset_from_file
+from keras.callbacks import CallbackList
+from keras_wrapper.cnn_model import saveModel, updateModel
 from keras_wrapper.dataset import loadDataset, saveDataset
+from keras_wrapper.extra.callbacks import LearningRateReducer
 from keras_wrapper.extra.read_write import dict2pkl
 from nmt_keras.model_zoo import TranslationModel
 from nmt_keras.build_callbacks import buildCallbacks
+from nmt_keras.callbacks import EpochShuffler, ExponentialMovingAverage, StoreTrainingState, get_trained_model, \
+    load_training_state, restore_training_state
+from nmt_keras.data_parallel import DataParallelTrainer, TRANSPORTS, shard_batches
+from nmt_keras.document_batches import document_batches, document_boundaries, load_document_lengths
+
+
+def set_model_mappings(nmt_model, dataset, params):
+    """
+    Defines the inputs and outputs mapping from a Dataset instance to a model.
+
+    :param Model_Wrapper nmt_model: Model instance.
+    :param Dataset dataset: Dataset instance.
+    :param dict params: Dictionary of network hyperparameters.
+    :return: None
+    """
+    inputMapping = dict()
+    for i, id_in in enumerate(params['INPUTS_IDS_DATASET']):
+        pos_source = dataset.ids_inputs.index(id_in)
+        id_dest = nmt_model.ids_inputs[i]
+        inputMapping[id_dest] = pos_source
+    nmt_model.setInputsMapping(inputMapping)
+
+    outputMapping = dict()
+    for i, id_out in enumerate(params['OUTPUTS_IDS_DATASET']):
+        pos_target = dataset.ids_outputs.index(id_out)
+        id_dest = nmt_model.ids_outputs[i]
+        outputMapping[id_dest] = pos_target
+    nmt_model.setOutputsMapping(outputMapping)
+
+
+def build_lr_reducer(params):
+    """
+    Builds the learning rate reducer callback from the LR_* parameters.
+
+    :param dict params: Dictionary of network hyperparameters.
+    :return: LearningRateReducer instance.
+    """
+    return LearningRateReducer(initial_lr=params.get('LR', 1.0),
+                               reduce_rate=params.get('LR_GAMMA', 0.9),
+                               reduce_frequency=params['LR_DECAY'],
+                               reduce_each_epochs=params.get('LR_REDUCE_EACH_EPOCHS', True),
+                               start_reduction_on_epoch=params.get('LR_START_REDUCTION_ON_EPOCH', 0),
+                               exp_base=params.get('LR_REDUCER_EXP_BASE', 0),
+                               half_life=params.get('LR_HALF_LIFE', 50000),
+                               warmup_exp=params.get('WARMUP_EXP', -1.5),
+                               reduction_function=params.get('LR_REDUCER_TYPE', 'linear'),
+                               min_lr=params.get('MIN_LR', 1e-9),
+                               verbose=params['VERBOSE'])
+
+
+def store_epoch_model(nmt_model, params, epoch):
+    """
+    Stores the model at the end of an epoch of the training loops of this module, each EPOCHS_FOR_SAVE epochs.
+    With USE_EMA, the model is stored by a callback instead (see buildCallbacks), after the EMA weights are swapped in.
+
+    :param nmt_model: Trained TranslationModel.
+    :param dict params: Dictionary of network hyperparameters.
+    :param int epoch: Finished epoch.
+    :return: None
+    """
+    if not params.get('USE_EMA', False) and params['EPOCHS_FOR_SAVE'] > 0 and \
+            (epoch + 1) % params['EPOCHS_FOR_SAVE'] == 0:
+        saveModel(nmt_model, epoch + 1)
+
+
+def check_positional_encodings(params):
+    """
+    Models trained with previous versions store the positional encodings of the Transformer models as embedding
+    weights. When resuming the training of one of them, sets STORED_POSITIONAL_ENCODINGS, so the rebuilt model has the
+    same weights as the stored one.
+
+    :param dict params: Dictionary of network hyperparameters.
+    :return: None
+    """
+    import h5py
+    from nmt_keras.helpers import to_str
+    model_path = params['STORE_PATH'] + ('/epoch_' if params['RELOAD_EPOCH'] else '/update_') + str(params['RELOAD'])
+    if os.path.isfile(model_path + '.h5'):
+        weights_file, group_name = model_path + '.h5', 'model_weights'
+    elif os.path.isfile(model_path + '_weights.h5'):
+        weights_file, group_name = model_path + '_weights.h5', None
+    else:
+        return
+    with h5py.File(weights_file, 'r') as model_file:
+        group = model_file[group_name] if group_name else model_file
+        stored = any(to_str(name).startswith('positional_') and len(group[to_str(name)].attrs['weight_names']) > 0
+                     for name in group.attrs['layer_names'])
+    if stored and not params.get('STORED_POSITIONAL_ENCODINGS', False):
+        logging.info('The reloaded model stores its positional encodings: setting STORED_POSITIONAL_ENCODINGS = True.')
+        params['STORED_POSITIONAL_ENCODINGS'] = True
 
 
 def train_model(params, load_dataset=None):
@@ -27,6 +125,29 @@ def train_model(params, load_dataset=None):
     :return: None
     """
 
+    if params.get('DATA_PARALLEL_WORKERS', 1) > 1:
+        return train_model_data_parallel(params, load_dataset=load_dataset)
+    if params.get('DOCUMENT_BATCHES', False):
+        # The cache of each row is reset when it starts a new document, which the CacheLayer does not support. The
+        # training loop of the document batches does not split the batches across GPUs
+        if not params.get('RING_BUFFER_CACHE', False):
+            raise ValueError('DOCUMENT_BATCHES requires RING_BUFFER_CACHE.')
+        if params.get('N_GPUS', 1) > 1:
+            raise ValueError('DOCUMENT_BATCHES does not support multi-GPU training (N_GPUS > 1).')
+
+    if (params.get('SAVE_TRAINING_STATE', False) or params.get('RELOAD_TRAINING_STATE', False)) and \
+            params['PARALLEL_LOADERS'] > 1 and not params['HOMOGENEOUS_BATCHES']:
+        # The parallel loaders are forked with their own copy of the Dataset, which the EpochShuffler does not
+        # reorder, and return the batches in any order: the batches of an interrupted epoch cannot be rebuilt
+        raise ValueError('SAVE_TRAINING_STATE and RELOAD_TRAINING_STATE do not support PARALLEL_LOADERS > 1.')
+
+    training_state = None
+    if params.get('RELOAD_TRAINING_STATE', False):
+        training_state = load_training_state(params['STORE_PATH'] + '/training_state.pkl')
+        params['RELOAD'] = training_state['update']
+        params['RELOAD_EPOCH'] = False
+        params['EPOCH_OFFSET'] = training_state['epoch']
+
     if params['RELOAD'] > 0:
         logging.info('Resuming training.')
         # Load data
@@ -34,13 +155,17 @@ def train_model(params, load_dataset=None):
             if params['REBUILD_DATASET']:
                 logging.info('Rebuilding dataset.')
                 dataset = build_dataset(params)
+            elif params.get('DATASET_CACHE', False):
+                logging.info('Loading the cached dataset (updated if its files changed).')
+                dataset = build_dataset(params)
             else:
                 logging.info('Updating dataset.')
                 dataset = loadDataset(
                     params['DATASET_STORE_PATH'] + '/Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] +
                     params['TRG_LAN'] + '.pkl')
-                params['EPOCH_OFFSET'] = params['RELOAD'] if params['RELOAD_EPOCH'] else \
-                    int(params['RELOAD'] * params['BATCH_SIZE'] / dataset.len_train)
+                if training_state is None:
+                    params['EPOCH_OFFSET'] = params['RELOAD'] if params['RELOAD_EPOCH'] else \
+                        int(params['RELOAD'] * params['BATCH_SIZE'] / dataset.len_train)
                 for split, filename in iteritems(params['TEXT_FILES']):
                     dataset = update_dataset_from_file(dataset,
                                                        params['DATA_ROOT_PATH'] + '/' + filename + params['SRC_LAN'],
@@ -65,6 +190,11 @@ def train_model(params, load_dataset=None):
 
     params['INPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['INPUTS_IDS_DATASET'][0]]
     params['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['OUTPUTS_IDS_DATASET'][0]]
+    if params.get('SAMPLED_SOFTMAX', False):
+        params['TARGET_UNIGRAM_COUNTS'] = get_unigram_counts(dataset, params['OUTPUTS_IDS_DATASET'][0])
+
+    if params['RELOAD'] > 0:
+        check_positional_encodings(params)
 
     # Build model
     set_optimizer = True if params['RELOAD'] == 0 else False
@@ -81,21 +211,14 @@ def train_model(params, load_dataset=None):
                                  clear_dirs=clear_dirs)
 
     # Define the inputs and outputs mapping from our Dataset instance to our model
-    inputMapping = dict()
-    for i, id_in in enumerate(params['INPUTS_IDS_DATASET']):
-        pos_source = dataset.ids_inputs.index(id_in)
-        id_dest = nmt_model.ids_inputs[i]
-        inputMapping[id_dest] = pos_source
-    nmt_model.setInputsMapping(inputMapping)
+    set_model_mappings(nmt_model, dataset, params)
 
-    outputMapping = dict()
-    for i, id_out in enumerate(params['OUTPUTS_IDS_DATASET']):
-        pos_target = dataset.ids_outputs.index(id_out)
-        id_dest = nmt_model.ids_outputs[i]
-        outputMapping[id_dest] = pos_target
-    nmt_model.setOutputsMapping(outputMapping)
-
-    if params['RELOAD'] > 0:
+    if training_state is not None:
+        # Exact resume: weights, optimizer slots, learning rate and RNG states
+        nmt_model.setParams(params)
+        nmt_model.setOptimizer()
+        restore_training_state(nmt_model, training_state)
+    elif params['RELOAD'] > 0:
         nmt_model = updateModel(nmt_model, params['STORE_PATH'], params['RELOAD'], reload_epoch=params['RELOAD_EPOCH'])
         nmt_model.setParams(params)
         nmt_model.setOptimizer()
@@ -108,17 +231,48 @@ def train_model(params, load_dataset=None):
 
     # Callbacks
     callbacks = buildCallbacks(params, nmt_model, dataset)
+    shuffler = None
+    if (params.get('SAVE_TRAINING_STATE', False) or training_state is not None) and \
+            not params.get('DOCUMENT_BATCHES', False):
+        # Seeded shuffles of the training samples, so the batches of an interrupted epoch can be rebuilt
+        shuffle_seed = training_state.get('shuffle_seed') if training_state is not None else None
+        shuffler = EpochShuffler(dataset,
+                                 shuffle_seed if shuffle_seed is not None else random.randint(0, 2 ** 31 - 1),
+                                 epoch=params.get('EPOCH_OFFSET', 0))
+    for callback in callbacks:
+        if isinstance(callback, StoreTrainingState):
+            callback.shuffler = shuffler
+        if isinstance(callback, ExponentialMovingAverage) and training_state is not None and \
+                training_state.get('ema_weights') is not None:
+            callback.shadow_weights = training_state['ema_weights']
+    lr_decay = params.get('LR_DECAY', None)
+    if training_state is not None and lr_decay is not None:
+        # The learning rate schedule must continue from the stored update, instead of restarting.
+        callback_lr_reducer = build_lr_reducer(params)
+        callback_lr_reducer.current_update_nb = training_state['update']
+        callback_lr_reducer.epoch = training_state['epoch']
+        callbacks.append(callback_lr_reducer)
+        lr_decay = None
 
     # Training
     total_start_time = timer()
     logger.debug('Starting training!')
+    batch_in_epoch = training_state.get('batch_in_epoch', 0) if training_state is not None else 0
+    if batch_in_epoch > 0 and not params.get('DOCUMENT_BATCHES', False):
+        if training_state.get('shuffle_seed') is None:
+            logging.warning('The training state does not store the order of the training samples: '
+                            'the interrupted epoch is trained from its beginning.')
+        else:
+            train_interrupted_epoch(nmt_model, dataset, params, callbacks, shuffler, training_state['epoch'],
+                                    batch_in_epoch)
+            params['EPOCH_OFFSET'] = training_state['epoch'] + 1
     training_params = {'n_epochs': params['MAX_EPOCH'],
                        'batch_size': params['BATCH_SIZE'],
                        'sep': params.get('SEP', 0),
                        'homogeneous_batches': params['HOMOGENEOUS_BATCHES'],
                        'maxlen': params['MAX_OUTPUT_TEXT_LEN'],
                        'joint_batches': params['JOINT_BATCHES'],
-                       'lr_decay': params.get('LR_DECAY', None),  # LR decay parameters
+                       'lr_decay': lr_decay,  # LR decay parameters
                        'initial_lr': params.get('LR', 1.0),
                        'reduce_each_epochs': params.get('LR_REDUCE_EACH_EPOCHS', True),
                        'start_reduction_on_epoch': params.get('LR_START_REDUCTION_ON_EPOCH', 0),
@@ -127,7 +281,9 @@ def train_model(params, load_dataset=None):
                        'lr_reducer_exp_base': params.get('LR_REDUCER_EXP_BASE', 0),
                        'lr_half_life': params.get('LR_HALF_LIFE', 50000),
                        'lr_warmup_exp': params.get('WARMUP_EXP', -1.5),
-                       'epochs_for_save': params['EPOCHS_FOR_SAVE'],
+                       'min_lr': params.get('MIN_LR', 1e-9),
+                       # With EMA, the model is stored by a callback which runs after the EMA one (see buildCallbacks)
+                       'epochs_for_save': -1 if params.get('USE_EMA', False) else params['EPOCHS_FOR_SAVE'],
                        'verbose': params['VERBOSE'],
                        'eval_on_sets': params['EVAL_ON_SETS_KERAS'],
                        'n_parallel_loaders': params['PARALLEL_LOADERS'],
@@ -156,8 +312,252 @@ def train_model(params, load_dataset=None):
                                               'word_embeddings_labels': params.get('WORD_EMBEDDINGS_LABELS', None),
                                               }
                        }
-    nmt_model.trainNet(dataset, training_params)
+    if params.get('DOCUMENT_BATCHES', False):
+        train_document_batches(nmt_model, dataset, params, callbacks, lr_decay=lr_decay,
+                               update_offset=training_state['update'] if training_state is not None else 0,
+                               batch_in_epoch=batch_in_epoch)
+    else:
+        nmt_model.trainNet(dataset, training_params)
+
+    total_end_time = timer()
+    time_difference = total_end_time - total_start_time
+    logging.info('In total is {0:.2f}s = {1:.2f}m'.format(time_difference, time_difference / 60.0))
+
+
+def train_interrupted_epoch(nmt_model, dataset, params, callbacks, shuffler, epoch, batch_in_epoch):
+    """
+    Trains the rest of an epoch interrupted after batch_in_epoch batches (see StoreTrainingState), so the training
+    resumes exactly where its state was stored. The samples are put in the order of the epoch by the EpochShuffler and
+    only the batches which were not trained are loaded (see interrupted_epoch_batches).
+
+    :param nmt_model: TranslationModel to train.
+    :param dataset: Dataset instance.
+    :param dict params: Dictionary of network hyperparameters.
+    :param list callbacks: Callbacks (e.g. from buildCallbacks).
+    :param EpochShuffler shuffler: Shuffler of the training samples.
+    :param int epoch: Interrupted epoch.
+    :param int batch_in_epoch: Number of batches of the epoch already trained.
+    :return: None
+    """
+    logger.info('Resuming epoch %d from its batch %d.' % (epoch + 1, batch_in_epoch + 1))
+    # Order of the samples in the interrupted epoch (the next shuffle, done by the batch generator of the rest of the
+    # training, gives the order of the next epoch)
+    shuffler.shuffle()
+    model_to_train = get_trained_model(nmt_model)
+    callbacks = CallbackList(callbacks)
+    callbacks.set_model(nmt_model.model)
+    callbacks.on_train_begin()
+    callbacks.on_epoch_begin(epoch)
+    loss = None
+    for n_update, data in interrupted_epoch_batches(nmt_model, dataset, params, batch_in_epoch):
+        callbacks.on_batch_begin(n_update)
+        loss = model_to_train.train_on_batch(*data)
+        callbacks.on_batch_end(n_update, {'loss': loss})
+    callbacks.on_epoch_end(epoch)
+    logger.info('Epoch %d - loss: %s' % (epoch + 1, str(loss)))
+    store_epoch_model(nmt_model, params, epoch)
+    callbacks.on_train_end()
+
+
+def interrupted_epoch_batches(nmt_model, dataset, params, batch_in_epoch):
+    """
+    Batches of an epoch after its first batch_in_epoch ones, equal to those built by the batch generator of the
+    training (Data_Batch_Generator or Homogeneous_Data_Batch_Generator) from the training samples in their current
+    order. Only the samples of these batches are loaded: with HOMOGENEOUS_BATCHES, from the maxibatch (JOINT_BATCHES
+    batches, sorted by target length) of the first one.
+
+    :param nmt_model: TranslationModel to train.
+    :param dataset: Dataset instance, with the training samples in the order of the epoch.
+    :param dict params: Dictionary of network hyperparameters.
+    :param int batch_in_epoch: Number of batches of the epoch already trained.
+    :return: Generator of tuples (index of the batch in the epoch, data of the batch).
+    """
+    batch_size = params['BATCH_SIZE']
+    joint_batches = params['JOINT_BATCHES'] if params['HOMOGENEOUS_BATCHES'] else 1
+    samples_per_load = batch_size * joint_batches
+    for first_sample in range(batch_in_epoch // joint_batches * samples_per_load, dataset.len_train, samples_per_load):
+        last_sample = min(first_sample + samples_per_load, dataset.len_train)
+        X, Y = dataset.getXY_FromIndices('train', range(first_sample, last_sample),
+                                         dataAugmentation=params['DATA_AUGMENTATION'])
+        if not params['HOMOGENEOUS_BATCHES']:
+            yield first_sample // batch_size, nmt_model.prepareData(X, Y)
+            continue
+        # As Homogeneous_Data_Batch_Generator: the batches are built from the samples sorted by target length
+        order = np.asarray([int(np.sum(mask)) for mask in Y[0][1]]).argsort()
+        for batch in range(int(math.ceil(float(len(order)) / batch_size))):
+            n_update = first_sample // batch_size + batch
+            if n_update < batch_in_epoch:
+                continue
+            indices = order[batch * batch_size:(batch + 1) * batch_size]
+            X_batch = [np.asarray([x[i] for i in indices]) for x in X]
+            Y_batch = [tuple(np.asarray([y_data[i] for i in indices]) for y_data in y) for y in Y]
+            yield n_update, nmt_model.prepareData(X_batch, Y_batch)
+
+
+def train_document_batches(nmt_model, dataset, params, callbacks, lr_decay=None, update_offset=0, batch_in_epoch=0):
+    """
+    Training loop with document-ordered batches (see document_batches): each row of a batch follows a document, so
+    the cache of a TransformerCache model, which is carried across batches, holds the previous sentences of the same
+    document. The cache of a row is reset when the row starts a new document. The documents are defined in
+    DOCUMENTS_FILE; without it, each row follows a contiguous part of the training corpus.
+
+    :param nmt_model: TranslationModel to train.
+    :param dataset: Dataset instance.
+    :param dict params: Dictionary of network hyperparameters.
+    :param list callbacks: Callbacks (e.g. from buildCallbacks).
+    :param lr_decay: Number of updates between learning rate reductions (None for no reduction).
+    :param int update_offset: Number of updates already trained. The stream of batches continues after them.
+    :param int batch_in_epoch: Number of batches of the first epoch already trained.
+    :return: None
+    """
+    callbacks = list(callbacks)
+    if lr_decay is not None:
+        callbacks.append(build_lr_reducer(params))
+    callbacks = CallbackList(callbacks)
+    callbacks.set_model(nmt_model.model)
+
+    document_lengths = load_document_lengths(params.get('DOCUMENTS_FILE'))
+    if document_lengths is None:
+        logger.info('No documents file found. Each batch row will follow a contiguous part of the training corpus.')
+    batches = islice(document_batches(dataset.len_train, params['BATCH_SIZE'], document_lengths=document_lengths),
+                     update_offset, None)
+    boundaries = document_boundaries(dataset.len_train, params['BATCH_SIZE'], document_lengths=document_lengths)
+    document_starts = set(start for start, _ in boundaries)
+    cache = nmt_model.model.get_layer('src_cache')
+    steps_per_epoch = (dataset.len_train + params['BATCH_SIZE'] - 1) // params['BATCH_SIZE']
+
+    callbacks.on_train_begin()
+    for epoch in range(params.get('EPOCH_OFFSET', 0), params['MAX_EPOCH']):
+        callbacks.on_epoch_begin(epoch)
+        loss = None
+        for n_update in range(batch_in_epoch, steps_per_epoch):
+            callbacks.on_batch_begin(n_update)
+            indices = next(batches)
+            # Each row reads whole documents from their first sentence
+            new_documents = [row for row, index in enumerate(indices) if index in document_starts]
+            if new_documents:
+                cache.reset_rows(new_documents)
+            X, Y = dataset.getXY_FromIndices('train', indices)
+            loss = nmt_model.model.train_on_batch(*nmt_model.prepareData(X, Y))
+            callbacks.on_batch_end(n_update, {'loss': loss})
+        callbacks.on_epoch_end(epoch)
+        batch_in_epoch = 0
+        logger.info('Epoch %d - loss: %s' % (epoch + 1, str(loss)))
+        store_epoch_model(nmt_model, params, epoch)
+    callbacks.on_train_end()
+
+
+def train_model_data_parallel(params, load_dataset=None):
+    """
+    Data-parallel training on CPU.
+
+    Starts one process per worker. Each worker trains a replica of the model on a disjoint shard of the batches, and
+    the gradients are averaged across workers at each update (or each ACCUMULATE_GRADIENTS batches).
+    When the workers are spread across hosts, each host runs the ranks in DATA_PARALLEL_LOCAL_RANKS, and all of them
+    connect to the worker with rank 0 at DATA_PARALLEL_ADDRESS.
+
+    :param dict params: Dictionary of network hyperparameters.
+    :param str load_dataset: Load dataset from file or build it from the parameters.
+    :return: None
+    """
+    # The worker loop does not implement these features
+    unsupported = [name for name in ['RELOAD_TRAINING_STATE', 'SAVE_TRAINING_STATE', 'DOCUMENT_BATCHES', 'EARLY_STOP']
+                   if params.get(name, False)]
+    if unsupported:
+        raise ValueError('The data-parallel training (DATA_PARALLEL_WORKERS > 1) does not support %s. '
+                         'Set them to False.' % ', '.join(unsupported))
+    if load_dataset is None:
+        dataset = build_dataset(params)
+        load_dataset = params['DATASET_STORE_PATH'] + '/Dataset_' + dataset.name + '.pkl'
+
+    ranks = params.get('DATA_PARALLEL_LOCAL_RANKS') or list(range(params['DATA_PARALLEL_WORKERS']))
+    logger.info('Starting data-parallel training with workers: %s' % str(ranks))
+    total_start_time = timer()
+    workers = [multiprocessing.Process(target=train_data_parallel_worker, args=(rank, params, load_dataset))
+               for rank in ranks]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed_ranks = [rank for rank, worker in zip(ranks, workers) if worker.exitcode != 0]
+    if failed_ranks:
+        raise RuntimeError('Data-parallel workers %s failed.' % str(failed_ranks))
 
     total_end_time = timer()
     time_difference = total_end_time - total_start_time
     logging.info('In total is {0:.2f}s = {1:.2f}m'.format(time_difference, time_difference / 60.0))
+
+
+def train_data_parallel_worker(rank, params, dataset_path):
+    """
+    Training loop of a data-parallel worker. Only the worker with rank 0 evaluates and stores the model.
+
+    :param int rank: Rank of the worker.
+    :param dict params: Dictionary of network hyperparameters.
+    :param str dataset_path: Path to the stored Dataset instance.
+    :return: None
+    """
+    n_workers = params['DATA_PARALLEL_WORKERS']
+    dataset = loadDataset(dataset_path)
+    params['INPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['INPUTS_IDS_DATASET'][0]]
+    params['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['OUTPUTS_IDS_DATASET'][0]]
+    if params.get('SAMPLED_SOFTMAX', False):
+        params['TARGET_UNIGRAM_COUNTS'] = get_unigram_counts(dataset, params['OUTPUTS_IDS_DATASET'][0])
+    # Gradients are accumulated by the DataParallelTrainer, which also needs the Keras optimizers
+    accumulate_gradients = params.get('ACCUMULATE_GRADIENTS', 1)
+    params['ACCUMULATE_GRADIENTS'] = 1
+    params['USE_TF_OPTIMIZER'] = False
+    if params['RELOAD'] > 0:
+        check_positional_encodings(params)
+
+    nmt_model = TranslationModel(params,
+                                 model_type=params['MODEL_TYPE'],
+                                 verbose=params['VERBOSE'] if rank == 0 else 0,
+                                 model_name=params['MODEL_NAME'],
+                                 vocabularies=dataset.vocabulary,
+                                 store_path=params['STORE_PATH'],
+                                 set_optimizer=params['RELOAD'] == 0,
+                                 clear_dirs=rank == 0 and params['RELOAD'] == 0)
+    set_model_mappings(nmt_model, dataset, params)
+    epoch_offset = 0
+    steps_per_epoch = dataset.len_train // (params['BATCH_SIZE'] * n_workers)
+    if params['RELOAD'] > 0:
+        nmt_model = updateModel(nmt_model, params['STORE_PATH'], params['RELOAD'], reload_epoch=params['RELOAD_EPOCH'])
+        nmt_model.setParams(params)
+        nmt_model.setOptimizer()
+        epoch_offset = params['RELOAD'] if params['RELOAD_EPOCH'] else params['RELOAD'] // steps_per_epoch
+    if rank == 0:
+        dict2pkl(params, params['STORE_PATH'] + '/config')
+
+    transport = TRANSPORTS[params.get('DATA_PARALLEL_TRANSPORT', 'connection')](
+        rank, n_workers, address=params.get('DATA_PARALLEL_ADDRESS', 'localhost:6000'))
+    trainer = DataParallelTrainer(nmt_model.model, transport, accumulate_gradients=accumulate_gradients)
+    trainer.broadcast_weights()
+
+    callbacks = buildCallbacks(params, nmt_model, dataset, steps_per_epoch=steps_per_epoch) if rank == 0 else []
+    if params.get('LR_DECAY') is not None:
+        # All replicas must follow the same learning rate schedule
+        callbacks.append(build_lr_reducer(params))
+    callbacks = CallbackList(callbacks)
+    callbacks.set_model(nmt_model.model)
+
+    callbacks.on_train_begin()
+    for epoch in range(epoch_offset, params['MAX_EPOCH']):
+        callbacks.on_epoch_begin(epoch)
+        loss = None
+        for n_update, indices in enumerate(shard_batches(dataset.len_train, params['BATCH_SIZE'], rank, n_workers,
+                                                         seed=epoch)):
+            callbacks.on_batch_begin(n_update)
+            X, Y = dataset.getXY_FromIndices('train', indices)
+            loss = trainer.train_on_batch(*nmt_model.prepareData(X, Y))
+            callbacks.on_batch_end(n_update, {'loss': loss})
+        # The gradients of the last batches of the epoch are applied even if they do not complete an accumulation
+        flushed_loss = trainer.flush()
+        if flushed_loss is not None:
+            loss = flushed_loss
+        callbacks.on_epoch_end(epoch)
+        if rank == 0:
+            logger.info('Epoch %d - loss: %s' % (epoch + 1, str(loss)))
+            store_epoch_model(nmt_model, params, epoch)
+    callbacks.on_train_end()
+    transport.close()
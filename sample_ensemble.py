@@ -13,7 +13,7 @@ logger = logging.getLogger(__name__)
 
 def parse_args():
     parser = argparse.ArgumentParser("Use several translation models for obtaining predictions from a source text file.")
-    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance with data")
+    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance with data (or its inference Dataset: Dataset_*.inference.pkl)")
     parser.add_argument("-t", "--text", required=True, help="Text file with source sentences")
     parser.add_argument("-s", "--splits", nargs='+', required=False, default=['val'], help="Splits to sample. "
                                                                                            "Should be already included"
@@ -28,6 +28,8 @@ def parse_args():
     parser.add_argument("-w", "--weights", nargs="*", help="Weight given to each model in the ensemble. You should provide the same number of weights than models."
                                                            "By default, it applies the same weight to each model (1/N).", default=[])
     parser.add_argument("-m", "--models", nargs="+", required=True, help="Path to the models")
+    parser.add_argument("-np", "--numpy", action="store_true", default=False,
+                        help="Decode with the NumPy inference instead of Keras (Transformer and attentional RNN models)")
     parser.add_argument("-ch", "--changes", nargs="*", help="Changes to the config. Following the syntax Key=Value",
                         default="")
     return parser.parse_args()
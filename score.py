@@ -13,7 +13,7 @@ logger = logging.getLogger(__name__)
 
 def parse_args():
     parser = argparse.ArgumentParser("Use several translation models for scoring source--target pairs")
-    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance with data")
+    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance with data (or its inference Dataset: Dataset_*.inference.pkl)")
     parser.add_argument("-src", "--source", required=True, help="Text file with source sentences")
     parser.add_argument("-trg", "--target", required=True, help="Text file with target sentences")
     parser.add_argument("-s", "--splits", nargs='+', required=False, default=['val'], help="Splits to sample. "
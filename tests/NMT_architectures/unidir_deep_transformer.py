@@ -66,6 +66,13 @@ def test_transformer():
     params['RELOAD'] = 1
     print ("Done")
 
+    # The stored model (with custom layers) is reloaded by updateModel
+    print ("Resuming training")
+    params['RELOAD_EPOCH'] = True
+    params['MAX_EPOCH'] = 2
+    train_model(params)
+    print ("Done")
+
     parser = argparse.ArgumentParser('Parser for unit testing')
     parser.dataset = params['DATASET_STORE_PATH'] + '/Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl'
 
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os
+from collections import Counter
+
+import numpy as np
+import pytest
+from six.moves import cPickle as pk
+
+from config import load_parameters
+from data_engine.binarized import BinarizedDataset, BinarizedSequence, binarize_sentences, count_words, \
+    vocabulary_from_counts
+from data_engine.prepare_data import build_dataset
+from keras_wrapper.dataset import loadDataset
+
+
+def test_binarized_sequence(tmpdir):
+    sentences = [u'the house is red', u'', u'the car', u'a coché with ünicode words']
+    path = os.path.join(str(tmpdir), 'train.source_text')
+    assert binarize_sentences(sentences, path) == len(sentences)
+    assert np.load(path + '.ids.npy').dtype == np.int32
+    assert list(np.load(path + '.offsets.npy')) == [0, 4, 4, 6, 11]
+
+    sequence = BinarizedSequence(path, len(sentences))
+    assert len(sequence) == len(sentences)
+    # The sentences are arrays of token ids
+    assert sequence[0].dtype == np.int32
+    assert [list(ids) for ids in sequence] == [[0, 1, 2, 3], [], [0, 4], [5, 6, 7, 8, 9]]
+    assert [sequence.get_sentence(i) for i in range(len(sequence))] == sentences
+    assert list(sequence[-1]) == [5, 6, 7, 8, 9]
+    assert [list(ids) for ids in sequence[1:3]] == [[], [0, 4]]
+    with pytest.raises(IndexError):
+        sequence[len(sentences)]
+    assert list(sequence.count_ids(11)) == [2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0]
+
+    order = [2, 0, 3, 1]
+    sequence.shuffle(order)
+    assert [sequence.get_sentence(i) for i in range(len(sequence))] == [sentences[i] for i in order]
+    sequence.shuffle(order)
+    assert [sequence.get_sentence(i) for i in range(len(sequence))] == \
+        [sentences[i] for i in [order[j] for j in order]]
+
+    # The ids are remapped, but the text is kept
+    sequence.remap(np.arange(10)[::-1])
+    assert list(sequence[1]) == [9, 5]
+    assert sequence.get_sentence(1) == sentences[2]
+
+    # Only the path, the order and the mapping are pickled
+    unpickled = pk.loads(pk.dumps(sequence))
+    assert unpickled._ids is None
+    assert [list(ids) for ids in unpickled] == [list(ids) for ids in sequence]
+
+
+def test_sharded_binarized_sequence(tmpdir):
+    sentences = [u'w%d ' % i * (i % 3) for i in range(10)]
+    path = os.path.join(str(tmpdir), 'train.target_text')
+    words2idx = {u'<pad>': 0, u'<unk>': 1, u'w1': 2, u'w2': 3}
+    assert binarize_sentences(iter(sentences), path, words2idx=words2idx, shard_size=4) == len(sentences)
+    assert [os.path.isfile(path + '.%d.ids.npy' % shard) for shard in range(4)] == [True, True, True, False]
+    sequence = BinarizedSequence(path, len(sentences), shard_size=4)
+    # Words out of the vocabulary are stored as unknown words
+    assert [sequence.get_sentence(i) for i in range(len(sequence))] == \
+        [u' '.join(w if w in words2idx else u'<unk>' for w in s.split()) for s in sentences]
+    sequence.shuffle(list(reversed(range(len(sentences)))))
+    assert list(sequence[1]) == [1, 1]
+
+
+def test_count_words():
+    sentences = [u'a a a a b b b c c d', u'a b e f g h']
+    counter = count_words(sentences)
+    assert counter[u'a'] == 5 and counter[u'h'] == 1
+    # With lossy counting, frequent words are kept and rare ones are discarded. The counts are underestimated by at
+    # most n_words / bucket_width
+    lossy_counter = count_words(sentences, bucket_width=4)
+    assert lossy_counter == Counter({u'a': 5, u'b': 4})
+    for word, count in lossy_counter.items():
+        assert counter[word] - 16 // 4 <= count <= counter[word]
+
+    extra_words = {u'<pad>': 0, u'<unk>': 1, u'<null>': 2}
+    vocabulary = vocabulary_from_counts(counter, extra_words, min_occ=2, n_words=5)
+    assert vocabulary['words2idx'] == {u'<pad>': 0, u'<unk>': 1, u'<null>': 2, u'a': 3, u'b': 4}
+    assert vocabulary['idx2words'][4] == u'b'
+
+
+def test_build_streaming_dataset():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = './'
+    ds = build_dataset(params)
+    params['STREAMING_BUILD'] = True
+    params['STREAMING_SHARD_SIZE'] = 100
+    ds_streaming = build_dataset(params)
+    assert ds_streaming.len_train == ds.len_train
+    for data_id in params['INPUTS_IDS_DATASET'][:1] + params['OUTPUTS_IDS_DATASET']:
+        assert ds_streaming.vocabulary[data_id]['words2idx'] == ds.vocabulary[data_id]['words2idx']
+        assert ds_streaming.vocabulary_len[data_id] == ds.vocabulary_len[data_id]
+    X, Y = ds.getXY_FromIndices('train', [0, 1, 2])
+    X_streaming, Y_streaming = ds_streaming.getXY_FromIndices('train', [0, 1, 2])
+    assert np.all(X[0] == X_streaming[0])
+    for y, y_streaming in zip(Y[0], Y_streaming[0]):
+        assert np.all(y == y_streaming)
+
+
+def test_build_binarized_dataset():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = './'
+    ds = build_dataset(params)
+    params['BINARIZE_DATASET'] = True
+    ds_binarized = build_dataset(params)
+    assert isinstance(ds_binarized, BinarizedDataset)
+    for data_id in params['INPUTS_IDS_DATASET'][:1] + params['OUTPUTS_IDS_DATASET']:
+        assert isinstance(ds_binarized.Y_train.get(data_id, ds_binarized.X_train.get(data_id)), BinarizedSequence)
+        original = ds.Y_train.get(data_id, ds.X_train.get(data_id))
+        binarized = ds_binarized.Y_train.get(data_id, ds_binarized.X_train.get(data_id))
+        assert [s.split() for s in original] == [binarized.get_sentence(i).split() for i in range(len(binarized))]
+    # The token ids are encoded as the text
+    X, Y = ds.getXY_FromIndices('train', [0, 1, 2])
+    X_binarized, Y_binarized = ds_binarized.getXY_FromIndices('train', [0, 1, 2])
+    for x, x_binarized in zip(X, X_binarized):
+        assert np.all(x == x_binarized)
+    for y, y_binarized in zip(Y[0], Y_binarized[0]):
+        assert np.all(y == y_binarized)
+
+    ds_loaded = loadDataset('./Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl')
+    ds_loaded.shuffleTraining()
+    X, Y = ds_loaded.getXY_FromIndices('train', [0, 1, 2])
+    assert len(X) == len(ds_loaded.ids_inputs)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
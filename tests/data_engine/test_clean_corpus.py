@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import pytest
+import codecs
+import json
+import os
+from config import load_parameters
+from data_engine.clean_corpus import clean_corpus, normalize_sentence, BloomFilter
+from data_engine.prepare_data import build_dataset
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(1024)
+    assert not bloom_filter.add(u'una casa')
+    assert bloom_filter.add(u'una casa')
+    assert not bloom_filter.add(u'un perro')
+    assert normalize_sentence(u'  La casa, 2 veces! ') == normalize_sentence(u'la casa veces')
+
+
+def test_clean_corpus(tmpdir):
+    pairs = [(u'la casa verde', u'the green house'),
+             (u'', u'empty source'),
+             (u'una frase muy muy muy larga', u'a long one'),
+             (u'uno', u'one two three four'),
+             (u'la casa verde', u'the green house'),
+             (u'La casa verde.', u'The green house!'),
+             (u'el perro', u'the dog'),
+             (u'1.', u'1.'),
+             (u'2.', u'2.')]
+    src_path, trg_path = str(tmpdir.join('corpus.es')), str(tmpdir.join('corpus.en'))
+    for path, side in [(src_path, 0), (trg_path, 1)]:
+        with codecs.open(path, 'w', encoding='utf-8') as text_file:
+            text_file.write(u''.join(pair[side] + u'\n' for pair in pairs))
+    statistics = clean_corpus(src_path, trg_path, src_path + '.clean', trg_path + '.clean', max_len=5, max_ratio=3.,
+                              near_duplicates=True, deduplication_memory=1)
+    assert statistics == {'total': 9, 'kept': 4, 'empty': 1, 'too_long': 1, 'ratio': 1, 'duplicates': 1,
+                          'near_duplicates': 1}
+    with codecs.open(src_path + '.clean', 'r', encoding='utf-8') as text_file:
+        assert text_file.read().split(u'\n') == [u'la casa verde', u'el perro', u'1.', u'2.', u'']
+    with codecs.open(trg_path + '.clean', 'r', encoding='utf-8') as text_file:
+        assert text_file.read().split(u'\n') == [u'the green house', u'the dog', u'1.', u'2.', u'']
+
+
+def test_build_dataset_clean_corpus(tmpdir):
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = str(tmpdir)
+    params['CLEAN_CORPUS'] = True
+    params['CLEAN_DEDUPLICATION_MEMORY'] = 16
+    ds = build_dataset(params)
+    with open(os.path.join(str(tmpdir), params['TEXT_FILES']['train'] + 'clean.stats.json'), 'r') as stats_file:
+        statistics = json.load(stats_file)['statistics']
+    assert ds.len_train == statistics['kept'] < statistics['total']
+    assert params['TEXT_FILES']['train'] == 'training.'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,42 @@
+import pytest
+import os
+from config import load_parameters
+from data_engine.prepare_data import build_dataset, update_dataset_from_file
+from data_engine.inference_dataset import load_inference_dataset, inference_dataset_path
+from data_engine.vocabulary import CompactVocabulary
+from keras_wrapper.dataset import Dataset
+
+
+def test_inference_dataset(tmpdir):
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = str(tmpdir)
+    ds = build_dataset(params)
+    dataset_path = str(tmpdir) + '/Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl'
+    assert os.path.isfile(inference_dataset_path(dataset_path))
+    assert os.path.getsize(inference_dataset_path(dataset_path)) < os.path.getsize(dataset_path)
+
+    # The full Dataset is replaced by its inference Dataset
+    inference_ds = load_inference_dataset(dataset_path)
+    assert isinstance(inference_ds, Dataset)
+    assert inference_ds.len_train == 0
+    assert len(inference_ds.X_train[params['INPUTS_IDS_DATASET'][0]]) == 0
+    assert inference_ds.vocabulary == ds.vocabulary
+    assert isinstance(inference_ds.vocabulary[params['OUTPUTS_IDS_DATASET'][0]], CompactVocabulary)
+    assert inference_ds.vocabulary_len == ds.vocabulary_len
+    assert inference_ds.ids_inputs == ds.ids_inputs and inference_ds.ids_outputs == ds.ids_outputs
+
+    # It can be updated with new text as the full Dataset
+    source_file = params['DATA_ROOT_PATH'] + '/' + params['TEXT_FILES']['test'] + params['SRC_LAN']
+    inference_ds = update_dataset_from_file(inference_ds, source_file, params, splits=['test'], remove_outputs=True)
+    ds = update_dataset_from_file(ds, source_file, params, splits=['test'], remove_outputs=True)
+    assert inference_ds.len_test == ds.len_test
+    assert inference_ds.X_test[params['INPUTS_IDS_DATASET'][0]] == ds.X_test[params['INPUTS_IDS_DATASET'][0]]
+
+    # The full Dataset is loaded if it is newer than its inference Dataset
+    os.utime(dataset_path, (os.path.getatime(dataset_path), os.path.getmtime(inference_dataset_path(dataset_path)) + 10))
+    assert load_inference_dataset(dataset_path).len_train == ds.len_train
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -1,7 +1,9 @@
 import pytest
 import copy
+import os
+import shutil
 from config import load_parameters
-from data_engine.prepare_data import build_dataset, update_dataset_from_file, keep_n_captions
+from data_engine.prepare_data import build_dataset, update_dataset_from_file, keep_n_captions, get_unigram_counts
 from keras_wrapper.dataset import Dataset, loadDataset
 
 
@@ -95,3 +97,80 @@ def test_keep_n_captions():
 
     if __name__ == '__main__':
         pytest.main([__file__])
+
+
+def test_keep_n_captions_multiple_references():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = './'
+    ds = build_dataset(params)
+    id_in, id_out = params['INPUTS_IDS_DATASET'][0], params['OUTPUTS_IDS_DATASET'][0]
+    X_val, Y_val = ds.X_val[id_in], ds.Y_val[id_out]
+
+    # With one reference per sample, the data is not modified
+    keep_n_captions(ds, 1, n=1, set_names=['val'])
+    assert ds.X_val[id_in] is X_val and ds.Y_val[id_out] is Y_val
+    assert ds.extra_variables['val'][id_out][3] == [Y_val[3]]
+
+    # Consider that each sample of the validation set has two references
+    keep_n_captions(ds, 2, n=1, set_names=['val'])
+    assert ds.len_val == len(Y_val) // 2
+    assert len(ds.X_val[id_in]) == len(ds.Y_val[id_out]) == ds.len_val
+    assert list(ds.X_val[id_in]) == X_val[::2] and ds.Y_val[id_out][:] == Y_val[::2]
+    references = ds.extra_variables['val'][id_out]
+    assert list(references) == list(range(ds.len_val))
+    assert references[3] == Y_val[6:8]
+
+
+def test_get_unigram_counts():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = './'
+    ds = build_dataset(params)
+    data_id = params['OUTPUTS_IDS_DATASET'][0]
+    counts = get_unigram_counts(ds, data_id)
+    assert len(counts) == ds.vocabulary_len[data_id]
+    assert counts.sum() == sum(len(sentence.split()) for sentence in ds.Y_train[data_id])
+    # The padding symbol never appears in the data
+    assert counts[ds.vocabulary[data_id]['words2idx'][ds.pad_symbol]] == 0
+
+
+def test_dataset_cache(tmpdir):
+    params = load_parameters()
+    # Work on a copy of the data, which is modified
+    data_path = os.path.join(str(tmpdir), 'data')
+    os.makedirs(data_path)
+    for split in ['train', 'val', 'test']:
+        for lan in [params['SRC_LAN'], params['TRG_LAN']]:
+            shutil.copy(params['DATA_ROOT_PATH'] + '/' + params['TEXT_FILES'][split] + lan, data_path)
+    params['DATA_ROOT_PATH'] = data_path
+    params['DATASET_STORE_PATH'] = str(tmpdir)
+    params['DATASET_CACHE'] = True
+    params['REBUILD_DATASET'] = False
+    dataset_path = str(tmpdir) + '/Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN']
+    ds = build_dataset(params)
+    assert os.path.isfile(dataset_path + '.fingerprint.json')
+
+    # Unchanged: the stored dataset is reused
+    mtime = os.path.getmtime(dataset_path + '.pkl')
+    ds_cached = build_dataset(params)
+    assert os.path.getmtime(dataset_path + '.pkl') == mtime
+    assert ds_cached.vocabulary == ds.vocabulary
+    assert ds_cached.len_val == ds.len_val
+
+    # Only the validation files changed: the validation split is reloaded
+    for lan in [params['SRC_LAN'], params['TRG_LAN']]:
+        with open(data_path + '/' + params['TEXT_FILES']['val'] + lan, 'r') as val_file:
+            lines = val_file.readlines()
+        with open(data_path + '/' + params['TEXT_FILES']['val'] + lan, 'w') as val_file:
+            val_file.writelines(lines[:-10])
+    ds_updated = build_dataset(params)
+    assert ds_updated.len_val == ds.len_val - 10
+    assert len(ds_updated.X_val[params['INPUTS_IDS_DATASET'][0]]) == ds.len_val - 10
+    assert ds_updated.types_inputs['val'] == ds.types_inputs['val']
+    assert ds_updated.len_train == ds.len_train and ds_updated.len_test == ds.len_test
+
+    # A data parameter changed: the dataset is rebuilt
+    params['INPUT_VOCABULARY_SIZE'] = 100
+    ds_rebuilt = build_dataset(params)
+    assert ds_rebuilt.vocabulary_len[params['INPUTS_IDS_DATASET'][0]] == 100
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import codecs
+import os
+
+import pytest
+
+from config import load_parameters
+from data_engine.prepare_data import build_dataset, tokenize_text_file
+from data_engine.tokenization import tokenize_sentences
+from keras_wrapper.dataset import Dataset
+
+
+def test_tokenize_sentences():
+    sentences = [u'Sentence number %d, with "punctuation"!' % i for i in range(50)]
+    expected = [Dataset.tokenize_basic(sentence) for sentence in sentences]
+    assert list(tokenize_sentences(sentences, 'tokenize_basic')) == expected
+    # Small chunks: the order is kept across several rounds of the pool
+    assert list(tokenize_sentences(iter(sentences), 'tokenize_basic', n_jobs=3, chunk_size=4)) == expected
+    with pytest.raises(Exception):
+        list(tokenize_sentences(sentences, 'tokenize_unknown'))
+
+
+def test_build_dataset_parallel_tokenization():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = './'
+    ds = build_dataset(params)
+    params['TOKENIZATION_JOBS'] = 2
+    ds_parallel = build_dataset(params)
+    for split in ['train', 'val', 'test']:
+        assert getattr(ds_parallel, 'X_' + split) == getattr(ds, 'X_' + split)
+        assert getattr(ds_parallel, 'Y_' + split) == getattr(ds, 'Y_' + split)
+    assert ds_parallel.vocabulary == ds.vocabulary
+
+
+def test_tokenize_text_file_bpe(tmpdir):
+    codes_path = os.path.join(str(tmpdir), 'codes')
+    with codecs.open(codes_path, 'w', 'utf-8') as codes_file:
+        codes_file.write(u'#version: 0.2\nh o\nho u\n')
+    text_path = os.path.join(str(tmpdir), 'text')
+    with codecs.open(text_path, 'w', 'utf-8') as text_file:
+        text_file.write(u'the house\nhouses\n')
+    ds = Dataset('test', None, silence=True)
+    tokenized_files = dict()
+    sentences, tokenization = tokenize_text_file(ds, text_path, 'tokenize_bpe', n_jobs=2, bpe_codes=codes_path,
+                                                 tokenized_files=tokenized_files)
+    assert tokenization == 'tokenize_none'
+    # The Dataset loads the tokenized sentences without tokenizing them, but its BPE encoder is built
+    assert ds.BPE_built
+    assert sentences == [ds.tokenize_bpe(u'the house'), ds.tokenize_bpe(u'houses')]
+    # The tokenized sentences are reused, not copied
+    assert tokenize_text_file(ds, text_path, 'tokenize_bpe', n_jobs=2, bpe_codes=codes_path,
+                              tokenized_files=tokenized_files)[0] is sentences
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import pytest
+import numpy as np
+from six import iteritems
+from config import load_parameters
+from data_engine.prepare_data import build_dataset
+from data_engine.vocabulary import CompactVocabulary, compact_vocabularies, decode_predictions_beam_search
+
+
+def test_compact_vocabulary():
+    words = [u'<pad>', u'<unk>', u'<null>', u'casa', u'cañón', u'el', u'la', u'']
+    vocabulary = {'idx2words': dict(enumerate(words)), 'words2idx': dict((w, i) for i, w in enumerate(words))}
+    compact = CompactVocabulary.from_vocabulary(vocabulary)
+    assert compact.size == len(words)
+    assert compact['words2idx'] == vocabulary['words2idx']
+    assert compact['idx2words'] == vocabulary['idx2words']
+    assert compact['words2idx'].get(u'perro', 1) == 1
+    assert u'cañón' in compact['words2idx'] and u'perro' not in compact['words2idx']
+    with pytest.raises(KeyError):
+        compact['idx2words'][len(words)]
+
+    # Batch conversions
+    assert list(compact.words_to_ids([u'la', u'casa', u'perro'], unk_index=1)) == [6, 3, 1]
+    with pytest.raises(KeyError):
+        compact.words_to_ids([u'perro'])
+    assert [list(ids) for ids in compact.words_to_ids([[u'la', u'casa'], [u'el', u'cañón', u'perro']],
+                                                      unk_index=1)] == [[6, 3], [5, 4, 1]]
+    assert compact.ids_to_words(np.array([[6, 3, 0], [5, 4, 1]])) == [[u'la', u'casa', u'<pad>'],
+                                                                      [u'el', u'cañón', u'<unk>']]
+    assert compact.ids_to_words([[6, 3], [5, 4, 1]]) == [[u'la', u'casa'], [u'el', u'cañón', u'<unk>']]
+    assert compact.ids_to_words([np.array([6, 3]), np.array([], dtype='int64'), [5]]) == [[u'la', u'casa'], [],
+                                                                                          [u'el']]
+    assert compact.to_vocabulary() == vocabulary
+    assert dict(compact['words2idx'].items()) == vocabulary['words2idx']
+    assert dict(compact['idx2words'].items()) == vocabulary['idx2words']
+
+
+def test_decode_predictions_beam_search():
+    words = [u'<pad>', u'<unk>', u'<null>', u'casa', u'cañón', u'el', u'la', u'<eos>']
+    vocabulary = {'idx2words': dict(enumerate(words)), 'words2idx': dict((w, i) for i, w in enumerate(words))}
+    compact = CompactVocabulary.from_vocabulary(vocabulary)
+    preds = [[6, 3, 7], [5, 4, 1, 7], np.array([6, 7, 0, 0])]
+    # The words of all the predictions are gathered at once, with the same result as the wrapper
+    assert decode_predictions_beam_search(preds, compact['idx2words']) == \
+        decode_predictions_beam_search(preds, vocabulary['idx2words']) == [u'la casa', u'el cañón <unk>', u'la <eos> <pad>']
+    assert decode_predictions_beam_search(preds, compact['idx2words'], pad_sequences=True) == \
+        decode_predictions_beam_search(preds, vocabulary['idx2words'], pad_sequences=True) == \
+        [u'la casa', u'el cañón <unk>', u'la <eos>']
+
+    # Unknown words replacement
+    alphas = [np.eye(3, 2), np.eye(4, 3), np.eye(4, 1)]
+    x_text = [u'la casa', u'el cañón rojo', u'la']
+    assert decode_predictions_beam_search(preds, compact['idx2words'], alphas=alphas, x_text=x_text, heuristic=0) == \
+        decode_predictions_beam_search(preds, vocabulary['idx2words'], alphas=alphas, x_text=x_text, heuristic=0) == \
+        [u'la casa', u'el cañón rojo', u'la <eos> <pad>']
+
+
+def test_compact_vocabularies():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['DATASET_STORE_PATH'] = './'
+    ds = build_dataset(params)
+    vocabularies = dict((data_id, {'words2idx': dict(vocabulary['words2idx']),
+                                   'idx2words': dict(vocabulary['idx2words'])})
+                        for data_id, vocabulary in iteritems(ds.vocabulary))
+    compact_vocabularies(ds)
+    for data_id, vocabulary in iteritems(vocabularies):
+        assert isinstance(ds.vocabulary[data_id], CompactVocabulary)
+        assert dict(ds.vocabulary[data_id]['words2idx']) == vocabulary['words2idx']
+        assert dict(ds.vocabulary[data_id]['idx2words']) == vocabulary['idx2words']
+        assert len(ds.vocabulary[data_id]['words2idx']) == ds.vocabulary_len[data_id]
+
+    # The batches are loaded as with the original vocabularies
+    sentences = ds.X_val[params['INPUTS_IDS_DATASET'][0]][:10]
+    X, _ = ds.loadText(sentences, ds.vocabulary[params['INPUTS_IDS_DATASET'][0]], params['MAX_INPUT_TEXT_LEN'],
+                       0, 'end', True, False)
+    X_dict, _ = ds.loadText(sentences, vocabularies[params['INPUTS_IDS_DATASET'][0]], params['MAX_INPUT_TEXT_LEN'],
+                            0, 'end', True, False)
+    assert np.array_equal(X, X_dict)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
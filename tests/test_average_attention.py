@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from keras.layers import Input
+from keras.models import Model
+
+from config import load_parameters
+from nmt_keras.average_attention import CumulativeAverage
+from nmt_keras.model_zoo import TranslationModel
+
+
+def test_cumulative_average():
+    x = Input(shape=(None, 4))
+    prev_average = Input(shape=(1, 4))
+    position = Input(shape=(1,))
+    model = Model(inputs=[x], outputs=CumulativeAverage(return_state=True)(x))
+    step_model = Model(inputs=[x, prev_average, position],
+                       outputs=CumulativeAverage(return_state=True)([x, prev_average, position]))
+
+    sequence = np.random.RandomState(1).randn(2, 5, 4).astype('float32')
+    averages, last_average, next_position = model.predict_on_batch(sequence)
+    expected = np.cumsum(sequence, axis=1) / np.arange(1, 6)[None, :, None]
+    np.testing.assert_allclose(averages, expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(last_average, expected[:, -1:], rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(next_position, [[5.], [5.]])
+
+    # Continuing from the state of the first 3 positions gives the same averages
+    _, state, position = model.predict_on_batch(sequence[:, :3])
+    step_averages, _, next_position = step_model.predict_on_batch([sequence[:, 3:], state, position])
+    np.testing.assert_allclose(step_averages, expected[:, 3:], rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(next_position, [[5.], [5.]])
+
+
+def test_average_attention_network(tmpdir):
+    params = load_parameters()
+    params['MODEL_TYPE'] = 'AverageAttentionNetwork'
+    params['INPUT_VOCABULARY_SIZE'] = 15
+    params['OUTPUT_VOCABULARY_SIZE'] = 17
+    params['N_LAYERS_ENCODER'] = 2
+    params['N_LAYERS_DECODER'] = 2
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['SOURCE_TEXT_EMBEDDING_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 8
+    params['DEEP_OUTPUT_LAYERS'] = []
+    params['POS_UNK'] = False
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='average_attention',
+                                 store_path=str(tmpdir), set_optimizer=False, clear_dirs=False)
+
+    rng = np.random.RandomState(1)
+    src = rng.randint(3, 15, (2, 6))
+    next_words = rng.randint(3, 17, (2, 4))
+    probs = nmt_model.model_init.predict_on_batch([src, next_words])[0]
+
+    # Decoding word by word with the sampling models gives the probabilities of the whole prefix
+    outputs = dict(zip(nmt_model.ids_outputs_init, nmt_model.model_init.predict_on_batch([src, next_words[:, :1]])))
+    np.testing.assert_allclose(outputs[nmt_model.ids_outputs[0]], probs[:, :1], rtol=1e-4, atol=1e-5)
+    matchings = nmt_model.matchings_init_to_next
+    for step in range(1, next_words.shape[1]):
+        inputs = dict((matchings[output_id], output) for output_id, output in outputs.items() if output_id in matchings)
+        inputs[nmt_model.ids_inputs_next[0]] = next_words[:, step:step + 1]
+        outputs = dict(zip(nmt_model.ids_outputs_next,
+                           nmt_model.model_next.predict_on_batch([inputs[input_id]
+                                                                  for input_id in nmt_model.ids_inputs_next])))
+        np.testing.assert_allclose(outputs[nmt_model.ids_outputs[0]], probs[:, step:step + 1], rtol=1e-4, atol=1e-5)
+        matchings = nmt_model.matchings_next_to_next
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,184 @@
+import os
+import random
+import threading
+
+import numpy as np
+import pytest
+
+from nmt_keras.callbacks import EpochShuffler, ExponentialMovingAverage, ThroughputProfiler, load_training_state, \
+    save_training_state
+
+
+class FakeModel(object):
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weights(self):
+        return [np.copy(w) for w in self.weights]
+
+    def set_weights(self, weights):
+        self.weights = [np.copy(w) for w in weights]
+
+
+class FakeModelWrapper(object):
+    def __init__(self, weights):
+        self.model = FakeModel(weights)
+
+
+def test_save_load_training_state(tmpdir):
+    state_path = os.path.join(str(tmpdir), 'training_state.pkl')
+    state = {'epoch': 3,
+             'update': 1200,
+             'batch_in_epoch': 17,
+             'weights': [np.random.rand(4, 3).astype('float32'), np.zeros(3, dtype='float32')],
+             'optimizer_weights': [np.array(1200, dtype='int64'), np.random.rand(4, 3).astype('float32')],
+             'lr': np.float32(0.001),
+             'python_rng': random.getstate(),
+             'numpy_rng': np.random.get_state()}
+    save_training_state(state, state_path)
+    # The state is written atomically: no temporary file is left behind.
+    assert not os.path.exists(state_path + '.tmp')
+    loaded_state = load_training_state(state_path)
+    assert loaded_state['epoch'] == state['epoch']
+    assert loaded_state['update'] == state['update']
+    assert loaded_state['batch_in_epoch'] == state['batch_in_epoch']
+    for stored, loaded in zip(state['weights'] + state['optimizer_weights'],
+                              loaded_state['weights'] + loaded_state['optimizer_weights']):
+        assert np.array_equal(stored, loaded)
+
+    # Restoring the RNG states reproduces the same random streams
+    random.setstate(loaded_state['python_rng'])
+    np.random.set_state(loaded_state['numpy_rng'])
+    python_sample, numpy_sample = random.random(), np.random.rand()
+    random.setstate(state['python_rng'])
+    np.random.set_state(state['numpy_rng'])
+    assert python_sample == random.random()
+    assert numpy_sample == np.random.rand()
+
+    # Overwriting an existing state
+    state['update'] = 2400
+    save_training_state(state, state_path)
+    assert load_training_state(state_path)['update'] == 2400
+
+
+class FakeTrainingDataset(object):
+    def __init__(self, n_samples):
+        self.len_train = n_samples
+        self.X_train = {'source_text': ['src %d' % i for i in range(n_samples)]}
+        self.Y_train = {'target_text': ['trg %d' % i for i in range(n_samples)]}
+
+
+def test_epoch_shuffler():
+    dataset = FakeTrainingDataset(10)
+    shuffler = EpochShuffler(dataset, 1234, epoch=3)
+    orders = []
+    for _ in range(3):
+        dataset.shuffleTraining()
+        orders.append(list(dataset.X_train['source_text']))
+        # Inputs and outputs are shuffled together
+        assert [x.split()[1] for x in dataset.X_train['source_text']] == \
+            [y.split()[1] for y in dataset.Y_train['target_text']]
+    assert shuffler.epoch == 6
+    assert orders[0] != orders[1]
+    # A resumed training rebuilds the order of any epoch from the seed
+    resumed_dataset = FakeTrainingDataset(10)
+    EpochShuffler(resumed_dataset, 1234, epoch=5)
+    resumed_dataset.shuffleTraining()
+    assert list(resumed_dataset.X_train['source_text']) == orders[2]
+
+
+def test_exponential_moving_average():
+    model_wrapper = FakeModelWrapper([np.zeros((2, 2), dtype='float32')])
+    ema = ExponentialMovingAverage(model_wrapper, decay=0.5, each_n_updates=2, eval_on_epochs=False, eval_each=4)
+    ema.on_train_begin()
+    for update in range(4):
+        ema.on_batch_begin(update)
+        model_wrapper.model.weights = [np.full((2, 2), update + 1, dtype='float32')]
+        ema.on_batch_end(update)
+    # Average updated on updates 2 and 4: 0.5 * (0.5 * 0 + 0.5 * 2) + 0.5 * 4
+    expected = np.full((2, 2), 2.5, dtype='float32')
+    assert np.allclose(ema.shadow_weights[0], expected)
+    # At an evaluation update, the model holds the averaged weights
+    assert np.allclose(model_wrapper.model.weights[0], expected)
+    # Training weights are restored before the next batch
+    ema.on_batch_begin(4)
+    assert np.allclose(model_wrapper.model.weights[0], 4.)
+    ema.on_epoch_end(0)
+    assert np.allclose(model_wrapper.model.weights[0], expected)
+    ema.on_train_end()
+    assert np.allclose(model_wrapper.model.weights[0], 4.)
+
+    # A resumed training keeps the schedule of the averages: here, the first update is the 4th one
+    model_wrapper = FakeModelWrapper([np.zeros((2, 2), dtype='float32')])
+    ema = ExponentialMovingAverage(model_wrapper, decay=0.5, each_n_updates=2, update_offset=3)
+    ema.on_train_begin()
+    model_wrapper.model.weights = [np.ones((2, 2), dtype='float32')]
+    ema.on_batch_end(0)
+    assert np.allclose(ema.shadow_weights[0], 0.5)
+
+
+class FakeDataset(object):
+    def getXY(self, set_name, k, **kwargs):
+        return self.getXY_FromIndices(set_name, list(range(k)))
+
+    def getXY_FromIndices(self, set_name, k, **kwargs):
+        # Two sentences of 2 and 4 tokens, padded to 4
+        X = [np.array([[3, 4, 0, 0], [5, 6, 7, 8]], dtype='int32')]
+        return X, None
+
+
+class FakeSampler(object):
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def on_epoch_begin(self, epoch, logs=None):
+        pass
+
+    def on_epoch_end(self, epoch, logs=None):
+        pass
+
+    def on_batch_begin(self, n_update, logs=None):
+        pass
+
+    def on_batch_end(self, n_update, logs=None):
+        self.dataset.getXY('train', 2)
+
+
+def test_throughput_profiler(tmpdir):
+    csv_path = os.path.join(str(tmpdir), 'throughput.csv')
+    dataset = FakeDataset()
+    profiler = ThroughputProfiler(dataset, csv_path, each_n_updates=2, verbose=0)
+    profiler.on_train_begin()
+    for update in range(4):
+        # Training batches come from the generator thread
+        loader = threading.Thread(target=dataset.getXY_FromIndices, args=('train', [0, 1]))
+        loader.start()
+        loader.join()
+        profiler.on_batch_begin(update)
+        profiler.on_batch_end(update)
+    # Calls from the watched callbacks (e.g. sampling) are not counted
+    sampler = FakeSampler(dataset)
+    profiler.watch(sampler)
+    sampler.on_batch_end(4)
+    assert len(profiler.batch_sizes) == 0
+    # Batches loaded by a training loop in the main thread are counted
+    dataset.getXY_FromIndices('train', [0, 1])
+    profiler.on_batch_begin(4)
+    profiler.on_batch_end(4)
+    assert profiler.n_tokens == 6
+    profiler.on_train_end()
+    assert 'getXY' not in dataset.__dict__
+
+    with open(csv_path) as csv_file:
+        lines = csv_file.read().splitlines()
+    assert lines[0].split(',') == ThroughputProfiler.fields
+    assert len(lines) == 3
+    for line in lines[1:]:
+        measures = dict(zip(ThroughputProfiler.fields, line.split(',')))
+        assert float(measures['padding_ratio']) == 0.25
+        assert float(measures['tokens_per_sec']) > 0.
+    assert int(lines[2].split(',')[0]) == 4
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
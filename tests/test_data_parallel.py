@@ -0,0 +1,114 @@
+import multiprocessing
+import socket
+
+import numpy as np
+import pytest
+
+from nmt_keras.data_parallel import ConnectionTransport, DataParallelTrainer, shard_batches
+
+N_STEPS = 4
+GLOBAL_BATCH_SIZE = 4
+
+
+def get_free_address():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'localhost:%d' % port
+
+
+def get_data():
+    rng = np.random.RandomState(1)
+    X = rng.rand(N_STEPS * GLOBAL_BATCH_SIZE, 4).astype('float32')
+    Y = np.eye(3)[rng.randint(0, 3, N_STEPS * GLOBAL_BATCH_SIZE)].astype('float32')
+    return X, Y
+
+
+def get_initial_weights():
+    rng = np.random.RandomState(2)
+    return [rng.randn(4, 5).astype('float32') * 0.5, np.zeros(5, dtype='float32'),
+            rng.randn(5, 3).astype('float32') * 0.5, np.zeros(3, dtype='float32')]
+
+
+def build_model():
+    from keras.layers import Dense, Input
+    from keras.models import Model
+    from keras.optimizers import SGD
+    x = Input(shape=(4,))
+    y = Dense(3, activation='softmax')(Dense(5, activation='tanh')(x))
+    model = Model(inputs=x, outputs=y)
+    model.compile(SGD(lr=0.5), 'categorical_crossentropy')
+    model.set_weights(get_initial_weights())
+    return model
+
+
+def train_worker(rank, n_workers, address, results):
+    model = build_model()
+    trainer = DataParallelTrainer(model, ConnectionTransport(rank, n_workers, address=address))
+    trainer.broadcast_weights()
+    X, Y = get_data()
+    local_batch_size = GLOBAL_BATCH_SIZE // n_workers
+    losses = []
+    for step in range(N_STEPS):
+        start = step * GLOBAL_BATCH_SIZE + rank * local_batch_size
+        losses.append(trainer.train_on_batch(X[start:start + local_batch_size], Y[start:start + local_batch_size]))
+    trainer.transport.close()
+    results.put((rank, losses, model.get_weights()))
+
+
+def test_shard_batches():
+    n_workers = 3
+    shards = [list(shard_batches(20, 3, rank, n_workers, seed=5)) for rank in range(n_workers)]
+    # Same number of steps in all workers
+    assert all(len(shard) == 20 // (3 * n_workers) for shard in shards)
+    indices = [index for shard in shards for batch in shard for index in batch]
+    # Disjoint batches
+    assert len(indices) == len(set(indices))
+
+
+def test_two_workers_loss_parity():
+    # Workers run first, so the parent process does not hold a backend session when forking
+    address = get_free_address()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=train_worker, args=(rank, 2, address, results)) for rank in range(2)]
+    for worker in workers:
+        worker.start()
+    worker_results = sorted([results.get(timeout=300) for _ in workers], key=lambda result: result[0])
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    # Reference: a single process training on the full batches
+    model = build_model()
+    X, Y = get_data()
+    single_losses = [float(model.train_on_batch(X[step * GLOBAL_BATCH_SIZE:(step + 1) * GLOBAL_BATCH_SIZE],
+                                                Y[step * GLOBAL_BATCH_SIZE:(step + 1) * GLOBAL_BATCH_SIZE]))
+                     for step in range(N_STEPS)]
+
+    for _, losses, weights in worker_results:
+        assert np.allclose(losses, single_losses, rtol=1e-4, atol=1e-6)
+        for worker_weight, single_weight in zip(weights, model.get_weights()):
+            assert np.allclose(worker_weight, single_weight, rtol=1e-4, atol=1e-6)
+
+
+def test_flush_accumulated_gradients():
+    model = build_model()
+    trainer = DataParallelTrainer(model, ConnectionTransport(0, 1), accumulate_gradients=3)
+    X, Y = get_data()
+    trainer.train_on_batch(X[:4], Y[:4])
+    trainer.train_on_batch(X[4:8], Y[4:8])
+    # Two batches do not complete an accumulation: they are applied when flushing
+    assert trainer.n_accumulated == 2
+    assert trainer.flush() is not None
+    assert trainer.flush() is None
+
+    # Reference: a single update on both batches
+    reference = build_model()
+    reference.train_on_batch(X[:8], Y[:8])
+    for weight, reference_weight in zip(model.get_weights(), reference.get_weights()):
+        assert np.allclose(weight, reference_weight, rtol=1e-4, atol=1e-6)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
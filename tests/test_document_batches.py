@@ -0,0 +1,40 @@
+from itertools import islice
+
+import pytest
+
+from nmt_keras.document_batches import document_batches, document_boundaries, load_document_lengths
+
+
+def test_document_boundaries(tmpdir):
+    assert document_boundaries(10, 3) == [(0, 4), (4, 7), (7, 10)]
+    assert document_boundaries(6, 2, document_lengths=[2, 0, 4]) == [(0, 2), (2, 6)]
+    with pytest.raises(ValueError):
+        document_boundaries(6, 2, document_lengths=[2, 3])
+    documents_path = tmpdir.join('training.docs')
+    documents_path.write('2\n0\n4\n')
+    assert load_document_lengths(str(documents_path)) == [2, 0, 4]
+    assert load_document_lengths(str(tmpdir.join('missing'))) is None
+
+
+def test_document_batches():
+    document_lengths = [3, 1, 5, 2, 4]
+    n_samples = sum(document_lengths)
+    documents = document_boundaries(n_samples, 2, document_lengths=document_lengths)
+    batches = list(islice(document_batches(n_samples, 2, document_lengths=document_lengths, seed=3), 30))
+    assert all(len(batch) == 2 for batch in batches)
+    for row in range(2):
+        stream = [batch[row] for batch in batches]
+        # Each row reads whole documents, in order, one after another
+        position = 0
+        while position < len(stream):
+            start, end = [document for document in documents if document[0] <= stream[position] < document[1]][0]
+            assert stream[position] == start
+            assert stream[position:position + end - start] == list(range(start, end))[:len(stream) - position]
+            position += end - start
+    # No sentence is dropped
+    seen = [index for batch in batches for index in batch]
+    assert set(seen) == set(range(n_samples))
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from keras_wrapper.cnn_model import saveModel
+
+from config import load_parameters
+from nmt_keras.fused_attention import fuse_attention_weights
+from nmt_keras.model_zoo import TranslationModel
+from nmt_keras.numpy_inference import load_numpy_model
+from utils.fuse_attention import fuse_model_attention
+
+
+def test_fuse_attention_weights():
+    rng = np.random.RandomState(1)
+    weights = [rng.randn(8, 8) for _ in range(4)] + [rng.randn(8) for _ in range(4)]
+    x = rng.randn(3, 8)
+    wqkv, wo, bqkv, bo = fuse_attention_weights(weights)
+    np.testing.assert_allclose(np.dot(x, wqkv) + bqkv,
+                               np.concatenate([np.dot(x, w) + b for w, b in zip(weights[:3], weights[4:7])], axis=-1))
+    assert wo is weights[3] and bo is weights[7]
+    wq, wkv, wo, bq, bkv, bo = fuse_attention_weights(weights[:4], self_attention=False)
+    assert wq is weights[0] and wkv.shape == (8, 16) and not np.any(bkv)
+    with pytest.raises(ValueError):
+        fuse_attention_weights(weights, use_bias=False)
+
+
+def test_fuse_model_attention(tmpdir):
+    params = load_parameters()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['INPUT_VOCABULARY_SIZE'] = 15
+    params['OUTPUT_VOCABULARY_SIZE'] = 17
+    params['N_LAYERS_ENCODER'] = 2
+    params['N_LAYERS_DECODER'] = 2
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['SOURCE_TEXT_EMBEDDING_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 8
+    params['DEEP_OUTPUT_LAYERS'] = []
+    params['POS_UNK'] = False
+    store_path = str(tmpdir)
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='fuse_attention',
+                                 store_path=store_path, set_optimizer=False, clear_dirs=False)
+    saveModel(nmt_model, 1, path=store_path)
+    fused_model = fuse_model_attention(params, store_path + '/epoch_1', store_path + '/fused/epoch_1')
+    assert fused_model.params['FUSED_ATTENTION']
+    assert fused_model.model.get_layer('src_MultiHeadAttention_0').__class__.__name__ == 'FusedMultiHeadAttention'
+
+    rng = np.random.RandomState(1)
+    src = rng.randint(3, 15, (2, 6))
+    src[1, 4:] = 0
+    inputs = [src, rng.randint(3, 17, (2, 3))]
+    outputs = nmt_model.model_init.predict_on_batch(inputs)
+    fused_outputs = fused_model.model_init.predict_on_batch(inputs)
+    for output, fused_output in zip(outputs, fused_outputs):
+        np.testing.assert_allclose(fused_output, output, rtol=1e-4, atol=1e-5)
+    numpy_model = load_numpy_model(fused_model.params, store_path + '/fused/epoch_1')
+    numpy_outputs = numpy_model.predict_init(dict(zip(fused_model.ids_inputs_init, inputs)))
+    np.testing.assert_allclose(numpy_outputs[0], fused_outputs[0], rtol=1e-4, atol=1e-5)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+from keras_wrapper.cnn_model import saveModel
+
+from config import load_parameters
+from nmt_keras.model_zoo import TranslationModel
+from nmt_keras.numpy_inference import load_numpy_model
+
+INPUT_VOCABULARY_SIZE = 15
+OUTPUT_VOCABULARY_SIZE = 17
+
+
+def load_tests_params():
+    params = load_parameters()
+    params['INPUT_VOCABULARY_SIZE'] = INPUT_VOCABULARY_SIZE
+    params['OUTPUT_VOCABULARY_SIZE'] = OUTPUT_VOCABULARY_SIZE
+    params['SOURCE_TEXT_EMBEDDING_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 8
+    params['DECODER_HIDDEN_SIZE'] = 4
+    params['ENCODER_HIDDEN_SIZE'] = 4
+    params['DEEP_OUTPUT_LAYERS'] = [('linear', 8)]
+    params['USE_CUDNN'] = False
+    params['POS_UNK'] = False
+    params['COVERAGE_PENALTY'] = False
+    return params
+
+
+def check_parity(params, store_path, n_next_words):
+    """
+    Stores a (randomly initialized) model and compares the outputs of its model_init and model_next with those of the
+    NumPy inference.
+    """
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='numpy_inference',
+                                 store_path=store_path, set_optimizer=False, clear_dirs=False)
+    saveModel(nmt_model, 1, path=store_path)
+    numpy_model = load_numpy_model(params, store_path + '/epoch_1')
+
+    rng = np.random.RandomState(1)
+    src = rng.randint(3, INPUT_VOCABULARY_SIZE, (2, 6))
+    next_words = rng.randint(3, OUTPUT_VOCABULARY_SIZE, (2, 3))
+    init_inputs = {nmt_model.ids_inputs_init[0]: src, nmt_model.ids_inputs_init[1]: next_words}
+    keras_outputs = nmt_model.model_init.predict_on_batch([init_inputs[input_id]
+                                                           for input_id in nmt_model.ids_inputs_init])
+    numpy_outputs = numpy_model.predict_init(init_inputs)
+    assert numpy_model.ids_outputs_init == nmt_model.ids_outputs_init
+    for keras_output, numpy_output in zip(keras_outputs, numpy_outputs):
+        np.testing.assert_allclose(numpy_output, keras_output, rtol=1e-4, atol=1e-5)
+
+    next_inputs = {nmt_model.ids_inputs_next[0]: next_words[:, -n_next_words:]}
+    for output_id, output in zip(nmt_model.ids_outputs_init, keras_outputs):
+        if output_id in nmt_model.matchings_init_to_next:
+            next_inputs[nmt_model.matchings_init_to_next[output_id]] = output
+    keras_outputs = nmt_model.model_next.predict_on_batch([next_inputs[input_id]
+                                                           for input_id in nmt_model.ids_inputs_next])
+    numpy_outputs = numpy_model.predict_next(next_inputs)
+    assert numpy_model.ids_outputs_next == nmt_model.ids_outputs_next
+    for keras_output, numpy_output in zip(keras_outputs, numpy_outputs):
+        np.testing.assert_allclose(numpy_output, keras_output, rtol=1e-4, atol=1e-5)
+
+
+def test_transformer(tmpdir):
+    params = load_tests_params()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['N_LAYERS_ENCODER'] = 2
+    params['N_LAYERS_DECODER'] = 2
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    # model_next takes the whole prefix
+    check_parity(params, str(tmpdir), n_next_words=3)
+
+
+def test_transformer_asymmetric(tmpdir):
+    params = load_tests_params()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['N_LAYERS_ENCODER'] = 3
+    params['N_LAYERS_DECODER'] = 1
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['DECODER_MODEL_SIZE'] = 4
+    params['DECODER_FF_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 4
+    check_parity(params, str(tmpdir), n_next_words=3)
+
+
+def test_transformer_stored_positional_encodings(tmpdir):
+    params = load_tests_params()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['STORED_POSITIONAL_ENCODINGS'] = True
+    check_parity(params, str(tmpdir), n_next_words=3)
+
+
+def test_prepare_data(tmpdir):
+    params = load_tests_params()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    store_path = str(tmpdir)
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='numpy_inference',
+                                 store_path=store_path, set_optimizer=False, clear_dirs=False)
+    saveModel(nmt_model, 1, path=store_path)
+    numpy_model = load_numpy_model(params, store_path + '/epoch_1')
+    # The batches of the Dataset are mapped to the model inputs as by a Model_Wrapper (see set_model_mappings)
+    inputs_mapping = dict((input_id, i) for i, input_id in enumerate(params['INPUTS_IDS_MODEL']))
+    nmt_model.setInputsMapping(inputs_mapping)
+    numpy_model.setInputsMapping(inputs_mapping)
+    X_batch = [np.ones((2, 6), dtype='int32'), np.zeros((2, 3), dtype='int32')]
+    numpy_data, keras_data = numpy_model.prepareData(X_batch)[0], nmt_model.prepareData(X_batch, None)[0]
+    assert sorted(numpy_data) == sorted(keras_data)
+    for input_id in keras_data:
+        np.testing.assert_array_equal(numpy_data[input_id], keras_data[input_id])
+
+
+@pytest.mark.parametrize('rnn_type', ['GRU', 'LSTM'])
+def test_attention_rnn_encoder_decoder(tmpdir, rnn_type):
+    params = load_tests_params()
+    params['MODEL_TYPE'] = 'AttentionRNNEncoderDecoder'
+    params['ENCODER_RNN_TYPE'] = rnn_type
+    params['DECODER_RNN_TYPE'] = 'Conditional' + rnn_type
+    params['N_LAYERS_ENCODER'] = 2
+    params['N_LAYERS_DECODER'] = 2
+    params['BIDIRECTIONAL_ENCODER'] = True
+    params['BIDIRECTIONAL_DEEP_ENCODER'] = True
+    params['USE_BATCH_NORMALIZATION'] = True
+    params['BATCH_NORMALIZATION_MODE'] = 1
+    # model_next takes the last word
+    check_parity(params, str(tmpdir), n_next_words=1)
+
+
+@pytest.mark.parametrize('model_type', ['Transformer', 'AttentionRNNEncoderDecoder'])
+def test_tied_output_embeddings(tmpdir, model_type):
+    params = load_tests_params()
+    params['MODEL_TYPE'] = model_type
+    params['TIE_OUTPUT_EMBEDDINGS'] = True
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    check_parity(params, str(tmpdir), n_next_words=3 if model_type == 'Transformer' else 1)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
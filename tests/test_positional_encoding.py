@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from keras.layers import Embedding, Input
+from keras.models import Model
+
+from nmt_keras.model_zoo import getPositionalEncodingWeights
+from nmt_keras.helpers import positional_encodings
+from nmt_keras.positional_encoding import SinusoidalPositionalEncoding
+
+
+def test_sinusoidal_positional_encoding():
+    positions = Input(name='positions', batch_shape=tuple([None, None]), dtype='int32')
+    encodings = SinusoidalPositionalEncoding(6)(positions)
+    stored_encodings = Embedding(50, 6, trainable=False,
+                                 weights=getPositionalEncodingWeights(50, 6, verbose=False))(positions)
+    model = Model(inputs=positions, outputs=[encodings, stored_encodings])
+    assert not model.layers[1].weights
+    x = np.tile(np.arange(50), (2, 1))
+    computed, stored = model.predict_on_batch(x)
+    np.testing.assert_allclose(computed, stored, rtol=1e-4, atol=1e-4)
+    # There is no maximum position
+    encoder = Model(inputs=positions, outputs=encodings)
+    np.testing.assert_allclose(encoder.predict_on_batch(np.array([[1000]]))[0],
+                               positional_encodings(np.array([1000]), 6), atol=1e-3)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
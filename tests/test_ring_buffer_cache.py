@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from keras import backend as K
+from keras.layers import Input
+from keras.models import Model
+
+from nmt_keras.ring_buffer_cache import RingBufferCache
+
+
+def build_cache_model(cache_size, patience, top_k=0, n_rows=0):
+    annotations = Input(name='annotations', batch_shape=tuple([None, None, 2]), dtype='float32')
+    src_text = Input(name='src_text', batch_shape=tuple([None, None]), dtype='int32')
+    cache = RingBufferCache(cache_size, patience, top_k=top_k, n_rows=n_rows)
+    return Model(inputs=[annotations, src_text], outputs=cache([annotations, src_text])), cache
+
+
+def test_ring_buffer_cache():
+    model, cache = build_cache_model(4, 2)
+    a = np.array([[[1., 2.], [3., 4.], [5., 6.]]])
+    b = np.array([[[7., 8.], [9., 10.], [11., 12.]]])
+    # The cache is empty: the entries are zeros
+    out = model.predict_on_batch([a, np.array([[3, 4, 0]])])
+    assert out.shape == (1, 7, 2)
+    np.testing.assert_allclose(out[0, 3:], np.zeros((4, 2)))
+    # The annotations of the padded words are not inserted
+    out = model.predict_on_batch([b, np.array([[5, 6, 7]])])
+    np.testing.assert_allclose(out[0, :3], b[0])
+    np.testing.assert_allclose(out[0, 3:], [[1., 2.], [3., 4.], [0., 0.], [0., 0.]])
+    # The buffer wraps around and the entries older than 2 insertions are evicted
+    assert K.get_value(cache.n_inserted) == 5
+    np.testing.assert_allclose(K.get_value(cache.memory), [[11., 12.], [3., 4.], [7., 8.], [9., 10.]])
+    out = model.predict_on_batch([a, np.array([[0, 0, 0]])])
+    np.testing.assert_allclose(out[0, 3:], [[11., 12.], [0., 0.], [0., 0.], [9., 10.]])
+
+    cache.reset_states()
+    out = model.predict_on_batch([a, np.array([[3, 4, 5]])])
+    np.testing.assert_allclose(out[0, 3:], np.zeros((4, 2)))
+
+
+def test_ring_buffer_cache_overflow():
+    model, cache = build_cache_model(4, 100)
+    x = np.arange(12, dtype='float32').reshape((2, 3, 2))
+    model.predict_on_batch([x, np.ones((2, 3), dtype='int32')])
+    # Only the last 4 annotations are kept, at their position in the ring
+    np.testing.assert_allclose(K.get_value(cache.memory), x.reshape((6, 2))[[4, 5, 2, 3]])
+    assert list(K.get_value(cache.positions)) == [4, 5, 2, 3]
+
+
+def test_ring_buffer_cache_rows():
+    model, cache = build_cache_model(4, 100, n_rows=2)
+    a = np.array([[[1., 2.]], [[3., 4.]]])
+    b = np.array([[[5., 6.]], [[7., 8.]]])
+    src_text = np.ones((2, 1), dtype='int32')
+    model.predict_on_batch([a, src_text])
+    # Each row only reads its own entries
+    out = model.predict_on_batch([b, src_text])
+    np.testing.assert_allclose(out[0, 1:], [[1., 2.], [0., 0.], [0., 0.], [0., 0.]])
+    np.testing.assert_allclose(out[1, 1:], [[0., 0.], [3., 4.], [0., 0.], [0., 0.]])
+    # A reset row (e.g. starting a new document) only reads the entries inserted after the reset
+    cache.reset_rows([1])
+    out = model.predict_on_batch([a, src_text])
+    np.testing.assert_allclose(out[0, 1:], [[1., 2.], [0., 0.], [5., 6.], [0., 0.]])
+    np.testing.assert_allclose(out[1, 1:], np.zeros((4, 2)))
+    out = model.predict_on_batch([a, src_text])
+    np.testing.assert_allclose(out[1, 1:], [[0., 0.], [3., 4.], [0., 0.], [0., 0.]])
+
+
+@pytest.mark.skipif(K.backend() != 'tensorflow', reason='The top-k retrieval requires Tensorflow')
+def test_ring_buffer_cache_top_k():
+    model, cache = build_cache_model(4, 100, top_k=1)
+    model.predict_on_batch([np.array([[[1., 0.], [0., 1.]]]), np.array([[3, 4]])])
+    # Each sentence reads the entry most similar to its average annotation
+    out = model.predict_on_batch([np.array([[[0., 2.], [5., 0.]], [[3., 1.], [0., 0.]]]),
+                                  np.array([[3, 0], [3, 0]])])
+    assert out.shape == (2, 3, 2)
+    np.testing.assert_allclose(out[:, 2], [[0., 1.], [1., 0.]])
+
+
+@pytest.mark.skipif(K.backend() != 'tensorflow', reason='The top-k retrieval requires Tensorflow')
+def test_ring_buffer_cache_top_k_rows():
+    # Without patience, the entries are only evicted when they are overwritten
+    model, cache = build_cache_model(4, 0, top_k=2, n_rows=2)
+    src_text = np.ones((2, 1), dtype='int32')
+    model.predict_on_batch([np.array([[[1., 0.]], [[0., 1.]]]), src_text])
+    # Each row retrieves the most similar entries among its own ones: the rest are masked
+    out = model.predict_on_batch([np.array([[[1., 0.]], [[1., 0.]]]), src_text])
+    np.testing.assert_allclose(out[:, 1:], [[[1., 0.], [0., 0.]], [[0., 1.], [0., 0.]]])
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from keras import backend as K
+from keras.layers import Dense, Input
+
+from nmt_keras.sampled_softmax import SampledSoftmaxOutput, sampled_softmax_loss, sampler_parameters
+
+
+def test_sampler_parameters():
+    # Words never seen in the training data can also be sampled
+    num_sampled, unigrams = sampler_parameters(8192, 5, unigram_counts=np.array([0, 0, 10, 3, 0]))
+    assert num_sampled == 5
+    assert unigrams == [1, 1, 11, 4, 1]
+    assert sampler_parameters(2, 5) == (2, None)
+
+
+@pytest.mark.skipif(K.backend() != 'tensorflow', reason='The sampled softmax requires Tensorflow')
+def test_sampled_softmax_loss_small_vocabulary():
+    vocabulary_size = 10
+    inputs = Input(shape=(3, 4))
+    output_layer = SampledSoftmaxOutput(vocabulary_size, output_layer=Dense(vocabulary_size))
+    y_pred = output_layer(inputs)
+    unigram_counts = np.array([0, 0, 0, 5, 4, 3, 2, 1, 0, 0])
+    # Default SAMPLED_SOFTMAX_WORDS, larger than the vocabulary and the number of seen words
+    loss = sampled_softmax_loss(output_layer, 8192, unigram_counts=unigram_counts, sparse_targets=True)
+    y_true = K.placeholder(shape=(None, 3, 1))
+    loss_function = K.function([inputs, y_true], [loss(y_true, y_pred)])
+    losses = loss_function([np.random.rand(2, 3, 4), np.random.randint(0, vocabulary_size, (2, 3, 1))])[0]
+    assert losses.shape == (2, 3)
+    assert np.all(np.isfinite(losses))
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
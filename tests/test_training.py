@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from keras_wrapper.dataset import Data_Batch_Generator, Homogeneous_Data_Batch_Generator
+
+from nmt_keras.training import interrupted_epoch_batches
+
+
+class FakeBatchDataset(object):
+    def __init__(self, n_samples):
+        self.len_train = n_samples
+        self.silence = True
+        self.counter = 0
+
+    def shuffleTraining(self):
+        pass
+
+    def resetCounters(self, set_name='all'):
+        self.counter = 0
+
+    def getXY(self, set_name, k, **kwargs):
+        indices = range(self.counter, self.counter + k)
+        self.counter += k
+        return self.getXY_FromIndices(set_name, indices)
+
+    def getXY_FromIndices(self, set_name, k, **kwargs):
+        k = list(k)
+        X = [np.array([[i, i] for i in k])]
+        # Target lengths in random order, so the homogeneous batches are not consecutive samples
+        lengths = [(i * 7) % 5 + 1 for i in k]
+        Y = [(np.array([[i] for i in k]), np.array([[1.] * length + [0.] * (5 - length) for length in lengths]))]
+        return X, Y
+
+
+class FakeNet(object):
+    def prepareData(self, X_batch, Y_batch):
+        return [X_batch, Y_batch]
+
+
+def assert_same_batch(batch, expected_batch):
+    X, Y = batch
+    expected_X, expected_Y = expected_batch
+    for x, expected_x in zip(X, expected_X):
+        np.testing.assert_array_equal(x, expected_x)
+    for y, expected_y in zip(Y, expected_Y):
+        for y_data, expected_y_data in zip(y, expected_y):
+            np.testing.assert_array_equal(y_data, expected_y_data)
+
+
+@pytest.mark.parametrize('homogeneous_batches', [False, True])
+def test_interrupted_epoch_batches(homogeneous_batches):
+    params = {'BATCH_SIZE': 4, 'JOINT_BATCHES': 2, 'HOMOGENEOUS_BATCHES': homogeneous_batches,
+              'DATA_AUGMENTATION': False}
+    dataset, net = FakeBatchDataset(23), FakeNet()
+    steps_per_epoch = 6
+    if homogeneous_batches:
+        generator = Homogeneous_Data_Batch_Generator('train', net, dataset, steps_per_epoch, batch_size=4,
+                                                     joint_batches=2, data_augmentation=False).generator()
+    else:
+        generator = Data_Batch_Generator('train', net, dataset, steps_per_epoch, batch_size=4,
+                                         data_augmentation=False).generator()
+    epoch_batches = [next(generator) for _ in range(steps_per_epoch)]
+    for batch_in_epoch in [0, 3, 5]:
+        batches = list(interrupted_epoch_batches(net, FakeBatchDataset(23), params, batch_in_epoch))
+        # The rest of the epoch is rebuilt as the batch generator of the training builds it
+        assert [n_update for n_update, _ in batches] == list(range(batch_in_epoch, steps_per_epoch))
+        for (_, batch), expected_batch in zip(batches, epoch_batches[batch_in_epoch:]):
+            assert_same_batch(batch, expected_batch)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
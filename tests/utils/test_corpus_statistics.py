@@ -0,0 +1,35 @@
+import pytest
+from collections import Counter
+from config import load_parameters
+from utils.corpus_statistics import count_file, corpus_statistics, suggest_parameters, length_percentile
+
+
+def test_count_file():
+    params = load_parameters()
+    filename = params['DATA_ROOT_PATH'] + params['TEXT_FILES']['val'] + params['TRG_LAN']
+    words, lengths = count_file(filename)
+    assert sum(lengths.values()) == 100
+    assert sum(length * count for length, count in lengths.items()) == sum(words.values())
+    # Parallel counting gives the same results
+    assert count_file(filename, n_jobs=2, chunk_size=7) == (words, lengths)
+
+    statistics = corpus_statistics(words, lengths, cutoffs=[1, len(words), 10 * len(words)])
+    assert statistics['sentences'] == 100
+    assert statistics['vocabulary_size'] == len(words)
+    assert statistics['coverage'][str(1)] == float(words.most_common(1)[0][1]) / sum(words.values())
+    assert statistics['coverage'][str(len(words))] == statistics['coverage'][str(10 * len(words))] == 1.
+
+
+def test_suggest_parameters():
+    lengths = Counter({5: 50, 10: 40, 20: 9, 50: 1})
+    assert length_percentile(lengths, 50) == 5
+    assert length_percentile(lengths, 99) == 20
+    assert length_percentile(lengths, 100) == 50
+    suggestions = suggest_parameters(lengths, lengths, percentile=99., tokens_per_batch=1000)
+    assert suggestions['MAX_INPUT_TEXT_LEN'] == suggestions['MAX_OUTPUT_TEXT_LEN'] == 21
+    assert suggestions['BATCH_SIZE (PAD_ON_BATCH = False)'] == 1000 // 21
+    assert suggestions['BATCH_SIZE'] == int(1000 / 9.8)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,79 @@
+import copy
+
+import numpy as np
+import pytest
+from keras_wrapper.cnn_model import saveModel
+
+from config import load_parameters
+from nmt_keras.model_zoo import TranslationModel
+from nmt_keras.numpy_inference import load_numpy_model
+from utils.prune_heads import attention_heads, prune_model, pruning_order, removed_heads, store_pruned_model
+
+
+def test_pruning_order():
+    importance = {('a', 0): 0.1, ('a', 1): -0.2, ('b', 0): 0., ('b', 1): 0.3, ('b', 2): 0.05}
+    order = pruning_order(importance, {'a': 2, 'b': 3})
+    # At least one head is kept in each layer
+    assert order == [('a', 1), ('b', 0), ('b', 2)]
+    assert removed_heads(order, 2) == {'a': [1], 'b': [0]}
+    with pytest.raises(ValueError):
+        removed_heads(order, 4)
+
+
+@pytest.mark.parametrize('fused_attention', [False, True])
+def test_prune_heads(tmpdir, fused_attention):
+    params = load_parameters()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['INPUT_VOCABULARY_SIZE'] = 15
+    params['OUTPUT_VOCABULARY_SIZE'] = 17
+    params['N_LAYERS_ENCODER'] = 1
+    params['N_LAYERS_DECODER'] = 1
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['SOURCE_TEXT_EMBEDDING_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 8
+    params['DEEP_OUTPUT_LAYERS'] = []
+    params['POS_UNK'] = False
+    params['FUSED_ATTENTION'] = fused_attention
+    store_path = str(tmpdir)
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='prune_heads',
+                                 store_path=store_path, set_optimizer=False, clear_dirs=False)
+    saveModel(nmt_model, 1, path=store_path)
+    model = load_numpy_model(params, store_path + '/epoch_1')
+    n_heads = attention_heads(model)
+    assert list(n_heads.values()) == [2, 2, 2]
+
+    heads = {'src_MultiHeadAttention_0': [1], 'src_trg_MultiHeadAttention_0': [0]}
+    pruned_model = prune_model(model, heads)
+    # Removing a head is equivalent to zeroing its rows of the output projection
+    masked_model = copy.copy(model)
+    masked_model.weights = copy.copy(model.weights)
+    for name, layer_heads in heads.items():
+        masked_model.weights[name] = copy.copy(model.weights[name])
+        output_kernel = [weight_name for weight_name, weight in model.weights[name].items() if weight.ndim == 2][-1]
+        wo = model.weights[name][output_kernel].copy()
+        for head in layer_heads:
+            wo[head * 4:(head + 1) * 4] = 0.
+        masked_model.weights[name][output_kernel] = wo
+    rng = np.random.RandomState(1)
+    inputs = {params['INPUTS_IDS_MODEL'][0]: rng.randint(3, 15, (2, 6)),
+              params['INPUTS_IDS_MODEL'][1]: rng.randint(3, 17, (2, 3))}
+    probs = pruned_model.predict_init(inputs)[0]
+    np.testing.assert_allclose(probs, masked_model.predict_init(inputs)[0], rtol=1e-5, atol=1e-6)
+
+    pruned_keras_model = store_pruned_model(params, store_path + '/epoch_1', store_path + '/pruned',
+                                            dict((name, (n_heads[name], layer_heads))
+                                                 for name, layer_heads in heads.items()))
+    assert pruned_keras_model.params['ATTENTION_HEADS'] == {'src_MultiHeadAttention_0': 1,
+                                                            'src_trg_MultiHeadAttention_0': 1}
+    keras_probs = pruned_keras_model.model_init.predict_on_batch([inputs[input_id] for input_id
+                                                                 in pruned_keras_model.ids_inputs_init])[0]
+    np.testing.assert_allclose(keras_probs, probs, rtol=1e-4, atol=1e-5)
+    stored_model = load_numpy_model(pruned_keras_model.params, store_path + '/pruned')
+    assert list(attention_heads(stored_model).values()) == [1, 2, 1]
+    np.testing.assert_allclose(stored_model.predict_init(inputs)[0], probs, rtol=1e-5, atol=1e-6)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from keras_wrapper.cnn_model import saveModel
+
+from config import load_parameters
+from nmt_keras.model_zoo import TranslationModel
+from nmt_keras.numpy_inference import QuantizedMatrix, load_keras_model, load_numpy_model, quantize
+from utils.quantize_model import default_layers, quantize_model
+
+
+@pytest.mark.parametrize('axis', [0, 1])
+def test_quantize(axis):
+    rng = np.random.RandomState(1)
+    matrix = rng.randn(7, 30).astype('float32')
+    matrix[3] = 0.
+    quantized = quantize(matrix, axis=axis)
+    assert quantized.values.dtype == np.int8
+    assert quantized.scales.shape == (matrix.shape[axis],)
+    # Each weight is rounded to the nearest multiple of its scale
+    scales = quantized.scales[:, None] if axis == 0 else quantized.scales[None, :]
+    assert np.all(np.abs(quantized.dequantize() - matrix) <= scales / 2. + 1e-6)
+    x = rng.randn(2, 3, 7).astype('float32')
+    np.testing.assert_allclose(quantized.dot(x), np.dot(x, quantized.dequantize()), rtol=1e-5, atol=1e-5)
+    # The dequantized matrix is cached, and shared with the transpose
+    assert quantized.T.dequantized().base is quantized.matrix
+    uncached = QuantizedMatrix(quantized.values, quantized.scales, axis=axis, cache=False)
+    np.testing.assert_allclose(uncached.dot(x, block_size=8), np.dot(x, quantized.dequantize()), rtol=1e-5, atol=1e-5)
+    assert uncached.matrix is None
+    np.testing.assert_allclose(quantized[np.array([[1, 3]])], quantized.dequantize()[np.array([[1, 3]])])
+
+
+def test_quantize_model(tmpdir):
+    params = load_parameters()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['INPUT_VOCABULARY_SIZE'] = 15
+    params['OUTPUT_VOCABULARY_SIZE'] = 17
+    params['N_LAYERS_ENCODER'] = 1
+    params['N_LAYERS_DECODER'] = 1
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['SOURCE_TEXT_EMBEDDING_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 8
+    params['DEEP_OUTPUT_LAYERS'] = []
+    params['POS_UNK'] = False
+    store_path = str(tmpdir)
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='quantize_model',
+                                 store_path=store_path, set_optimizer=False, clear_dirs=False)
+    saveModel(nmt_model, 1, path=store_path)
+    model_path = store_path + '/epoch_1'
+
+    layer_names = default_layers(load_keras_model(model_path)[0], params['OUTPUTS_IDS_MODEL'][0])
+    assert set(layer_names) == {'source_word_embedding', 'target_word_embedding', 'src_MultiHeadAttention_0',
+                                'trg_MultiHeadAttention_0', 'src_trg_MultiHeadAttention_0',
+                                params['OUTPUTS_IDS_MODEL'][0]}
+    float_bytes, int8_bytes = quantize_model(model_path, store_path + '/quantized', layer_names)
+    assert int8_bytes < float_bytes
+
+    float_model = load_numpy_model(params, model_path)
+    int8_model = load_numpy_model(params, store_path + '/quantized')
+    assert isinstance(int8_model.weights['target_word_embedding']['embeddings'], QuantizedMatrix)
+    assert not isinstance(int8_model.weights['src_Normalization_FF_0']['gamma'], QuantizedMatrix)
+    rng = np.random.RandomState(1)
+    inputs = {params['INPUTS_IDS_MODEL'][0]: rng.randint(3, 15, (2, 6)),
+              params['INPUTS_IDS_MODEL'][1]: rng.randint(3, 17, (2, 3))}
+    np.testing.assert_allclose(int8_model.predict_init(inputs)[0], float_model.predict_init(inputs)[0], atol=1e-2)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from keras_wrapper.cnn_model import loadModel, saveModel
+
+from config import load_parameters
+from nmt_keras.model_zoo import TranslationModel
+from nmt_keras.numpy_inference import load_numpy_model
+from utils.trim_vocabulary import kept_words, output_frequencies, trim_model, trim_model_wrapper
+
+
+def test_kept_words():
+    counts = output_frequencies([[5, 5, 7, 4], [9, 7, 5]], 12)
+    assert list(counts) == [0, 0, 0, 0, 1, 3, 0, 2, 0, 1, 0, 0]
+    assert list(kept_words(counts, [0, 1, 2])) == [0, 1, 2, 4, 5, 7, 9]
+    assert list(kept_words(counts, [0, 1, 2], min_count=2)) == [0, 1, 2, 5, 7]
+    # The most frequent words are kept
+    assert list(kept_words(counts, [0, 1, 2], size=4)) == [0, 1, 2, 5]
+
+
+@pytest.mark.parametrize('tie_output_embeddings', [False, True])
+def test_trim_model(tmpdir, tie_output_embeddings):
+    params = load_parameters()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['INPUT_VOCABULARY_SIZE'] = 15
+    params['OUTPUT_VOCABULARY_SIZE'] = 17
+    params['N_LAYERS_ENCODER'] = 1
+    params['N_LAYERS_DECODER'] = 1
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['SOURCE_TEXT_EMBEDDING_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 8
+    params['DEEP_OUTPUT_LAYERS'] = []
+    params['POS_UNK'] = False
+    params['TIE_OUTPUT_EMBEDDINGS'] = tie_output_embeddings
+    store_path = str(tmpdir)
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='trim_vocabulary',
+                                 store_path=store_path, set_optimizer=False, clear_dirs=False)
+    saveModel(nmt_model, 1, path=store_path)
+
+    words = np.array([0, 1, 2, 4, 7, 8, 12, 16])
+    trim_model(store_path + '/epoch_1', store_path + '/trimmed', ['target_word_embedding', 'target_text'], words, 17)
+    trim_model_wrapper(store_path + '/epoch_1', store_path + '/trimmed', len(words))
+    trimmed_params = dict(params)
+    trimmed_params['OUTPUT_VOCABULARY_SIZE'] = len(words)
+    model = load_numpy_model(params, store_path + '/epoch_1')
+    trimmed_model = load_numpy_model(trimmed_params, store_path + '/trimmed')
+
+    rng = np.random.RandomState(1)
+    src = rng.randint(3, 15, (2, 6))
+    next_words = np.array([[4, 7, 16], [12, 8, 1]])
+    probs = model.predict_init({params['INPUTS_IDS_MODEL'][0]: src, params['INPUTS_IDS_MODEL'][1]: next_words})[0]
+    trimmed_inputs = {params['INPUTS_IDS_MODEL'][0]: src,
+                      params['INPUTS_IDS_MODEL'][1]: np.searchsorted(words, next_words)}
+    trimmed_probs = trimmed_model.predict_init(trimmed_inputs)[0]
+    # The trimmed softmax is the original one, restricted to the kept words
+    np.testing.assert_allclose(trimmed_probs, probs[..., words] / probs[..., words].sum(axis=-1, keepdims=True),
+                               rtol=1e-5, atol=1e-6)
+
+    # The trimmed model is loaded by Keras as the original one
+    trimmed_keras_model = loadModel(store_path + '/trimmed', -1, full_path=True)
+    assert trimmed_keras_model.params['OUTPUT_VOCABULARY_SIZE'] == len(words)
+    keras_probs = trimmed_keras_model.model_init.predict_on_batch([trimmed_inputs[input_id]
+                                                                   for input_id in nmt_model.ids_inputs_init])[0]
+    np.testing.assert_allclose(keras_probs, trimmed_probs, rtol=1e-4, atol=1e-5)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import codecs
+import json
+from collections import Counter
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Computes statistics of text corpora (one sentence per line) in a single pass and "
+                                     "suggests length and batch size parameters.")
+    parser.add_argument("files", nargs="*", help="Text files")
+    parser.add_argument("-src", "--source", nargs="*", default=[],
+                        help="Source text files. Used for suggesting MAX_INPUT_TEXT_LEN.")
+    parser.add_argument("-trg", "--target", nargs="*", default=[],
+                        help="Target text files. Used for suggesting MAX_OUTPUT_TEXT_LEN.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes")
+    parser.add_argument("-c", "--cutoffs", nargs="*", type=int, default=[5000, 10000, 20000, 30000, 50000],
+                        help="Vocabulary sizes at which the coverage of the tokens is computed")
+    parser.add_argument("-p", "--percentile", type=float, default=99.,
+                        help="Percentile of the sentence lengths used for suggesting the maximum lengths")
+    parser.add_argument("-tb", "--tokens-per-batch", type=int, default=4096,
+                        help="Number of (target) tokens per batch used for suggesting the batch size")
+    parser.add_argument("-o", "--output", default=None, help="Store the statistics in this JSON file")
+    return parser.parse_args()
+
+
+def count_chunk(lines):
+    """
+    Counts the words and the sentence lengths of a list of lines.
+
+    :param lines: List of lines.
+    :return: Counter of words, Counter of sentence lengths (in words).
+    """
+    words = Counter()
+    lengths = Counter()
+    for line in lines:
+        sentence = line.split()
+        words.update(sentence)
+        lengths[len(sentence)] += 1
+    return words, lengths
+
+
+def count_file(path, n_jobs=1, chunk_size=10000):
+    """
+    Counts the words and the sentence lengths of a text file, reading it once. With several jobs, chunks of lines are
+    counted in parallel (only a few chunks per process are kept in memory).
+
+    :param str path: Path to the text file.
+    :param int n_jobs: Number of processes.
+    :param int chunk_size: Number of lines of each chunk.
+    :return: Counter of words, Counter of sentence lengths (in words).
+    """
+    words = Counter()
+    lengths = Counter()
+    with codecs.open(path, 'r', encoding='utf-8') as text_file:
+        if n_jobs <= 1:
+            return count_chunk(text_file)
+        pool = Pool(n_jobs)
+        try:
+            while True:
+                chunks = [chunk for chunk in (list(islice(text_file, chunk_size)) for _ in range(2 * n_jobs)) if chunk]
+                if not chunks:
+                    break
+                for chunk_words, chunk_lengths in pool.map(count_chunk, chunks):
+                    words.update(chunk_words)
+                    lengths.update(chunk_lengths)
+        finally:
+            pool.terminate()
+    return words, lengths
+
+
+def length_percentile(lengths, percentile):
+    """
+    Percentile of a histogram of sentence lengths.
+
+    :param Counter lengths: Number of sentences of each length.
+    :param float percentile: Percentile (0-100).
+    :return: Smallest length such that at least percentile % of the sentences are not longer.
+    """
+    if not lengths:
+        return 0
+    sorted_lengths = sorted(lengths)
+    cumulative = np.cumsum([lengths[length] for length in sorted_lengths])
+    position = np.searchsorted(cumulative, cumulative[-1] * percentile / 100., side='left')
+    return sorted_lengths[min(position, len(sorted_lengths) - 1)]
+
+
+def corpus_statistics(words, lengths, cutoffs=None, percentiles=(50, 90, 95, 99, 100)):
+    """
+    Computes the statistics of a corpus.
+
+    :param Counter words: Number of occurrences of each word.
+    :param Counter lengths: Number of sentences of each length.
+    :param cutoffs: Vocabulary sizes at which the coverage of the tokens is computed.
+    :param percentiles: Percentiles of the sentence lengths.
+    :return: Dictionary with the statistics.
+    """
+    n_tokens = sum(words.values())
+    counts = np.cumsum(sorted(words.values(), reverse=True)) if words else np.zeros(1)
+    n_sentences = sum(lengths.values())
+    return {'sentences': n_sentences,
+            'tokens': n_tokens,
+            'vocabulary_size': len(words),
+            'singletons': sum(1 for count in words.values() if count == 1),
+            'mean_length': float(n_tokens) / max(1, n_sentences),
+            'length_percentiles': dict((str(percentile), int(length_percentile(lengths, percentile)))
+                                       for percentile in percentiles),
+            'length_histogram': dict((str(length), lengths[length]) for length in sorted(lengths)),
+            'coverage': dict((str(cutoff), float(counts[min(cutoff, len(counts)) - 1]) / max(1, n_tokens))
+                             for cutoff in (cutoffs or []) if cutoff > 0)}
+
+
+def suggest_parameters(source_lengths, target_lengths, percentile=99., tokens_per_batch=4096):
+    """
+    Suggests the maximum text lengths and the batch size from the sentence lengths of the source and target corpora.
+    The lengths leave room for the <eos> symbol. The batch size is the number of sentences that fit in
+    tokens_per_batch (target) tokens, for sentences of mean length and, as a lower bound, of the maximum length.
+
+    :param Counter source_lengths: Number of source sentences of each length.
+    :param Counter target_lengths: Number of target sentences of each length.
+    :param float percentile: Percentile of the lengths which are not truncated.
+    :param int tokens_per_batch: Number of tokens per batch.
+    :return: Dictionary with the suggested parameters.
+    """
+    suggestions = dict()
+    if source_lengths:
+        suggestions['MAX_INPUT_TEXT_LEN'] = int(length_percentile(source_lengths, percentile)) + 1
+    if target_lengths:
+        max_output_len = int(length_percentile(target_lengths, percentile)) + 1
+        mean_output_len = float(sum(length * count for length, count in target_lengths.items())) / \
+            sum(target_lengths.values()) + 1
+        suggestions['MAX_OUTPUT_TEXT_LEN'] = max_output_len
+        # Batches padded to their longest sentence (PAD_ON_BATCH) with sentences of similar lengths
+        suggestions['BATCH_SIZE'] = max(1, int(tokens_per_batch / mean_output_len))
+        # Batches padded to MAX_OUTPUT_TEXT_LEN
+        suggestions['BATCH_SIZE (PAD_ON_BATCH = False)'] = max(1, tokens_per_batch // max_output_len)
+    return suggestions
+
+
+def print_statistics(path, statistics):
+    print(path)
+    print('  Sentences: %d, tokens: %d, vocabulary size: %d (%d singletons), mean length: %.2f' %
+          (statistics['sentences'], statistics['tokens'], statistics['vocabulary_size'], statistics['singletons'],
+           statistics['mean_length']))
+    percentiles = sorted(statistics['length_percentiles'].items(), key=lambda item: float(item[0]))
+    print('  Length percentiles: ' + ', '.join('%s%%: %d' % (percentile, length) for percentile, length in percentiles))
+    coverage = sorted(statistics['coverage'].items(), key=lambda item: int(item[0]))
+    print('  Coverage: ' + ', '.join('%s words: %.2f%%' % (cutoff, 100 * value) for cutoff, value in coverage))
+    buckets = Counter()
+    for length, count in statistics['length_histogram'].items():
+        buckets[int(length) // 10 * 10] += count
+    max_count = max(list(buckets.values()) or [1])
+    print('  Length histogram:')
+    for bucket in range(0, max(list(buckets) or [0]) + 1, 10):
+        print('    %4d-%-4d %8d %s' % (bucket, bucket + 9, buckets[bucket], '#' * int(50 * buckets[bucket] / max_count)))
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    results = {'files': dict(), 'suggestions': dict()}
+    all_lengths = {'source': Counter(), 'target': Counter()}
+    for path in args.files + args.source + args.target:
+        if path in results['files']:
+            continue
+        file_words, file_lengths = count_file(path, n_jobs=args.jobs)
+        results['files'][path] = corpus_statistics(file_words, file_lengths, cutoffs=args.cutoffs)
+        print_statistics(path, results['files'][path])
+        del file_words
+        if path in args.source:
+            all_lengths['source'].update(file_lengths)
+        if path in args.target:
+            all_lengths['target'].update(file_lengths)
+    results['suggestions'] = suggest_parameters(all_lengths['source'], all_lengths['target'],
+                                                percentile=args.percentile, tokens_per_batch=args.tokens_per_batch)
+    if results['suggestions']:
+        print('Suggested parameters (%.1f%% of the sentences are not truncated, %d tokens per batch):' %
+              (args.percentile, args.tokens_per_batch))
+        for key in sorted(results['suggestions']):
+            print('  %s = %d' % (key, results['suggestions'][key]))
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, sort_keys=True, indent=1)
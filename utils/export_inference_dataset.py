@@ -0,0 +1,30 @@
+import argparse
+import logging
+import sys
+import os
+sys.path.insert(1, os.path.abspath("."))
+sys.path.insert(0, os.path.abspath("../"))
+from keras_wrapper.dataset import loadDataset
+from data_engine.inference_dataset import export_inference_dataset, inference_dataset_path
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Stores a copy of a Dataset instance without data, for decoding and scoring.")
+    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance with data")
+    parser.add_argument("-d", "--dest", required=False, default=None,
+                        help="Path to the inference Dataset. If not specified, it is stored next to the Dataset, "
+                             "as Dataset_*.inference.pkl.")
+    parser.add_argument("-b", "--bpe-codes", required=False, default=None,
+                        help="BPE codes to include in the inference Dataset (if the Dataset does not include them).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    dataset = loadDataset(args.dataset)
+    export_inference_dataset(dataset, args.dest or inference_dataset_path(args.dataset), bpe_codes=args.bpe_codes)
+    logging.info('Inference Dataset stored.')
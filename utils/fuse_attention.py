@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(1, os.path.abspath("."))
+sys.path.insert(0, os.path.abspath("../"))
+from nmt_keras.numpy_inference import load_keras_model
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Converts a stored Transformer model into a model with fused attention "
+                                     "projections (FUSED_ATTENTION = True).")
+    parser.add_argument("-c", "--config", required=True, help="Config pkl of the model")
+    parser.add_argument("-m", "--model", required=True, help="Path to the model (e.g. trained_models/model/epoch_1)")
+    parser.add_argument("-d", "--dest", required=True, help="Path to the converted model "
+                                                            "(e.g. trained_models/model_fused/epoch_1)")
+    return parser.parse_args()
+
+
+def fuse_model_attention(params, model_path, dest_path):
+    """
+    Converts a stored Transformer (or TransformerCache) model with MultiHeadAttention layers into the equivalent model
+    with FusedMultiHeadAttention layers, and stores it. The rest of the layers keep their weights.
+
+    :param dict params: Parameters of the stored model.
+    :param str model_path: Path to the stored model.
+    :param str dest_path: Path to the converted model.
+    :return: TranslationModel with fused attentions.
+    """
+    layers, weights = load_keras_model(model_path, suffix='')
+    params = dict(params)
+    params['FUSED_ATTENTION'] = True
+    return rebuild_model(params, layers, weights, dest_path)
+
+
+def rebuild_model(params, layers, weights, dest_path):
+    """
+    Builds the model of some parameters, sets the weights of the layers of a stored model and stores it. The weights of
+    the MultiHeadAttention layers which are FusedMultiHeadAttention layers in the built model are fused.
+
+    :param dict params: Parameters of the built model.
+    :param layers: Layer descriptions of the stored model (see load_keras_model).
+    :param weights: Weights of the stored model (see load_keras_model).
+    :param str dest_path: Path to the built model.
+    :return: TranslationModel.
+    """
+    from keras import activations
+    from keras_wrapper.cnn_model import saveModel
+    from nmt_keras.fused_attention import FusedMultiHeadAttention, fuse_attention_weights
+    from nmt_keras.model_zoo import TranslationModel
+
+    params = dict(params)
+    if any(name.startswith('positional_') and weights.get(name) for name in layers):
+        params['STORED_POSITIONAL_ENCODINGS'] = True
+    nmt_model = TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0,
+                                 model_name=os.path.basename(dest_path), store_path=os.path.dirname(dest_path),
+                                 set_optimizer=False, clear_dirs=False)
+    # Both models have the same layers, in the same order (some of them are not named, so their names may differ)
+    if len(layers) != len(nmt_model.model.layers):
+        raise ValueError('The stored model has %d layers, but the built model has %d.' %
+                         (len(layers), len(nmt_model.model.layers)))
+    for stored_name, layer in zip(layers, nmt_model.model.layers):
+        if not weights.get(stored_name):
+            continue
+        layer_weights = list(weights[stored_name].values())
+        if isinstance(layer, FusedMultiHeadAttention) and \
+                layers[stored_name]['class_name'] != 'FusedMultiHeadAttention':
+            activation = layers[stored_name]['config'].get('activation', 'linear')
+            if activation != activations.serialize(layer.activation):
+                raise ValueError('The layer %s has a "%s" activation, but the fused layer has a "%s" activation.' %
+                                 (layer.name, activation, activations.serialize(layer.activation)))
+            layer_weights = fuse_attention_weights(layer_weights, self_attention=layer.self_attention,
+                                                   use_bias=layer.use_bias)
+        layer.set_weights(layer_weights)
+    saveModel(nmt_model, 0, path=dest_path, full_path=True)
+    return nmt_model
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    from keras_wrapper.extra.read_write import pkl2dict, dict2pkl
+    fused_model = fuse_model_attention(pkl2dict(args.config), args.model, args.dest)
+    dict2pkl(fused_model.params, os.path.join(os.path.dirname(args.dest), 'config'))
+    logger.info('Model with fused attentions stored in %s.' % args.dest)
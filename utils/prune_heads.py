@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import codecs
+import copy
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.insert(1, os.path.abspath("."))
+sys.path.insert(0, os.path.abspath("../"))
+from nmt_keras.numpy_inference import QuantizedMatrix, load_keras_model, load_numpy_model
+from utils.quantize_model import bleu, translate
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+ATTENTION_LAYERS = ['MultiHeadAttention', 'FusedMultiHeadAttention']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Scores the importance of each attention head of a Transformer model (the BLEU "
+                                     "drop on a development set when the head is removed), reports the BLEU and "
+                                     "decoding time of the model with the least important heads removed and stores "
+                                     "a pruned copy of the model.")
+    parser.add_argument("-c", "--config", required=True, help="Config pkl of the model")
+    parser.add_argument("-m", "--model", required=True, help="Path to the model (e.g. trained_models/model/epoch_1)")
+    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance (or inference Dataset) of the model")
+    parser.add_argument("-t", "--text", required=True, help="Development source text file")
+    parser.add_argument("-r", "--references", required=True, help="Development reference file")
+    parser.add_argument("-b", "--beam-size", type=int, default=None, help="Beam size. By default, BEAM_SIZE.")
+    parser.add_argument("-n", "--n-pruned", type=int, default=None,
+                        help="Number of heads removed from the stored model")
+    parser.add_argument("-d", "--dest", default=None, help="Path to the pruned model (required with --n-pruned)")
+    parser.add_argument("--curve", nargs="*", type=int, default=None,
+                        help="Numbers of removed heads of the reported trade-off curve. By default, 0, 25%%, 50%%, "
+                             "75%% and 100%% of the heads which can be removed (all but one per layer).")
+    return parser.parse_args()
+
+
+def attention_heads(model):
+    """
+    Number of heads of each multi-head attention layer of a NumPy model.
+
+    :param model: NumpyTranslationModel.
+    :return: OrderedDict from layer names to numbers of heads.
+    """
+    return OrderedDict((name, model.layer_config(name).get('n_heads', model.params['N_HEADS']))
+                       for name, layer in model.layers.items() if layer['class_name'] in ATTENTION_LAYERS)
+
+
+def head_units(n_heads, head_size, heads, n_projections=1):
+    """
+    Indices of the units of some heads in the output of n_projections concatenated projections (e.g. 3 for the fused
+    queries, keys and values projection).
+    """
+    units = np.arange(n_projections * n_heads * head_size).reshape(n_projections, n_heads, head_size)
+    return units[:, heads].ravel()
+
+
+def prune_attention_weights(weights, n_heads, heads):
+    """
+    Removes heads from the weights of a multi-head attention layer: their units of the queries, keys and values
+    projections (columns of the kernels and biases) and their rows of the output projection. Removing a head is
+    equivalent to zeroing its rows of the output projection, since the heads are independent.
+
+    :param weights: OrderedDict of weights of a MultiHeadAttention (wq, wk, wv, wo, bq, bk, bv, bo) or
+                    FusedMultiHeadAttention layer: the output projection is the last kernel and its bias is the last
+                    bias.
+    :param int n_heads: Number of heads of the layer.
+    :param heads: Heads to keep.
+    :return: OrderedDict with the weights of the pruned layer.
+    """
+    kernels = [name for name, weight in weights.items() if weight.ndim == 2]
+    biases = [name for name, weight in weights.items() if weight.ndim == 1]
+    if any(isinstance(weight, QuantizedMatrix) for weight in weights.values()):
+        raise ValueError('Quantized attention layers cannot be pruned: prune the float32 model before quantizing it.')
+    dmodel = weights[kernels[-1]].shape[0]
+    head_size = dmodel // n_heads
+    pruned = OrderedDict()
+    for name, weight in weights.items():
+        if name == kernels[-1]:
+            pruned[name] = weight[head_units(n_heads, head_size, heads)]
+        elif biases and name == biases[-1]:
+            pruned[name] = weight
+        else:
+            pruned[name] = weight[..., head_units(n_heads, head_size, heads, weight.shape[-1] // dmodel)]
+    return pruned
+
+
+def kept_heads(n_heads, removed_heads):
+    return [head for head in range(n_heads) if head not in removed_heads]
+
+
+def prune_model(model, removed_heads):
+    """
+    Copy of a NumPy model without some attention heads. The weights of the rest of the layers are shared.
+
+    :param model: NumpyTranslationModel.
+    :param dict removed_heads: Dictionary from layer names to the heads removed from them.
+    :return: Pruned NumpyTranslationModel.
+    """
+    n_heads = attention_heads(model)
+    pruned_model = copy.copy(model)
+    pruned_model.layers, pruned_model.weights = copy.copy(model.layers), copy.copy(model.weights)
+    for name, heads in removed_heads.items():
+        if not heads:
+            continue
+        heads = kept_heads(n_heads[name], heads)
+        if not heads:
+            raise ValueError('All the heads of %s would be removed.' % name)
+        pruned_model.weights[name] = prune_attention_weights(model.weights[name], n_heads[name], heads)
+        pruned_model.layers[name] = copy.deepcopy(model.layers[name])
+        pruned_model.layers[name]['config']['n_heads'] = len(heads)
+    return pruned_model
+
+
+def evaluate(model, dataset, params, sentences, references, beam_size=None):
+    """
+    BLEU and decoding time (in seconds) of a NumPy model on a development set.
+    """
+    start_time = time.time()
+    hypotheses = translate(model, dataset, params, sentences, beam_size=beam_size)
+    return bleu(references, hypotheses), time.time() - start_time
+
+
+def head_importance(model, dataset, params, sentences, references, beam_size=None):
+    """
+    Importance of each attention head: the BLEU drop on a development set when the head is removed (ablation).
+
+    :param model: NumpyTranslationModel.
+    :param dataset: Dataset instance with the vocabularies of the model.
+    :param dict params: Parameters of the model.
+    :param sentences: Tokenized development source sentences.
+    :param references: Development references.
+    :param int beam_size: Beam size (BEAM_SIZE if None).
+    :return: Tuple (BLEU of the model, OrderedDict from (layer name, head) to BLEU drop).
+    """
+    baseline, _ = evaluate(model, dataset, params, sentences, references, beam_size=beam_size)
+    importance = OrderedDict()
+    for name, n_heads in attention_heads(model).items():
+        for head in range(n_heads):
+            score, _ = evaluate(prune_model(model, {name: [head]}), dataset, params, sentences, references,
+                                beam_size=beam_size)
+            importance[(name, head)] = baseline - score
+            logger.info('%s, head %d: BLEU drop %.4f' % (name, head, importance[(name, head)]))
+    return baseline, importance
+
+
+def pruning_order(importance, n_heads):
+    """
+    Order in which the heads are removed: from the least to the most important one, keeping at least one head in
+    each layer.
+
+    :param importance: Dictionary from (layer name, head) to importance.
+    :param dict n_heads: Dictionary from layer names to numbers of heads.
+    :return: List of (layer name, head).
+    """
+    order, remaining = [], dict(n_heads)
+    for name, head in sorted(importance, key=lambda layer_head: importance[layer_head]):
+        if remaining[name] > 1:
+            order.append((name, head))
+            remaining[name] -= 1
+    return order
+
+
+def removed_heads(order, n_pruned):
+    """
+    Heads removed from each layer when the first n_pruned heads of a pruning order are removed.
+    """
+    if n_pruned > len(order):
+        raise ValueError('Only %d heads can be removed (at least one head per layer is kept).' % len(order))
+    heads = dict()
+    for name, head in order[:n_pruned]:
+        heads.setdefault(name, []).append(head)
+    return heads
+
+
+def store_pruned_model(params, model_path, dest_path, pruned_heads):
+    """
+    Stores a copy of a Transformer (or TransformerCache) model without some attention heads: their projections are
+    removed from the weights and the pruned layers become FusedMultiHeadAttention layers with fewer heads (see
+    ATTENTION_HEADS). The copy is a regular model, which can be loaded by Keras (with the returned parameters) and by
+    the NumPy inference.
+
+    :param dict params: Parameters of the stored model.
+    :param str model_path: Path to the stored model.
+    :param str dest_path: Path to the pruned model.
+    :param dict pruned_heads: Dictionary from layer names to tuples (number of heads of the layer, removed heads).
+    :return: TranslationModel without the heads.
+    """
+    from utils.fuse_attention import rebuild_model
+    layers, weights = load_keras_model(model_path, suffix='')
+    params = dict(params)
+    params['ATTENTION_HEADS'] = dict(params.get('ATTENTION_HEADS') or {})
+    for name, (n_heads, heads) in pruned_heads.items():
+        heads = kept_heads(n_heads, heads)
+        weights[name] = prune_attention_weights(weights[name], n_heads, heads)
+        params['ATTENTION_HEADS'][name] = len(heads)
+    return rebuild_model(params, layers, weights, dest_path)
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    if args.n_pruned is not None and args.dest is None:
+        raise ValueError('The path of the pruned model (--dest) is required.')
+    from keras_wrapper.extra.read_write import pkl2dict, dict2pkl
+    from data_engine.inference_dataset import load_inference_dataset
+    from data_engine.prepare_data import update_dataset_from_file
+    params = pkl2dict(args.config)
+    dataset = update_dataset_from_file(load_inference_dataset(args.dataset), args.text, params, splits=['val'],
+                                       remove_outputs=True)
+    sentences = dataset.X_val[params['INPUTS_IDS_DATASET'][0]]
+    with codecs.open(args.references, 'r', encoding='utf-8') as references_file:
+        references = references_file.read().splitlines()
+    model = load_numpy_model(params, args.model)
+    n_heads = attention_heads(model)
+    baseline, importance = head_importance(model, dataset, params, sentences, references, beam_size=args.beam_size)
+    order = pruning_order(importance, n_heads)
+    # The speed-ups are relative to the unpruned model
+    curve = sorted(set([0] + (args.curve if args.curve is not None else [len(order) * i // 4 for i in range(1, 5)])))
+    logger.info('Trade-off curve (%d heads, BLEU %.4f):' % (sum(n_heads.values()), baseline))
+    logger.info('Removed heads\tBLEU\tTime (s)\tSpeed-up')
+    for n_pruned in curve:
+        score, decoding_time = evaluate(prune_model(model, removed_heads(order, n_pruned)), dataset, params,
+                                        sentences, references, beam_size=args.beam_size)
+        if n_pruned == 0:
+            base_time = decoding_time
+        logger.info('%d\t%.4f\t%.2f\t%.2fx' % (n_pruned, score, decoding_time, base_time / decoding_time))
+    if args.n_pruned is not None:
+        heads = removed_heads(order, args.n_pruned)
+        pruned_heads = dict((name, (n_heads[name], layer_heads)) for name, layer_heads in heads.items())
+        pruned_model = store_pruned_model(params, args.model, args.dest, pruned_heads)
+        dict2pkl(pruned_model.params, os.path.join(os.path.dirname(args.dest), 'config'))
+        logger.info('Model without %d heads stored in %s.' % (args.n_pruned, args.dest))
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import codecs
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(1, os.path.abspath("."))
+sys.path.insert(0, os.path.abspath("../"))
+from nmt_keras.helpers import to_str
+from nmt_keras.numpy_inference import load_keras_model, load_numpy_model, quantize
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Quantizes the embeddings, attention and output projections of a stored model to "
+                                     "int8 (with a scale per row) for the NumPy inference, and reports the BLEU "
+                                     "and decoding time differences with the float32 model on a development set.")
+    parser.add_argument("-c", "--config", required=True, help="Config pkl of the model")
+    parser.add_argument("-m", "--model", required=True, help="Path to the model (e.g. trained_models/model/epoch_1)")
+    parser.add_argument("-d", "--dest", required=True, help="Path to the quantized model")
+    parser.add_argument("-l", "--layers", nargs="*", default=None,
+                        help="Layers to quantize. By default, the word embeddings, the multi-head attentions and the "
+                             "output layer.")
+    parser.add_argument("-ds", "--dataset", default=None, help="Dataset instance (or inference Dataset) of the model")
+    parser.add_argument("-t", "--text", default=None, help="Development source text file")
+    parser.add_argument("-r", "--references", default=None, help="Development reference file")
+    parser.add_argument("-b", "--beam-size", type=int, default=None, help="Beam size. By default, BEAM_SIZE.")
+    return parser.parse_args()
+
+
+def model_files(model_path, suffix='_init'):
+    """
+    Files of a model stored by saveModel (the model_init by default): (structure file or None, weights file, weights
+    group).
+    """
+    if os.path.isfile(model_path + suffix + '.h5'):
+        return None, model_path + suffix + '.h5', 'model_weights'
+    return model_path + '_structure' + suffix + '.json', model_path + '_weights' + suffix + '.h5', None
+
+
+def default_layers(layers, output_name):
+    """
+    Layers quantized by default: word embeddings, multi-head attentions and output layer.
+
+    :param layers: Layer descriptions (see load_keras_model).
+    :param str output_name: Name of the output layer.
+    :return: List of layer names.
+    """
+    return [name for name, layer in layers.items()
+            if (layer['class_name'] in ['Embedding', 'TiedEmbedding'] and not name.startswith('positional_')) or
+            layer['class_name'] in ['MultiHeadAttention', 'FusedMultiHeadAttention'] or name == output_name]
+
+
+def quantize_model(model_path, dest_path, layer_names):
+    """
+    Stores a copy of the model_init of a model in which the 2D weights of some layers are int8 matrices, with a float32
+    scale for each row of the embeddings and for each column (output unit) of the kernels. The scales of each weight
+    are stored in '<weight name>_scales'. The copy can only be loaded by the NumPy inference (load_numpy_model).
+
+    :param str model_path: Path to the stored model.
+    :param str dest_path: Path to the quantized model.
+    :param layer_names: Layers to quantize.
+    :return: Size (in bytes) of the quantized weights before and after the quantization.
+    """
+    import h5py
+    layers, _ = load_keras_model(model_path)
+    structure_file, weights_file, group_name = model_files(model_path)
+    if structure_file is None:
+        dest_weights_file = dest_path + '_init.h5'
+    else:
+        dest_weights_file = dest_path + '_weights_init.h5'
+        shutil.copyfile(structure_file, dest_path + '_structure_init.json')
+    float_bytes, int8_bytes = 0, 0
+    with h5py.File(weights_file, 'r') as src_file, h5py.File(dest_weights_file, 'w') as dest_file:
+        for key, value in src_file.attrs.items():
+            dest_file.attrs[key] = value
+        src_group = src_file[group_name] if group_name else src_file
+        dest_group = dest_file.create_group(group_name) if group_name else dest_file
+        for key, value in src_group.attrs.items():
+            dest_group.attrs[key] = value
+        for layer_name in src_group.attrs['layer_names']:
+            layer_name = to_str(layer_name)
+            src_layer, dest_layer = src_group[layer_name], dest_group.create_group(layer_name)
+            for key, value in src_layer.attrs.items():
+                dest_layer.attrs[key] = value
+            for weight_name in src_layer.attrs['weight_names']:
+                weight_name = to_str(weight_name)
+                weight = src_layer[weight_name][()]
+                if layer_name not in layer_names or weight.ndim != 2:
+                    dest_layer.create_dataset(weight_name, data=weight)
+                    continue
+                axis = 0 if layers[layer_name]['class_name'] in ['Embedding', 'TiedEmbedding'] else 1
+                quantized = quantize(weight, axis=axis)
+                dest_layer.create_dataset(weight_name, data=quantized.values).attrs['quantization_axis'] = axis
+                dest_layer.create_dataset(weight_name + '_scales', data=quantized.scales)
+                float_bytes += weight.nbytes
+                int8_bytes += quantized.values.nbytes + quantized.scales.nbytes
+    return float_bytes, int8_bytes
+
+
+def search_parameters(params, beam_size=None):
+    """
+    Parameters of keras_wrapper.search.beam_search for decoding a sentence at a time with a NumPy model.
+    """
+    return {'beam_size': beam_size or params.get('BEAM_SIZE', 6),
+            'maxlen': params.get('MAX_OUTPUT_TEXT_LEN_TEST', 100),
+            'optimized_search': True,
+            'search_pruning': False,
+            'pos_unk': False,
+            'words_so_far': False,
+            'pad_on_batch': params.get('PAD_ON_BATCH', True),
+            'state_below_maxlen': -1 if params.get('PAD_ON_BATCH', True) else params.get('MAX_OUTPUT_TEXT_LEN', 50),
+            'model_inputs': params['INPUTS_IDS_MODEL'],
+            'dataset_inputs': params['INPUTS_IDS_DATASET'],
+            'state_below_index': -1,
+            'attend_on_output': params.get('ATTEND_ON_OUTPUT', 'transformer' in params['MODEL_TYPE'].lower()),
+            'output_max_length_depending_on_x': params.get('MAXLEN_GIVEN_X', True),
+            'output_max_length_depending_on_x_factor': params.get('MAXLEN_GIVEN_X_FACTOR', 3),
+            'output_min_length_depending_on_x': params.get('MINLEN_GIVEN_X', True),
+            'output_min_length_depending_on_x_factor': params.get('MINLEN_GIVEN_X_FACTOR', 2)}
+
+
+def best_hypotheses(model, dataset, params, sentences, beam_size=None):
+    """
+    Decodes (tokenized) sentences with a NumPy model.
+
+    :param model: NumpyTranslationModel.
+    :param dataset: Dataset instance with the vocabularies of the model.
+    :param dict params: Parameters of the model.
+    :param sentences: Tokenized source sentences.
+    :param int beam_size: Beam size (BEAM_SIZE if None).
+    :return: List with the best hypothesis (list of word indices) for each sentence.
+    """
+    from keras_wrapper.search import beam_search
+    input_id = params['INPUTS_IDS_DATASET'][0]
+    search_params = search_parameters(params, beam_size=beam_size)
+    hypotheses = []
+    for sentence in sentences:
+        src = dataset.loadText([sentence], dataset.vocabulary[input_id], params.get('MAX_INPUT_TEXT_LEN_TEST', 100), 0,
+                               dataset.fill_text[input_id], dataset.pad_on_batch[input_id], False, loading_X=True)[0]
+        samples, scores, _ = beam_search(model, {input_id: src}, search_params,
+                                         null_sym=dataset.extra_words['<null>'])
+        if params.get('NORMALIZE_SAMPLING', False):
+            scores = [score / len(sample) ** params.get('ALPHA_FACTOR', 1.0) for sample, score in zip(samples, scores)]
+        hypotheses.append(samples[int(np.argmin(scores))])
+    return hypotheses
+
+
+def translate(model, dataset, params, sentences, beam_size=None):
+    """
+    Translates (tokenized) sentences with a NumPy model.
+
+    :param model: NumpyTranslationModel.
+    :param dataset: Dataset instance with the vocabularies of the model.
+    :param dict params: Parameters of the model.
+    :param sentences: Tokenized source sentences.
+    :param int beam_size: Beam size (BEAM_SIZE if None).
+    :return: List of translations.
+    """
+    from data_engine.vocabulary import decode_predictions_beam_search
+    output_id = params['OUTPUTS_IDS_DATASET'][0]
+    translations = decode_predictions_beam_search(best_hypotheses(model, dataset, params, sentences,
+                                                                  beam_size=beam_size),
+                                                  dataset.vocabulary[output_id]['idx2words'], verbose=0)
+    if params.get('APPLY_DETOKENIZATION', False):
+        detokenize_function = eval('dataset.' + params['DETOKENIZATION_METHOD'])
+        translations = [detokenize_function(translation) for translation in translations]
+    return translations
+
+
+def bleu(references, hypotheses):
+    """
+    BLEU-4 of a list of hypotheses, with a reference for each one.
+    """
+    from pycocoevalcap.bleu.bleu import Bleu
+    score, _ = Bleu(4).compute_score(dict((i, [reference.strip()]) for i, reference in enumerate(references)),
+                                     dict((i, [hypothesis.strip()]) for i, hypothesis in enumerate(hypotheses)))
+    return score[-1]
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    from keras_wrapper.extra.read_write import pkl2dict
+    params = pkl2dict(args.config)
+    layer_names = args.layers or default_layers(load_keras_model(args.model)[0], params['OUTPUTS_IDS_MODEL'][0])
+    logger.info('Quantizing layers: %s' % ', '.join(layer_names))
+    float_bytes, int8_bytes = quantize_model(args.model, args.dest, layer_names)
+    logger.info('Quantized weights: %.2f MB (float32) -> %.2f MB (int8)' %
+                (float_bytes / 2. ** 20, int8_bytes / 2. ** 20))
+    if args.dataset is not None and args.text is not None and args.references is not None:
+        from data_engine.inference_dataset import load_inference_dataset
+        from data_engine.prepare_data import update_dataset_from_file
+        dataset = update_dataset_from_file(load_inference_dataset(args.dataset), args.text, params, splits=['val'],
+                                           remove_outputs=True)
+        sentences = dataset.X_val[params['INPUTS_IDS_DATASET'][0]]
+        with codecs.open(args.references, 'r', encoding='utf-8') as references_file:
+            references = references_file.read().splitlines()
+        scores, times = dict(), dict()
+        for name, path in [('float32', args.model), ('int8', args.dest)]:
+            model = load_numpy_model(params, path)
+            start_time = time.time()
+            scores[name] = bleu(references, translate(model, dataset, params, sentences, beam_size=args.beam_size))
+            times[name] = time.time() - start_time
+            logger.info('BLEU (%s): %.4f - Decoding time: %.2fs' % (name, scores[name], times[name]))
+        logger.info('BLEU delta (int8 - float32): %+.4f - Decoding time ratio (int8 / float32): %.2fx' %
+                    (scores['int8'] - scores['float32'], times['int8'] / times['float32']))
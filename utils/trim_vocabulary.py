@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import cPickle as pk
+except ImportError:
+    import pickle as pk
+
+sys.path.insert(1, os.path.abspath("."))
+sys.path.insert(0, os.path.abspath("../"))
+from nmt_keras.helpers import to_str
+from utils.quantize_model import model_files
+
+logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+EMBEDDING_LAYERS = ['Embedding', 'TiedEmbedding']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Decodes a representative corpus, counts the words produced by the model and "
+                                     "stores a copy of the model and of its (inference) Dataset without the rarely "
+                                     "produced target words, which shrinks the target embeddings and the softmax.")
+    parser.add_argument("-c", "--config", required=True, help="Config pkl of the model")
+    parser.add_argument("-m", "--model", required=True, help="Path to the model (e.g. trained_models/model/epoch_1)")
+    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance (or inference Dataset) of the model")
+    parser.add_argument("-t", "--text", required=True, help="Source text file of the representative corpus")
+    parser.add_argument("-d", "--dest", required=True, help="Path to the trimmed model "
+                                                            "(e.g. trained_models/model_trimmed/epoch_1)")
+    parser.add_argument("-dd", "--dest-dataset", required=True, help="Path to the trimmed inference Dataset")
+    parser.add_argument("--min-count", type=int, default=1, help="Minimum number of occurrences of the kept words")
+    parser.add_argument("--size", type=int, default=None, help="Maximum size of the trimmed vocabulary")
+    parser.add_argument("-b", "--beam-size", type=int, default=None, help="Beam size. By default, BEAM_SIZE.")
+    return parser.parse_args()
+
+
+def output_frequencies(hypotheses, vocabulary_size):
+    """
+    Number of occurrences of each target word in a list of hypotheses (lists of word indices).
+    """
+    if not hypotheses:
+        return np.zeros(vocabulary_size, dtype='int64')
+    return np.bincount(np.concatenate([np.asarray(hypothesis, dtype='int64') for hypothesis in hypotheses]),
+                       minlength=vocabulary_size)
+
+
+def kept_words(counts, extra_words, min_count=1, size=None):
+    """
+    Words of the trimmed vocabulary: the extra words (<pad>, <unk>, <null>) and the words with at least min_count
+    occurrences (the most frequent ones, up to a total of size words).
+
+    :param counts: Number of occurrences of each word.
+    :param extra_words: Indices of the extra words, which are always kept.
+    :param int min_count: Minimum number of occurrences of the kept words.
+    :param int size: Maximum size of the trimmed vocabulary.
+    :return: Indices of the kept words, sorted (so the relative order of the words is kept).
+    """
+    extra_words = np.unique(np.asarray(list(extra_words), dtype='int64'))
+    candidates = np.setdiff1d(np.where(counts >= min_count)[0], extra_words)
+    if size is not None:
+        candidates = candidates[np.argsort(-counts[candidates], kind='mergesort')][:max(size - len(extra_words), 0)]
+    return np.union1d(extra_words, candidates)
+
+
+def vocabulary_key(vocabulary):
+    """
+    Object which identifies a vocabulary of a Dataset, shared by the inputs and outputs which share it.
+    """
+    return vocabulary if not isinstance(vocabulary, dict) else vocabulary['idx2words']
+
+
+def trim_dataset(ds, output_id, words):
+    """
+    Replaces the vocabulary of an output of a Dataset instance (and of the inputs which share it, such as the
+    state_below) with a vocabulary with only some of its words, reindexed from 0 in the same order.
+
+    :param ds: Dataset instance.
+    :param str output_id: Identifier of the output.
+    :param words: Indices of the kept words (sorted).
+    :return: Dataset instance.
+    """
+    target_key = vocabulary_key(ds.vocabulary[output_id])
+    idx2words = ds.vocabulary[output_id]['idx2words']
+    idx2words = dict((index, idx2words[int(word)]) for index, word in enumerate(words))
+    vocabulary = {'words2idx': dict((word, index) for index, word in idx2words.items()), 'idx2words': idx2words}
+    for data_id in list(ds.vocabulary):
+        if vocabulary_key(ds.vocabulary[data_id]) is target_key:
+            ds.vocabulary[data_id] = vocabulary
+            ds.vocabulary_len[data_id] = len(words)
+    return ds
+
+
+def trim_weights(class_name, weights, words, vocabulary_size):
+    """
+    Removes the trimmed words from the weights of a target embedding (rows of the embeddings and, for a TiedEmbedding,
+    of the output bias) or output layer (columns of the kernel and bias).
+
+    :param str class_name: Class of the layer.
+    :param weights: OrderedDict of weights of the layer.
+    :param words: Indices of the kept words.
+    :param int vocabulary_size: Size of the original vocabulary.
+    :return: OrderedDict with the trimmed weights.
+    """
+    axis = 0 if class_name in EMBEDDING_LAYERS else -1
+    return OrderedDict((name, np.take(weight, words, axis=axis) if weight.shape[axis] == vocabulary_size else weight)
+                       for name, weight in weights.items())
+
+
+def trim_structure(structure, layer_names, size):
+    """
+    Sets the vocabulary size of the target embedding and output layers in a model structure (JSON config).
+    """
+    for layer in structure['config']['layers']:
+        if layer['name'] not in layer_names:
+            continue
+        config = layer['config']['layer']['config'] if layer['class_name'] == 'TimeDistributed' else layer['config']
+        if layer['class_name'] in EMBEDDING_LAYERS:
+            config['input_dim'] = size
+        elif 'units' in config:
+            config['units'] = size
+    return structure
+
+
+def trim_model(model_path, dest_path, layer_names, words, vocabulary_size):
+    """
+    Stores a copy of a model (model, model_init and model_next, as stored by saveModel) without the trimmed target
+    words. The copy can be loaded as the original model, with an OUTPUT_VOCABULARY_SIZE of len(words). The optimizer
+    state of the training model is not copied.
+
+    :param str model_path: Path to the stored model.
+    :param str dest_path: Path to the trimmed model.
+    :param layer_names: Names of the target embedding and output layers.
+    :param words: Indices of the kept words.
+    :param int vocabulary_size: Size of the original vocabulary.
+    """
+    import h5py
+    for suffix in ['', '_init', '_next']:
+        structure_file, weights_file, group_name = model_files(model_path, suffix=suffix)
+        if not os.path.isfile(weights_file):
+            continue
+        if structure_file is None:
+            dest_weights_file = dest_path + suffix + '.h5'
+            with h5py.File(weights_file, 'r') as src_file:
+                structure = json.loads(to_str(src_file.attrs['model_config']))
+        else:
+            dest_weights_file = dest_path + '_weights' + suffix + '.h5'
+            with open(structure_file, 'r') as src_file:
+                structure = json.load(src_file)
+        classes = dict((layer['name'], layer['class_name']) for layer in structure['config']['layers'])
+        structure = trim_structure(structure, layer_names, len(words))
+        if structure_file is not None:
+            with open(dest_path + '_structure' + suffix + '.json', 'w') as dest_file:
+                json.dump(structure, dest_file)
+        with h5py.File(weights_file, 'r') as src_file, h5py.File(dest_weights_file, 'w') as dest_file:
+            for key, value in src_file.attrs.items():
+                if key == 'model_config':
+                    value = json.dumps(structure).encode('utf-8')
+                dest_file.attrs[key] = value
+            src_group = src_file[group_name] if group_name else src_file
+            dest_group = dest_file.create_group(group_name) if group_name else dest_file
+            for key, value in src_group.attrs.items():
+                dest_group.attrs[key] = value
+            for layer_name in src_group.attrs['layer_names']:
+                layer_name = to_str(layer_name)
+                src_layer, dest_layer = src_group[layer_name], dest_group.create_group(layer_name)
+                for key, value in src_layer.attrs.items():
+                    dest_layer.attrs[key] = value
+                weights = OrderedDict((to_str(weight_name), src_layer[to_str(weight_name)][()])
+                                      for weight_name in src_layer.attrs['weight_names'])
+                if layer_name in layer_names:
+                    weights = trim_weights(classes[layer_name], weights, words, vocabulary_size)
+                for weight_name, weight in weights.items():
+                    dest_layer.create_dataset(weight_name, data=weight)
+
+
+def trim_model_wrapper(model_path, dest_path, size):
+    """
+    Stores a copy of the Model_Wrapper of a model, with the trimmed OUTPUT_VOCABULARY_SIZE.
+    """
+    with open(model_path + '_Model_Wrapper.pkl', 'rb') as src_file:
+        if sys.version_info.major == 3:
+            model_wrapper = pk.load(src_file, encoding='latin1')
+        else:
+            model_wrapper = pk.load(src_file)
+    if getattr(model_wrapper, 'params', None):
+        model_wrapper.params['OUTPUT_VOCABULARY_SIZE'] = size
+    with open(dest_path + '_Model_Wrapper.pkl', 'wb') as dest_file:
+        pk.dump(model_wrapper, dest_file, protocol=-1)
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    from keras_wrapper.extra.read_write import pkl2dict, dict2pkl
+    from data_engine.inference_dataset import export_inference_dataset, load_inference_dataset
+    from data_engine.prepare_data import update_dataset_from_file
+    from nmt_keras.numpy_inference import load_numpy_model
+    from utils.quantize_model import best_hypotheses
+    params = pkl2dict(args.config)
+    input_id, output_id = params['INPUTS_IDS_DATASET'][0], params['OUTPUTS_IDS_DATASET'][0]
+    dataset = load_inference_dataset(args.dataset)
+    if params.get('TIE_EMBEDDINGS', False) or \
+            vocabulary_key(dataset.vocabulary[input_id]) is vocabulary_key(dataset.vocabulary[output_id]):
+        raise ValueError('The source and target vocabularies are shared: the target vocabulary cannot be trimmed.')
+    vocabulary_size = dataset.vocabulary_len[output_id]
+    hypotheses = best_hypotheses(load_numpy_model(params, args.model),
+                                 update_dataset_from_file(dataset, args.text, params, splits=['val'],
+                                                          remove_outputs=True),
+                                 params, dataset.X_val[input_id], beam_size=args.beam_size)
+    words = kept_words(output_frequencies(hypotheses, vocabulary_size), dataset.extra_words.values(),
+                       min_count=args.min_count, size=args.size)
+    logger.info('Trimming the target vocabulary from %d to %d words.' % (vocabulary_size, len(words)))
+    trim_model(args.model, args.dest, ['target_word_embedding', params['OUTPUTS_IDS_MODEL'][0]], words,
+               vocabulary_size)
+    if os.path.isfile(args.model + '_Model_Wrapper.pkl'):
+        trim_model_wrapper(args.model, args.dest, len(words))
+    params['OUTPUT_VOCABULARY_SIZE'] = len(words)
+    dict2pkl(params, os.path.join(os.path.dirname(args.dest), 'config'))
+    export_inference_dataset(trim_dataset(dataset, output_id, words), args.dest_dataset)
+    logger.info('Trimmed model stored in %s and inference Dataset stored in %s.' % (args.dest, args.dest_dataset))